@@ -0,0 +1,180 @@
+import argparse
+import json
+import sys
+
+from collections import defaultdict
+from contextlib import contextmanager, nullcontext
+from pathlib import Path
+from time import perf_counter
+from typing import ContextManager, Dict, Generator, List, Optional, Tuple
+
+REPORT_VERSION = 1
+PERCENTILES = (50, 95, 99)
+
+# Name of the pseudo phase covering a whole run of a flow
+TOTAL_PHASE = "total"
+
+
+def percentile(samples: List[float], p: float) -> float:
+    """
+    Linear interpolation between closest ranks, same as numpy's default method
+
+    :param samples: The measured values, in any order
+    :type samples: List[float]
+    :param p: The requested percentile, between 0 and 100
+    :type p: float
+
+    :return: The interpolated percentile
+    :rtype: float
+    """
+    if not samples:
+        raise ValueError("Can not compute a percentile of an empty sample list")
+    ordered = sorted(samples)
+    rank = (len(ordered) - 1) * p / 100
+    low = int(rank)
+    high = min(low + 1, len(ordered) - 1)
+    return ordered[low] + (ordered[high] - ordered[low]) * (rank - low)
+
+
+class PhaseTimer:
+    """
+    Accumulates the time spent in named phases during one run of an exchange flow.
+
+    A phase entered several times during the same run (for example two GET_CHALLENGE for a
+    refund and a payout alias) is summed, so that each run yields one value per phase.
+    """
+
+    def __init__(self):
+        self._durations: Dict[str, float] = defaultdict(float)
+        self._start = perf_counter()
+
+    @contextmanager
+    def phase(self, name: str) -> Generator[None, None, None]:
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            self._durations[name] += perf_counter() - start
+
+    def stop(self) -> Dict[str, float]:
+        """
+        :return: The time spent in each phase in seconds, including the run total
+        :rtype: Dict[str, float]
+        """
+        durations = dict(self._durations)
+        durations[TOTAL_PHASE] = perf_counter() - self._start
+        return durations
+
+
+def timed_phase(timer: Optional[PhaseTimer], name: str) -> ContextManager:
+    # Helper for instrumented code paths, does nothing when no benchmark is running
+    if timer is None:
+        return nullcontext()
+    return timer.phase(name)
+
+
+class BenchmarkRecorder:
+    """
+    Collects the phase durations of several runs of several flows and renders them as a
+    percentile report that can be diffed against a stored baseline.
+    """
+
+    def __init__(self):
+        self._runs: Dict[str, List[Dict[str, float]]] = defaultdict(list)
+
+    @staticmethod
+    def key(coin: str, firmware: str, flow: str) -> str:
+        return f"{coin}/{firmware}/{flow}"
+
+    @contextmanager
+    def run(self, key: str) -> Generator[PhaseTimer, None, None]:
+        timer = PhaseTimer()
+        yield timer
+        # Only successful runs are recorded, a failing flow would skew the distribution
+        self._runs[key].append(timer.stop())
+
+    def report(self) -> Dict:
+        results = {}
+        for key, runs in sorted(self._runs.items()):
+            samples: Dict[str, List[float]] = defaultdict(list)
+            for run in runs:
+                for phase, duration in run.items():
+                    samples[phase].append(duration * 1000)
+            results[key] = {
+                "runs": len(runs),
+                "phases": {
+                    phase: {f"p{p}": round(percentile(values, p), 3) for p in PERCENTILES}
+                    for phase, values in sorted(samples.items())
+                },
+            }
+        return {"version": REPORT_VERSION, "unit": "ms", "results": results}
+
+    def dump(self, path: Path):
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.report(), f, indent=2)
+            f.write("\n")
+
+
+def compare_reports(baseline: Dict,
+                    current: Dict,
+                    tolerance: float = 0.2,
+                    min_delta_ms: float = 5.0) -> List[Tuple[str, str, str, float, float]]:
+    """
+    Compare two reports produced by BenchmarkRecorder.
+
+    A phase regresses when one of its percentiles is more than `tolerance` (relative) and
+    more than `min_delta_ms` (absolute, to ignore the noise on very short phases) above the
+    baseline. Flows or phases absent from one of the reports are ignored.
+
+    :return: The regressions as (flow key, phase, percentile, baseline ms, current ms)
+    :rtype: List[Tuple[str, str, str, float, float]]
+    """
+    for report in (baseline, current):
+        if report.get("version") != REPORT_VERSION:
+            raise ValueError(f"Unsupported benchmark report version {report.get('version')}")
+
+    regressions = []
+    for key, current_result in sorted(current["results"].items()):
+        baseline_result = baseline["results"].get(key)
+        if baseline_result is None:
+            continue
+        for phase, current_values in sorted(current_result["phases"].items()):
+            baseline_values = baseline_result["phases"].get(phase)
+            if baseline_values is None:
+                continue
+            for p in PERCENTILES:
+                name = f"p{p}"
+                old = baseline_values[name]
+                new = current_values[name]
+                if new > old * (1 + tolerance) and new - old > min_delta_ms:
+                    regressions.append((key, phase, name, old, new))
+    return regressions
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Compare an exchange benchmark report against a baseline")
+    parser.add_argument("baseline", type=Path, help="Stored reference report")
+    parser.add_argument("current", type=Path, help="Report of the run to check")
+    parser.add_argument("--tolerance", type=float, default=0.2,
+                        help="Accepted relative slowdown before flagging a regression (default 0.2)")
+    parser.add_argument("--min-delta-ms", type=float, default=5.0,
+                        help="Ignore slowdowns smaller than this absolute value (default 5 ms)")
+    args = parser.parse_args(argv)
+
+    with open(args.baseline, encoding="utf-8") as f:
+        baseline = json.load(f)
+    with open(args.current, encoding="utf-8") as f:
+        current = json.load(f)
+
+    regressions = compare_reports(baseline, current, args.tolerance, args.min_delta_ms)
+    for key, phase, name, old, new in regressions:
+        print(f"{key} {phase} {name}: {old:.3f} ms -> {new:.3f} ms (+{(new / old - 1) * 100 if old else float('inf'):.1f}%)")
+    if regressions:
+        print(f"{len(regressions)} regression(s) found")
+        return 1
+    print("No regression found")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
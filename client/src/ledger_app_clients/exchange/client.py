@@ -222,20 +222,7 @@ class ExchangeClient:
 
         return self._exchange_split(Command.SEND_TRUSTED_NAME_DESCRIPTOR, payload=payload)
 
-    def send_pki_certificate_and_trusted_name_descriptor(self,
-                                                         structure_type: Optional[int] = 3,
-                                                         version: Optional[int] = 3,
-                                                         trusted_name_type: Optional[int] = 0x06,
-                                                         trusted_name_source: Optional[int] = 0x06,
-                                                         trusted_name: Optional[bytes] = b"Whatever",
-                                                         chain_id: Optional[int] = 0,
-                                                         address: Optional[bytes] = b"Whatever",
-                                                         trusted_name_source_contract: Optional[int] = None,
-                                                         challenge: Optional[bytes] = bytes.fromhex("01010101"),
-                                                         signer_key_id: Optional[int] = 0, # test key
-                                                         signer_algo: Optional[int] = 1, # secp256k1
-                                                         skip_signature_field: bool = False,
-                                                         fake_signature_field: bool = False) -> RAPDU:
+    def send_pki_certificate(self) -> None:
         # send PKI certificate
         if self._pki_client is None:
             print(f"Ledger-PKI Not supported on '{self._client.firmware.name}'")
@@ -254,6 +241,22 @@ class ExchangeClient:
             # pylint: enable=line-too-long
             self._pki_client.send_certificate(bytes.fromhex(cert_apdu))
 
+    def send_pki_certificate_and_trusted_name_descriptor(self,
+                                                         structure_type: Optional[int] = 3,
+                                                         version: Optional[int] = 3,
+                                                         trusted_name_type: Optional[int] = 0x06,
+                                                         trusted_name_source: Optional[int] = 0x06,
+                                                         trusted_name: Optional[bytes] = b"Whatever",
+                                                         chain_id: Optional[int] = 0,
+                                                         address: Optional[bytes] = b"Whatever",
+                                                         trusted_name_source_contract: Optional[int] = None,
+                                                         challenge: Optional[bytes] = bytes.fromhex("01010101"),
+                                                         signer_key_id: Optional[int] = 0, # test key
+                                                         signer_algo: Optional[int] = 1, # secp256k1
+                                                         skip_signature_field: bool = False,
+                                                         fake_signature_field: bool = False) -> RAPDU:
+        self.send_pki_certificate()
+
         return self.send_trusted_name_descriptor(structure_type=structure_type,
                                                  version=version,
                                                  trusted_name_type=trusted_name_type,
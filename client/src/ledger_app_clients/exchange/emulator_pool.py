@@ -0,0 +1,481 @@
+"""
+Pool of booted Speculos instances, kept warm by a long lived local daemon.
+
+Booting Speculos with Exchange and all its sideloaded libraries takes several seconds, paid for each
+backend scope and each pytest invocation. The daemon keeps `size` booted instances ready for each
+emulator specification (firmware, application and Speculos arguments) it has been asked for, and
+hands them out on lease to the test sessions.
+
+Speculos can not reset the state of a running application, so a returned instance is never leased
+again: it is stopped and a fresh one is booted in the background, behind the warm spares.
+
+Start the daemon once:
+
+    python -m ledger_app_clients.exchange.emulator_pool --size 2
+
+then run pytest with `--emulator_pool 127.0.0.1:7400`.
+"""
+import argparse
+import json
+import logging
+import socket
+import socketserver
+import sys
+import threading
+
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from dataclasses import dataclass
+from pathlib import Path
+from time import monotonic, sleep
+from typing import Deque, Dict, Generator, List, Optional, Set, Tuple
+
+import requests
+
+from ledgered.devices import Device, Devices
+from ragger.backend import SpeculosBackend
+from speculos.client import SpeculosClient, SpeculosInstance
+
+DEFAULT_POOL_HOST = "127.0.0.1"
+DEFAULT_POOL_PORT = 7400
+DEFAULT_POOL_SIZE = 2
+DEFAULT_HEALTH_CHECK_PERIOD = 10.0
+DEFAULT_LEASE_TIMEOUT = 120.0
+
+# Time given to a booted instance to display its home screen
+BOOT_TIMEOUT = 20.0
+# Time given to a ready instance to answer the health check
+HEALTH_CHECK_TIMEOUT = 1.0
+
+logger = logging.getLogger(__name__)
+
+
+class EmulatorPoolError(Exception):
+    pass
+
+
+# Ports handed out by get_unused_ports and not released yet, the instances of this process may not have bound them
+_reserved_ports: Set[int] = set()
+_reserved_ports_lock = threading.Lock()
+
+
+def get_unused_ports(count: int) -> List[int]:
+    """
+    Pick `count` distinct free ports for an instance. The sockets they are picked with are held open until all of
+    them are picked, so that the system does not give the same port twice, and the ports handed out to the other
+    instances of this process are skipped until they are released with release_ports.
+    """
+    with _reserved_ports_lock:
+        sockets = []
+        ports: List[int] = []
+        try:
+            while len(ports) < count:
+                s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+                sockets.append(s)
+                s.bind((DEFAULT_POOL_HOST, 0))
+                port = s.getsockname()[1]
+                if port not in _reserved_ports:
+                    ports.append(port)
+        finally:
+            for s in sockets:
+                s.close()
+        assert len(set(ports)) == count
+        _reserved_ports.update(ports)
+        return ports
+
+
+def release_ports(ports: List[int]) -> None:
+    """Let get_unused_ports hand out again ports of a stopped instance."""
+    with _reserved_ports_lock:
+        _reserved_ports.difference_update(ports)
+
+
+@dataclass(frozen=True)
+class EmulatorSpec:
+    """
+    Everything needed to boot an emulator, instances booted from equal specifications are interchangeable.
+    The ports are not part of it, they are allocated by the pool.
+    """
+    firmware: str
+    application: str
+    args: Tuple[str, ...]
+
+    @classmethod
+    def from_speculos_args(cls, device: Device, application: Path, speculos_args: Dict) -> "EmulatorSpec":
+        """
+        :param speculos_args: The Speculos keyword arguments, as returned by ragger's prepare_speculos_args
+        """
+        args = list(speculos_args.get("args", []))
+        for port_arg in ("--api-port", "--apdu-port"):
+            if port_arg in args:
+                raise ValueError(f"{port_arg} is allocated by the emulator pool")
+        if "--model" not in args:
+            args = ["--model", device.name] + args
+        return cls(firmware=device.name, application=str(Path(application).resolve()), args=tuple(args))
+
+    def to_json(self) -> Dict:
+        return {"firmware": self.firmware, "application": self.application, "args": list(self.args)}
+
+    @classmethod
+    def from_json(cls, data: Dict) -> "EmulatorSpec":
+        return cls(firmware=data["firmware"], application=data["application"], args=tuple(data["args"]))
+
+
+class _Emulator:
+    def __init__(self, spec: EmulatorSpec):
+        self.spec = spec
+        self.api_port, self.apdu_port = get_unused_ports(2)
+        args = list(spec.args) + ["--api-port", str(self.api_port), "--apdu-port", str(self.apdu_port)]
+        try:
+            self._instance = SpeculosInstance(spec.application, args)
+        except Exception:
+            release_ports([self.api_port, self.apdu_port])
+            raise
+
+    @property
+    def url(self) -> str:
+        return f"http://{DEFAULT_POOL_HOST}:{self.api_port}"
+
+    def _has_screen_content(self, timeout: float) -> bool:
+        try:
+            with requests.get(f"{self.url}/events?currentscreenonly=true", timeout=timeout) as response:
+                return response.status_code == 200 and len(response.json().get("events", [])) > 0
+        except (requests.RequestException, ValueError):
+            return False
+
+    def start(self):
+        try:
+            self._instance.start()
+            # Same readiness criteria as ragger: the application has drawn its home screen
+            deadline = monotonic() + BOOT_TIMEOUT
+            while not self._has_screen_content(HEALTH_CHECK_TIMEOUT):
+                if monotonic() > deadline:
+                    raise EmulatorPoolError(f"Timeout waiting for the home screen of {self.spec.firmware}")
+                sleep(0.1)
+        except BaseException:
+            # Whatever failed, the process possibly started and the ports must not stay reserved
+            self.stop()
+            raise
+
+    def is_healthy(self) -> bool:
+        process = self._instance.process
+        if process is None or process.poll() is not None:
+            return False
+        return self._has_screen_content(HEALTH_CHECK_TIMEOUT)
+
+    def stop(self):
+        try:
+            self._instance.stop()
+        finally:
+            release_ports([self.api_port, self.apdu_port])
+
+
+class EmulatorPool:
+    """
+    Keeps `size` booted instances ready per specification. The specifications are registered by the
+    first lease asking for them, so the first lease of a specification pays for a boot.
+    """
+
+    def __init__(self,
+                 size: int = DEFAULT_POOL_SIZE,
+                 health_check_period: float = DEFAULT_HEALTH_CHECK_PERIOD,
+                 boot_workers: int = 4):
+        if size < 1:
+            raise ValueError("The pool needs at least one instance per specification")
+        self.size = size
+        self._health_check_period = health_check_period
+        self._condition = threading.Condition()
+        self._ready: Dict[EmulatorSpec, Deque[_Emulator]] = {}
+        self._booting: Dict[EmulatorSpec, int] = {}
+        self._leased: Dict[EmulatorSpec, int] = {}
+        self._errors: Dict[EmulatorSpec, str] = {}
+        self._closed = threading.Event()
+        self._executor = ThreadPoolExecutor(max_workers=boot_workers, thread_name_prefix="emulator-boot")
+        self._health_thread = threading.Thread(target=self._health_loop, name="emulator-health", daemon=True)
+        self._health_thread.start()
+
+    def _replenish(self, spec: EmulatorSpec):
+        # Called with the condition held
+        while len(self._ready[spec]) + self._booting[spec] < self.size:
+            self._booting[spec] += 1
+            self._executor.submit(self._boot, spec)
+
+    def _boot(self, spec: EmulatorSpec):
+        emulator: Optional[_Emulator] = None
+        error = ""
+        try:
+            # Picking the ports or preparing the instance can fail too, the waiting leases must see it
+            emulator = _Emulator(spec)
+            emulator.start()
+        except Exception as e:
+            logger.error("Failed to boot %s: %s", spec.firmware, e)
+            emulator = None
+            error = str(e)
+        with self._condition:
+            self._booting[spec] -= 1
+            if emulator is None:
+                self._errors[spec] = error
+            elif self._closed.is_set():
+                emulator.stop()
+            else:
+                self._ready[spec].append(emulator)
+            self._condition.notify_all()
+
+    def lease(self, spec: EmulatorSpec, timeout: float = DEFAULT_LEASE_TIMEOUT) -> _Emulator:
+        deadline = monotonic() + timeout
+        with self._condition:
+            if spec not in self._ready:
+                logger.info("New emulator specification for %s", spec.firmware)
+                self._ready[spec] = deque()
+                self._booting[spec] = 0
+                self._leased[spec] = 0
+            # A previous boot failure is retried once per lease, the binaries may have been rebuilt since
+            self._errors.pop(spec, None)
+            while True:
+                if self._closed.is_set():
+                    raise EmulatorPoolError("The emulator pool is closed")
+                self._replenish(spec)
+                while not self._ready[spec]:
+                    if spec in self._errors and self._booting[spec] == 0:
+                        raise EmulatorPoolError(self._errors.pop(spec))
+                    remaining = deadline - monotonic()
+                    if remaining <= 0:
+                        raise EmulatorPoolError(f"Timeout waiting for a {spec.firmware} emulator")
+                    self._condition.wait(remaining)
+                emulator = self._ready[spec].popleft()
+                # Check outside of the lock, an unresponsive instance must not block the other leases
+                self._condition.release()
+                try:
+                    healthy = emulator.is_healthy()
+                finally:
+                    self._condition.acquire()
+                if healthy:
+                    self._leased[spec] += 1
+                    self._replenish(spec)
+                    return emulator
+                logger.warning("Discarding an unhealthy %s emulator", spec.firmware)
+                self._executor.submit(emulator.stop)
+
+    def release(self, emulator: _Emulator):
+        # The application state of a leased instance is unknown, it is replaced by a fresh one
+        self._executor.submit(emulator.stop)
+        with self._condition:
+            self._leased[emulator.spec] -= 1
+            if not self._closed.is_set():
+                self._replenish(emulator.spec)
+
+    def _health_loop(self):
+        while not self._closed.wait(self._health_check_period):
+            with self._condition:
+                idle = [(spec, emulator) for spec, ready in self._ready.items() for emulator in ready]
+            for spec, emulator in idle:
+                if emulator.is_healthy():
+                    continue
+                with self._condition:
+                    if emulator not in self._ready[spec]:
+                        # Leased in the meantime, the lease performs its own check
+                        continue
+                    logger.warning("Replacing an unhealthy idle %s emulator", spec.firmware)
+                    self._ready[spec].remove(emulator)
+                    self._replenish(spec)
+                self._executor.submit(emulator.stop)
+
+    def status(self) -> List[Dict]:
+        with self._condition:
+            return [{
+                "firmware": spec.firmware,
+                "application": spec.application,
+                "ready": len(self._ready[spec]),
+                "booting": self._booting[spec],
+                "leased": self._leased[spec],
+            } for spec in self._ready]
+
+    def close(self):
+        self._closed.set()
+        with self._condition:
+            emulators = [emulator for ready in self._ready.values() for emulator in ready]
+            for ready in self._ready.values():
+                ready.clear()
+            self._condition.notify_all()
+        for emulator in emulators:
+            emulator.stop()
+        # Instances still booting are stopped by _boot once started
+        self._executor.shutdown(wait=True)
+
+
+class _PoolRequestHandler(socketserver.StreamRequestHandler):
+    """
+    JSON lines protocol. A lease lasts as long as the connection that obtained it: the instance is
+    returned on a "release" request or when the client disconnects, even if the test session crashed.
+    """
+
+    def _reply(self, **kwargs):
+        self.wfile.write(json.dumps(kwargs).encode() + b"\n")
+        self.wfile.flush()
+
+    def handle(self):
+        pool: EmulatorPool = self.server.pool  # type: ignore[attr-defined]
+        emulator: Optional[_Emulator] = None
+        try:
+            for line in self.rfile:
+                request = json.loads(line)
+                command = request.get("command")
+                if command == "status":
+                    self._reply(status="ok", pool=pool.status())
+                elif command == "lease" and emulator is None:
+                    try:
+                        emulator = pool.lease(EmulatorSpec.from_json(request["spec"]),
+                                              request.get("timeout", DEFAULT_LEASE_TIMEOUT))
+                    except EmulatorPoolError as e:
+                        self._reply(status="error", error=str(e))
+                        continue
+                    self._reply(status="ok", api_port=emulator.api_port, apdu_port=emulator.apdu_port)
+                elif command == "release" and emulator is not None:
+                    pool.release(emulator)
+                    emulator = None
+                    self._reply(status="ok")
+                else:
+                    self._reply(status="error", error=f"Unexpected command {command}")
+        except (ConnectionError, ValueError) as e:
+            logger.warning("Dropping pool client: %s", e)
+        finally:
+            if emulator is not None:
+                pool.release(emulator)
+
+
+class EmulatorPoolServer(socketserver.ThreadingTCPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+
+    def __init__(self, pool: EmulatorPool, host: str = DEFAULT_POOL_HOST, port: int = DEFAULT_POOL_PORT):
+        super().__init__((host, port), _PoolRequestHandler)
+        self.pool = pool
+
+
+class _PoolConnection:
+    def __init__(self, address: Tuple[str, int]):
+        self._socket = socket.create_connection(address)
+        self._file = self._socket.makefile("rwb")
+
+    def request(self, **kwargs) -> Dict:
+        self._file.write(json.dumps(kwargs).encode() + b"\n")
+        self._file.flush()
+        line = self._file.readline()
+        if not line:
+            raise EmulatorPoolError("The emulator pool closed the connection")
+        response = json.loads(line)
+        if response["status"] != "ok":
+            raise EmulatorPoolError(response["error"])
+        return response
+
+    def close(self):
+        self._file.close()
+        self._socket.close()
+
+
+def parse_pool_address(address: str) -> Tuple[str, int]:
+    host, _, port = address.rpartition(":")
+    return (host or DEFAULT_POOL_HOST, int(port))
+
+
+def pool_status(address: Tuple[str, int] = (DEFAULT_POOL_HOST, DEFAULT_POOL_PORT)) -> List[Dict]:
+    connection = _PoolConnection(address)
+    try:
+        return connection.request(command="status")["pool"]
+    finally:
+        connection.close()
+
+
+@contextmanager
+def lease_emulator(spec: EmulatorSpec,
+                   address: Tuple[str, int] = (DEFAULT_POOL_HOST, DEFAULT_POOL_PORT),
+                   timeout: float = DEFAULT_LEASE_TIMEOUT) -> Generator[Tuple[int, int], None, None]:
+    """
+    Lease a booted instance from the pool daemon for the duration of the context.
+
+    :return: The API and APDU ports of the leased instance
+    :rtype: Tuple[int, int]
+    """
+    connection = _PoolConnection(address)
+    try:
+        response = connection.request(command="lease", spec=spec.to_json(), timeout=timeout)
+        try:
+            yield (response["api_port"], response["apdu_port"])
+        finally:
+            connection.request(command="release")
+    finally:
+        connection.close()
+
+
+class _AttachedSpeculosClient(SpeculosClient):
+    # The instance is owned by the pool, only the event stream follows the backend lifetime
+    def start(self) -> None:
+        self.open_stream()
+
+    def stop(self) -> None:
+        self.close_stream()
+
+
+class PooledSpeculosBackend(SpeculosBackend):
+    """
+    SpeculosBackend attached to an already running instance instead of starting its own.
+    """
+
+    def __init__(self, application: Path, device: Device, api_port: int, apdu_port: int, **kwargs):
+        kwargs["args"] = ["--api-port", str(api_port), "--apdu-port", str(apdu_port)]
+        super().__init__(application, device, **kwargs)
+        self._client = _AttachedSpeculosClient(app=str(application), args=kwargs["args"], api_url=self.url)
+
+
+@contextmanager
+def pooled_backend(spec: EmulatorSpec,
+                   address: Tuple[str, int] = (DEFAULT_POOL_HOST, DEFAULT_POOL_PORT),
+                   **kwargs) -> Generator[PooledSpeculosBackend, None, None]:
+    """
+    Lease an instance matching `spec` and yield a started backend on it, the instance is returned
+    to the pool on exit.
+    """
+    device = Devices.get_by_name(spec.firmware)
+    with lease_emulator(spec, address) as (api_port, apdu_port):
+        with PooledSpeculosBackend(Path(spec.application), device, api_port, apdu_port, **kwargs) as backend:
+            yield backend
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Keep booted Speculos instances ready for the Exchange tests")
+    parser.add_argument("--host", default=DEFAULT_POOL_HOST, help=f"Listening address (default {DEFAULT_POOL_HOST})")
+    parser.add_argument("--port", type=int, default=DEFAULT_POOL_PORT,
+                        help=f"Listening port (default {DEFAULT_POOL_PORT})")
+    parser.add_argument("--size", type=int, default=DEFAULT_POOL_SIZE,
+                        help=f"Booted instances kept ready per firmware and application (default {DEFAULT_POOL_SIZE})")
+    parser.add_argument("--health-check-period", type=float, default=DEFAULT_HEALTH_CHECK_PERIOD,
+                        help=f"Seconds between two health checks of the idle instances (default {DEFAULT_HEALTH_CHECK_PERIOD})")
+    parser.add_argument("--status", action="store_true", help="Print the status of a running daemon and exit")
+    args = parser.parse_args(argv)
+
+    if args.status:
+        try:
+            status = pool_status((args.host, args.port))
+        except (ConnectionError, EmulatorPoolError) as e:
+            print(f"No emulator pool reachable on {args.host}:{args.port}: {e}")
+            return 1
+        print(json.dumps(status, indent=2))
+        return 0
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    pool = EmulatorPool(args.size, args.health_check_period)
+    server = EmulatorPoolServer(pool, args.host, args.port)
+    logger.info("Emulator pool listening on %s:%d", args.host, args.port)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        pool.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
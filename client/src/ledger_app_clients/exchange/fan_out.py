@@ -0,0 +1,169 @@
+"""
+Drive one ExchangeTestRunner flow on several firmwares at once.
+
+Each device gets its own backend and navigation helper, the per-firmware differences are already
+handled by ExchangeNavigationHelper and ExchangeClient. The devices are driven by one thread each,
+so a device matrix costs about the wall time of the slowest device instead of the sum.
+"""
+import json
+import threading
+import traceback
+
+from contextlib import ExitStack, contextmanager
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+from time import perf_counter
+from typing import Callable, ContextManager, Dict, Generator, List, Optional, Tuple, Type
+
+import pytest
+
+from ragger.backend import BackendInterface
+
+from .benchmark import PhaseTimer, TOTAL_PHASE
+from .navigation_helper import ExchangeNavigationHelper
+
+REPORT_VERSION = 1
+
+PASSED = "passed"
+FAILED = "failed"
+SKIPPED = "skipped"
+
+
+@dataclass
+class DeviceResult:
+    device: str
+    outcome: str
+    # Milliseconds spent in each phase of the flow, including the total
+    phases: Dict[str, float] = field(default_factory=dict)
+    error: Optional[str] = None
+
+    @property
+    def duration(self) -> float:
+        return self.phases.get(TOTAL_PHASE, 0.0)
+
+
+@dataclass
+class FanOutReport:
+    runner: str
+    flow: str
+    wall_time: float
+    results: List[DeviceResult]
+
+    @property
+    def passed(self) -> bool:
+        return all(result.outcome != FAILED for result in self.results)
+
+    @property
+    def sequential_time(self) -> float:
+        # What the same matrix would have cost when run device after device
+        return sum(result.duration for result in self.results)
+
+    def to_json(self) -> Dict:
+        return {
+            "runner": self.runner,
+            "flow": self.flow,
+            "wall_time": round(self.wall_time, 3),
+            "sequential_time": round(self.sequential_time, 3),
+            "results": [asdict(result) for result in self.results],
+        }
+
+    def summary(self) -> str:
+        lines = [f"{self.runner} {self.flow}: {self.wall_time:.0f} ms wall time, {self.sequential_time:.0f} ms sequential"]
+        for result in self.results:
+            lines.append(f"  {result.device:<8} {result.outcome:<8} {result.duration:8.0f} ms")
+            if result.error is not None:
+                lines.append("    " + result.error.strip().splitlines()[-1])
+        return "\n".join(lines)
+
+
+def dump_reports(reports: List[FanOutReport], path: Path):
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({"version": REPORT_VERSION, "unit": "ms", "reports": [report.to_json() for report in reports]}, f, indent=2)
+        f.write("\n")
+
+
+def _run_on_device(runner_class: Type,
+                   flow: str,
+                   backend: BackendInterface,
+                   exchange_navigation_helper: ExchangeNavigationHelper) -> DeviceResult:
+    runner = runner_class(backend, exchange_navigation_helper)
+    runner.phase_timer = PhaseTimer()
+    outcome = PASSED
+    error = None
+    try:
+        runner.run_test(flow)
+    except pytest.skip.Exception as e:
+        outcome = SKIPPED
+        error = str(e)
+    except (Exception, pytest.fail.Exception):
+        outcome = FAILED
+        error = traceback.format_exc()
+    phases = {phase: round(duration * 1000, 3) for phase, duration in runner.phase_timer.stop().items()}
+    return DeviceResult(device=backend.device.name, outcome=outcome, phases=phases, error=error)
+
+
+def run_fan_out(runner_class: Type,
+                flow: str,
+                sessions: List[Tuple[BackendInterface, ExchangeNavigationHelper]]) -> FanOutReport:
+    """
+    Run `flow` of `runner_class` concurrently on every (backend, navigation helper) session.
+    A failure on one device does not interrupt the others, it is recorded in the report.
+
+    :param runner_class: An ExchangeTestRunner child class
+    :param flow: The flow name, as given to ExchangeTestRunner.run_test
+    """
+    results: List[Optional[DeviceResult]] = [None] * len(sessions)
+
+    def worker(index: int, backend: BackendInterface, helper: ExchangeNavigationHelper):
+        results[index] = _run_on_device(runner_class, flow, backend, helper)
+
+    threads = [threading.Thread(target=worker, args=(i, backend, helper), name=f"fan-out-{backend.device.name}")
+               for i, (backend, helper) in enumerate(sessions)]
+    start = perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall_time = (perf_counter() - start) * 1000
+    return FanOutReport(runner=runner_class.__name__,
+                        flow=flow,
+                        wall_time=wall_time,
+                        results=[result for result in results if result is not None])
+
+
+@contextmanager
+def open_backends(factories: Dict[str, Callable[[], ContextManager[BackendInterface]]]) \
+        -> Generator[Dict[str, BackendInterface], None, None]:
+    """
+    Enter the backend of every device concurrently, so that the emulators boot in parallel.
+    If one of them fails to start, the started ones are closed and the error is raised.
+
+    :param factories: Per device name, a callable returning the backend context manager
+    """
+    entered: Dict[str, Tuple[ContextManager, BackendInterface]] = {}
+    errors: List[BaseException] = []
+    lock = threading.Lock()
+
+    def enter(name: str, factory: Callable[[], ContextManager[BackendInterface]]):
+        try:
+            context = factory()
+            backend = context.__enter__()
+        except BaseException as e:
+            with lock:
+                errors.append(e)
+            return
+        with lock:
+            entered[name] = (context, backend)
+
+    threads = [threading.Thread(target=enter, args=item) for item in factories.items()]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    with ExitStack() as stack:
+        for context, _ in entered.values():
+            stack.push(context.__exit__)
+        if errors:
+            raise errors[0]
+        yield {name: entered[name][1] for name in factories}
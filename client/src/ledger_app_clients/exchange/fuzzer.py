@@ -0,0 +1,732 @@
+import copy
+import random
+import threading
+
+from abc import ABC, abstractmethod
+from base64 import urlsafe_b64encode
+from dataclasses import dataclass, field
+from time import perf_counter
+from typing import Callable, Dict, List, Optional, Sequence as SequenceType, Tuple
+
+from cryptography.hazmat.primitives.asymmetric.utils import decode_dss_signature
+from google.protobuf.descriptor import FieldDescriptor
+from ragger.backend import BackendInterface, RaisePolicy
+from ragger.error import ExceptionRAPDU
+
+from .client import ExchangeClient, Command, Errors, Rate, EXCHANGE_CLASS, MAX_CHUNK_SIZE, P2_EXTEND, P2_MORE
+from .ethereum import ETH_PACKED_DERIVATION_PATH
+from .pki.pem_signer import KeySigner
+from .pki.tlv import FieldTag, der_encode
+from .signing_authority import SigningAuthority, LEDGER_SIGNER
+from .transaction_builder import SubCommand, SUBCOMMAND_TO_SPECS, get_credentials
+
+# Status words that are not a normal refusal of a malformed input
+SUSPICIOUS_STATUSES = {Errors.INTERNAL_ERROR, Errors.MEMORY_CORRUPTION}
+
+# Values that tend to hit the boundaries of the C parsers
+INTERESTING_LENGTHS = [0, 1, 2, 0x7F, 0x80, 0xFE, 0xFF]
+
+
+##############################################################################
+# Structured messages: a tree of nodes rendered to bytes at execution time.  #
+# Length prefixes, encodings and signatures are derived from their children, #
+# so mutating a leaf yields a well formed message unless the fuzzer decides  #
+# to also corrupt the derived part.                                          #
+##############################################################################
+
+def _random_bytes(rng: random.Random, size: int) -> bytes:
+    return bytes(rng.getrandbits(8) for _ in range(size))
+
+
+def _varint(value: int) -> bytes:
+    out = bytearray()
+    while True:
+        to_write = value & 0x7F
+        value >>= 7
+        if value:
+            out.append(to_write | 0x80)
+        else:
+            out.append(to_write)
+            return bytes(out)
+
+
+class Node(ABC):
+    name: str
+
+    @abstractmethod
+    def render(self, ctx: Dict[str, bytes]) -> bytes:
+        ...
+
+    def children(self) -> List["Node"]:
+        return []
+
+    @abstractmethod
+    def mutate(self, rng: random.Random) -> None:
+        ...
+
+    def walk(self):
+        yield self
+        for child in self.children():
+            yield from child.walk()
+
+
+@dataclass
+class Blob(Node):
+    name: str
+    value: bytes
+
+    def render(self, ctx: Dict[str, bytes]) -> bytes:
+        return self.value
+
+    def mutate(self, rng: random.Random) -> None:
+        value = bytearray(self.value)
+        choice = rng.randrange(6)
+        if choice == 0 and value:
+            # Flip one bit
+            index = rng.randrange(len(value))
+            value[index] ^= 1 << rng.randrange(8)
+        elif choice == 1:
+            # Truncate
+            value = value[:rng.randrange(len(value) + 1)]
+        elif choice == 2:
+            # Extend with random bytes
+            value += _random_bytes(rng, rng.choice([1, 2, 8, 64]))
+        elif choice == 3:
+            # Boundary sizes filled with a boundary value
+            value = bytearray([rng.choice([0x00, 0x7F, 0x80, 0xFF])] * rng.choice(INTERESTING_LENGTHS))
+        elif choice == 4 and value:
+            # Replace one byte by a non printable / boundary value
+            value[rng.randrange(len(value))] = rng.choice([0x00, 0x20, 0x7F, 0x80, 0xFF])
+        else:
+            # Duplicate
+            value = value + value
+        self.value = bytes(value)
+
+
+@dataclass
+class Uint(Node):
+    name: str
+    value: int
+    size: int
+
+    def render(self, ctx: Dict[str, bytes]) -> bytes:
+        return (self.value % (1 << (8 * self.size))).to_bytes(self.size, "big")
+
+    def mutate(self, rng: random.Random) -> None:
+        maximum = (1 << (8 * self.size)) - 1
+        self.value = rng.choice([0, 1, maximum, maximum - 1, self.value + 1, self.value - 1,
+                                 rng.randint(0, maximum)])
+
+
+@dataclass
+class Placeholder(Node):
+    # Bound to a value produced by the device during the prelude (transaction id, challenge)
+    name: str
+    key: str
+    override: Optional[bytes] = None
+
+    def render(self, ctx: Dict[str, bytes]) -> bytes:
+        if self.override is not None:
+            return self.override
+        return ctx[self.key]
+
+    def mutate(self, rng: random.Random) -> None:
+        self.override = _random_bytes(rng, rng.choice([0, 1, 4, 10, 32, 33]))
+
+
+@dataclass
+class Sequence(Node):
+    name: str
+    items: List[Node]
+
+    def render(self, ctx: Dict[str, bytes]) -> bytes:
+        return b"".join(item.render(ctx) for item in self.items)
+
+    def children(self) -> List[Node]:
+        return self.items
+
+    def mutate(self, rng: random.Random) -> None:
+        choice = rng.randrange(3)
+        if choice == 0 and self.items:
+            del self.items[rng.randrange(len(self.items))]
+        elif choice == 1 and self.items:
+            index = rng.randrange(len(self.items))
+            self.items.insert(index, copy.deepcopy(self.items[index]))
+        elif len(self.items) > 1:
+            i, j = rng.sample(range(len(self.items)), 2)
+            self.items[i], self.items[j] = self.items[j], self.items[i]
+
+
+@dataclass
+class LengthPrefixed(Node):
+    name: str
+    item: Node
+    prefix_size: int = 1
+    length_override: Optional[int] = None
+
+    def render(self, ctx: Dict[str, bytes]) -> bytes:
+        content = self.item.render(ctx)
+        length = len(content) if self.length_override is None else self.length_override
+        return (length % (1 << (8 * self.prefix_size))).to_bytes(self.prefix_size, "big") + content
+
+    def children(self) -> List[Node]:
+        return [self.item]
+
+    def mutate(self, rng: random.Random) -> None:
+        self.length_override = rng.choice(INTERESTING_LENGTHS + [rng.randrange(1 << (8 * self.prefix_size))])
+
+
+@dataclass
+class Tlv(Node):
+    # Trusted name descriptor TLV, see pki/tlv.py
+    name: str
+    tag: int
+    item: Node
+    length_override: Optional[int] = None
+
+    def render(self, ctx: Dict[str, bytes]) -> bytes:
+        content = self.item.render(ctx)
+        length = len(content) if self.length_override is None else self.length_override
+        return der_encode(self.tag) + der_encode(length) + content
+
+    def children(self) -> List[Node]:
+        return [self.item]
+
+    def mutate(self, rng: random.Random) -> None:
+        if rng.randrange(2):
+            self.tag = rng.choice([tag.value for tag in FieldTag] + [0x00, 0x7F, 0x80, 0xFF])
+        else:
+            self.length_override = rng.choice(INTERESTING_LENGTHS)
+
+
+@dataclass
+class ProtoField(Node):
+    # Protobuf length-delimited or varint field, see pb/exchange_pb2.py
+    name: str
+    number: int
+    wire_type: int
+    item: Node
+
+    def render(self, ctx: Dict[str, bytes]) -> bytes:
+        key = _varint((self.number << 3) | self.wire_type)
+        content = self.item.render(ctx)
+        if self.wire_type == 0:
+            return key + _varint(int.from_bytes(content, "big"))
+        return key + _varint(len(content)) + content
+
+    def children(self) -> List[Node]:
+        return [self.item]
+
+    def mutate(self, rng: random.Random) -> None:
+        if rng.randrange(2):
+            self.number = rng.choice([self.number + 1, 0, 15, 16, 0x1FFFFFFF])
+        else:
+            self.wire_type = rng.choice([0, 1, 2, 5, 7])
+
+
+@dataclass
+class Transform(Node):
+    # Encoding of a child, base64url for the NG transaction payloads
+    name: str
+    item: Node
+    encode: Callable[[bytes], bytes]
+    raw: bool = False
+
+    def render(self, ctx: Dict[str, bytes]) -> bytes:
+        content = self.item.render(ctx)
+        return content if self.raw else self.encode(content)
+
+    def children(self) -> List[Node]:
+        return [self.item]
+
+    def mutate(self, rng: random.Random) -> None:
+        self.raw = not self.raw
+
+
+@dataclass
+class Signature(Node):
+    # Signature of another node of the same message, recomputed on each rendering
+    name: str
+    covers: Node
+    sign: Callable[[bytes], bytes]
+    corrupt: bool = False
+
+    def render(self, ctx: Dict[str, bytes]) -> bytes:
+        signature = bytearray(self.sign(self.covers.render(ctx)))
+        if self.corrupt and signature:
+            signature[-1] ^= 0x01
+        return bytes(signature)
+
+    def mutate(self, rng: random.Random) -> None:
+        self.corrupt = not self.corrupt
+
+    def __deepcopy__(self, memo):
+        # The covered node is part of the same tree, keep the reference consistent in the copy
+        return Signature(self.name, copy.deepcopy(self.covers, memo), self.sign, self.corrupt)
+
+
+@dataclass
+class Apdu:
+    ins: int
+    payload: Node
+    # Split the payload in chunks flagged with P2_MORE / P2_EXTEND
+    split: bool = False
+    chunk_size: int = MAX_CHUNK_SIZE
+    # Chunk index -> P2 extension bits to XOR, to send unexpected P2_MORE / P2_EXTEND sequences
+    extension_flips: Dict[int, int] = field(default_factory=dict)
+    dropped_chunks: List[int] = field(default_factory=list)
+
+    def render(self, ctx: Dict[str, bytes]) -> List[Tuple[int, bytes]]:
+        data = self.payload.render(ctx)
+        if not self.split:
+            return [(0, data[:MAX_CHUNK_SIZE])]
+        chunks = [data[x:x + self.chunk_size] for x in range(0, len(data), self.chunk_size)] or [b""]
+        rendered = []
+        for i, chunk in enumerate(chunks):
+            if i in self.dropped_chunks:
+                continue
+            extension = 0
+            if i != len(chunks) - 1:
+                extension |= P2_MORE
+            if i != 0:
+                extension |= P2_EXTEND
+            rendered.append((extension ^ self.extension_flips.get(i, 0), chunk))
+        return rendered
+
+    def mutate_framing(self, rng: random.Random) -> None:
+        choice = rng.randrange(3)
+        if choice == 0:
+            self.chunk_size = rng.choice([1, 2, 16, 64, 128, MAX_CHUNK_SIZE])
+        elif choice == 1:
+            self.extension_flips[rng.randrange(4)] = rng.choice([P2_MORE, P2_EXTEND, P2_MORE | P2_EXTEND, 0x40, 0x80])
+        else:
+            self.dropped_chunks.append(rng.randrange(4))
+
+
+##############################################################################
+# Seeds built from the same helpers as the regular tests                     #
+##############################################################################
+
+def proto_to_node(message) -> Sequence:
+    """
+    Convert a protobuf message (pb/exchange_pb2.py) to a tree of ProtoField, in field number
+    order as the protobuf encoder does, so that the unmutated tree renders SerializeToString()
+    """
+    items = []
+    for descriptor, value in sorted(message.ListFields(), key=lambda f: f[0].number):
+        if descriptor.type == FieldDescriptor.TYPE_MESSAGE:
+            items.append(ProtoField(descriptor.name, descriptor.number, 2, proto_to_node(value)))
+        elif descriptor.type == FieldDescriptor.TYPE_STRING:
+            items.append(ProtoField(descriptor.name, descriptor.number, 2, Blob(descriptor.name, value.encode())))
+        elif descriptor.type == FieldDescriptor.TYPE_BYTES:
+            items.append(ProtoField(descriptor.name, descriptor.number, 2, Blob(descriptor.name, value)))
+        else:
+            size = max(1, (value.bit_length() + 7) // 8)
+            items.append(ProtoField(descriptor.name, descriptor.number, 0, Uint(descriptor.name, value, size)))
+    return Sequence(message.DESCRIPTOR.name, items)
+
+
+def currency_config_node(ticker: str, application_name: str, sub_config: Optional[Node] = None) -> Sequence:
+    # Layout of ethereum.create_currency_config
+    return Sequence("currency_config", [
+        LengthPrefixed("ticker", Blob("ticker", ticker.encode())),
+        LengthPrefixed("application_name", Blob("application_name", application_name.encode())),
+        LengthPrefixed("sub_config", sub_config if sub_config is not None else Blob("sub_config", b"")),
+    ])
+
+
+def eth_sub_config_node(ticker: str, decimals: int, chain_id: int, fees_ticker: str, fees_decimals: int) -> Sequence:
+    # Layout of ethereum.get_sub_config
+    return Sequence("sub_config", [
+        LengthPrefixed("ticker", Blob("ticker", ticker.encode())),
+        Uint("decimals", decimals, 1),
+        Uint("chain_id", chain_id, 8),
+        LengthPrefixed("fees_ticker", Blob("fees_ticker", fees_ticker.encode())),
+        Uint("fees_decimals", fees_decimals, 1),
+    ])
+
+
+def derivation_path_node(packed_path: bytes) -> Sequence:
+    count = packed_path[0]
+    indexes = [Uint(f"index_{i}", int.from_bytes(packed_path[1 + 4 * i:5 + 4 * i], "big"), 4) for i in range(count)]
+    return Sequence("derivation_path", [Uint("count", count, 1)] + indexes)
+
+
+def check_address_payload_node(conf: Node, packed_path: bytes) -> Sequence:
+    # Layout of cal_helper.CurrencyConfiguration.get_conf_for_ticker
+    return Sequence("check_address", [
+        LengthPrefixed("conf", conf),
+        Signature("conf_signature", conf, LEDGER_SIGNER.sign),
+        LengthPrefixed("derivation_path", derivation_path_node(packed_path)),
+    ])
+
+
+def eth_check_address_payload_node() -> Sequence:
+    conf = currency_config_node("ETH", "Ethereum", eth_sub_config_node("ETH", 18, 1, "ETH", 18))
+    return check_address_payload_node(conf, ETH_PACKED_DERIVATION_PATH)
+
+
+def trusted_name_descriptor_node(trusted_name: bytes, address: bytes, key_signer: KeySigner) -> Sequence:
+    # Layout of ExchangeClient.send_trusted_name_descriptor
+    fields = Sequence("fields", [
+        Tlv("structure_type", FieldTag.TAG_STRUCTURE_TYPE, Uint("structure_type", 3, 1)),
+        Tlv("version", FieldTag.TAG_VERSION, Uint("version", 3, 1)),
+        Tlv("trusted_name_type", FieldTag.TAG_TRUSTED_NAME_TYPE, Uint("trusted_name_type", 0x06, 1)),
+        Tlv("trusted_name_source", FieldTag.TAG_TRUSTED_NAME_SOURCE, Uint("trusted_name_source", 0x06, 1)),
+        Tlv("trusted_name", FieldTag.TAG_TRUSTED_NAME, Blob("trusted_name", trusted_name)),
+        Tlv("chain_id", FieldTag.TAG_CHAIN_ID, Uint("chain_id", 0, 1)),
+        Tlv("address", FieldTag.TAG_ADDRESS, Blob("address", address)),
+        Tlv("challenge", FieldTag.TAG_CHALLENGE, Placeholder("challenge", "challenge")),
+        Tlv("signer_key_id", FieldTag.TAG_SIGNER_KEY_ID, Uint("signer_key_id", 0, 1)),
+        Tlv("signer_algo", FieldTag.TAG_SIGNER_ALGO, Uint("signer_algo", 1, 1)),
+    ])
+    signature = Tlv("signature", FieldTag.TAG_DER_SIGNATURE,
+                    Signature("signature", fields, key_signer.sign_data))
+    return Sequence("trusted_name_descriptor", [fields, signature])
+
+
+##############################################################################
+# Targets: a prelude bringing the app in the expected state and a seed       #
+##############################################################################
+
+DEFAULT_SWAP_TX_INFOS = {
+    "payin_address": b"0xd692Cb1346262F584D17B4B470954501f6715a82",
+    "payin_extra_id": b"",
+    "refund_address": b"0xDad77910DbDFdE764fC21FCD4E74D71bBACA6D8D",
+    "refund_extra_id": b"",
+    "payout_address": b"0xDad77910DbDFdE764fC21FCD4E74D71bBACA6D8D",
+    "payout_extra_id": b"",
+    "currency_from": "ETH",
+    "currency_to": "ETH",
+    "amount_to_provider": int.to_bytes(1000, length=8, byteorder='big'),
+    "amount_to_wallet": b"\246\333t\233+\330\000",
+}
+
+DEFAULT_FUND_TX_INFOS = {
+    "user_id": "Jon Wick",
+    "account_name": "My account 00",
+    "in_currency": "ETH",
+    "in_amount": int.to_bytes(1000, length=8, byteorder='big'),
+    "in_address": "0xd692Cb1346262F584D17B4B470954501f6715a82",
+}
+
+DEFAULT_FEES = 100
+
+# Steps of the preludes, each one run in the state left by the previous one
+PARTNER_CHECKED = ("init", "partner_set", "partner_checked")
+TRANSACTION_CHECKED = PARTNER_CHECKED + ("transaction_checked",)
+
+
+@dataclass
+class Target:
+    name: str
+    subcommand: SubCommand
+    # Steps of ExchangeFuzzer._prelude to perform before the fuzzed APDUs, in order
+    prelude: Tuple[str, ...]
+    # Build the APDUs to fuzz from the fuzzer context (partner, tx infos, ...)
+    seed: Callable[["ExchangeFuzzer"], List[Apdu]]
+
+
+def _partner_key_seed(fuzzer: "ExchangeFuzzer") -> List[Apdu]:
+    name = fuzzer.partner_name.encode()
+    public_key = fuzzer.partner.credentials_ng[len(name) + 2:]
+    credentials = Sequence("credentials", [
+        LengthPrefixed("name", Blob("name", name)),
+        Uint("curve_id", 0x01, 1),
+        Blob("public_key", public_key),
+    ])
+    return [Apdu(Command.SET_PARTNER_KEY, credentials),
+            Apdu(Command.CHECK_PARTNER, Signature("partner_signature", credentials, LEDGER_SIGNER.sign))]
+
+
+def _transaction_seed(fuzzer: "ExchangeFuzzer", subcommand: SubCommand, tx_infos: Dict) -> List[Apdu]:
+    specs = SUBCOMMAND_TO_SPECS[subcommand]
+    fields = dict(tx_infos)
+    # The transaction id placeholder is bound at execution time to the one of the device
+    fields[specs.transaction_id_field] = b"\x00"
+    message = specs.transaction_type(**fields)
+    proto = proto_to_node(message)
+    for item in proto.items:
+        if item.name == specs.transaction_id_field:
+            item.item = Placeholder("transaction_id", "transaction_id")
+    encoded = Transform("payload", proto, urlsafe_b64encode)
+
+    payload = Sequence("transaction", [
+        Uint("payload_encoding", specs.payload_encoding_prefix[0], 1),
+        LengthPrefixed("payload", encoded, prefix_size=2),
+        LengthPrefixed("fees", Blob("fees", DEFAULT_FEES.to_bytes(1, "big"))),
+    ])
+
+    def sign(payload_bytes: bytes) -> bytes:
+        der = fuzzer.partner.sign(specs.format_transaction(payload_bytes))
+        r, s = decode_dss_signature(der)
+        return specs.dot_prefix + specs.signature_encoding_prefix + r.to_bytes(32, "big") + s.to_bytes(32, "big")
+
+    return [Apdu(Command.PROCESS_TRANSACTION_RESPONSE, payload, split=True),
+            Apdu(Command.CHECK_TRANSACTION_SIGNATURE, Signature("transaction_signature", encoded, sign))]
+
+
+TARGETS = {
+    "partner_key": Target("partner_key", SubCommand.SWAP_NG, ("init",), _partner_key_seed),
+    "swap_transaction": Target("swap_transaction", SubCommand.SWAP_NG, PARTNER_CHECKED,
+                               lambda f: _transaction_seed(f, SubCommand.SWAP_NG, DEFAULT_SWAP_TX_INFOS)),
+    "fund_transaction": Target("fund_transaction", SubCommand.FUND_NG, PARTNER_CHECKED,
+                               lambda f: _transaction_seed(f, SubCommand.FUND_NG, DEFAULT_FUND_TX_INFOS)),
+    "payout_address": Target("payout_address", SubCommand.SWAP_NG, TRANSACTION_CHECKED,
+                             lambda f: [Apdu(Command.CHECK_PAYOUT_ADDRESS, eth_check_address_payload_node())]),
+    "refund_address": Target("refund_address", SubCommand.SWAP_NG, TRANSACTION_CHECKED + ("payout_checked",),
+                             lambda f: [Apdu(Command.CHECK_REFUND_ADDRESS_NO_DISPLAY, eth_check_address_payload_node())]),
+    "asset_in": Target("asset_in", SubCommand.FUND_NG, TRANSACTION_CHECKED,
+                       lambda f: [Apdu(Command.CHECK_ASSET_IN_NO_DISPLAY, eth_check_address_payload_node())]),
+    # The challenge is only given before the payout address is checked
+    "trusted_name": Target("trusted_name", SubCommand.SWAP_NG, TRANSACTION_CHECKED + ("challenge",),
+                           lambda f: [Apdu(Command.SEND_TRUSTED_NAME_DESCRIPTOR,
+                                           trusted_name_descriptor_node(DEFAULT_SWAP_TX_INFOS["refund_address"],
+                                                                        b"my.alias.eth",
+                                                                        f.trusted_name_key_signer))]),
+}
+
+
+##############################################################################
+# Engine                                                                     #
+##############################################################################
+
+@dataclass
+class Finding:
+    target: str
+    status: Optional[int]
+    error: Optional[str]
+    # Rendered APDUs sent after the prelude, as (ins, p2 extension, data hex)
+    reproducer: List[Tuple[int, int, str]]
+    count: int = 1
+
+
+@dataclass
+class FuzzStats:
+    executions: int = 0
+    elapsed: float = 0.0
+    corpus_size: int = 0
+    statuses: Dict[int, int] = field(default_factory=dict)
+    findings: List[Finding] = field(default_factory=list)
+
+    @property
+    def executions_per_second(self) -> float:
+        return self.executions / self.elapsed if self.elapsed else 0.0
+
+    def summary(self) -> str:
+        lines = [f"{self.executions} executions in {self.elapsed:.2f}s "
+                 f"({self.executions_per_second:.1f} exec/s), corpus {self.corpus_size}, "
+                 f"{len(self.findings)} unique finding(s)"]
+        for status, count in sorted(self.statuses.items()):
+            try:
+                status_name = Errors(status).name
+            except ValueError:
+                status_name = "UNKNOWN"
+            lines.append(f"  0x{status:04X} {status_name}: {count}")
+        for finding in self.findings:
+            lines.append(f"  finding {finding.target} status={finding.status} error={finding.error} x{finding.count}")
+        return "\n".join(lines)
+
+
+class FuzzState:
+    """
+    Corpus and findings, shared by all the fuzzers of a campaign running on an emulator pool
+    """
+
+    def __init__(self, max_corpus_size: int = 256):
+        self._lock = threading.Lock()
+        self._max_corpus_size = max_corpus_size
+        self.corpus: Dict[str, List[List[Apdu]]] = {}
+        self._signals: Dict[str, set] = {}
+        self.findings: Dict[Tuple[str, object], Finding] = {}
+        self.statuses: Dict[int, int] = {}
+        self.executions = 0
+
+    def pick(self, target: str, rng: random.Random) -> Optional[List[Apdu]]:
+        with self._lock:
+            inputs = self.corpus.get(target)
+            return copy.deepcopy(rng.choice(inputs)) if inputs else None
+
+    def add_seed(self, target: str, apdus: List[Apdu]) -> None:
+        with self._lock:
+            self.corpus.setdefault(target, []).append(apdus)
+
+    def record(self, target: str, apdus: List[Apdu], signal: Tuple, status: Optional[int]) -> bool:
+        # Keep the input in the corpus if it produced a response never seen for this target
+        with self._lock:
+            self.executions += 1
+            if status is not None:
+                self.statuses[status] = self.statuses.get(status, 0) + 1
+            signals = self._signals.setdefault(target, set())
+            if signal in signals:
+                return False
+            signals.add(signal)
+            corpus = self.corpus.setdefault(target, [])
+            if len(corpus) < self._max_corpus_size:
+                corpus.append(apdus)
+            return True
+
+    def report(self, finding: Finding) -> None:
+        # Findings are deduplicated by target and status word (or exception type)
+        key = (finding.target, finding.status if finding.error is None else finding.error)
+        with self._lock:
+            if key in self.findings:
+                self.findings[key].count += 1
+            else:
+                self.findings[key] = finding
+
+
+class ExchangeFuzzer:
+    """
+    Structure-aware fuzzer of the Exchange APDU protocol.
+
+    Each execution brings the application in the state expected by the target through a valid
+    prelude, then sends a mutated version of the target APDUs. The mutations are made at the field
+    level (protobuf fields, CAL configuration, TLV, length prefixes, signatures, P2 split flags).
+    Works on any BackendInterface: Speculos, a physical device or an in-process model.
+    """
+
+    def __init__(self,
+                 backend: BackendInterface,
+                 targets: Optional[SequenceType[str]] = None,
+                 seed: int = 0,
+                 state: Optional[FuzzState] = None,
+                 max_mutations: int = 4,
+                 suspicious_statuses=SUSPICIOUS_STATUSES):
+        self.backend = backend
+        self.rng = random.Random(seed)
+        self.targets = [TARGETS[name] for name in (targets if targets is not None else TARGETS)]
+        self.state = state if state is not None else FuzzState()
+        self.max_mutations = max_mutations
+        self.suspicious_statuses = set(suspicious_statuses)
+        self.known_statuses = {error.value for error in Errors}
+
+        self.partner_name = "Fuzz partner"
+        self.partner = SigningAuthority(curve=SUBCOMMAND_TO_SPECS[SubCommand.SWAP_NG].partner_curve,
+                                        name=self.partner_name,
+                                        existing_key=0x1234 + seed)
+        self.trusted_name_key_signer = KeySigner("trusted_name.pem")
+        for target in self.targets:
+            if target.name not in self.state.corpus:
+                self.state.add_seed(target.name, target.seed(self))
+
+    def _prelude(self, target: Target) -> Dict[str, bytes]:
+        ex = ExchangeClient(self.backend, Rate.FIXED, target.subcommand)
+        ctx = {}
+        credentials = get_credentials(target.subcommand, self.partner)
+        for step in target.prelude:
+            if step == "init":
+                ctx["transaction_id"] = ex.init_transaction().data
+            elif step == "partner_set":
+                ex.set_partner_key(credentials)
+            elif step == "partner_checked":
+                ex.check_partner_key(LEDGER_SIGNER.sign(credentials))
+            elif step == "transaction_checked":
+                tx_infos = DEFAULT_SWAP_TX_INFOS if target.subcommand == SubCommand.SWAP_NG else DEFAULT_FUND_TX_INFOS
+                for apdu in _transaction_seed(self, target.subcommand, tx_infos):
+                    self._send(apdu, ctx, target.subcommand)
+            elif step == "payout_checked":
+                self._send(Apdu(Command.CHECK_PAYOUT_ADDRESS, eth_check_address_payload_node()), ctx, target.subcommand)
+            elif step == "challenge":
+                ctx["challenge"] = ex.get_challenge().data
+                ex.send_pki_certificate()
+            else:
+                raise ValueError(f"Unknown prelude step {step}")
+        return ctx
+
+    def _send(self, apdu: Apdu, ctx: Dict[str, bytes], subcommand: SubCommand) -> List[Tuple[int, int, bytes, int]]:
+        sent = []
+        for extension, data in apdu.render(ctx):
+            rapdu = self.backend.exchange(EXCHANGE_CLASS, apdu.ins, p1=Rate.FIXED, p2=subcommand | extension, data=data)
+            sent.append((apdu.ins, extension, data, rapdu.status))
+            if rapdu.status != Errors.SUCCESS:
+                break
+        return sent
+
+    def _mutate(self, apdus: List[Apdu]) -> List[Apdu]:
+        for _ in range(self.rng.randint(1, self.max_mutations)):
+            apdu = self.rng.choice(apdus)
+            if apdu.split and self.rng.randrange(8) == 0:
+                apdu.mutate_framing(self.rng)
+                continue
+            nodes = list(apdu.payload.walk())
+            self.rng.choice(nodes).mutate(self.rng)
+        return apdus
+
+    def execute(self, target: Target, apdus: List[Apdu]) -> Tuple[Optional[int], Optional[str], List]:
+        """
+        Run the prelude then the given APDUs, stopping at the first error
+
+        :return: The last status word, the name of the exception raised by the backend if any, and the sent chunks
+        """
+        sent = []
+        try:
+            self.backend.raise_policy = RaisePolicy.RAISE_ALL_BUT_0x9000
+            ctx = self._prelude(target)
+            self.backend.raise_policy = RaisePolicy.RAISE_NOTHING
+            for apdu in apdus:
+                sent += self._send(apdu, ctx, target.subcommand)
+                if sent and sent[-1][3] != Errors.SUCCESS:
+                    break
+        except ExceptionRAPDU as e:
+            # The prelude itself failed, the application is in an unexpected state
+            return e.status, f"prelude failure 0x{e.status:04X}", sent
+        except Exception as e:  # pylint: disable=broad-except
+            return None, type(e).__name__, sent
+        finally:
+            self.backend.raise_policy = RaisePolicy.RAISE_ALL_BUT_0x9000
+        return (sent[-1][3] if sent else None), None, sent
+
+    def step(self) -> None:
+        target = self.rng.choice(self.targets)
+        apdus = self.state.pick(target.name, self.rng)
+        apdus = self._mutate(apdus)
+        status, error, sent = self.execute(target, apdus)
+
+        # Depth reached and response are the feedback, we have no coverage from the device
+        signal = (len(sent), status, error)
+        self.state.record(target.name, apdus, signal, status)
+
+        if error is not None or status in self.suspicious_statuses or status not in self.known_statuses:
+            self.state.report(Finding(target=target.name,
+                                      status=status,
+                                      error=error,
+                                      reproducer=[(ins, extension, data.hex()) for ins, extension, data, _ in sent]))
+
+    def run(self, iterations: Optional[int] = None, duration: Optional[float] = None) -> FuzzStats:
+        if iterations is None and duration is None:
+            raise ValueError("Specify a number of iterations or a duration")
+        start = perf_counter()
+        done = 0
+        while (iterations is None or done < iterations) and (duration is None or perf_counter() - start < duration):
+            self.step()
+            done += 1
+        return self.stats(perf_counter() - start)
+
+    def stats(self, elapsed: float) -> FuzzStats:
+        return FuzzStats(executions=self.state.executions,
+                         elapsed=elapsed,
+                         corpus_size=sum(len(inputs) for inputs in self.state.corpus.values()),
+                         statuses=dict(self.state.statuses),
+                         findings=list(self.state.findings.values()))
+
+
+def run_campaign(backends: SequenceType[BackendInterface],
+                 targets: Optional[SequenceType[str]] = None,
+                 iterations: Optional[int] = None,
+                 duration: Optional[float] = None,
+                 seed: int = 0) -> FuzzStats:
+    """
+    Fuzz on several backends (for example a pool of emulators) concurrently, sharing the corpus
+    and the findings. The iterations are per backend.
+    """
+    state = FuzzState()
+    fuzzers = [ExchangeFuzzer(backend, targets=targets, seed=seed + i, state=state) for i, backend in enumerate(backends)]
+    threads = [threading.Thread(target=fuzzer.run, kwargs={"iterations": iterations, "duration": duration})
+               for fuzzer in fuzzers]
+    start = perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return fuzzers[0].stats(perf_counter() - start)
@@ -0,0 +1,938 @@
+import re
+import random
+
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from enum import IntEnum
+from hashlib import sha256
+from typing import Callable, Dict, Generator, Iterable, Optional, Tuple
+
+from cryptography.exceptions import InvalidSignature
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.asymmetric import ec
+from cryptography.hazmat.primitives.asymmetric.utils import Prehashed, encode_dss_signature
+from google.protobuf.descriptor import FieldDescriptor
+from google.protobuf.message import DecodeError, Message
+from ragger.backend.physical_backend import PhysicalBackend
+from ragger.error import ExceptionRAPDU
+from ragger.utils import RAPDU
+
+from .client import Command, Errors, Rate, EXCHANGE_CLASS, P2_EXTEND, P2_MORE, KEY_ID_TEST
+from .navigation_helper import ExchangeNavigationHelper
+from .pb.exchange_pb2 import NewFundResponse, NewSellResponse, NewTransactionResponse
+from .pki.tlv import FieldTag
+from .signing_authority import LEDGER_SIGNER
+from .transaction_builder import SubCommand, SWAP_SUBCOMMANDS, SELL_SUBCOMMANDS, FUND_SUBCOMMANDS, LEGACY_SUBCOMMANDS
+
+# Version of the C application this model was written against, answered to GET_VERSION
+MODEL_APP_VERSION = (4, 4, 2)
+
+# Transaction ids generated by the application when compiled with the TESTING flag
+LEGACY_SWAP_TRANSACTION_ID = bytes([ord('A') + 42 % 26]) * 10
+TRANSACTION_ID = bytes.fromhex("350aea0c97f747f1d0f760814614a47523801b1aeb7d0bcbbaa2a4f46bf8184b")
+
+MIN_DER_SIGNATURE_LENGTH = 67
+MAX_DER_SIGNATURE_LENGTH = 73
+UNCOMPRESSED_KEY_LENGTH = 65
+MIN_PARTNER_NAME_LENGTH = 3
+MAX_PARTNER_NAME_LENGTH = 15
+TICKER_MIN_SIZE = 1
+TICKER_MAX_SIZE = 9
+APPNAME_MIN_SIZE = 3
+APPNAME_MAX_SIZE = 32
+MAX_COIN_SUB_CONFIG_SIZE = 64
+MAX_SPLIT_DATA_SIZE = 256 * 2
+MAX_DECODED_TRANSACTION_SIZE = 512
+PAYIN_EXTRA_DATA_SIZE = 33
+
+PKI_CLASS = 0xB0
+PKI_INS_LOAD_CERTIFICATE = 0x06
+PKI_CERTIFICATE_TAG_PUBLIC_KEY = 0x33
+
+TRUSTED_NAME_STRUCTURE_TYPE = 0x03
+TRUSTED_NAME_VERSION = 0x03
+TRUSTED_NAME_TYPE_CONTEXT_ADDRESS = 0x06
+TRUSTED_NAME_SOURCE_DYNAMIC_RESOLVER = 0x06
+TRUSTED_NAME_SIGNER_ALGO_ECDSA_SHA256 = 0x01
+TRUSTED_NAME_REQUIRED_TAGS = {
+    FieldTag.TAG_STRUCTURE_TYPE,
+    FieldTag.TAG_VERSION,
+    FieldTag.TAG_TRUSTED_NAME_TYPE,
+    FieldTag.TAG_TRUSTED_NAME_SOURCE,
+    FieldTag.TAG_TRUSTED_NAME,
+    FieldTag.TAG_CHAIN_ID,
+    FieldTag.TAG_ADDRESS,
+    FieldTag.TAG_SIGNER_KEY_ID,
+    FieldTag.TAG_SIGNER_ALGO,
+    FieldTag.TAG_DER_SIGNATURE,
+}
+
+# Same aliases as ticker_normalization.c and parse_coin_config.c
+CURRENCY_ALIASES = ((b"USDT20", b"USDT"), (b"REP", b"REPv2"))
+APPNAME_ALIASES = {
+    b"Tezos": b"Tezos Wallet",
+    b"bsc": b"Binance Smart Chain",
+    b"Bsc": b"Binance Smart Chain",
+}
+
+# nanopb buffer sizes from src/proto/protocol.options. Strings are stored NULL terminated
+PB_MAX_SIZES = {
+    "NewTransactionResponse": {
+        "payin_address": 151, "payin_extra_id": 20, "payin_extra_data": 33, "refund_address": 151,
+        "refund_extra_id": 20, "payout_address": 151, "payout_extra_id": 20, "currency_from": 10,
+        "currency_to": 10, "amount_to_provider": 16, "amount_to_wallet": 16, "device_transaction_id": 11,
+        "device_transaction_id_ng": 32,
+    },
+    "NewSellResponse": {
+        "trader_email": 50, "in_currency": 10, "in_amount": 16, "in_address": 151, "in_extra_id": 20,
+        "out_currency": 10, "device_transaction_id": 32,
+    },
+    "NewFundResponse": {
+        "user_id": 50, "account_name": 50, "in_currency": 10, "in_amount": 16, "in_address": 151,
+        "in_extra_id": 20, "device_transaction_id": 32,
+    },
+    "UDecimal": {
+        "coefficient": 16,
+    },
+}
+
+_BASE58 = "[1-9A-HJ-NP-Za-km-z]"
+_BECH32 = "[02-9ac-hj-np-z]"
+_EVM_ADDRESS = "0x[0-9a-fA-F]{40}"
+
+# Address formats accepted by the coin applications the tests sideload. The model can not derive
+# addresses from the seed, so it only rejects addresses that the coin application could not parse
+ADDRESS_FORMATS: Dict[str, str] = {
+    "Ethereum": _EVM_ADDRESS,
+    "Ethereum Classic": _EVM_ADDRESS,
+    "Binance Smart Chain": _EVM_ADDRESS,
+    "Celo": _EVM_ADDRESS,
+    "Bitcoin": f"(bc1|tb1|bcrt1){_BECH32}{{6,87}}|[132mn]{_BASE58}{{25,34}}",
+    "Bitcoin Test": f"(bc1|tb1|bcrt1){_BECH32}{{6,87}}|[132mn]{_BASE58}{{25,34}}",
+    "Litecoin": f"(ltc1|tltc1|rltc1){_BECH32}{{6,87}}|[LM32mnQ]{_BASE58}{{25,34}}",
+    "Stellar": "G[A-Z2-7]{55}",
+    "Tezos Wallet": f"(tz[1-4]|KT1){_BASE58}{{33}}",
+    "XRP": f"r{_BASE58}{{24,34}}",
+    "Tron": f"T{_BASE58}{{33}}",
+}
+
+# Signature of the hook used in place of the CHECK_ADDRESS library call:
+# (application name, sub coin configuration, packed derivation path, address, extra id) -> valid
+AddressChecker = Callable[[str, bytes, bytes, str, str], bool]
+
+
+def check_address_format(appname: str,
+                         sub_config: bytes,
+                         derivation_path: bytes,
+                         address: str,
+                         extra_id: str) -> bool:
+    pattern = ADDRESS_FORMATS.get(appname)
+    if pattern is None:
+        return True
+    return re.fullmatch(pattern, address) is not None
+
+
+class State(IntEnum):
+    # Same values and order as src/states.h
+    INITIAL_STATE = 0
+    WAITING_TRANSACTION = 1
+    PROVIDER_SET = 2
+    PROVIDER_CHECKED = 3
+    TRANSACTION_RECEIVED = 4
+    SIGNATURE_CHECKED = 5
+    PAYOUT_ADDRESS_CHECKED = 6
+    ALL_ADDRESSES_CHECKED = 7
+    WAITING_USER_VALIDATION = 8
+    WAITING_SIGNING = 9
+    SIGN_FINISHED = 10
+
+
+# Expected state of each instruction, None if the instruction is accepted in any state
+INSTRUCTION_STATES: Dict[int, Optional[State]] = {
+    Command.GET_VERSION: None,
+    Command.START_NEW_TRANSACTION: None,
+    Command.SET_PARTNER_KEY: State.WAITING_TRANSACTION,
+    Command.CHECK_PARTNER: State.PROVIDER_SET,
+    Command.PROCESS_TRANSACTION_RESPONSE: State.PROVIDER_CHECKED,
+    Command.CHECK_TRANSACTION_SIGNATURE: State.TRANSACTION_RECEIVED,
+    Command.GET_CHALLENGE: State.SIGNATURE_CHECKED,
+    Command.SEND_TRUSTED_NAME_DESCRIPTOR: State.SIGNATURE_CHECKED,
+    Command.CHECK_PAYOUT_ADDRESS: State.SIGNATURE_CHECKED,
+    Command.CHECK_ASSET_IN_AND_DISPLAY: State.SIGNATURE_CHECKED,
+    Command.CHECK_ASSET_IN_NO_DISPLAY: State.SIGNATURE_CHECKED,
+    Command.CHECK_REFUND_ADDRESS_AND_DISPLAY: State.PAYOUT_ADDRESS_CHECKED,
+    Command.CHECK_REFUND_ADDRESS_NO_DISPLAY: State.PAYOUT_ADDRESS_CHECKED,
+    Command.PROMPT_UI_DISPLAY: State.ALL_ADDRESSES_CHECKED,
+    Command.START_SIGNING_TRANSACTION: State.WAITING_SIGNING,
+}
+
+ADDRESS_INSTRUCTIONS = (
+    Command.CHECK_PAYOUT_ADDRESS,
+    Command.CHECK_ASSET_IN_AND_DISPLAY,
+    Command.CHECK_ASSET_IN_NO_DISPLAY,
+    Command.CHECK_REFUND_ADDRESS_AND_DISPLAY,
+    Command.CHECK_REFUND_ADDRESS_NO_DISPLAY,
+)
+
+
+class ModelError(Exception):
+    # Raised by the handlers to reply an error status word, mirrors `return reply_error(...)`
+    def __init__(self, status: int):
+        super().__init__(f"Exchange model replied {status:#x}")
+        self.status = status
+
+
+def base64_decode(coded: bytes, max_size: int = MAX_DECODED_TRANSACTION_SIZE) -> Optional[bytes]:
+    """
+    Port of src/base64.c: accepts both the standard and the URL alphabets, does not reject
+    invalid characters, fails only on impossible lengths or when the output does not fit.
+    """
+    if len(coded) % 4 == 1 or len(coded) == 0:
+        return None
+    remaining = len(coded)
+    if coded[remaining - 1] == ord('='):
+        remaining -= 1
+    if coded[remaining - 1] == ord('='):
+        remaining -= 1
+
+    def six(c: int) -> int:
+        return _BASE64_TABLE.get(c, 64)
+
+    out = bytearray()
+    offset = 0
+    while remaining > 4:
+        a, b, c, d = (six(x) for x in coded[offset:offset + 4])
+        out += bytes([(a << 2 | b >> 4) & 0xFF, (b << 4 | c >> 2) & 0xFF, (c << 6 | d) & 0xFF])
+        offset += 4
+        remaining -= 4
+    tail = [six(x) for x in coded[offset:offset + remaining]]
+    if remaining > 1:
+        out.append((tail[0] << 2 | tail[1] >> 4) & 0xFF)
+    if remaining > 2:
+        out.append((tail[1] << 4 | tail[2] >> 2) & 0xFF)
+    if remaining > 3:
+        out.append((tail[2] << 6 | tail[3]) & 0xFF)
+    if len(out) > max_size or len(out) == 0:
+        return None
+    return bytes(out)
+
+
+_BASE64_TABLE = {c: i for i, c in enumerate(b"ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789")}
+_BASE64_TABLE.update({ord('+'): 62, ord('-'): 62, ord('/'): 63, ord('_'): 63})
+
+
+def _read_der_value(data: bytes, offset: int) -> Tuple[int, int]:
+    # Tags and lengths of the trusted name TLV are DER encoded, see pki.tlv.der_encode
+    if offset >= len(data):
+        raise ValueError("Truncated TLV")
+    first = data[offset]
+    if first < 0x80:
+        return first, offset + 1
+    size = first & 0x7F
+    if size == 0 or size > 4 or offset + 1 + size > len(data):
+        raise ValueError("Invalid DER value")
+    return int.from_bytes(data[offset + 1:offset + 1 + size], "big"), offset + 1 + size
+
+
+def parse_tlv(data: bytes) -> Tuple[Dict[int, bytes], Dict[int, int]]:
+    """
+    :return: The value of each tag, and the offset at which each tag starts
+    :rtype: Tuple[Dict[int, bytes], Dict[int, int]]
+    """
+    values: Dict[int, bytes] = {}
+    offsets: Dict[int, int] = {}
+    offset = 0
+    while offset < len(data):
+        start = offset
+        tag, offset = _read_der_value(data, offset)
+        length, offset = _read_der_value(data, offset)
+        if offset + length > len(data):
+            raise ValueError("Truncated TLV value")
+        if tag in values:
+            raise ValueError(f"Duplicated TLV tag {tag:#x}")
+        values[tag] = data[offset:offset + length]
+        offsets[tag] = start
+        offset += length
+    return values, offsets
+
+
+def _verify(public_key: Optional[ec.EllipticCurvePublicKey], digest: bytes, der_signature: bytes) -> bool:
+    if public_key is None:
+        return False
+    try:
+        public_key.verify(der_signature, digest, ec.ECDSA(Prehashed(hashes.SHA256())))
+    except (InvalidSignature, ValueError):
+        return False
+    return True
+
+
+def _pop_sized(data: bytes, offset: int, length_size: int = 1) -> Tuple[bytes, int]:
+    # Port of parse_to_sized_buffer
+    if offset + length_size > len(data):
+        raise ModelError(Errors.INCORRECT_COMMAND_DATA)
+    size = int.from_bytes(data[offset:offset + length_size], "big")
+    offset += length_size
+    if offset + size > len(data):
+        raise ModelError(Errors.INCORRECT_COMMAND_DATA)
+    return data[offset:offset + size], offset + size
+
+
+def _pop_uint8(data: bytes, offset: int) -> Tuple[int, int]:
+    if offset >= len(data):
+        raise ModelError(Errors.INCORRECT_COMMAND_DATA)
+    return data[offset], offset + 1
+
+
+def _c_string(value: str) -> bytes:
+    # nanopb copies strings as is, the C code then stops at the first NULL byte
+    return value.encode().split(b"\0", 1)[0]
+
+
+def normalize_ticker(ticker: bytes) -> bytes:
+    normalized = bytes(c - 0x20 if ord('a') <= c <= ord('z') else c for c in ticker)
+    for foreign_name, ledger_name in CURRENCY_ALIASES:
+        if normalized.startswith(foreign_name):
+            return ledger_name
+    return normalized
+
+
+def _decode_transaction(message_type: type, payload: bytes) -> Message:
+    message = message_type()
+    try:
+        message.ParseFromString(payload)
+    except (DecodeError, UnicodeDecodeError) as e:
+        raise ModelError(Errors.DESERIALIZATION_FAILED) from e
+    _check_pb_sizes(message)
+    return message
+
+
+def _check_pb_sizes(message: Message):
+    max_sizes = PB_MAX_SIZES[message.DESCRIPTOR.name]
+    for descriptor, value in message.ListFields():
+        if descriptor.type == FieldDescriptor.TYPE_MESSAGE:
+            _check_pb_sizes(value)
+        elif descriptor.type == FieldDescriptor.TYPE_STRING:
+            if len(value.encode()) >= max_sizes[descriptor.name]:
+                raise ModelError(Errors.DESERIALIZATION_FAILED)
+        elif descriptor.type == FieldDescriptor.TYPE_BYTES:
+            if len(value) > max_sizes[descriptor.name]:
+                raise ModelError(Errors.DESERIALIZATION_FAILED)
+
+
+@dataclass
+class ExchangeContext:
+    """
+    Host side equivalent of G_swap_ctx
+    """
+    state: State = State.INITIAL_STATE
+    subcommand: Optional[SubCommand] = None
+    rate: Optional[Rate] = None
+    device_transaction_id: bytes = b""
+    partner_name: bytes = b""
+    partner_public_key: Optional[ec.EllipticCurvePublicKey] = None
+    sha256_digest_prefixed: bytes = b""
+    sha256_digest_no_prefix: bytes = b""
+    transaction: Optional[Message] = None
+    fees: bytes = b""
+    payin_application_name: str = ""
+    payin_sub_config: bytes = b""
+    other_seed_payout: bool = False
+
+
+@dataclass
+class _SplitReception:
+    expecting_more: bool = False
+    instruction: int = 0
+    rate: int = 0
+    subcommand: int = 0
+    data: bytearray = field(default_factory=bytearray)
+
+
+class ExchangeModel:
+    """
+    Pure Python model of the Exchange application state machine, written after the C handlers
+    of src/. It answers the Exchange APDUs the same way the application compiled with the TESTING
+    flag does, without any device or emulator.
+
+    The parts that depend on the coin applications or on the seed are modelled by hooks:
+    - `address_checker` replaces the CHECK_ADDRESS library call (see `check_address_format`)
+    - `installed_applications` lists the applications that can be called as library, None for all
+
+    The user decisions on the review screens are given through `review` and `cross_seed_warning`.
+    """
+
+    def __init__(self,
+                 address_checker: AddressChecker = check_address_format,
+                 installed_applications: Optional[Iterable[str]] = None,
+                 fixed_challenge: Optional[int] = None,
+                 seed: Optional[int] = None,
+                 auto_approve: bool = True,
+                 is_nano: bool = False):
+        self.address_checker = address_checker
+        self.installed_applications = None if installed_applications is None else set(installed_applications)
+        self.auto_approve = auto_approve
+        self.is_nano = is_nano
+        self.ctx = ExchangeContext()
+        self._split = _SplitReception()
+        self._ledger_public_key = LEDGER_SIGNER._public_key
+        # Certificates loaded through the PKI, by key usage
+        self._pki_keys: Dict[int, ec.EllipticCurvePublicKey] = {}
+        self._fixed_challenge = fixed_challenge
+        self._rng = random.Random(seed)
+        self._challenge = 0
+        self._review_choice: Optional[bool] = None
+        self._cross_seed_choice: Optional[bool] = None
+        self.roll_challenge()
+
+    ###########
+    # Helpers #
+    ###########
+
+    def roll_challenge(self):
+        if self._fixed_challenge is not None:
+            self._challenge = self._fixed_challenge
+        else:
+            self._challenge = self._rng.getrandbits(32)
+
+    def _check_installed(self, appname: str):
+        # os_lib_call throws SWO_SEC_APP_14 when the application is missing
+        if self.installed_applications is not None and appname not in self.installed_applications:
+            raise ModelError(Errors.APPLICATION_NOT_INSTALLED)
+
+    @property
+    def waiting_user_validation(self) -> bool:
+        return self.ctx.state == State.WAITING_USER_VALIDATION
+
+    def review(self, accept: bool):
+        self._review_choice = accept
+
+    def cross_seed_warning(self, accept: bool):
+        self._cross_seed_choice = accept
+
+    def resolve_user_validation(self) -> RAPDU:
+        """
+        Apply the user decisions taken on the review screens, equivalent of the UI callbacks of
+        ui/validate_transaction_nbgl.c. Decisions not taken default to `auto_approve`.
+        """
+        if not self.waiting_user_validation:
+            raise RuntimeError("The model is not displaying a review")
+        review = self.auto_approve if self._review_choice is None else self._review_choice
+        cross_seed = self.auto_approve if self._cross_seed_choice is None else self._cross_seed_choice
+        self._review_choice = None
+        self._cross_seed_choice = None
+
+        if self.ctx.other_seed_payout and not self.is_nano and not cross_seed:
+            return self._refuse(Errors.USER_REFUSED_CROSS_SEED)
+        if not review:
+            # On Nano there is no dedicated warning screen, all refusals are assumed to be cross seed
+            if self.ctx.other_seed_payout and self.is_nano:
+                return self._refuse(Errors.USER_REFUSED_CROSS_SEED)
+            return self._refuse(Errors.USER_REFUSED_TRANSACTION)
+        self.ctx.state = State.WAITING_SIGNING
+        return RAPDU(Errors.SUCCESS, b"")
+
+    def _refuse(self, status: int) -> RAPDU:
+        self.ctx.state = State.INITIAL_STATE
+        return RAPDU(status, b"")
+
+    ##############
+    # Entry point #
+    ##############
+
+    def handle(self, apdu: bytes) -> Optional[RAPDU]:
+        """
+        :return: The response to the APDU, None if the application now waits for the user
+        :rtype: Optional[RAPDU]
+        """
+        if len(apdu) >= 2 and apdu[0] == PKI_CLASS:
+            return self._handle_pki(apdu)
+        try:
+            command = self._check_apdu_validity(apdu)
+            if command is None:
+                # Split reception, the chunk is acknowledged without touching the state machine
+                return RAPDU(Errors.SUCCESS, b"")
+            ins, rate, subcommand, data = command
+            response = self._dispatch(ins, rate, subcommand, data)
+        except ModelError as e:
+            return RAPDU(e.status, b"")
+        return response
+
+    def _handle_pki(self, apdu: bytes) -> RAPDU:
+        # The certificate is handled by the OS. Its signature by the Ledger PKI root is not
+        # checked here, only its public key is kept to verify the descriptors later
+        if len(apdu) < 5 or apdu[1] != PKI_INS_LOAD_CERTIFICATE:
+            return RAPDU(Errors.INVALID_INSTRUCTION, b"")
+        usage = apdu[2]
+        certificate = apdu[5:]
+        try:
+            offset = 0
+            public_key = None
+            while offset < len(certificate):
+                tag, length = certificate[offset], certificate[offset + 1]
+                if tag == PKI_CERTIFICATE_TAG_PUBLIC_KEY:
+                    public_key = certificate[offset + 2:offset + 2 + length]
+                offset += 2 + length
+            if public_key is None:
+                raise ValueError("No public key in certificate")
+            self._pki_keys[usage] = ec.EllipticCurvePublicKey.from_encoded_point(ec.SECP256K1(), public_key)
+        except (IndexError, ValueError):
+            return RAPDU(Errors.INCORRECT_COMMAND_DATA, b"")
+        return RAPDU(Errors.SUCCESS, b"")
+
+    def _check_apdu_validity(self, apdu: bytes) -> Optional[Tuple[int, Rate, SubCommand, bytes]]:
+        # Port of check_apdu_validity in apdu_parser.c
+        if len(apdu) < 5:
+            raise ModelError(Errors.MALFORMED_APDU)
+        cla, instruction, rate, p2, data_length = apdu[:5]
+        if data_length != len(apdu) - 5:
+            raise ModelError(Errors.MALFORMED_APDU)
+        if cla != EXCHANGE_CLASS:
+            raise ModelError(Errors.CLASS_NOT_SUPPORTED)
+        if rate not in (Rate.FIXED, Rate.FLOATING):
+            raise ModelError(Errors.WRONG_P1)
+        subcommand = p2 & 0x0F
+        if subcommand not in {s.value for s in SubCommand}:
+            raise ModelError(Errors.WRONG_P2_SUBCOMMAND)
+        subcommand = SubCommand(subcommand)
+
+        # CHECK_ASSET_IN_LEGACY_AND_DISPLAY shares the value of CHECK_PAYOUT_ADDRESS
+        if instruction == Command.CHECK_ASSET_IN_LEGACY_AND_DISPLAY and subcommand in (SubCommand.SELL, SubCommand.FUND):
+            instruction = Command.CHECK_ASSET_IN_AND_DISPLAY
+        self._check_instruction(instruction, subcommand)
+
+        extension = p2 & 0xF0
+        if extension & ~(P2_MORE | P2_EXTEND):
+            raise ModelError(Errors.WRONG_P2_EXTENSION)
+        is_first_chunk = not extension & P2_EXTEND
+        is_last_chunk = not extension & P2_MORE
+        is_whole_apdu = is_first_chunk and is_last_chunk
+        if subcommand in LEGACY_SUBCOMMANDS and not is_whole_apdu:
+            raise ModelError(Errors.WRONG_P2_EXTENSION)
+        if instruction != Command.PROCESS_TRANSACTION_RESPONSE and not is_whole_apdu:
+            raise ModelError(Errors.WRONG_P2_EXTENSION)
+
+        data = apdu[5:]
+        split = self._split
+        if is_first_chunk:
+            split.instruction, split.rate, split.subcommand = instruction, rate, subcommand
+            split.data = bytearray(data)
+            if not is_last_chunk:
+                split.expecting_more = True
+        else:
+            if not split.expecting_more:
+                raise ModelError(Errors.INVALID_P2_EXTENSION)
+            if (split.instruction, split.rate, split.subcommand) != (instruction, rate, subcommand):
+                raise ModelError(Errors.INVALID_P2_EXTENSION)
+            if len(split.data) + len(data) > MAX_SPLIT_DATA_SIZE:
+                raise ModelError(Errors.INVALID_P2_EXTENSION)
+            split.data += data
+
+        if not is_last_chunk:
+            return None
+        split.expecting_more = False
+        return split.instruction, Rate(split.rate), SubCommand(split.subcommand), bytes(split.data)
+
+    def _check_instruction(self, instruction: int, subcommand: SubCommand):
+        # Port of check_instruction in apdu_parser.c
+        is_swap = subcommand in SWAP_SUBCOMMANDS
+        if instruction in (Command.CHECK_ASSET_IN_AND_DISPLAY, Command.CHECK_ASSET_IN_NO_DISPLAY) and is_swap:
+            raise ModelError(Errors.INVALID_INSTRUCTION)
+        if instruction in (Command.CHECK_PAYOUT_ADDRESS,
+                           Command.GET_CHALLENGE,
+                           Command.SEND_TRUSTED_NAME_DESCRIPTOR,
+                           Command.CHECK_REFUND_ADDRESS_AND_DISPLAY,
+                           Command.CHECK_REFUND_ADDRESS_NO_DISPLAY) and not is_swap:
+            raise ModelError(Errors.INVALID_INSTRUCTION)
+        if instruction not in INSTRUCTION_STATES:
+            raise ModelError(Errors.INVALID_INSTRUCTION)
+
+        expected_state = INSTRUCTION_STATES[instruction]
+        check_subcommand_context = instruction not in (Command.GET_VERSION, Command.START_NEW_TRANSACTION)
+        allowed_during_waiting_for_signing = instruction in (Command.START_NEW_TRANSACTION,
+                                                             Command.START_SIGNING_TRANSACTION)
+        if self.ctx.state == State.WAITING_USER_VALIDATION:
+            raise ModelError(Errors.UNEXPECTED_INSTRUCTION)
+        if not allowed_during_waiting_for_signing and self.ctx.state == State.WAITING_SIGNING:
+            raise ModelError(Errors.UNEXPECTED_INSTRUCTION)
+        if check_subcommand_context and subcommand != self.ctx.subcommand:
+            raise ModelError(Errors.UNEXPECTED_INSTRUCTION)
+        if expected_state is not None and self.ctx.state != expected_state:
+            raise ModelError(Errors.UNEXPECTED_INSTRUCTION)
+
+    def _dispatch(self, ins: int, rate: Rate, subcommand: SubCommand, data: bytes) -> Optional[RAPDU]:
+        if ins == Command.GET_VERSION:
+            return RAPDU(Errors.SUCCESS, bytes(MODEL_APP_VERSION))
+        if ins == Command.START_NEW_TRANSACTION:
+            return self._start_new_transaction(subcommand)
+        if ins == Command.SET_PARTNER_KEY:
+            return self._set_partner_key(subcommand, data)
+        if ins == Command.CHECK_PARTNER:
+            return self._check_partner(data)
+        if ins == Command.PROCESS_TRANSACTION_RESPONSE:
+            return self._process_transaction(subcommand, data)
+        if ins == Command.CHECK_TRANSACTION_SIGNATURE:
+            return self._check_transaction_signature(subcommand, data)
+        if ins == Command.GET_CHALLENGE:
+            return RAPDU(Errors.SUCCESS, self._challenge.to_bytes(4, "big"))
+        if ins == Command.SEND_TRUSTED_NAME_DESCRIPTOR:
+            try:
+                return self._trusted_name_descriptor(data)
+            finally:
+                # Prevent brute-force guesses
+                self.roll_challenge()
+        if ins in ADDRESS_INSTRUCTIONS:
+            return self._check_addresses_and_amounts(ins, rate, subcommand, data)
+        if ins == Command.PROMPT_UI_DISPLAY:
+            self.ctx.state = State.WAITING_USER_VALIDATION
+            return None
+        # START_SIGNING_TRANSACTION, the coin application then takes over and the context is
+        # fully reset when it returns
+        self.ctx = ExchangeContext()
+        return RAPDU(Errors.SUCCESS, b"")
+
+    ############
+    # Handlers #
+    ############
+
+    def _start_new_transaction(self, subcommand: SubCommand) -> RAPDU:
+        self.ctx = ExchangeContext()
+        if subcommand == SubCommand.SWAP:
+            self.ctx.device_transaction_id = LEGACY_SWAP_TRANSACTION_ID
+        else:
+            self.ctx.device_transaction_id = TRANSACTION_ID
+        self.ctx.state = State.WAITING_TRANSACTION
+        self.ctx.subcommand = subcommand
+        return RAPDU(Errors.SUCCESS, self.ctx.device_transaction_id)
+
+    def _set_partner_key(self, subcommand: SubCommand, data: bytes) -> RAPDU:
+        name, offset = _pop_sized(data, 0)
+        if not MIN_PARTNER_NAME_LENGTH <= len(name) <= MAX_PARTNER_NAME_LENGTH:
+            raise ModelError(Errors.INCORRECT_COMMAND_DATA)
+        if subcommand == SubCommand.SWAP:
+            curve = ec.SECP256K1()
+        elif subcommand in (SubCommand.SELL, SubCommand.FUND):
+            curve = ec.SECP256R1()
+        else:
+            curve_id, offset = _pop_uint8(data, offset)
+            if curve_id == 0x00:
+                curve = ec.SECP256K1()
+            elif curve_id == 0x01:
+                curve = ec.SECP256R1()
+            else:
+                raise ModelError(Errors.INCORRECT_COMMAND_DATA)
+        if offset + UNCOMPRESSED_KEY_LENGTH != len(data):
+            raise ModelError(Errors.INCORRECT_COMMAND_DATA)
+
+        self.ctx.partner_name = (b"To " if subcommand in FUND_SUBCOMMANDS else b"") + name.split(b"\0", 1)[0]
+        try:
+            self.ctx.partner_public_key = ec.EllipticCurvePublicKey.from_encoded_point(curve, data[offset:])
+        except ValueError:
+            # The point is not checked on device, the signature verifications will fail instead
+            self.ctx.partner_public_key = None
+        self.ctx.sha256_digest_no_prefix = sha256(data).digest()
+        self.ctx.state = State.PROVIDER_SET
+        return RAPDU(Errors.SUCCESS, b"")
+
+    def _check_partner(self, data: bytes) -> RAPDU:
+        if not MIN_DER_SIGNATURE_LENGTH <= len(data) <= MAX_DER_SIGNATURE_LENGTH:
+            raise ModelError(Errors.INCORRECT_COMMAND_DATA)
+        if not _verify(self._ledger_public_key, self.ctx.sha256_digest_no_prefix, data):
+            raise ModelError(Errors.SIGN_VERIFICATION_FAIL)
+        self.ctx.state = State.PROVIDER_CHECKED
+        return RAPDU(Errors.SUCCESS, b"")
+
+    def _process_transaction(self, subcommand: SubCommand, data: bytes) -> RAPDU:
+        offset = 0
+        if subcommand == SubCommand.SWAP:
+            needs_base64_decoding = False
+        elif subcommand in (SubCommand.SELL, SubCommand.FUND):
+            needs_base64_decoding = True
+        else:
+            encoding, offset = _pop_uint8(data, offset)
+            if encoding not in (0x00, 0x01):
+                raise ModelError(Errors.INCORRECT_COMMAND_DATA)
+            needs_base64_decoding = encoding == 0x01
+        payload, offset = _pop_sized(data, offset, 1 if subcommand in LEGACY_SUBCOMMANDS else 2)
+        fees, offset = _pop_sized(data, offset)
+        if offset != len(data) or len(fees) > 16:
+            raise ModelError(Errors.INCORRECT_COMMAND_DATA)
+
+        self.ctx.sha256_digest_prefixed = sha256(b"." + payload).digest()
+        self.ctx.sha256_digest_no_prefix = sha256(payload).digest()
+
+        if needs_base64_decoding:
+            decoded = base64_decode(payload)
+            if decoded is None:
+                raise ModelError(Errors.DESERIALIZATION_FAILED)
+            payload = decoded
+        if subcommand in SWAP_SUBCOMMANDS:
+            transaction = _decode_transaction(NewTransactionResponse, payload)
+        elif subcommand in SELL_SUBCOMMANDS:
+            transaction = _decode_transaction(NewSellResponse, payload)
+        else:
+            transaction = _decode_transaction(NewFundResponse, payload)
+
+        if subcommand in SWAP_SUBCOMMANDS:
+            has_extra_id = len(_c_string(transaction.payin_extra_id)) != 0
+            extra_data = transaction.payin_extra_data
+            has_extra_data = len(extra_data) != 0 and extra_data != b"\0"
+            if has_extra_id and has_extra_data:
+                raise ModelError(Errors.WRONG_EXTRA_ID_OR_EXTRA_DATA)
+            if has_extra_data and len(extra_data) != PAYIN_EXTRA_DATA_SIZE:
+                raise ModelError(Errors.WRONG_EXTRA_ID_OR_EXTRA_DATA)
+
+        if subcommand == SubCommand.SWAP:
+            received_id = transaction.device_transaction_id.encode()
+            # The C code compares the 10 bytes of the NULL padded buffer
+            if received_id.ljust(10, b"\0")[:10] != self.ctx.device_transaction_id:
+                raise ModelError(Errors.WRONG_TRANSACTION_ID)
+        else:
+            if subcommand in SWAP_SUBCOMMANDS:
+                received_id = transaction.device_transaction_id_ng
+            else:
+                received_id = transaction.device_transaction_id
+            if received_id != self.ctx.device_transaction_id:
+                raise ModelError(Errors.WRONG_TRANSACTION_ID)
+
+        if subcommand in SWAP_SUBCOMMANDS:
+            transaction.currency_from = normalize_ticker(_c_string(transaction.currency_from)).decode()
+            transaction.currency_to = normalize_ticker(_c_string(transaction.currency_to)).decode()
+            # Strip bcash CashAddr header and similar prefixes
+            transaction.payin_address = transaction.payin_address.split(":", 1)[-1]
+            transaction.amount_to_provider = transaction.amount_to_provider.lstrip(b"\0")
+            transaction.amount_to_wallet = transaction.amount_to_wallet.lstrip(b"\0")
+        else:
+            transaction.in_currency = normalize_ticker(_c_string(transaction.in_currency)).decode()
+            transaction.in_amount = transaction.in_amount.lstrip(b"\0")
+
+        self.ctx.transaction = transaction
+        self.ctx.fees = fees
+        self.ctx.state = State.TRANSACTION_RECEIVED
+        return RAPDU(Errors.SUCCESS, b"")
+
+    def _check_transaction_signature(self, subcommand: SubCommand, data: bytes) -> RAPDU:
+        offset = 0
+        if subcommand == SubCommand.SWAP:
+            r_s_format, dot_prefixed = False, False
+        elif subcommand == SubCommand.FUND:
+            r_s_format, dot_prefixed = False, True
+        elif subcommand == SubCommand.SELL:
+            r_s_format, dot_prefixed = True, True
+        else:
+            dot, offset = _pop_uint8(data, offset)
+            if dot not in (0x00, 0x01):
+                raise ModelError(Errors.INCORRECT_COMMAND_DATA)
+            signature_format, offset = _pop_uint8(data, offset)
+            if signature_format not in (0x00, 0x01):
+                raise ModelError(Errors.INCORRECT_COMMAND_DATA)
+            dot_prefixed, r_s_format = dot == 0x01, signature_format == 0x01
+
+        signature = data[offset:]
+        if not r_s_format:
+            if not MIN_DER_SIGNATURE_LENGTH <= len(signature) <= MAX_DER_SIGNATURE_LENGTH:
+                raise ModelError(Errors.INCORRECT_COMMAND_DATA)
+            if signature[1] + 2 != len(signature):
+                raise ModelError(Errors.INCORRECT_COMMAND_DATA)
+        else:
+            if len(signature) != 64:
+                raise ModelError(Errors.INCORRECT_COMMAND_DATA)
+            signature = encode_dss_signature(int.from_bytes(signature[:32], "big"),
+                                             int.from_bytes(signature[32:], "big"))
+
+        digest = self.ctx.sha256_digest_prefixed if dot_prefixed else self.ctx.sha256_digest_no_prefix
+        if not _verify(self.ctx.partner_public_key, digest, signature):
+            raise ModelError(Errors.SIGN_VERIFICATION_FAIL)
+        self.ctx.state = State.SIGNATURE_CHECKED
+        return RAPDU(Errors.SUCCESS, b"")
+
+    def _trusted_name_descriptor(self, data: bytes) -> RAPDU:
+        try:
+            values, offsets = parse_tlv(data)
+        except ValueError as e:
+            raise ModelError(Errors.WRONG_TRUSTED_NAME_TLV) from e
+        # Checks done by the SDK trusted name use case
+        if not TRUSTED_NAME_REQUIRED_TAGS.issubset(values):
+            raise ModelError(Errors.WRONG_TRUSTED_NAME_TLV)
+        if not set(values).issubset(set(FieldTag)):
+            raise ModelError(Errors.WRONG_TRUSTED_NAME_TLV)
+        if int.from_bytes(values[FieldTag.TAG_STRUCTURE_TYPE], "big") != TRUSTED_NAME_STRUCTURE_TYPE:
+            raise ModelError(Errors.WRONG_TRUSTED_NAME_TLV)
+        if int.from_bytes(values[FieldTag.TAG_VERSION], "big") != TRUSTED_NAME_VERSION:
+            raise ModelError(Errors.WRONG_TRUSTED_NAME_TLV)
+        if int.from_bytes(values[FieldTag.TAG_SIGNER_KEY_ID], "big") != KEY_ID_TEST:
+            raise ModelError(Errors.WRONG_TRUSTED_NAME_TLV)
+        if int.from_bytes(values[FieldTag.TAG_SIGNER_ALGO], "big") != TRUSTED_NAME_SIGNER_ALGO_ECDSA_SHA256:
+            raise ModelError(Errors.WRONG_TRUSTED_NAME_TLV)
+        trusted_name = values[FieldTag.TAG_TRUSTED_NAME]
+        address = values[FieldTag.TAG_ADDRESS]
+        if len(trusted_name) == 0 or len(address) == 0:
+            raise ModelError(Errors.WRONG_TRUSTED_NAME_TLV)
+        signed_data = data[:offsets[FieldTag.TAG_DER_SIGNATURE]]
+        if not _verify(self._pki_keys.get(0x04), sha256(signed_data).digest(), values[FieldTag.TAG_DER_SIGNATURE]):
+            raise ModelError(Errors.WRONG_TRUSTED_NAME_TLV)
+
+        # Checks done by trusted_name_descriptor_handler.c
+        if FieldTag.TAG_CHALLENGE not in values:
+            raise ModelError(Errors.MISSING_TLV_CONTENT)
+        if int.from_bytes(values[FieldTag.TAG_CHALLENGE], "big") != self._challenge:
+            raise ModelError(Errors.WRONG_TLV_CHALLENGE)
+        if int.from_bytes(values[FieldTag.TAG_TRUSTED_NAME_TYPE], "big") != TRUSTED_NAME_TYPE_CONTEXT_ADDRESS:
+            raise ModelError(Errors.WRONG_TLV_CONTENT)
+        if int.from_bytes(values[FieldTag.TAG_TRUSTED_NAME_SOURCE], "big") != TRUSTED_NAME_SOURCE_DYNAMIC_RESOLVER:
+            raise ModelError(Errors.WRONG_TLV_CONTENT)
+
+        transaction = self.ctx.transaction
+        applied = False
+        for name in ("payout_address", "refund_address"):
+            if _c_string(getattr(transaction, name)) == trusted_name and len(address) < PB_MAX_SIZES["NewTransactionResponse"][name]:
+                setattr(transaction, name, address.decode(errors="replace"))
+                applied = True
+        if not applied:
+            raise ModelError(Errors.DESCRIPTOR_NOT_USED)
+        return RAPDU(Errors.SUCCESS, b"")
+
+    def _check_addresses_and_amounts(self, ins: int, rate: Rate, subcommand: SubCommand, data: bytes) -> Optional[RAPDU]:
+        # parse_check_address_message.c
+        config, offset = _pop_sized(data, 0)
+        if len(config) < 1 or len(data) < offset + 3:
+            raise ModelError(Errors.INCORRECT_COMMAND_DATA)
+        # The DER header is skipped without being checked, then the signature is read with it
+        signature_size = data[offset + 1] + 2
+        if offset + signature_size > len(data):
+            raise ModelError(Errors.INCORRECT_COMMAND_DATA)
+        signature = data[offset:offset + signature_size]
+        offset += signature_size
+        if not MIN_DER_SIGNATURE_LENGTH <= len(signature) <= MAX_DER_SIGNATURE_LENGTH:
+            raise ModelError(Errors.INCORRECT_COMMAND_DATA)
+        derivation_path, offset = _pop_sized(data, offset)
+        if len(derivation_path) < 1 or offset != len(data):
+            raise ModelError(Errors.INCORRECT_COMMAND_DATA)
+
+        if not _verify(self._ledger_public_key, sha256(config).digest(), signature):
+            raise ModelError(Errors.SIGN_VERIFICATION_FAIL)
+
+        # parse_coin_config.c
+        ticker, offset = _pop_sized(config, 0)
+        if not TICKER_MIN_SIZE <= len(ticker) <= TICKER_MAX_SIZE:
+            raise ModelError(Errors.INCORRECT_COMMAND_DATA)
+        appname, offset = _pop_sized(config, offset)
+        if not APPNAME_MIN_SIZE <= len(appname) <= APPNAME_MAX_SIZE:
+            raise ModelError(Errors.INCORRECT_COMMAND_DATA)
+        sub_config, offset = _pop_sized(config, offset)
+        if len(sub_config) > MAX_COIN_SUB_CONFIG_SIZE or offset != len(config):
+            raise ModelError(Errors.INCORRECT_COMMAND_DATA)
+        appname = APPNAME_ALIASES.get(appname, appname)
+        application_name = appname.split(b"\0", 1)[0].decode(errors="replace")
+
+        transaction = self.ctx.transaction
+        if subcommand in SWAP_SUBCOMMANDS:
+            reference = transaction.currency_to if ins == Command.CHECK_PAYOUT_ADDRESS else transaction.currency_from
+        else:
+            reference = transaction.in_currency
+        if normalize_ticker(ticker.split(b"\0", 1)[0]) != reference.encode():
+            raise ModelError(Errors.INCORRECT_COMMAND_DATA)
+
+        if subcommand in SWAP_SUBCOMMANDS:
+            if ins == Command.CHECK_PAYOUT_ADDRESS:
+                address, extra_id = transaction.payout_address, transaction.payout_extra_id
+            else:
+                address, extra_id = transaction.refund_address, transaction.refund_extra_id
+            self._check_installed(application_name)
+            if not self.address_checker(application_name, sub_config, derivation_path, address, extra_id):
+                if ins == Command.CHECK_PAYOUT_ADDRESS:
+                    self.ctx.other_seed_payout = True
+                else:
+                    raise ModelError(Errors.INVALID_ADDRESS)
+
+        # The amounts and fees formatting is a library call as well
+        self._check_installed(application_name)
+
+        if ins != Command.CHECK_PAYOUT_ADDRESS:
+            self.ctx.payin_application_name = application_name
+            self.ctx.payin_sub_config = sub_config
+            self.ctx.rate = rate
+
+        if ins in (Command.CHECK_ASSET_IN_AND_DISPLAY, Command.CHECK_REFUND_ADDRESS_AND_DISPLAY):
+            self.ctx.state = State.WAITING_USER_VALIDATION
+            return None
+        if ins == Command.CHECK_PAYOUT_ADDRESS:
+            self.ctx.state = State.PAYOUT_ADDRESS_CHECKED
+        else:
+            self.ctx.state = State.ALL_ADDRESSES_CHECKED
+        return RAPDU(Errors.SUCCESS, b"")
+
+
+class ExchangeModelBackend(PhysicalBackend):
+    """
+    Ragger backend answering the APDUs with an in-process ExchangeModel instead of a device.
+
+    The screens are not modelled: the navigation is replaced by `ExchangeModelNavigationHelper`
+    which forwards the user decisions to the model.
+    """
+
+    def __init__(self, device, *args, model: Optional[ExchangeModel] = None, **kwargs):
+        super().__init__(device, *args, **kwargs)
+        self.model = model if model is not None else ExchangeModel(is_nano=device.is_nano)
+        self._pending: Optional[RAPDU] = None
+        self._waiting_user = False
+
+    def __enter__(self) -> "ExchangeModelBackend":
+        return self
+
+    def __exit__(self, *args):
+        super().__exit__(*args)
+
+    def handle_usb_reset(self) -> None:
+        pass
+
+    def _raise_if_required(self, rapdu: RAPDU) -> RAPDU:
+        self.apdu_logger.info("<= %s%4x", rapdu.data.hex(), rapdu.status)
+        if self.is_raise_required(rapdu):
+            raise ExceptionRAPDU(rapdu.status, rapdu.data)
+        return rapdu
+
+    def send_raw(self, data: bytes = b"") -> None:
+        self.apdu_logger.info("=> %s", data.hex())
+        if self._pending is not None or self._waiting_user:
+            raise RuntimeError("The previous APDU has not been answered yet")
+        response = self.model.handle(bytes(data))
+        if response is None:
+            self._waiting_user = True
+        else:
+            self._pending = response
+
+    def receive(self) -> RAPDU:
+        if self._waiting_user:
+            self._waiting_user = False
+            response = self.model.resolve_user_validation()
+        elif self._pending is not None:
+            response, self._pending = self._pending, None
+        else:
+            raise RuntimeError("No APDU was sent")
+        return self._raise_if_required(response)
+
+    def exchange_raw(self, data: bytes = b"", tick_timeout: int = 0) -> RAPDU:
+        self.send_raw(data)
+        return self.receive()
+
+    @contextmanager
+    def exchange_async_raw(self, data: bytes = b"") -> Generator[bool, None, None]:
+        self.send_raw(data)
+        yield True
+        self._last_async_response = self.receive()
+
+
+class ExchangeModelNavigationHelper(ExchangeNavigationHelper):
+    """
+    Navigation helper for ExchangeModelBackend: there is no screen to navigate nor snapshot to
+    compare, the accept / reject choices are given to the model directly.
+    """
+
+    def _navigate_and_compare(self, accept: bool):
+        self._backend.model.review(accept)
+
+    def _cross_seed_navigate_and_compare(self, accept: bool):
+        self._backend.model.cross_seed_warning(accept)
+
+    def check_post_sign_display(self):
+        pass
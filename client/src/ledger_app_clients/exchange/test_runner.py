@@ -10,6 +10,7 @@ from .transaction_builder import get_partner_curve, get_credentials, craft_and_s
 from . import cal_helper as cal_helper
 from .signing_authority import SigningAuthority, LEDGER_SIGNER
 from .utils import handle_lib_call_start_or_stop, int_to_minimally_sized_bytes
+from .benchmark import PhaseTimer, timed_phase
 
 # When adding a new test, have it prefixed by this string in order to have it automatically parametrized for currencies tests
 TEST_METHOD_PREFIX="perform_test_"
@@ -72,6 +73,9 @@ class ExchangeTestRunner:
     wrong_amount_error_code = None
 
     alias_address: Optional[bytes] = None
+
+    # Set by the benchmark harness to measure the time spent in each phase of the flows
+    phase_timer: Optional[PhaseTimer] = None
     _alias_refund_address: Optional[bytes] = None
     _alias_payout_address: Optional[bytes] = None
 
@@ -97,63 +101,86 @@ class ExchangeTestRunner:
         self.exchange_navigation_helper.set_test_name_suffix("_" + function_to_test)
         getattr(self, TEST_METHOD_PREFIX + function_to_test)()
 
+    def _phase(self, name: str):
+        return timed_phase(self.phase_timer, name)
+
     def _perform_valid_exchange(self, subcommand, tx_infos, from_currency_configuration, to_currency_configuration, fees, ui_validation, start_application):
         # Initialize the exchange client plugin that will format and send the APDUs to the device
         ex = ExchangeClient(self.backend, Rate.FIXED, subcommand)
 
         # The partner we will perform the exchange with
-        partner = SigningAuthority(curve=get_partner_curve(subcommand), name=self.partner_name)
+        with self._phase("host_crypto"):
+            partner = SigningAuthority(curve=get_partner_curve(subcommand), name=self.partner_name)
 
         # Initialize a new transaction request
-        transaction_id = ex.init_transaction().data
+        with self._phase("apdu.init_transaction"):
+            transaction_id = ex.init_transaction().data
 
         # Enroll the partner
-        credentials = get_credentials(subcommand, partner)
-        ex.set_partner_key(credentials)
-        ex.check_partner_key(LEDGER_SIGNER.sign(credentials))
+        with self._phase("host_crypto"):
+            credentials = get_credentials(subcommand, partner)
+            signed_credentials = LEDGER_SIGNER.sign(credentials)
+        with self._phase("apdu.set_partner_key"):
+            ex.set_partner_key(credentials)
+        with self._phase("apdu.check_partner_key"):
+            ex.check_partner_key(signed_credentials)
 
         # Craft the exchange transaction proposal and have it signed by the enrolled partner
-        tx, tx_signature = craft_and_sign_tx(subcommand, tx_infos, transaction_id, fees, partner)
+        with self._phase("host_crypto"):
+            tx, tx_signature = craft_and_sign_tx(subcommand, tx_infos, transaction_id, fees, partner)
 
         # Send the exchange transaction proposal and its signature
-        ex.process_transaction(tx)
-        ex.check_transaction_signature(tx_signature)
+        with self._phase("apdu.process_transaction"):
+            ex.process_transaction(tx)
+        with self._phase("apdu.check_transaction_signature"):
+            ex.check_transaction_signature(tx_signature)
 
         # Ask our fake CAL the coin configuration for both FROM and TO currencies (None for TO in case of FUND or SELL)
-        from_configuration = from_currency_configuration.get_conf_for_ticker()
+        with self._phase("host_crypto"):
+            from_configuration = from_currency_configuration.get_conf_for_ticker()
 
         if subcommand == SubCommand.SWAP_NG:
             if self._alias_refund_address is not None:
-                challenge = ex.get_challenge().data
-                ex.send_pki_certificate_and_trusted_name_descriptor(challenge=challenge, trusted_name=tx_infos["refund_address"], address=self._alias_refund_address)
+                with self._phase("apdu.get_challenge"):
+                    challenge = ex.get_challenge().data
+                with self._phase("apdu.send_trusted_name_descriptor"):
+                    ex.send_pki_certificate_and_trusted_name_descriptor(challenge=challenge, trusted_name=tx_infos["refund_address"], address=self._alias_refund_address)
             if self._alias_payout_address is not None:
-                challenge = ex.get_challenge().data
-                ex.send_pki_certificate_and_trusted_name_descriptor(challenge=challenge, trusted_name=tx_infos["payout_address"], address=self._alias_payout_address)
+                with self._phase("apdu.get_challenge"):
+                    challenge = ex.get_challenge().data
+                with self._phase("apdu.send_trusted_name_descriptor"):
+                    ex.send_pki_certificate_and_trusted_name_descriptor(challenge=challenge, trusted_name=tx_infos["payout_address"], address=self._alias_payout_address)
 
-            to_configuration = to_currency_configuration.get_conf_for_ticker()
-            ex.check_payout_address(to_configuration)
+            with self._phase("host_crypto"):
+                to_configuration = to_currency_configuration.get_conf_for_ticker()
+            with self._phase("apdu.check_payout_address"):
+                ex.check_payout_address(to_configuration)
 
             # Request the final address check and UI approval request on the device
-            ex.check_refund_address_no_display(from_configuration)
+            with self._phase("apdu.check_refund_address"):
+                ex.check_refund_address_no_display(from_configuration)
         else:
-            ex.check_asset_in_no_display(from_configuration)
+            with self._phase("apdu.check_asset_in"):
+                ex.check_asset_in_no_display(from_configuration)
 
-        with ex.prompt_ui_display():
-            if ui_validation:
-                self.exchange_navigation_helper.simple_accept()
-            else:
-                # Calling the navigator delays the RAPDU reception until the end of navigation
-                # Which is problematic if the RAPDU is an error as we would not raise until the navigation is done
-                # As a workaround, we avoid calling the navigation if we want the function to raise
-                pass
+        with self._phase("navigation"):
+            with ex.prompt_ui_display():
+                if ui_validation:
+                    self.exchange_navigation_helper.simple_accept()
+                else:
+                    # Calling the navigator delays the RAPDU reception until the end of navigation
+                    # Which is problematic if the RAPDU is an error as we would not raise until the navigation is done
+                    # As a workaround, we avoid calling the navigation if we want the function to raise
+                    pass
 
-        self.exchange_navigation_helper.wait_for_exchange_spinner()
+            self.exchange_navigation_helper.wait_for_exchange_spinner()
 
         if start_application:
             # Ask exchange to start the library application to sign the actual outgoing transaction
-            ex.start_signing_transaction()
+            with self._phase("library_app_start"):
+                ex.start_signing_transaction()
 
-            self.exchange_navigation_helper.wait_for_library_spinner()
+                self.exchange_navigation_helper.wait_for_library_spinner()
 
     def perform_valid_swap_from_custom(self, destination, send_amount, fees, destination_memo, refund_address=None, refund_memo=None, ui_validation=True, allow_alias=True, start_application=True):
         # Refund data is almost always 'valid', make it optional to specify it
@@ -247,12 +274,14 @@ class ExchangeTestRunner:
     # Wrapper of the function above to handle the USB reset in the parent class instead of the currency class
     def perform_coin_specific_final_tx(self, destination, send_amount, fees, memo):
         try:
-            self.perform_final_tx(destination, send_amount, fees, memo)
+            with self._phase("final_tx"):
+                self.perform_final_tx(destination, send_amount, fees, memo)
         except Exception as e:
             raise e
         finally:
-            self.exchange_navigation_helper.check_post_sign_display()
-            handle_lib_call_start_or_stop(self.backend)
+            with self._phase("library_app_stop"):
+                self.exchange_navigation_helper.check_post_sign_display()
+                handle_lib_call_start_or_stop(self.backend)
 
     def assert_exchange_is_started(self):
         # We don't care at all for the subcommand / rate
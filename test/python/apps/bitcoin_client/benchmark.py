@@ -0,0 +1,875 @@
+"""
+Host side benchmarks of the ledger_bitcoin client, on PSBTs generated with txmaker.
+
+Run from this folder:
+
+    python benchmark.py --inputs 10000 --outputs 10000 --repeat 5 [name_filter ...]
+    python benchmark.py --sizes 1,10,100,1000,10000 --output baseline.json
+    python benchmark.py --sizes 1,10,100,1000,10000 --baseline baseline.json --max-regression 20
+
+The timings are printed as JSON, in milliseconds. With --sizes, every benchmark runs on PSBTs with that many inputs and
+outputs each. With --baseline, the exit code is 1 if the median time of a benchmark is more than --max-regression
+percent slower than in the baseline, for the same benchmark and size. Both runs need --repeat 3 or more: the median of
+fewer runs is mostly noise.
+"""
+
+import argparse
+import base64
+import copy
+import json
+import random
+import sys
+import tracemalloc
+
+from io import BytesIO
+from statistics import median
+from time import perf_counter
+from typing import Callable, Dict, List, Mapping, Optional, Tuple, Union
+
+from ledger_bitcoin import WalletCache, WalletPolicy
+from ledger_bitcoin.bip380.descriptors import Descriptor, checksum
+from ledger_bitcoin.bip380.key import derive_prefix
+from ledger_bitcoin.bip380.miniscript import Node, SatisfactionMaterial
+from ledger_bitcoin.btchip.bitcoinTransaction import bitcoinTransaction
+from ledger_bitcoin.btchip.btchip import btchip
+from ledger_bitcoin.btchip.btchipComm import HIDDongleHIDAPI
+from ledger_bitcoin.client import NewClient, parse_stream_to_map
+from ledger_bitcoin import _base58 as base58, key, ripemd, segwit_addr
+from ledger_bitcoin.client_command import ClientCommandCode, ClientCommandInterpreter
+from ledger_bitcoin.command_builder import BitcoinInsType
+from ledger_bitcoin.common import ByteStreamParser, write_varint
+from ledger_bitcoin.merkle import MerkleTree, element_hash, get_merkleized_map_commitment
+from ledger_bitcoin.psbt import PSBT
+from ledger_bitcoin.psbt_commitment import PsbtCommitment
+from ledger_bitcoin.psbt_parser import PSBTMapParser
+from ledger_bitcoin.tx import COutPoint, CTransaction, CTxIn, CTxInWitness, CTxOut
+
+import txmaker
+
+from stand_ins import DongleStandIn, FakeHIDDevice, SequentialDongle, SignPsbtReplayBackend, legacy_app_response
+
+BENCHMARK_WALLET = WalletPolicy(
+    "",
+    "wpkh(@0/**)",
+    ["[f5acc2fd/84'/1'/0']tpubDCtKfsNyRhULjZ9XMS4VKKtVcPdVDi8MKUbcSD9MJDyjRu1A2ND5MiipozyyspBT9bg8upEp7a8EAgFxNxXn1d7QkdbL52Ty5jiSLcxPt1P"],
+)
+
+# txmaker derives keys for every input and output, larger PSBTs are tiled from a template of this size
+TEMPLATE_SIZE = 50
+
+
+def make_psbt(n_inputs: int, n_outputs: int, seed: int = 0) -> PSBT:
+    """Returns a deterministic PSBT with n_inputs inputs and n_outputs change outputs."""
+
+    random.seed(seed)
+    n_template_inputs = min(n_inputs, TEMPLATE_SIZE)
+    n_template_outputs = min(n_outputs, TEMPLATE_SIZE)
+    template = txmaker.createPsbt(BENCHMARK_WALLET,
+                                  [random.randint(10_000, 100_000_000) for _ in range(n_template_inputs)],
+                                  [random.randint(1_000, 10_000) for _ in range(n_template_outputs)],
+                                  [True] * n_template_outputs)
+
+    psbt = template
+    tx = template.tx
+    for i in range(n_template_inputs, n_inputs):
+        j = i % n_template_inputs
+        # distinct prevout transactions, so that the input maps are distinct; the other fields are shared
+        prevout = copy.copy(template.inputs[j].non_witness_utxo)
+        prevout.nLockTime = i
+        prevout.rehash()
+        psbt_in = copy.copy(template.inputs[j])
+        psbt_in.non_witness_utxo = prevout
+        psbt.inputs.append(psbt_in)
+        tx.vin.append(CTxIn(COutPoint(prevout.sha256, tx.vin[j].prevout.n), b"", 0))
+    for i in range(n_template_outputs, n_outputs):
+        j = i % n_template_outputs
+        psbt.outputs.append(copy.copy(template.outputs[j]))
+        tx.vout.append(CTxOut(random.randint(1_000, 10_000), tx.vout[j].scriptPubKey))
+    return psbt
+
+
+def psbt_v2_bytes(psbt: PSBT) -> bytes:
+    """Returns the serialized PSBTv2 version of `psbt`, as sign_psbt does."""
+
+    psbt_v2 = PSBT()
+    psbt_v2.deserialize_bytes(psbt.serialize_bytes())
+    psbt_v2.convert_to_v2()
+    return psbt_v2.serialize_bytes()
+
+
+def parse_psbt_maps(psbt_bytes: bytes, n_inputs: int, n_outputs: int) \
+        -> Tuple[Mapping[bytes, bytes], List[Mapping[bytes, bytes]], List[Mapping[bytes, bytes]]]:
+    """Returns the global, input and output maps of a serialized PSBT."""
+
+    parser = PSBTMapParser(psbt_bytes)
+    global_map = parser.read_map()
+    input_maps = [parser.read_map() for _ in range(n_inputs)]
+    output_maps = [parser.read_map() for _ in range(n_outputs)]
+    return global_map, input_maps, output_maps
+
+
+class BenchmarkContext:
+    """Inputs shared by the benchmarks, computed once and on demand."""
+
+    def __init__(self, n_inputs: int, n_outputs: int, seed: int):
+        self.n_inputs = n_inputs
+        self.n_outputs = n_outputs
+        self.seed = seed
+        self._cache: Dict[str, object] = {}
+
+    def _get(self, name: str, compute: Callable[[], object]):
+        if name not in self._cache:
+            self._cache[name] = compute()
+        return self._cache[name]
+
+    @property
+    def psbt(self) -> PSBT:
+        return self._get("psbt", lambda: make_psbt(self.n_inputs, self.n_outputs, self.seed))
+
+    @property
+    def psbt_bytes(self) -> bytes:
+        """The serialized PSBTv2 version of the PSBT."""
+        return self._get("psbt_bytes", lambda: psbt_v2_bytes(self.psbt))
+
+    @property
+    def maps(self) -> Tuple[Mapping[bytes, bytes], List[Mapping[bytes, bytes]], List[Mapping[bytes, bytes]]]:
+        return self._get("maps", lambda: parse_psbt_maps(self.psbt_bytes, self.n_inputs, self.n_outputs))
+
+    @property
+    def commitment_leaves(self) -> List[bytes]:
+        """Leaf hashes of the input commitments tree followed by the output commitments tree."""
+        def compute():
+            _, input_maps, output_maps = self.maps
+            return [element_hash(get_merkleized_map_commitment(m)) for m in input_maps + output_maps]
+        return self._get("commitment_leaves", compute)
+
+    @property
+    def commitment_tree(self) -> MerkleTree:
+        return self._get("commitment_tree", lambda: MerkleTree(self.commitment_leaves))
+
+
+# Each benchmark receives the context and returns the function to time, or a pair of functions (prepare, run) when the
+# benchmarked operation changes its input: prepare is called before each timed run, and is not timed
+Benchmark = Union[Callable[[], None], Tuple[Callable[[], None], Callable[[], None]]]
+BENCHMARKS: Dict[str, Callable[[BenchmarkContext], Benchmark]] = {}
+
+
+def benchmark(name: str):
+    def register(setup: Callable[[BenchmarkContext], Benchmark]):
+        BENCHMARKS[name] = setup
+        return setup
+    return register
+
+
+@benchmark("psbt_parser.parse_stream_to_map")
+def _bench_parse_stream_to_map(ctx: BenchmarkContext) -> Callable[[], None]:
+    psbt_bytes = ctx.psbt_bytes
+
+    def run():
+        f = BytesIO(psbt_bytes)
+        f.read(5)
+        return [parse_stream_to_map(f) for _ in range(1 + ctx.n_inputs + ctx.n_outputs)]
+    return run
+
+
+@benchmark("psbt_parser.read_map")
+def _bench_read_map(ctx: BenchmarkContext) -> Callable[[], None]:
+    psbt_bytes = ctx.psbt_bytes
+    return lambda: parse_psbt_maps(psbt_bytes, ctx.n_inputs, ctx.n_outputs)
+
+
+@benchmark("psbt_parser.entries")
+def _bench_entries(ctx: BenchmarkContext) -> Callable[[], None]:
+    # views of all the keys and values, without materializing them
+    psbt_bytes = ctx.psbt_bytes
+
+    def run():
+        parser = PSBTMapParser(psbt_bytes)
+        for _ in range(1 + ctx.n_inputs + ctx.n_outputs):
+            for _ in parser.entries():
+                pass
+    return run
+
+
+@benchmark("psbt_parser.skip_inputs")
+def _bench_skip_inputs(ctx: BenchmarkContext) -> Callable[[], None]:
+    # the global and output maps only, the input maps (which hold the non-witness UTXOs) are skipped
+    psbt_bytes = ctx.psbt_bytes
+
+    def run():
+        parser = PSBTMapParser(psbt_bytes)
+        parser.read_map()
+        for _ in range(ctx.n_inputs):
+            parser.skip_map()
+        for _ in range(ctx.n_outputs):
+            parser.read_map()
+    return run
+
+
+@benchmark("psbt.deserialize")
+def _bench_psbt_deserialize(ctx: BenchmarkContext) -> Callable[[], None]:
+    psbt_base64 = base64.b64encode(ctx.psbt_bytes).decode()
+    return lambda: PSBT().deserialize(psbt_base64)
+
+
+@benchmark("psbt.deserialize_bytes")
+def _bench_psbt_deserialize_bytes(ctx: BenchmarkContext) -> Callable[[], None]:
+    psbt_bytes = ctx.psbt_bytes
+    return lambda: PSBT().deserialize_bytes(psbt_bytes)
+
+
+def _psbt_copy(ctx: BenchmarkContext) -> PSBT:
+    psbt = PSBT()
+    psbt.deserialize_bytes(ctx.psbt.serialize_bytes())
+    return psbt
+
+
+@benchmark("psbt.serialize")
+def _bench_psbt_serialize(ctx: BenchmarkContext) -> Callable[[], None]:
+    return ctx.psbt.serialize
+
+
+@benchmark("psbt.serialize_bytes")
+def _bench_psbt_serialize_bytes(ctx: BenchmarkContext) -> Callable[[], None]:
+    return ctx.psbt.serialize_bytes
+
+
+@benchmark("psbt.serialize_v2_bytes")
+def _bench_psbt_serialize_v2_bytes(ctx: BenchmarkContext) -> Callable[[], None]:
+    # the serialization parsed by sign_psbt
+    psbt = _psbt_copy(ctx)
+    psbt.convert_to_v2()
+    return psbt.serialize_bytes
+
+
+@benchmark("psbt.convert_to_v2")
+def _bench_psbt_convert_to_v2(ctx: BenchmarkContext) -> Benchmark:
+    psbt = _psbt_copy(ctx)
+    return psbt.convert_to_v0, psbt.convert_to_v2
+
+
+@benchmark("psbt.convert_to_v0")
+def _bench_psbt_convert_to_v0(ctx: BenchmarkContext) -> Benchmark:
+    psbt = _psbt_copy(ctx)
+    return psbt.convert_to_v2, psbt.convert_to_v0
+
+
+@benchmark("tx.calc_sha256")
+def _bench_tx_calc_sha256(ctx: BenchmarkContext) -> Benchmark:
+    # the unsigned transaction of the PSBT; calc_sha256 always recomputes its txid
+    tx = _psbt_copy(ctx).tx
+    return tx.calc_sha256
+
+
+@benchmark("tx.calc_sha256_cached")
+def _bench_tx_calc_sha256_cached(ctx: BenchmarkContext) -> Callable[[], None]:
+    tx = _psbt_copy(ctx).tx
+    tx.rehash()
+    return lambda: [tx.sha256 for _ in range(100)]
+
+
+def _signed_tx(ctx: BenchmarkContext) -> CTransaction:
+    # the transaction of the PSBT, with a taproot key path signature for each input
+    tx = _psbt_copy(ctx).tx
+    rng = random.Random(ctx.seed)
+    for _ in tx.vin:
+        witness = CTxInWitness()
+        witness.scriptWitness.stack = [rng.getrandbits(512).to_bytes(64, "big")]
+        tx.wit.vtxinwit.append(witness)
+    return tx
+
+
+@benchmark("tx.serialize_with_witness")
+def _bench_tx_serialize_with_witness(ctx: BenchmarkContext) -> Callable[[], None]:
+    return _signed_tx(ctx).serialize_with_witness
+
+
+@benchmark("tx.calc_wtxid")
+def _bench_tx_calc_wtxid(ctx: BenchmarkContext) -> Benchmark:
+    tx = _signed_tx(ctx)
+    return tx.rehash, lambda: tx.calc_sha256(with_witness=True)
+
+
+def _pure_python_ec(setup: Benchmark) -> Benchmark:
+    # runs the benchmark with the pure Python elliptic curve arithmetic of ledger_bitcoin.key, even if coincurve is
+    # installed
+    prepare, function = setup if isinstance(setup, tuple) else (lambda: None, setup)
+
+    def run():
+        backend, key._coincurve = key._coincurve, None
+        try:
+            function()
+        finally:
+            key._coincurve = backend
+    return prepare, run
+
+
+def _derive_pubs(ctx: BenchmarkContext) -> Benchmark:
+    # the receive addresses of the wallet, as when verifying the addresses of a wallet policy; the keys derived by a
+    # previous run are forgotten
+    account = key.ExtendedKey.deserialize(BENCHMARK_WALLET.keys_info[0].split("]")[1])
+    return key.clear_derivation_cache, lambda: [account.derive_pub_path([0, i]) for i in range(ctx.n_outputs)]
+
+
+@benchmark("key.derive_pub")
+def _bench_derive_pub(ctx: BenchmarkContext) -> Benchmark:
+    return _derive_pubs(ctx)
+
+
+@benchmark("key.derive_pub_pure")
+def _bench_derive_pub_pure(ctx: BenchmarkContext) -> Benchmark:
+    return _pure_python_ec(_derive_pubs(ctx))
+
+
+@benchmark("key.derive_range")
+def _bench_derive_range(ctx: BenchmarkContext) -> Benchmark:
+    account = key.ExtendedKey.deserialize(BENCHMARK_WALLET.keys_info[0].split("]")[1])
+    return key.clear_derivation_cache, lambda: account.derive_range([0], 0, ctx.n_outputs)
+
+
+def _taproot_tweaks(ctx: BenchmarkContext) -> Callable[[], None]:
+    pubkeys = [key.point_to_bytes(key.point_mul(key.G, i + 1))[1:] for i in range(ctx.n_outputs)]
+    return lambda: [key.taproot_tweak_pubkey(pubkey, b"") for pubkey in pubkeys]
+
+
+@benchmark("key.taproot_tweak_pubkey")
+def _bench_taproot_tweak(ctx: BenchmarkContext) -> Callable[[], None]:
+    return _taproot_tweaks(ctx)
+
+
+@benchmark("key.taproot_tweak_pubkey_pure")
+def _bench_taproot_tweak_pure(ctx: BenchmarkContext) -> Benchmark:
+    return _pure_python_ec(_taproot_tweaks(ctx))
+
+
+def _extended_keys(ctx: BenchmarkContext) -> List[bytes]:
+    # serialized extended keys, with their checksums, as in the key origins of wallet policies
+    rng = random.Random(ctx.seed)
+    return [bytes(rng.getrandbits(8) for _ in range(82)) for _ in range(ctx.n_outputs)]
+
+
+@benchmark("base58.encode")
+def _bench_base58_encode(ctx: BenchmarkContext) -> Callable[[], None]:
+    xpubs = _extended_keys(ctx)
+    return lambda: base58.encode_many(xpubs)
+
+
+@benchmark("base58.decode")
+def _bench_base58_decode(ctx: BenchmarkContext) -> Callable[[], None]:
+    xpubs = base58.encode_many(_extended_keys(ctx))
+    return lambda: base58.decode_many(xpubs)
+
+
+def _descriptors(ctx: BenchmarkContext) -> List[str]:
+    # the descriptors of the outputs, without their checksums
+    xpub = BENCHMARK_WALLET.keys_info[0].split("]")[1]
+    return [f"wsh(or_d(multi(2,{xpub}/0/{i},{xpub}/1/{i}),and_v(v:pkh({xpub}/2/{i}),older(144))))"
+            for i in range(ctx.n_outputs)]
+
+
+@benchmark("checksum.descsum_create")
+def _bench_descsum_create(ctx: BenchmarkContext) -> Callable[[], None]:
+    descriptors = _descriptors(ctx)
+    return lambda: checksum.descsum_create_many(descriptors)
+
+
+@benchmark("checksum.descsum_check")
+def _bench_descsum_check(ctx: BenchmarkContext) -> Callable[[], None]:
+    descriptors = checksum.descsum_create_many(_descriptors(ctx))
+    return lambda: checksum.descsum_check_many(descriptors)
+
+
+def _witness_programs(ctx: BenchmarkContext) -> List[bytes]:
+    # the taproot output keys of the outputs
+    rng = random.Random(ctx.seed)
+    return [rng.getrandbits(256).to_bytes(32, "big") for _ in range(ctx.n_outputs)]
+
+
+@benchmark("segwit_addr.encode")
+def _bench_segwit_addr_encode(ctx: BenchmarkContext) -> Callable[[], None]:
+    programs = _witness_programs(ctx)
+    return lambda: segwit_addr.encode_many("tb", 1, programs)
+
+
+@benchmark("segwit_addr.verify")
+def _bench_segwit_addr_verify(ctx: BenchmarkContext) -> Callable[[], None]:
+    addresses = segwit_addr.encode_many("tb", 1, _witness_programs(ctx))
+    return lambda: segwit_addr.verify_many("tb", addresses)
+
+
+def _hash160s(ctx: BenchmarkContext) -> Callable[[], None]:
+    # the compressed public keys of the outputs, as for P2WPKH scripts and key fingerprints
+    pubkeys = [bytes([2 + i % 2]) + i.to_bytes(32, "big") for i in range(ctx.n_outputs)]
+    return lambda: ripemd.hash160_many(pubkeys)
+
+
+@benchmark("ripemd.hash160")
+def _bench_hash160(ctx: BenchmarkContext) -> Callable[[], None]:
+    return _hash160s(ctx)
+
+
+@benchmark("ripemd.hash160_fallback")
+def _bench_hash160_fallback(ctx: BenchmarkContext) -> Benchmark:
+    # with the pure Python RIPEMD160, as when hashlib does not provide it
+    function = _hash160s(ctx)
+
+    def run():
+        provider, ripemd.HASHLIB_RIPEMD160 = ripemd.HASHLIB_RIPEMD160, False
+        try:
+            function()
+        finally:
+            ripemd.HASHLIB_RIPEMD160 = provider
+    return run
+
+
+def thresh_policy(width: int) -> str:
+    """Returns a miniscript policy requiring a majority of signatures among `width` distinct keys."""
+    pubkeys = [key.point_to_bytes(key.point_mul(key.G, i + 1)).hex() for i in range(width)]
+    subs = [f"pk({pubkeys[0]})"] + [f"s:pk({pubkey})" for pubkey in pubkeys[1:]]
+    return f"thresh({width // 2 + 1},{','.join(subs)})"
+
+
+@benchmark("miniscript.from_str")
+def _bench_miniscript_from_str(ctx: BenchmarkContext) -> Callable[[], None]:
+    policy = thresh_policy(ctx.n_outputs)
+    return lambda: Node.from_str(policy)
+
+
+@benchmark("miniscript.from_script")
+def _bench_miniscript_from_script(ctx: BenchmarkContext) -> Callable[[], None]:
+    script = Node.from_str(thresh_policy(ctx.n_outputs)).script
+    return lambda: Node.from_script(script)
+
+
+def nested_thresh_policy(n_keys: int, width: int = 10) -> str:
+    """
+    Returns a miniscript policy of thresholds of up to `width` subs, requiring a majority of their subs, nested until
+    there is a single one. There are `n_keys` distinct keys.
+    """
+    pubkeys = [key.point_to_bytes(key.point_mul(key.G, i + 1)).hex() for i in range(n_keys)]
+    subs = [f"pk({pubkey})" for pubkey in pubkeys]
+    wrapper = "s:"
+    while len(subs) > 1:
+        groups = [subs[i:i + width] for i in range(0, len(subs), width)]
+        subs = [group[0] if len(group) == 1 else
+                f"thresh({len(group) // 2 + 1},{group[0]},{','.join(wrapper + sub for sub in group[1:])})"
+                for group in groups]
+        wrapper = "a:"
+    return subs[0]
+
+
+def _cosigners_signatures(node: Node) -> Dict[bytes, bytes]:
+    # signatures from two thirds of the keys, enough for the majority thresholds of the benchmark policies
+    return {pubkey.bytes(): b"\x30" * 71 for i, pubkey in enumerate(node.keys) if i % 3 != 2}
+
+
+def _satisfy(policy: str) -> Benchmark:
+    # the first satisfaction of a freshly parsed miniscript
+    nodes = [Node.from_str(policy)]
+    sat_material = SatisfactionMaterial(signatures=_cosigners_signatures(nodes[0]))
+
+    def prepare():
+        nodes[0] = Node.from_str(policy)
+    return prepare, lambda: nodes[0].satisfy(sat_material)
+
+
+@benchmark("miniscript.satisfy")
+def _bench_miniscript_satisfy(ctx: BenchmarkContext) -> Benchmark:
+    return _satisfy(nested_thresh_policy(ctx.n_outputs))
+
+
+@benchmark("miniscript.satisfy_flat")
+def _bench_miniscript_satisfy_flat(ctx: BenchmarkContext) -> Benchmark:
+    return _satisfy(thresh_policy(ctx.n_outputs))
+
+
+@benchmark("miniscript.satisfy_rounds")
+def _bench_miniscript_satisfy_rounds(ctx: BenchmarkContext) -> Benchmark:
+    # cosigners adding their signature one after the other, the miniscript is satisfied again after each of them
+    node = Node.from_str(nested_thresh_policy(ctx.n_outputs))
+    signatures = list(_cosigners_signatures(node).items())
+    rounds = min(10, len(signatures))
+    sat_material = SatisfactionMaterial(signatures={})
+
+    def prepare():
+        sat_material.signatures = dict(signatures[rounds:])
+
+    def run():
+        for pubkey, signature in signatures[:rounds]:
+            sat_material.signatures[pubkey] = signature
+            node.satisfy(sat_material)
+    return prepare, run
+
+
+def _benchmark_descriptor() -> Descriptor:
+    # a 2-of-2 multisig with a timelocked recovery key, whose derived keys appear both as keys and as key hashes
+    xpub = BENCHMARK_WALLET.keys_info[0].split("]")[1]
+    return Descriptor.from_str(f"wsh(or_d(multi(2,{xpub}/0/0/*,{xpub}/1/0/*),and_v(v:pkh({xpub}/2/0/*),older(144))))")
+
+
+@benchmark("descriptor.derive")
+def _bench_descriptor_derive(ctx: BenchmarkContext) -> Callable[[], None]:
+    # the script_pubkeys of consecutive indexes, one derived copy of the descriptor at a time
+    descriptor = _benchmark_descriptor()
+
+    def run():
+        for i in range(ctx.n_outputs):
+            derived = descriptor.copy()
+            derived.derive(i)
+            derived.script_pubkey
+    return run
+
+
+@benchmark("descriptor.derive_range")
+def _bench_descriptor_derive_range(ctx: BenchmarkContext) -> Benchmark:
+    descriptor = _benchmark_descriptor()
+    return derive_prefix.cache_clear, lambda: descriptor.derive_range(0, ctx.n_outputs)
+
+
+@benchmark("merkle.get_merkleized_map_commitment")
+def _bench_map_commitments(ctx: BenchmarkContext) -> Callable[[], None]:
+    _, input_maps, output_maps = ctx.maps
+    maps = input_maps + output_maps
+    return lambda: [get_merkleized_map_commitment(m) for m in maps]
+
+
+@benchmark("merkle.build")
+def _bench_merkle_build(ctx: BenchmarkContext) -> Callable[[], None]:
+    leaves = ctx.commitment_leaves
+    return lambda: MerkleTree(leaves)
+
+
+@benchmark("merkle.add")
+def _bench_merkle_add(ctx: BenchmarkContext) -> Callable[[], None]:
+    leaves = ctx.commitment_leaves
+
+    def run():
+        tree = MerkleTree()
+        for leaf in leaves:
+            tree.add(leaf)
+    return run
+
+
+@benchmark("merkle.leaf_index")
+def _bench_merkle_leaf_index(ctx: BenchmarkContext) -> Callable[[], None]:
+    tree, leaves = ctx.commitment_tree, ctx.commitment_leaves
+    return lambda: [tree.leaf_index(leaf) for leaf in leaves]
+
+
+@benchmark("merkle.prove_leaf")
+def _bench_merkle_prove_leaf(ctx: BenchmarkContext) -> Callable[[], None]:
+    tree = ctx.commitment_tree
+    return lambda: [tree.prove_leaf(i) for i in range(len(tree))]
+
+
+@benchmark("common.byte_stream_parser")
+def _bench_byte_stream_parser(ctx: BenchmarkContext) -> Callable[[], None]:
+    # the GET_MERKLE_LEAF_PROOF requests for every leaf of the tree of the input commitments, parsed as by the command
+    n_leaves = len(ctx.commitment_leaves)
+    prefix = bytes([ClientCommandCode.GET_MERKLE_LEAF_PROOF]) + bytes(32) + write_varint(n_leaves)
+    requests = [prefix + write_varint(i) for i in range(n_leaves)]
+
+    def run():
+        for request in requests:
+            req = ByteStreamParser(request, 1)
+            req.read_bytes(32)
+            req.read_varint()
+            req.read_varint()
+            req.assert_empty()
+    return run
+
+
+@benchmark("client_command.preimage_stream")
+def _bench_preimage_stream(ctx: BenchmarkContext) -> Callable[[], None]:
+    # the device fetches every value of the input maps (non-witness UTXOs being the largest) with GET_PREIMAGE,
+    # followed by GET_MORE_ELEMENTS for the part not fitting in the first response
+    _, input_maps, _ = ctx.maps
+    interpreter = ClientCommandInterpreter()
+    requests = []
+    for m in input_maps:
+        interpreter.add_known_mapping(m)
+        requests += [bytes([ClientCommandCode.GET_PREIMAGE, 0]) + element_hash(v) for v in m.values()]
+    get_more_elements = bytes([ClientCommandCode.GET_MORE_ELEMENTS])
+
+    def run():
+        for request in requests:
+            response = ByteStreamParser(interpreter.execute(request))
+            remaining = response.read_varint() - response.read_uint(1)
+            while remaining > 0:
+                response = interpreter.execute(get_more_elements)
+                remaining -= response[0]
+    return run
+
+
+def _sign_psbt_interpreter(ctx: BenchmarkContext, precompute_proofs: bool) -> Callable[[], None]:
+    # Host side of sign_psbt for the Merkle proofs: the interpreter is prepared as in NewClient.sign_psbt, then the
+    # device asks for the proof of every leaf of every known tree
+    global_map, input_maps, output_maps = ctx.maps
+    input_commitments = [get_merkleized_map_commitment(m) for m in input_maps]
+    output_commitments = [get_merkleized_map_commitment(m) for m in output_maps]
+    get_more_elements = bytes([ClientCommandCode.GET_MORE_ELEMENTS])
+
+    def run():
+        interpreter = ClientCommandInterpreter(precompute_proofs=precompute_proofs)
+        for m in [global_map] + input_maps + output_maps:
+            interpreter.add_known_mapping(m)
+        interpreter.add_known_list(input_commitments)
+        interpreter.add_known_list(output_commitments)
+
+        for root, tree in interpreter.known_trees.items():
+            prefix = bytes([ClientCommandCode.GET_MERKLE_LEAF_PROOF]) + root + write_varint(len(tree))
+            for i in range(len(tree)):
+                response = interpreter.execute(prefix + write_varint(i))
+                remaining = response[32] - response[33]
+                while remaining > 0:
+                    remaining -= interpreter.execute(get_more_elements)[0]
+    return run
+
+
+@benchmark("client_command.sign_psbt_proofs")
+def _bench_sign_psbt_proofs(ctx: BenchmarkContext) -> Callable[[], None]:
+    return _sign_psbt_interpreter(ctx, precompute_proofs=False)
+
+
+@benchmark("client_command.sign_psbt_proofs_precomputed")
+def _bench_sign_psbt_proofs_precomputed(ctx: BenchmarkContext) -> Callable[[], None]:
+    return _sign_psbt_interpreter(ctx, precompute_proofs=True)
+
+
+class _HostOnlyClient(NewClient):
+    """A NewClient whose device answers every request at once, to time the host side of the commands."""
+
+    def __init__(self):
+        super().__init__(None)
+
+    def _make_request(self, apdu, client_intepreter=None):
+        return 0x9000, b""
+
+
+@benchmark("client.sign_psbt_host")
+def _bench_sign_psbt_host(ctx: BenchmarkContext) -> Callable[[], None]:
+    # everything sign_psbt does before the device takes over: cloning and converting the PSBT, parsing its maps,
+    # computing the commitments and preparing the client interpreter
+    client = _HostOnlyClient()
+    psbt = ctx.psbt
+    return lambda: client.sign_psbt(psbt, BENCHMARK_WALLET, None)
+
+
+def _miniscript_wallet() -> WalletPolicy:
+    # a 2-of-2 multisig with a timelocked recovery key: get_wallet_address derives the addresses of miniscript policies
+    # again on the host
+    account = key.ExtendedKey.deserialize(BENCHMARK_WALLET.keys_info[0].split("]")[1])
+    keys_info = [f"[f5acc2fd/84'/1'/0'/{i}]{account.derive_pub(i).to_string()}" for i in range(3)]
+    return WalletPolicy("Timelocked 2-of-2", "wsh(or_d(multi(2,@0/**,@1/**),and_v(v:pkh(@2/**),older(144))))", keys_info)
+
+
+class _WalletHostClient(NewClient):
+    """A NewClient whose device returns the addresses of `wallet` at once, to time the host side of get_wallet_address."""
+
+    def __init__(self, wallet: WalletPolicy, n_addresses: int):
+        super().__init__(None)
+        self._addresses = [NewClient._derive_segwit_address_for_policy(self, wallet, False, i) for i in range(n_addresses)]
+
+    def _make_request(self, apdu, client_intepreter=None):
+        if apdu["ins"] == BitcoinInsType.GET_MASTER_FINGERPRINT:
+            return 0x9000, bytes.fromhex("f5acc2fd")
+        return 0x9000, self._addresses[int.from_bytes(apdu["data"][-4:], "big")].encode()
+
+
+def _wallet_addresses(ctx: BenchmarkContext, cached: bool) -> Benchmark:
+    # the receive addresses of a miniscript policy, checked against the ones derived on the host; with a warm wallet
+    # cache, as in a later flow with the same policy, they are not derived again
+    wallet = _miniscript_wallet()
+    client = _WalletHostClient(wallet, ctx.n_outputs)
+    if cached:
+        client.wallet_cache = WalletCache()
+        for i in range(ctx.n_outputs):
+            client.get_wallet_address(wallet, None, 0, i, False)
+
+    def prepare():
+        key.clear_derivation_cache()
+        derive_prefix.cache_clear()
+
+    return prepare, lambda: [client.get_wallet_address(wallet, None, 0, i, False) for i in range(ctx.n_outputs)]
+
+
+@benchmark("client.get_wallet_address_host")
+def _bench_wallet_address_host(ctx: BenchmarkContext) -> Benchmark:
+    return _wallet_addresses(ctx, cached=False)
+
+
+@benchmark("client.get_wallet_address_cached")
+def _bench_wallet_address_cached(ctx: BenchmarkContext) -> Benchmark:
+    return _wallet_addresses(ctx, cached=True)
+
+
+@benchmark("client.sign_psbt_replay")
+def _bench_sign_psbt_replay(ctx: BenchmarkContext) -> Callable[[], None]:
+    # the whole host side of sign_psbt, with the client commands of a device
+    global_map, input_maps, output_maps = ctx.maps
+    client = NewClient(SignPsbtReplayBackend(PsbtCommitment(global_map, input_maps, output_maps)))
+    psbt = ctx.psbt
+
+    def run():
+        assert len(client.sign_psbt(psbt, BENCHMARK_WALLET, None)) == ctx.n_inputs
+    return run
+
+
+# An APDU of the legacy app with a full payload, as sent when hashing the inputs of a transaction
+LEGACY_APDU = bytes([0xE0, 0x44, 0x80, 0x00, 0xFF]) + bytes(range(255))
+
+
+def _echo_apdu(apdu: bytes) -> Tuple[bytes, int]:
+    return apdu[5:], 0x9000
+
+
+@benchmark("btchip.hid_exchange")
+def _bench_hid_exchange(ctx: BenchmarkContext) -> Callable[[], None]:
+    # host side of the HID transport: framing the requests and parsing the responses, with the Ledger framing
+    dongle = HIDDongleHIDAPI(FakeHIDDevice(_echo_apdu), ledger=True)
+    return lambda: [dongle.exchange(LEGACY_APDU) for _ in range(ctx.n_outputs)]
+
+
+@benchmark("btchip.dongle_server_exchange")
+def _bench_dongle_server_exchange(ctx: BenchmarkContext) -> Callable[[], None]:
+    # one round trip per APDU to a local stand-in of the device proxy
+    dongle = DongleStandIn(_echo_apdu).connect()
+    return lambda: [dongle.exchange(LEGACY_APDU) for _ in range(ctx.n_outputs)]
+
+
+@benchmark("btchip.dongle_server_pipelined")
+def _bench_dongle_server_pipelined(ctx: BenchmarkContext) -> Callable[[], None]:
+    # the same APDUs, all sent before reading the responses
+    dongle = DongleStandIn(_echo_apdu).connect()
+    return lambda: dongle.exchangeMany([LEGACY_APDU] * ctx.n_outputs)
+
+
+def _trusted_input(ctx: BenchmarkContext, pipelined: bool) -> Callable[[], None]:
+    # the previous transaction of an input is the transaction of the PSBT, with n_inputs inputs and n_outputs outputs
+    previous_tx = bitcoinTransaction(bytearray(ctx.psbt.tx.serialize_without_witness()))
+    dongle = DongleStandIn(legacy_app_response).connect()
+    app = btchip(dongle if pipelined else SequentialDongle(dongle))
+    return lambda: app.getTrustedInput(previous_tx, 0)
+
+
+@benchmark("btchip.get_trusted_input")
+def _bench_get_trusted_input(ctx: BenchmarkContext) -> Callable[[], None]:
+    return _trusted_input(ctx, pipelined=True)
+
+
+@benchmark("btchip.get_trusted_input_sequential")
+def _bench_get_trusted_input_sequential(ctx: BenchmarkContext) -> Callable[[], None]:
+    return _trusted_input(ctx, pipelined=False)
+
+
+def run_benchmarks(ctx: BenchmarkContext, names: List[str], repeat: int, memory: bool = False) -> Dict[str, Dict[str, float]]:
+    results = {}
+    for name in names:
+        setup = BENCHMARKS[name](ctx)
+        prepare, function = setup if isinstance(setup, tuple) else (lambda: None, setup)
+        samples = []
+        for _ in range(repeat):
+            prepare()
+            start = perf_counter()
+            function()
+            samples.append((perf_counter() - start) * 1000)
+        results[name] = {"min": round(min(samples), 3), "median": round(median(samples), 3)}
+        if memory:
+            # in a separate run, as tracing the allocations slows it down
+            prepare()
+            tracemalloc.start()
+            function()
+            results[name]["peak_kib"] = round(tracemalloc.get_traced_memory()[1] / 1024, 1)
+            tracemalloc.stop()
+    return results
+
+
+# Timed runs per benchmark needed to compare with a baseline
+MIN_COMPARED_REPEAT = 3
+
+
+def find_regressions(report: Dict, baseline: Dict, max_regression: float, min_time: float = 0.0) -> List[str]:
+    """
+    Returns a description of each benchmark of `report` whose median is more than `max_regression` percent slower
+    than in `baseline`. The medians are compared rather than the best times, a single lucky run of the baseline would
+    flag the next runs. The benchmarks taking less than `min_time` milliseconds in the baseline are ignored, as their
+    timings are mostly noise.
+    """
+
+    for name, runs in (("report", report), ("baseline", baseline)):
+        if runs.get("repeat", 0) < MIN_COMPARED_REPEAT:
+            raise ValueError(f"The {name} needs at least {MIN_COMPARED_REPEAT} timed runs per benchmark to be compared")
+
+    baseline_runs = {(run["inputs"], run["outputs"]): run["results"] for run in baseline["runs"]}
+    regressions = []
+    for run in report["runs"]:
+        baseline_results = baseline_runs.get((run["inputs"], run["outputs"]), {})
+        for name, result in run["results"].items():
+            if name not in baseline_results:
+                continue
+            before, after = baseline_results[name]["median"], result["median"]
+            if before < min_time:
+                continue
+            if after > before * (1 + max_regression / 100):
+                regressions.append(f"{name} ({run['inputs']} inputs, {run['outputs']} outputs): "
+                                   f"{before:.3f} ms -> {after:.3f} ms (+{(after / before - 1) * 100:.0f}%)")
+    return regressions
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Host side benchmarks of the ledger_bitcoin client")
+    parser.add_argument("filters", nargs="*", help="Only run the benchmarks whose name contains one of these strings")
+    parser.add_argument("--inputs", type=int, default=10_000, help="Number of inputs of the PSBT (default 10000)")
+    parser.add_argument("--outputs", type=int, default=10_000, help="Number of outputs of the PSBT (default 10000)")
+    parser.add_argument("--sizes", type=lambda arg: [int(size) for size in arg.split(",")],
+                        help="Comma separated numbers of inputs and outputs to run with, instead of --inputs/--outputs")
+    parser.add_argument("--repeat", type=int, default=5, help="Timed runs per benchmark (default 5)")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the generated PSBT (default 0)")
+    parser.add_argument("--memory", action="store_true", help="Also report the peak memory allocated by each benchmark")
+    parser.add_argument("--output", help="Also write the JSON report to this file, to be used as a baseline")
+    parser.add_argument("--baseline", help="JSON report of a previous run to compare with")
+    parser.add_argument("--max-regression", type=float, default=20.0,
+                        help="Slowdown in percent from the baseline above which the run fails (default 20)")
+    parser.add_argument("--min-time", type=float, default=1.0,
+                        help="Do not compare the benchmarks faster than this in the baseline, in ms (default 1)")
+    args = parser.parse_args(argv)
+    if args.baseline and args.repeat < MIN_COMPARED_REPEAT:
+        parser.error(f"--baseline needs --repeat {MIN_COMPARED_REPEAT} or more")
+
+    names = [name for name in BENCHMARKS if not args.filters or any(f in name for f in args.filters)]
+    sizes = [(size, size) for size in args.sizes] if args.sizes else [(args.inputs, args.outputs)]
+
+    runs = []
+    for n_inputs, n_outputs in sizes:
+        ctx = BenchmarkContext(n_inputs, n_outputs, args.seed)
+        runs.append({
+            "inputs": n_inputs,
+            "outputs": n_outputs,
+            "psbt_bytes": len(ctx.psbt_bytes),
+            "results": run_benchmarks(ctx, names, args.repeat, args.memory),
+        })
+    report = {"unit": "ms", "seed": args.seed, "repeat": args.repeat, "runs": runs}
+
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+            f.write("\n")
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+        try:
+            regressions = find_regressions(report, baseline, args.max_regression, args.min_time)
+        except ValueError as e:
+            print(e, file=sys.stderr)
+            return 2
+        for regression in regressions:
+            print(f"Regression: {regression}", file=sys.stderr)
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,2 @@
+# The tests import the client and its helpers through the path setup of the Bitcoin app
+from .. import bitcoin  # noqa: F401
@@ -6,6 +6,7 @@ from .client import createClient
 from .common import Chain
 
 from .wallet import AddressType, WalletPolicy, MultisigWallet, WalletType
+from .wallet_cache import WalletCache
 
 __version__ = '0.2.1'
 
@@ -17,5 +18,6 @@ __all__ = [
     "AddressType",
     "WalletPolicy",
     "MultisigWallet",
-    "WalletType"
+    "WalletType",
+    "WalletCache"
 ]
@@ -15,8 +15,8 @@ Base 58 conversion utilities
 # file COPYING or http://www.opensource.org/licenses/mit-license.php.
 #
 
-from binascii import hexlify, unhexlify
-from typing import List
+from binascii import hexlify
+from typing import Iterable, List
 
 from .common import hash256
 from .errors import BadArgumentError
@@ -24,6 +24,28 @@ from .errors import BadArgumentError
 
 b58_digits: str = '123456789ABCDEFGHJKLMNPQRSTUVWXYZabcdefghijkmnopqrstuvwxyz'
 
+# Translation table from an ASCII character to its value as a base58 digit, 0xff for the characters not in the
+# alphabet
+_B58_VALUES: bytes = bytes(b58_digits.index(chr(c)) if chr(c) in b58_digits else 0xff for c in range(256))
+
+# The integers are converted by chunks of _CHUNK_DIGITS base58 digits, which fit in a machine word: only one big
+# integer operation is done per chunk, the digits of a chunk are computed on small integers
+_CHUNK_DIGITS = 10
+_CHUNK_BASE = 58 ** _CHUNK_DIGITS
+
+# The two digits encoding each integer in [0, 58 * 58)
+_B58_PAIRS: List[str] = [high + low for high in b58_digits for low in b58_digits]
+
+
+def _encode_chunk(chunk: int) -> str:
+    # The _CHUNK_DIGITS digits of chunk, two at a time
+    pairs = _B58_PAIRS
+    chunk, p4 = divmod(chunk, 3364)
+    chunk, p3 = divmod(chunk, 3364)
+    chunk, p2 = divmod(chunk, 3364)
+    p0, p1 = divmod(chunk, 3364)
+    return pairs[p0] + pairs[p1] + pairs[p2] + pairs[p3] + pairs[p4]
+
 
 def encode(b: bytes) -> str:
     """
@@ -32,26 +54,27 @@ def encode(b: bytes) -> str:
     :return: Base58 encoded string of ``b``
     """
 
-    # Convert big-endian bytes to integer
-    n: int = int('0x0' + hexlify(b).decode('utf8'), 16)
-
-    # Divide that integer into base58
-    temp: List[str] = []
-    while n > 0:
-        n, r = divmod(n, 58)
-        temp.append(b58_digits[r])
-    res: str = ''.join(temp[::-1])
-
-    # Encode leading zeros as base58 zeros
-    czero: int = 0
-    pad: int = 0
-    for c in b:
-        if c == czero:
-            pad += 1
-        else:
-            break
+    # Leading zeros are encoded as base58 zeros
+    pad = len(b) - len(b.lstrip(b'\x00'))
+
+    # Divide the big-endian integer into chunks of base58 digits, from the least significant one
+    n = int.from_bytes(b, 'big')
+    chunks: List[str] = []
+    while n:
+        n, chunk = divmod(n, _CHUNK_BASE)
+        chunks.append(_encode_chunk(chunk))
+    res = ''.join(reversed(chunks)).lstrip(b58_digits[0])
+
     return b58_digits[0] * pad + res
 
+
+def _invalid_character(s: str) -> BadArgumentError:
+    for c in s:
+        if c not in b58_digits:
+            return BadArgumentError('Character %r is not a valid base58 character' % c)
+    raise AssertionError("no invalid character in %r" % s)
+
+
 def decode(s: str) -> bytes:
     """
     Decode a base58-encoding string, returning bytes
@@ -61,29 +84,71 @@ def decode(s: str) -> bytes:
     if not s:
         return b''
 
-    # Convert the string to an integer
-    n: int = 0
-    for c in s:
-        n *= 58
-        if c not in b58_digits:
-            raise BadArgumentError('Character %r is not a valid base58 character' % c)
-        digit = b58_digits.index(c)
-        n += digit
-
-    # Convert the integer to bytes
-    h: str = '%x' % n
-    if len(h) % 2:
-        h = '0' + h
-    res = unhexlify(h.encode('utf8'))
-
-    # Add padding back.
-    pad = 0
-    for c in s[:-1]:
-        if c == b58_digits[0]:
-            pad += 1
-        else:
-            break
-    return b'\x00' * pad + res
+    try:
+        values = s.encode('ascii').translate(_B58_VALUES)
+    except UnicodeEncodeError:
+        raise _invalid_character(s) from None
+    if 0xff in values:
+        raise _invalid_character(s)
+
+    # Convert the digits to an integer, one chunk at a time; the first chunk is the shortest so that the others are
+    # complete
+    n = 0
+    start, end = 0, len(values) % _CHUNK_DIGITS or _CHUNK_DIGITS
+    while start < len(values):
+        chunk = 0
+        for digit in values[start:end]:
+            chunk = chunk * 58 + digit
+        n = n * 58 ** (end - start) + chunk
+        start, end = end, end + _CHUNK_DIGITS
+
+    # Add padding back
+    pad = len(s) - len(s.lstrip(b58_digits[0]))
+    if pad == len(s):
+        # The string only has zeros, the last one is the integer
+        return b'\x00' * pad
+    return b'\x00' * pad + n.to_bytes((n.bit_length() + 7) // 8, 'big')
+
+
+def encode_check(b: bytes) -> str:
+    """
+    Base58 Check Encode bytes: encode them followed by the first four bytes of their double SHA256.
+    :param b: Bytes to encode
+    :return: Base58 Check encoded string of ``b``
+    """
+    return encode(b + hash256(b)[0:4])
+
+
+def decode_check(s: str) -> bytes:
+    """
+    Decode a Base58 Check encoded string, verifying its checksum.
+    :param s: Base58 Check string to decode
+    :return: Bytes encoded by ``s``, without the checksum
+    """
+    data = decode(s)
+    if len(data) < 4 or hash256(data[:-4])[0:4] != data[-4:]:
+        raise BadArgumentError('Invalid base58 checksum')
+    return data[:-4]
+
+
+def encode_many(items: Iterable[bytes], check: bool = False) -> List[str]:
+    """
+    Encode several byte strings to base58.
+    :param items: Bytes to encode
+    :param check: Whether to Base58 Check encode them
+    :return: The encoded strings, in the same order as ``items``
+    """
+    return list(map(encode_check if check else encode, items))
+
+
+def decode_many(items: Iterable[str], check: bool = False) -> List[bytes]:
+    """
+    Decode several base58 strings.
+    :param items: Base58 strings to decode
+    :param check: Whether they are Base58 Check encoded; the checksums are verified and removed
+    :return: The decoded bytes, in the same order as ``items``
+    """
+    return list(map(decode_check if check else decode, items))
 
 def get_xpub_fingerprint(s: str) -> bytes:
     """
@@ -113,10 +178,7 @@ def to_address(b: bytes, version: bytes) -> str:
     :param version: The version number to encode with
     :return: The Base58 Check Encoded string
     """
-    data = version + b
-    checksum = hash256(data)[0:4]
-    data += checksum
-    return encode(data)
+    return encode_check(version + b)
 
 def xpub_to_pub_hex(xpub: str) -> str:
     """
@@ -147,6 +209,4 @@ def xpub_main_2_test(xpub: str) -> str:
     :return: The extended pubkey re-encoded using testnet version bytes
     """
     data = decode(xpub)
-    test_data = b'\x04\x35\x87\xCF' + data[4:-4]
-    checksum = hash256(test_data)[0:4]
-    return encode(test_data + checksum)
+    return encode_check(b'\x04\x35\x87\xCF' + data[4:-4])
@@ -37,6 +37,12 @@ class Serializable(Protocol):
         ...
 
 
+# Serializations of the compact sizes that fit in a single byte
+_SINGLE_BYTE_COMPACT_SIZES = [bytes([size]) for size in range(253)]
+
+UINT256_MASK = (1 << 256) - 1
+
+
 # Serialization/deserialization tools
 def ser_compact_size(size: int) -> bytes:
     """
@@ -46,8 +52,10 @@ def ser_compact_size(size: int) -> bytes:
     :returns: The int serialized as a compact size unsigned integer
     """
     r = b""
-    if size < 253:
-        r = struct.pack("B", size)
+    if 0 <= size < 253:
+        r = _SINGLE_BYTE_COMPACT_SIZES[size]
+    elif size < 0:
+        r = struct.pack("B", size)  # raises struct.error
     elif size < 0x10000:
         r = struct.pack("<BH", 253, size)
     elif size < 0x100000000:
@@ -112,11 +120,7 @@ def ser_uint256(u: int) -> bytes:
     :param u: The integer to serialize
     :returns: The serialized 256 bit integer
     """
-    rs = b""
-    for _ in range(8):
-        rs += struct.pack("<I", u & 0xFFFFFFFF)
-        u >>= 32
-    return rs
+    return (u & UINT256_MASK).to_bytes(32, "little")
 
 
 def uint256_from_str(s: bytes) -> int:
@@ -132,6 +136,86 @@ def uint256_from_str(s: bytes) -> int:
         r += t[i] << (i * 32)
     return r
 
+
+class Writer(object):
+    """
+    Serializes objects into a single growing buffer, instead of concatenating the serializations of their fields.
+    """
+
+    def __init__(self) -> None:
+        self.buffer = bytearray()
+
+    def write(self, b: bytes) -> None:
+        """Append raw bytes."""
+        self.buffer += b
+
+    def write_varint(self, n: int) -> None:
+        """Append an integer serialized as a compact size unsigned integer."""
+        if n < 253:
+            self.buffer.append(n)
+        else:
+            self.buffer += ser_compact_size(n)
+
+    def write_string(self, s: bytes) -> None:
+        """Append a byte string with Bitcoin's variable length string serialization."""
+        n = len(s)
+        if n < 253:
+            self.buffer.append(n)
+        else:
+            self.buffer += ser_compact_size(n)
+        self.buffer += s
+
+    def write_map_entry(self, key_type: int, key_data: bytes, value: bytes) -> None:
+        """
+        Append a key-value pair of a PSBT map.
+
+        :param key_type: The type of the key
+        :param key_data: The bytes of the key following its type
+        :param value: The value
+        """
+        key_len = len(key_data)
+        if key_type < 253:
+            key_len += 1
+            if key_len < 253:
+                self.buffer.append(key_len)
+            else:
+                self.buffer += ser_compact_size(key_len)
+            self.buffer.append(key_type)
+        else:
+            key_type_bytes = ser_compact_size(key_type)
+            self.write_varint(len(key_type_bytes) + key_len)
+            self.buffer += key_type_bytes
+        self.buffer += key_data
+        self.write_string(value)
+
+    def write_string_vector(self, v: List[bytes]) -> None:
+        """Append a list of byte strings as a vector of byte strings."""
+        self.write_varint(len(v))
+        for s in v:
+            self.write_string(s)
+
+    def write_uint256(self, u: int) -> None:
+        """Append a 256 bit integer with Bitcoin's 256 bit integer serialization."""
+        self.buffer += (u & UINT256_MASK).to_bytes(32, "little")
+
+    def write_vector(self, v: Sequence["WriterSerializable"]) -> None:
+        """Append a vector of objects with Bitcoin's object vector serialization."""
+        self.write_varint(len(v))
+        for i in v:
+            i.serialize_into(self)
+
+    def getvalue(self) -> bytes:
+        """
+        :returns: The serialized bytes
+        """
+        return bytes(self.buffer)
+
+
+class WriterSerializable(Protocol):
+    def serialize_into(self, w: Writer) -> None:
+        ...
+
+
 D = TypeVar("D", bound=Deserializable)
 
 def deser_vector(f: Readable, c: Callable[[], D]) -> List[D]:
@@ -158,10 +242,7 @@ def ser_vector(v: Sequence[Serializable]) -> bytes:
     :param v: The list of objects to serialize
     :returns: The serialized objects
     """
-    r = ser_compact_size(len(v))
-    for i in v:
-        r += i.serialize()
-    return r
+    return b"".join([ser_compact_size(len(v))] + [i.serialize() for i in v])
 
 
 def deser_string_vector(f: Readable) -> List[bytes]:
@@ -186,10 +267,9 @@ def ser_string_vector(v: List[bytes]) -> bytes:
     :param v: The list of byte strings to serialize
     :returns: The serialized list of byte strings
     """
-    r = ser_compact_size(len(v))
-    for sv in v:
-        r += ser_string(sv)
-    return r
+    w = Writer()
+    w.write_string_vector(v)
+    return w.getvalue()
 
 def ser_sig_der(r: bytes, s: bytes) -> bytes:
     """
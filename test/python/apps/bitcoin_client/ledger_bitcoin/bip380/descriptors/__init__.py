@@ -69,6 +69,26 @@ class Descriptor:
         for key in self.keys:
             key.derive(index)
 
+    def derive_range(self, start, count, packed=False):
+        """Get the ScriptPubKeys of this descriptor derived at each of the indexes from
+        start to start + count - 1.
+
+        The same as the script_pubkey of a copy derived at each index, without copying
+        the descriptor nor deriving the whole path of the keys for each index.
+
+        :param packed: whether to return the ScriptPubKeys concatenated in a single
+                       bytes, rather than as a list. They all have the same size.
+        """
+        assert isinstance(start, int) and isinstance(count, int) and count >= 0
+        script_pubkeys = self._derive_script_pubkeys(start, count) if count > 0 else []
+        if packed:
+            return b"".join(script_pubkeys)
+        return script_pubkeys
+
+    def _derive_script_pubkeys(self, start, count):
+        # To be implemented by derived classes
+        raise NotImplementedError
+
     def satisfy(self, *args, **kwargs):
         """Get the witness stack to spend from this descriptor.
 
@@ -140,6 +160,38 @@ class WshDescriptor(Descriptor):
     def keys(self):
         return self.witness_script.keys
 
+    def _derive_script_pubkeys(self, start, count):
+        # The witness Script at the first index is a template for the others: only the
+        # keys that are derived, and their hashes, change from one index to the next.
+        keys = {id(key): key for key in self.keys}.values()
+        derived = [
+            key.derive_range(start, count)
+            for key in keys
+            if key.path is not None and key.path.kind.is_wildcard()
+        ]
+        first = self.copy()
+        first.derive(start)
+        template = first.witness_script.script
+        # The offsets in the template of each derived key or key hash, with the key
+        # bytes at all indexes and whether to hash them.
+        slots = []
+        for key_bytes in derived:
+            n_slots = len(slots)
+            for value, hashed in [(key_bytes[0], False), (hash160(key_bytes[0]), True)]:
+                offset = template.find(value)
+                while offset >= 0:
+                    slots.append((offset, offset + len(value), key_bytes, hashed))
+                    offset = template.find(value, offset + len(value))
+            assert len(slots) > n_slots
+
+        script_pubkeys = [CScript(b"\x00\x20" + sha256(template))]
+        script = bytearray(template)
+        for i in range(1, count):
+            for offset, end, key_bytes, hashed in slots:
+                script[offset:end] = hash160(key_bytes[i]) if hashed else key_bytes[i]
+            script_pubkeys.append(CScript(b"\x00\x20" + sha256(bytes(script))))
+        return script_pubkeys
+
     def satisfy(self, sat_material=None):
         """Get the witness stack to spend from this descriptor.
 
@@ -175,6 +227,12 @@ class WpkhDescriptor(Descriptor):
     def keys(self):
         return [self.pubkey]
 
+    def _derive_script_pubkeys(self, start, count):
+        return [
+            CScript(b"\x00\x14" + hash160(pubkey))
+            for pubkey in self.pubkey.derive_range(start, count)
+        ]
+
     def satisfy(self, signature):
         """Get the witness stack to spend from this descriptor.
 
@@ -207,6 +265,12 @@ class TrDescriptor(Descriptor):
     def keys(self):
         return [self.internal_key]
 
+    def _derive_script_pubkeys(self, start, count):
+        return [
+            CScript(b"\x51\x20" + taproot_tweak(pubkey, b"").format())
+            for pubkey in self.internal_key.derive_range(start, count)
+        ]
+
     def satisfy(self, sat_material=None):
         """Get the witness stack to spend from this descriptor.
 
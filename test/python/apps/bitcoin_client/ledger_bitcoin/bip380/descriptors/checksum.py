@@ -11,34 +11,57 @@ CHECKSUM_CHARSET = "qpzry9x8gf2tvdw0s3jn54khce6mua7l"
 GENERATOR = [0xF5DEE51989, 0xA9FDCA3312, 0x1BAB10E32D, 0x3706B1677A, 0x644D626FFD]
 
 
+# The value of each character of INPUT_CHARSET and CHECKSUM_CHARSET
+INPUT_CHARSET_VALUES = {c: i for i, c in enumerate(INPUT_CHARSET)}
+CHECKSUM_CHARSET_VALUES = {c: i for i, c in enumerate(CHECKSUM_CHARSET)}
+
+
+def descsum_polymod_step(chk, value):
+    """Internal function that feeds a single symbol to the descriptor checksum."""
+    top = chk >> 35
+    chk = (chk & 0x7FFFFFFFF) << 5 ^ value
+    for i in range(5):
+        chk ^= GENERATOR[i] if ((top >> i) & 1) else 0
+    return chk
+
+
+# The checksum is linear: feeding it two symbols shifts it by 10 bits, and XORs it with
+# the symbols and with what its top 10 bits contribute, which is this table.
+POLYMOD_TABLE = [
+    descsum_polymod_step(descsum_polymod_step(top << 30, 0), 0) for top in range(1024)
+]
+
+
 def descsum_polymod(symbols):
     """Internal function that computes the descriptor checksum."""
     chk = 1
-    for value in symbols:
-        top = chk >> 35
-        chk = (chk & 0x7FFFFFFFF) << 5 ^ value
-        for i in range(5):
-            chk ^= GENERATOR[i] if ((top >> i) & 1) else 0
+    pairs = iter(symbols)
+    for first, second in zip(pairs, pairs):
+        chk = (
+            (chk & 0x3FFFFFFF) << 10 ^ (first << 5 | second) ^ POLYMOD_TABLE[chk >> 30]
+        )
+    if len(symbols) % 2:
+        chk = descsum_polymod_step(chk, symbols[-1])
     return chk
 
 
 def descsum_expand(s):
     """Internal function that does the character to symbol expansion"""
-    groups = []
+    try:
+        values = [INPUT_CHARSET_VALUES[c] for c in s]
+    except KeyError:
+        return None
     symbols = []
-    for c in s:
-        if not c in INPUT_CHARSET:
-            return None
-        v = INPUT_CHARSET.find(c)
-        symbols.append(v & 31)
-        groups.append(v >> 5)
-        if len(groups) == 3:
-            symbols.append(groups[0] * 9 + groups[1] * 3 + groups[2])
-            groups = []
-    if len(groups) == 1:
-        symbols.append(groups[0])
-    elif len(groups) == 2:
-        symbols.append(groups[0] * 3 + groups[1])
+    n_groups = len(values) - len(values) % 3
+    for i in range(0, n_groups, 3):
+        a, b, c = values[i], values[i + 1], values[i + 2]
+        symbols += (a & 31, b & 31, c & 31, (a >> 5) * 9 + (b >> 5) * 3 + (c >> 5))
+    rest = values[n_groups:]
+    symbols += [v & 31 for v in rest]
+    if len(rest) == 1:
+        symbols.append(rest[0] >> 5)
+    elif len(rest) == 2:
+        symbols.append((rest[0] >> 5) * 3 + (rest[1] >> 5))
     return symbols
 
 
@@ -57,12 +80,24 @@ def descsum_check(s):
     """Verify that the checksum is correct in a descriptor"""
     if s[-9] != "#":
         return False
-    if not all(x in CHECKSUM_CHARSET for x in s[-8:]):
+    try:
+        checksum = [CHECKSUM_CHARSET_VALUES[x] for x in s[-8:]]
+    except KeyError:
         return False
-    symbols = descsum_expand(s[:-9]) + [CHECKSUM_CHARSET.find(x) for x in s[-8:]]
+    symbols = descsum_expand(s[:-9]) + checksum
     return descsum_polymod(symbols) == 1
 
 
+def descsum_create_many(descriptors):
+    """Add a checksum to each of the descriptors"""
+    return [descsum_create(s) for s in descriptors]
+
+
+def descsum_check_many(descriptors):
+    """Verify the checksum of each of the descriptors"""
+    return [descsum_check(s) for s in descriptors]
+
+
 def drop_origins(s):
     """Drop the key origins from a descriptor"""
     desc = re.sub(r"\[.+?\]", "", s)
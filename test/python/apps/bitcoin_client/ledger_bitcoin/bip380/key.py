@@ -1,7 +1,9 @@
 import coincurve
 import copy
+import functools
+import hmac
 
-from bip32 import BIP32, HARDENED_INDEX
+from bip32 import BIP32, BIP32DerivationError, HARDENED_INDEX
 from bip32.utils import _deriv_path_str_to_list
 from .utils.hashes import hash160
 from enum import Enum, auto
@@ -11,6 +13,36 @@ def is_raw_key(obj):
     return isinstance(obj, (coincurve.PublicKey, coincurve.PublicKeyXOnly))
 
 
+# Number of derivation path prefixes kept in memory by DescriptorKey.derive_range(),
+# shared by all the keys.
+PREFIX_CACHE_SIZE = 256
+
+
+def derive_public_child(pubkey, chaincode, index):
+    """Get the (pubkey, chaincode) of the unhardened child at the given index of an
+    extended public key (CKDpub).
+
+    The python-bip32 package does the same, but doesn't expose it in its public API.
+    """
+    tweak = hmac.digest(chaincode, pubkey + index.to_bytes(4, "big"), "sha512")
+    try:
+        child = coincurve.PublicKey(pubkey).add(tweak[:32])
+    except ValueError:
+        raise BIP32DerivationError(
+            f"Invalid public key at index {index}, try the next one!"
+        )
+    return child.format(), tweak[32:]
+
+
+@functools.lru_cache(maxsize=PREFIX_CACHE_SIZE)
+def derive_prefix(pubkey, chaincode, path):
+    """Get the (pubkey, chaincode) of the child at the given unhardened path (a tuple)
+    of an extended public key."""
+    for index in path:
+        pubkey, chaincode = derive_public_child(pubkey, chaincode, index)
+    return pubkey, chaincode
+
+
 class DescriptorKeyError(Exception):
     def __init__(self, message):
         self.message = message
@@ -305,6 +337,48 @@ class DescriptorKey:
             assert not self.path.kind.is_wildcard()  # TODO: real errors
             return self.key.get_pubkey_from_path(path)
 
+    def derive_range(self, start, count):
+        """Get the raw bytes of this key derived at each of the indexes from start to
+        start + count - 1.
+
+        The same as the bytes() of a copy derived at each index, but the path up to the
+        wildcard is derived once for all indexes (and cached). Will raise if this key
+        contains multiple derivation paths.
+        """
+        assert isinstance(start, int) and isinstance(count, int)
+        if self.path is None or not self.path.kind.is_wildcard():
+            return [self.bytes()] * count
+        path = self.derivation_path()
+        assert isinstance(self.key, BIP32)
+
+        if self.path.kind == KeyPathKind.WILDCARD_HARDENED:
+            start += 2 ** 31
+            assert start + count <= 2 ** 32
+            return [
+                self.key.get_pubkey_from_path(path + [index])
+                for index in range(start, start + count)
+            ]
+        assert start + count <= 2 ** 31
+
+        if any(index & HARDENED_INDEX for index in path):
+            chaincode, pubkey = self.key.get_extended_pubkey_from_path(path)
+        else:
+            pubkey, chaincode = derive_prefix(
+                self.key.pubkey, self.key.chaincode, tuple(path)
+            )
+        # Same as CKDpub, with the parent public key only parsed once.
+        parent = coincurve.PublicKey(pubkey)
+        keys = []
+        for index in range(start, start + count):
+            tweak = hmac.digest(chaincode, pubkey + index.to_bytes(4, "big"), "sha512")
+            try:
+                keys.append(parent.add(tweak[:32]).format())
+            except ValueError:
+                raise BIP32DerivationError(
+                    f"Invalid public key at index {index}, try the next one!"
+                )
+        return keys
+
     def derive(self, index):
         """Derive the key at the given index.
 
@@ -45,7 +45,12 @@ from ...bip380.utils.script import (
 
 from .errors import MiniscriptNodeCreationError
 from .property import Property
-from .satisfaction import ExecutionInfo, Satisfaction
+from .satisfaction import (
+    ExecutionInfo,
+    Satisfaction,
+    SatisfactionCache,
+    SatisfactionMaterial,
+)
 
 
 # Threshold for nLockTime: below this value it is interpreted as block number,
@@ -90,6 +95,8 @@ class Node:
     no_timelock_mix = None
     # Information about this Miniscript execution (satisfaction cost, etc..)
     exec_info = None
+    # The (dis)satisfactions of this fragment and its subs, from the last satisfaction
+    _sat_cache = None
 
     def __init__(self, *args, **kwargs):
         # Needs to be implemented by derived classes.
@@ -134,12 +141,30 @@ class Node:
         :param sat_material: a SatisfactionMaterial containing available data to satisfy
                              challenges.
         """
-        # Needs to be implemented by derived classes.
-        raise NotImplementedError
+        # Overriden by fragments without subs, the others are computed from their subs.
+        if self._sat_cache is None:
+            self._sat_cache = SatisfactionCache(self)
+        return self._sat_cache.update(sat_material)[0]
 
     def dissatisfaction(self):
         """Get the dissatisfaction for this fragment."""
-        # Needs to be implemented by derived classes.
+        # Overriden by fragments without subs, the others are computed from their subs.
+        if self._sat_cache is None:
+            self._sat_cache = SatisfactionCache(self)
+        # Dissatisfactions don't depend on the material, the last one is reused so the
+        # cached satisfactions stay valid.
+        sat_material = self._sat_cache.sat_material
+        if sat_material is None:
+            sat_material = SatisfactionMaterial({}, {}, 0, 0)
+        return self._sat_cache.update(sat_material)[1]
+
+    def combine_satisfactions(self, subs):
+        """Get the satisfaction and dissatisfaction for this fragment from those of its
+        subs.
+
+        :param subs: The list of the (satisfaction, dissatisfaction) of each sub.
+        """
+        # Needs to be implemented by derived classes with subs.
         raise NotImplementedError
 
 
@@ -507,11 +532,8 @@ class AndV(Node):
         exec_info.set_undissatisfiable()  # it's V.
         return exec_info
 
-    def satisfaction(self, sat_material):
-        return Satisfaction.from_concat(sat_material, *self.subs)
-
-    def dissatisfaction(self):
-        return Satisfaction.unavailable()  # it's V.
+    def combine_satisfactions(self, subs):
+        return Satisfaction.from_concat(*subs), Satisfaction.unavailable()  # it's V.
 
     def __repr__(self):
         return f"and_v({','.join(map(str, self.subs))})"
@@ -560,11 +582,8 @@ class AndB(Node):
             self.subs[0].exec_info, self.subs[1].exec_info, ops_count=1
         )
 
-    def satisfaction(self, sat_material):
-        return Satisfaction.from_concat(sat_material, self.subs[0], self.subs[1])
-
-    def dissatisfaction(self):
-        return self.subs[1].dissatisfaction() + self.subs[0].dissatisfaction()
+    def combine_satisfactions(self, subs):
+        return Satisfaction.from_concat(subs[0], subs[1]), subs[1][1] + subs[0][1]
 
     def __repr__(self):
         return f"and_b({','.join(map(str, self.subs))})"
@@ -607,14 +626,12 @@ class OrB(Node):
             disjunction=True,
         )
 
-    def satisfaction(self, sat_material):
-        return Satisfaction.from_concat(
-            sat_material, self.subs[0], self.subs[1], disjunction=True
+    def combine_satisfactions(self, subs):
+        return (
+            Satisfaction.from_concat(subs[0], subs[1], disjunction=True),
+            subs[1][1] + subs[0][1],
         )
 
-    def dissatisfaction(self):
-        return self.subs[1].dissatisfaction() + self.subs[0].dissatisfaction()
-
     def __repr__(self):
         return f"or_b({','.join(map(str, self.subs))})"
 
@@ -656,11 +673,11 @@ class OrC(Node):
         exec_info.set_undissatisfiable()  # it's V.
         return exec_info
 
-    def satisfaction(self, sat_material):
-        return Satisfaction.from_or_uneven(sat_material, self.subs[0], self.subs[1])
-
-    def dissatisfaction(self):
-        return Satisfaction.unavailable()  # it's V.
+    def combine_satisfactions(self, subs):
+        return (
+            Satisfaction.from_or_uneven(subs[0], subs[1]),
+            Satisfaction.unavailable(),  # it's V.
+        )
 
     def __repr__(self):
         return f"or_c({','.join(map(str, self.subs))})"
@@ -709,11 +726,8 @@ class OrD(Node):
             self.subs[0].exec_info, self.subs[1].exec_info, ops_count=3
         )
 
-    def satisfaction(self, sat_material):
-        return Satisfaction.from_or_uneven(sat_material, self.subs[0], self.subs[1])
-
-    def dissatisfaction(self):
-        return self.subs[1].dissatisfaction() + self.subs[0].dissatisfaction()
+    def combine_satisfactions(self, subs):
+        return Satisfaction.from_or_uneven(subs[0], subs[1]), subs[1][1] + subs[0][1]
 
     def __repr__(self):
         return f"or_d({','.join(map(str, self.subs))})"
@@ -764,14 +778,11 @@ class OrI(Node):
             self.subs[0].exec_info, self.subs[1].exec_info, ops_count=3
         )
 
-    def satisfaction(self, sat_material):
-        return (self.subs[0].satisfaction(sat_material) + Satisfaction([b"\x01"])) | (
-            self.subs[1].satisfaction(sat_material) + Satisfaction([b""])
-        )
-
-    def dissatisfaction(self):
-        return (self.subs[0].dissatisfaction() + Satisfaction(witness=[b"\x01"])) | (
-            self.subs[1].dissatisfaction() + Satisfaction(witness=[b""])
+    def combine_satisfactions(self, subs):
+        return tuple(
+            (subs[0][i] + Satisfaction(witness=[b"\x01"]))
+            | (subs[1][i] + Satisfaction(witness=[b""]))
+            for i in range(2)
         )
 
     def __repr__(self):
@@ -846,16 +857,11 @@ class AndOr(Node):
             ops_count=3,
         )
 
-    def satisfaction(self, sat_material):
+    def combine_satisfactions(self, subs):
         # (A and B) or (!A and C)
-        return (
-            self.subs[1].satisfaction(sat_material)
-            + self.subs[0].satisfaction(sat_material)
-        ) | (self.subs[2].satisfaction(sat_material) + self.subs[0].dissatisfaction())
-
-    def dissatisfaction(self):
+        sat = (subs[1][0] + subs[0][0]) | (subs[2][0] + subs[0][1])
         # Dissatisfy X and Z
-        return self.subs[2].dissatisfaction() + self.subs[0].dissatisfaction()
+        return sat, subs[2][1] + subs[0][1]
 
     def __repr__(self):
         return f"andor({','.join(map(str, self.subs))})"
@@ -941,13 +947,9 @@ class Thresh(Node):
     def exec_info(self):
         return ExecutionInfo.from_thresh(self.k, [sub.exec_info for sub in self.subs])
 
-    def satisfaction(self, sat_material):
-        return Satisfaction.from_thresh(sat_material, self.k, self.subs)
-
-    def dissatisfaction(self):
-        return sum(
-            [sub.dissatisfaction() for sub in self.subs], start=Satisfaction(witness=[])
-        )
+    def combine_satisfactions(self, subs):
+        dissat = Satisfaction.concat([sub[1] for sub in subs])
+        return Satisfaction.from_thresh(self.k, subs), dissat
 
     def __repr__(self):
         return f"thresh({self.k},{','.join(map(str, self.subs))})"
@@ -984,13 +986,9 @@ class WrapperNode(Node):
         # Wrapper have a single sub
         return self.subs[0]
 
-    def satisfaction(self, sat_material):
-        # Most wrappers are satisfied this way, for special cases it's overriden.
-        return self.subs[0].satisfaction(sat_material)
-
-    def dissatisfaction(self):
+    def combine_satisfactions(self, subs):
         # Most wrappers are satisfied this way, for special cases it's overriden.
-        return self.subs[0].dissatisfaction()
+        return subs[0]
 
     def skip_colon(self):
         # We need to check this because of the pk() and pkh() aliases.
@@ -1107,11 +1105,8 @@ class WrapD(WrapperNode):
             self.sub.exec_info, ops_count=3, sat=1, dissat=1
         )
 
-    def satisfaction(self, sat_material):
-        return Satisfaction(witness=[b"\x01"]) + self.subs[0].satisfaction(sat_material)
-
-    def dissatisfaction(self):
-        return Satisfaction(witness=[b""])
+    def combine_satisfactions(self, subs):
+        return Satisfaction(witness=[b"\x01"]) + subs[0][0], Satisfaction(witness=[b""])
 
     def __repr__(self):
         # Avoid duplicating colons
@@ -1144,8 +1139,8 @@ class WrapV(WrapperNode):
         verify_cost = int(self._script[-1] == OP_VERIFY)
         return ExecutionInfo.from_wrap(self.sub.exec_info, ops_count=verify_cost)
 
-    def dissatisfaction(self):
-        return Satisfaction.unavailable()  # It's V.
+    def combine_satisfactions(self, subs):
+        return subs[0][0], Satisfaction.unavailable()  # It's V.
 
     def __repr__(self):
         # Avoid duplicating colons
@@ -1171,8 +1166,8 @@ class WrapJ(WrapperNode):
     def exec_info(self):
         return ExecutionInfo.from_wrap_dissat(self.sub.exec_info, ops_count=4, dissat=1)
 
-    def dissatisfaction(self):
-        return Satisfaction(witness=[b""])
+    def combine_satisfactions(self, subs):
+        return subs[0][0], Satisfaction(witness=[b""])
 
     def __repr__(self):
         # Avoid duplicating colons
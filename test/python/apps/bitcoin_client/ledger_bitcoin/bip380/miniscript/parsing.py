@@ -1,7 +1,17 @@
 """
 Utilities to parse Miniscript from string and Script representations.
+
+Both parsers work in a single pass, without recursion, so that policies with hundreds of keys
+parse in linear time:
+- a Script is first scanned for terminal fragments from left to right, then the non-terminal
+  fragments are reduced from right to left on a stack;
+- a string is read with a stack of the fragments whose parameters are being parsed.
+Identical subexpressions of a string are parsed once and share the same node, as well as
+identical keys.
 """
 
+import re
+
 from ...bip380.miniscript import fragments
 
 from ...bip380.key import DescriptorKey
@@ -78,30 +88,29 @@ def decompose_script(script):
     return elems
 
 
-def parse_term_single_elem(expr_list, idx):
+def parse_term_single_elem(elem):
     """
-    Try to parse a terminal node from the element of {expr_list} at {idx}.
+    Try to parse a terminal node from the Script element {elem}.
+    Return the node on success, {elem} if there was no match.
     """
     # Match against pk_k(key).
-    if (
-        isinstance(expr_list[idx], bytes)
-        and len(expr_list[idx]) == 33
-        and expr_list[idx][0] in [2, 3]
-    ):
-        expr_list[idx] = fragments.Pk(expr_list[idx])
+    if isinstance(elem, bytes) and len(elem) == 33 and elem[0] in [2, 3]:
+        return fragments.Pk(elem)
 
     # Match against JUST_1 and JUST_0.
-    if expr_list[idx] == 1:
-        expr_list[idx] = fragments.Just1()
-    if expr_list[idx] == b"":
-        expr_list[idx] = fragments.Just0()
+    if elem == 1:
+        return fragments.Just1()
+    if elem == b"":
+        return fragments.Just0()
+
+    return elem
 
 
 def parse_term_2_elems(expr_list, idx):
     """
     Try to parse a terminal node from two elements of {expr_list}, starting
     from {idx}.
-    Return the new expression list on success, None if there was no match.
+    Return the node on success, None if there was no match.
     """
     elem_a = expr_list[idx]
     elem_b = expr_list[idx + 1]
@@ -120,21 +129,17 @@ def parse_term_2_elems(expr_list, idx):
         return
 
     if elem_b == OP_CHECKSEQUENCEVERIFY:
-        node = fragments.Older(n)
-        expr_list[idx: idx + 2] = [node]
-        return expr_list
+        return fragments.Older(n)
 
     if elem_b == OP_CHECKLOCKTIMEVERIFY:
-        node = fragments.After(n)
-        expr_list[idx: idx + 2] = [node]
-        return expr_list
+        return fragments.After(n)
 
 
 def parse_term_5_elems(expr_list, idx, pkh_preimages={}):
     """
     Try to parse a terminal node from five elements of {expr_list}, starting
     from {idx}.
-    Return the new expression list on success, None if there was no match.
+    Return the node on success, None if there was no match.
     """
     # The only 3 items node is pk_h
     if expr_list[idx: idx + 2] != [OP_DUP, OP_HASH160]:
@@ -149,131 +154,126 @@ def parse_term_5_elems(expr_list, idx, pkh_preimages={}):
     key_hash = expr_list[idx + 2]
     key = pkh_preimages.get(key_hash)
     assert key is not None  # TODO: have a real error here
-    node = fragments.Pkh(key)
-    expr_list[idx: idx + 5] = [node]
-    return expr_list
+    return fragments.Pkh(key)
 
 
 def parse_term_7_elems(expr_list, idx):
     """
     Try to parse a terminal node from seven elements of {expr_list}, starting
     from {idx}.
-    Return the new expression list on success, None if there was no match.
+    Return the node on success, None if there was no match.
     """
     # Note how all the hashes are 7 elems because the VERIFY was decomposed
-    # Match against sha256.
     if (
-        expr_list[idx: idx + 5] == [OP_SIZE, b"\x20", OP_EQUAL, OP_VERIFY, OP_SHA256]
-        and isinstance(expr_list[idx + 5], bytes)
-        and len(expr_list[idx + 5]) == 32
-        and expr_list[idx + 6] == OP_EQUAL
+        expr_list[idx: idx + 4] != [OP_SIZE, b"\x20", OP_EQUAL, OP_VERIFY]
+        or not isinstance(expr_list[idx + 5], bytes)
+        or expr_list[idx + 6] != OP_EQUAL
     ):
-        node = fragments.Sha256(expr_list[idx + 5])
-        expr_list[idx: idx + 7] = [node]
-        return expr_list
+        return
+    hash_op, digest = expr_list[idx + 4], expr_list[idx + 5]
+
+    # Match against sha256.
+    if hash_op == OP_SHA256 and len(digest) == 32:
+        return fragments.Sha256(digest)
 
     # Match against hash256.
-    if (
-        expr_list[idx: idx + 5] == [OP_SIZE, b"\x20", OP_EQUAL, OP_VERIFY, OP_HASH256]
-        and isinstance(expr_list[idx + 5], bytes)
-        and len(expr_list[idx + 5]) == 32
-        and expr_list[idx + 6] == OP_EQUAL
-    ):
-        node = fragments.Hash256(expr_list[idx + 5])
-        expr_list[idx: idx + 7] = [node]
-        return expr_list
+    if hash_op == OP_HASH256 and len(digest) == 32:
+        return fragments.Hash256(digest)
 
     # Match against ripemd160.
-    if (
-        expr_list[idx: idx + 5]
-        == [OP_SIZE, b"\x20", OP_EQUAL, OP_VERIFY, OP_RIPEMD160]
-        and isinstance(expr_list[idx + 5], bytes)
-        and len(expr_list[idx + 5]) == 20
-        and expr_list[idx + 6] == OP_EQUAL
-    ):
-        node = fragments.Ripemd160(expr_list[idx + 5])
-        expr_list[idx: idx + 7] = [node]
-        return expr_list
+    if hash_op == OP_RIPEMD160 and len(digest) == 20:
+        return fragments.Ripemd160(digest)
 
     # Match against hash160.
-    if (
-        expr_list[idx: idx + 5] == [OP_SIZE, b"\x20", OP_EQUAL, OP_VERIFY, OP_HASH160]
-        and isinstance(expr_list[idx + 5], bytes)
-        and len(expr_list[idx + 5]) == 20
-        and expr_list[idx + 6] == OP_EQUAL
-    ):
-        node = fragments.Hash160(expr_list[idx + 5])
-        expr_list[idx: idx + 7] = [node]
-        return expr_list
+    if hash_op == OP_HASH160 and len(digest) == 20:
+        return fragments.Hash160(digest)
 
 
-def parse_nonterm_2_elems(expr_list, idx):
+def parse_terminals(elems, pkh_preimages={}):
+    """Replace the terminal fragments in the list of Script elements {elems}, from left to right.
+    Return the new list of elements and nodes.
     """
-    Try to parse a non-terminal node from two elements of {expr_list}, starting
-    from {idx}.
-    Return the new expression list on success, None if there was no match.
+    elems = list(elems)
+    elems_len = len(elems)
+    expr_list = []
+
+    idx = 0
+    while idx < elems_len:
+        elems[idx] = parse_term_single_elem(elems[idx])
+
+        node, node_len = None, 1
+        if elems_len - idx >= 2:
+            node, node_len = parse_term_2_elems(elems, idx), 2
+        if node is None and elems_len - idx >= 5:
+            node, node_len = parse_term_5_elems(elems, idx, pkh_preimages), 5
+        if node is None and elems_len - idx >= 7:
+            node, node_len = parse_term_7_elems(elems, idx), 7
+
+        if node is None:
+            expr_list.append(elems[idx])
+            idx += 1
+        else:
+            expr_list.append(node)
+            idx += node_len
+
+    return expr_list
+
+
+# The non-terminal parsers below match the elements at the top of a stack holding the end of
+# the expression list in reverse order: stack[-1] is the leftmost element, stack[-2] the one
+# following it, etc.. They return the node and the number of elements it replaces on success,
+# None if there was no match.
+
+
+def parse_nonterm_2_elems(stack):
     """
-    elem_a = expr_list[idx]
-    elem_b = expr_list[idx + 1]
+    Try to parse a non-terminal node from the two elements at the top of {stack}.
+    """
+    elem_a = stack[-1]
+    elem_b = stack[-2]
 
     if isinstance(elem_a, fragments.Node):
         # Match against and_v.
         if isinstance(elem_b, fragments.Node) and elem_a.p.V and elem_b.p.has_any("BKV"):
             # Is it a special case of t: wrapper?
             if isinstance(elem_b, fragments.Just1):
-                node = fragments.WrapT(elem_a)
-            else:
-                node = fragments.AndV(elem_a, elem_b)
-            expr_list[idx: idx + 2] = [node]
-            return expr_list
+                return fragments.WrapT(elem_a), 2
+            return fragments.AndV(elem_a, elem_b), 2
 
         # Match against c wrapper.
         if elem_b == OP_CHECKSIG and elem_a.p.K:
-            node = fragments.WrapC(elem_a)
-            expr_list[idx: idx + 2] = [node]
-            return expr_list
+            return fragments.WrapC(elem_a), 2
 
         # Match against v wrapper.
         if elem_b == OP_VERIFY and elem_a.p.B:
-            node = fragments.WrapV(elem_a)
-            expr_list[idx: idx + 2] = [node]
-            return expr_list
+            return fragments.WrapV(elem_a), 2
 
         # Match against n wrapper.
         if elem_b == OP_0NOTEQUAL and elem_a.p.B:
-            node = fragments.WrapN(elem_a)
-            expr_list[idx: idx + 2] = [node]
-            return expr_list
+            return fragments.WrapN(elem_a), 2
 
     # Match against s wrapper.
     if isinstance(elem_b, fragments.Node) and elem_a == OP_SWAP and elem_b.p.has_all("Bo"):
-        node = fragments.WrapS(elem_b)
-        expr_list[idx: idx + 2] = [node]
-        return expr_list
+        return fragments.WrapS(elem_b), 2
 
 
-def parse_nonterm_3_elems(expr_list, idx):
+def parse_nonterm_3_elems(stack):
     """
-    Try to parse a non-terminal node from *at least* three elements of
-    {expr_list}, starting from {idx}.
-    Return the new expression list on success, None if there was no match.
+    Try to parse a non-terminal node from *at least* three elements at the top
+    of {stack}.
     """
-    elem_a = expr_list[idx]
-    elem_b = expr_list[idx + 1]
-    elem_c = expr_list[idx + 2]
+    elem_a = stack[-1]
+    elem_b = stack[-2]
+    elem_c = stack[-3]
 
     if isinstance(elem_a, fragments.Node) and isinstance(elem_b, fragments.Node):
         # Match against and_b.
         if elem_c == OP_BOOLAND and elem_a.p.B and elem_b.p.W:
-            node = fragments.AndB(elem_a, elem_b)
-            expr_list[idx: idx + 3] = [node]
-            return expr_list
+            return fragments.AndB(elem_a, elem_b), 3
 
         # Match against or_b.
         if elem_c == OP_BOOLOR and elem_a.p.has_all("Bd") and elem_b.p.has_all("Wd"):
-            node = fragments.OrB(elem_a, elem_b)
-            expr_list[idx: idx + 3] = [node]
-            return expr_list
+            return fragments.OrB(elem_a, elem_b), 3
 
     # Match against a wrapper.
     if (
@@ -282,76 +282,76 @@ def parse_nonterm_3_elems(expr_list, idx):
         and elem_b.p.B
         and elem_c == OP_FROMALTSTACK
     ):
-        node = fragments.WrapA(elem_b)
-        expr_list[idx: idx + 3] = [node]
-        return expr_list
+        return fragments.WrapA(elem_b), 3
 
     # FIXME: multi is a terminal!
     # Match against a multi.
     try:
-        k = stack_item_to_int(expr_list[idx])
+        k = stack_item_to_int(elem_a)
     except ScriptNumError:
         return
     if k is None:
         return
     # <k> (<key>)* <m> CHECKMULTISIG
-    if k > len(expr_list[idx + 1:]) - 2:
+    if k > len(stack) - 3:
         return
     # Get the keys
     keys = []
-    i = idx + 1
-    while idx < len(expr_list) - 2:
-        if not isinstance(expr_list[i], fragments.Pk):
-            break
-        keys.append(expr_list[i].pubkey)
+    i = 2
+    while i <= len(stack) and isinstance(stack[-i], fragments.Pk):
+        keys.append(stack[-i].pubkey)
         i += 1
-    if expr_list[i + 1] == OP_CHECKMULTISIG:
+    if i < len(stack) and stack[-i - 1] == OP_CHECKMULTISIG:
         if k > len(keys):
             return
         try:
-            m = stack_item_to_int(expr_list[i])
+            m = stack_item_to_int(stack[-i])
         except ScriptNumError:
             return
         if m is None or m != len(keys):
             return
-        node = fragments.Multi(k, keys)
-        expr_list[idx: i + 2] = [node]
-        return expr_list
+        return fragments.Multi(k, keys), i + 1
 
 
-def parse_nonterm_4_elems(expr_list, idx):
+def parse_thresh(stack):
     """
-    Try to parse a non-terminal node from at least four elements of {expr_list},
-    starting from {idx}.
-    Return the new expression list on success, None if there was no match.
+    Try to parse a thresh from at least three elements at the top of {stack}.
     """
-    (it_a, it_b, it_c, it_d) = expr_list[idx: idx + 4]
+    it_a = stack[-1]
 
-    # Match against thresh. It's of the form [X] ([X] ADD)* k EQUAL
+    # Match against thresh. It's of the form [X] ([X] ADD)* k EQUAL, a single sub
+    # takes three elements
     if isinstance(it_a, fragments.Node) and it_a.p.has_all("Bdu"):
         subs = [it_a]
         # The first matches, now do all the ([X] ADD)s and return
         # if a pair is of the form (k, EQUAL).
-        for i in range(idx + 1, len(expr_list) - 1, 2):
+        for i in range(1, len(stack) - 1, 2):
+            elem, next_elem = stack[-1 - i], stack[-2 - i]
             if (
-                isinstance(expr_list[i], fragments.Node)
-                and expr_list[i].p.has_all("Wdu")
-                and expr_list[i + 1] == OP_ADD
+                isinstance(elem, fragments.Node)
+                and elem.p.has_all("Wdu")
+                and next_elem == OP_ADD
             ):
-                subs.append(expr_list[i])
+                subs.append(elem)
                 continue
-            elif expr_list[i + 1] == OP_EQUAL:
+            elif next_elem == OP_EQUAL:
                 try:
-                    k = stack_item_to_int(expr_list[i])
-                    if len(subs) >= k >= 1:
-                        node = fragments.Thresh(k, subs)
-                        expr_list[idx: i + 1 + 1] = [node]
-                        return expr_list
+                    k = stack_item_to_int(elem)
+                    if k is not None and len(subs) >= k >= 1:
+                        return fragments.Thresh(k, subs), i + 2
                 except ScriptNumError:
                     break
             else:
                 break
 
+
+def parse_nonterm_4_elems(stack):
+    """
+    Try to parse a non-terminal node from at least four elements at the top of
+    {stack}.
+    """
+    it_a, it_b, it_c, it_d = stack[-1], stack[-2], stack[-3], stack[-4]
+
     # Match against or_c.
     if (
         isinstance(it_a, fragments.Node)
@@ -361,9 +361,7 @@ def parse_nonterm_4_elems(expr_list, idx):
         and it_c.p.V
         and it_d == OP_ENDIF
     ):
-        node = fragments.OrC(it_a, it_c)
-        expr_list[idx: idx + 4] = [node]
-        return expr_list
+        return fragments.OrC(it_a, it_c), 4
 
     # Match against d wrapper.
     if (
@@ -372,18 +370,14 @@ def parse_nonterm_4_elems(expr_list, idx):
         and it_c.p.has_all("Vz")
         and it_d == OP_ENDIF
     ):
-        node = fragments.WrapD(it_c)
-        expr_list[idx: idx + 4] = [node]
-        return expr_list
+        return fragments.WrapD(it_c), 4
 
 
-def parse_nonterm_5_elems(expr_list, idx):
+def parse_nonterm_5_elems(stack):
     """
-    Try to parse a non-terminal node from five elements of {expr_list}, starting
-    from {idx}.
-    Return the new expression list on success, None if there was no match.
+    Try to parse a non-terminal node from five elements at the top of {stack}.
     """
-    (it_a, it_b, it_c, it_d, it_e) = expr_list[idx: idx + 5]
+    it_a, it_b, it_c, it_d, it_e = stack[-1], stack[-2], stack[-3], stack[-4], stack[-5]
 
     # Match against or_d.
     if (
@@ -394,9 +388,7 @@ def parse_nonterm_5_elems(expr_list, idx):
         and it_d.p.B
         and it_e == OP_ENDIF
     ):
-        node = fragments.OrD(it_a, it_d)
-        expr_list[idx: idx + 5] = [node]
-        return expr_list
+        return fragments.OrD(it_a, it_d), 5
 
     # Match against or_i.
     if (
@@ -409,13 +401,10 @@ def parse_nonterm_5_elems(expr_list, idx):
         and it_e == OP_ENDIF
     ):
         if isinstance(it_b, fragments.Just0):
-            node = fragments.WrapL(it_d)
-        elif isinstance(it_d, fragments.Just0):
-            node = fragments.WrapU(it_b)
-        else:
-            node = fragments.OrI(it_b, it_d)
-        expr_list[idx: idx + 5] = [node]
-        return expr_list
+            return fragments.WrapL(it_d), 5
+        if isinstance(it_d, fragments.Just0):
+            return fragments.WrapU(it_b), 5
+        return fragments.OrI(it_b, it_d), 5
 
     # Match against j wrapper.
     if (
@@ -423,18 +412,16 @@ def parse_nonterm_5_elems(expr_list, idx):
         and isinstance(it_d, fragments.Node)
         and it_e == OP_ENDIF
     ):
-        node = fragments.WrapJ(expr_list[idx + 3])
-        expr_list[idx: idx + 5] = [node]
-        return expr_list
+        return fragments.WrapJ(it_d), 5
 
 
-def parse_nonterm_6_elems(expr_list, idx):
+def parse_nonterm_6_elems(stack):
     """
-    Try to parse a non-terminal node from six elements of {expr_list}, starting
-    from {idx}.
-    Return the new expression list on success, None if there was no match.
+    Try to parse a non-terminal node from six elements at the top of {stack}.
     """
-    (it_a, it_b, it_c, it_d, it_e, it_f) = expr_list[idx: idx + 6]
+    it_a, it_b, it_c, it_d, it_e, it_f = (
+        stack[-1], stack[-2], stack[-3], stack[-4], stack[-5], stack[-6]
+    )
 
     # Match against andor.
     if (
@@ -449,57 +436,54 @@ def parse_nonterm_6_elems(expr_list, idx):
         and it_f == OP_ENDIF
     ):
         if isinstance(it_c, fragments.Just0):
-            node = fragments.AndN(it_a, it_e)
-        else:
-            node = fragments.AndOr(it_a, it_e, it_c)
-        expr_list[idx: idx + 6] = [node]
-        return expr_list
+            return fragments.AndN(it_a, it_e), 6
+        return fragments.AndOr(it_a, it_e, it_c), 6
+
+
+NONTERM_PARSERS = [
+    (2, parse_nonterm_2_elems),
+    (3, parse_nonterm_3_elems),
+    (3, parse_thresh),
+    (4, parse_nonterm_4_elems),
+    (5, parse_nonterm_5_elems),
+    (6, parse_nonterm_6_elems),
+]
 
 
 def parse_expr_list(expr_list):
     """Parse a node from a list of Script elements."""
-    # Every recursive call must progress the AST construction,
-    # until it is complete (single root node remains).
-    expr_list_len = len(expr_list)
-
     # Root node reached.
-    if expr_list_len == 1 and isinstance(expr_list[0], fragments.Node):
+    if len(expr_list) == 1 and isinstance(expr_list[0], fragments.Node):
         return expr_list[0]
 
-    # Step through each list index and match against templates.
-    idx = expr_list_len - 1
-    while idx >= 0:
-        if expr_list_len - idx >= 2:
-            new_expr_list = parse_nonterm_2_elems(expr_list, idx)
-            if new_expr_list is not None:
-                return parse_expr_list(new_expr_list)
-
-        if expr_list_len - idx >= 3:
-            new_expr_list = parse_nonterm_3_elems(expr_list, idx)
-            if new_expr_list is not None:
-                return parse_expr_list(new_expr_list)
-
-        if expr_list_len - idx >= 4:
-            new_expr_list = parse_nonterm_4_elems(expr_list, idx)
-            if new_expr_list is not None:
-                return parse_expr_list(new_expr_list)
-
-        if expr_list_len - idx >= 5:
-            new_expr_list = parse_nonterm_5_elems(expr_list, idx)
-            if new_expr_list is not None:
-                return parse_expr_list(new_expr_list)
-
-        if expr_list_len - idx >= 6:
-            new_expr_list = parse_nonterm_6_elems(expr_list, idx)
-            if new_expr_list is not None:
-                return parse_expr_list(new_expr_list)
-
-        # Right-to-left parsing.
-        # Step one position left.
-        idx -= 1
+    # Right-to-left parsing: the elements are pushed on the stack one at a time, and the
+    # fragments starting at the top of the stack are reduced until none matches. A reduction
+    # cannot create a match further right, as the elements there did not change.
+    remaining = list(expr_list)
+    stack = []
+    while remaining:
+        stack.append(remaining.pop())
+
+        reduced = True
+        while reduced:
+            reduced = False
+            for min_len, parse_nonterm in NONTERM_PARSERS:
+                if len(stack) < min_len:
+                    break
+                match = parse_nonterm(stack)
+                if match is not None:
+                    node, node_len = match
+                    del stack[-node_len:]
+                    stack.append(node)
+                    reduced = True
+                    break
+
+        # Root node reached.
+        if not remaining and len(stack) == 1 and isinstance(stack[0], fragments.Node):
+            return stack[0]
 
     # No match found.
-    raise MiniscriptMalformed(f"{expr_list}")
+    raise MiniscriptMalformed(f"{stack[::-1]}")
 
 
 def miniscript_from_script(script, pkh_preimages={}):
@@ -509,228 +493,196 @@ def miniscript_from_script(script, pkh_preimages={}):
     :param pkh_preimage: A mapping from keyhash to key to decode pk_h() fragments.
     """
     expr_list = decompose_script(script)
-    expr_list_len = len(expr_list)
 
     # We first parse terminal expressions.
-    idx = 0
-    while idx < expr_list_len:
-        parse_term_single_elem(expr_list, idx)
-
-        if expr_list_len - idx >= 2:
-            new_expr_list = parse_term_2_elems(expr_list, idx)
-            if new_expr_list is not None:
-                expr_list = new_expr_list
-                expr_list_len = len(expr_list)
-
-        if expr_list_len - idx >= 5:
-            new_expr_list = parse_term_5_elems(expr_list, idx, pkh_preimages)
-            if new_expr_list is not None:
-                expr_list = new_expr_list
-                expr_list_len = len(expr_list)
-
-        if expr_list_len - idx >= 7:
-            new_expr_list = parse_term_7_elems(expr_list, idx)
-            if new_expr_list is not None:
-                expr_list = new_expr_list
-                expr_list_len = len(expr_list)
-
-        idx += 1
-
-    # fragments.And then recursively parse non-terminal ones.
-    return parse_expr_list(expr_list)
-
+    expr_list = parse_terminals(expr_list, pkh_preimages)
 
-def split_params(string):
-    """Read a list of values before the next ')'. Split the result by comma."""
-    i = string.find(")")
-    assert i >= 0
-
-    params, remaining = string[:i], string[i:]
-    if len(remaining) > 0:
-        return params.split(","), remaining[1:]
-    else:
-        return params.split(","), ""
-
-
-def parse_many(string):
-    """Read a list of nodes before the next ')'."""
-    subs = []
-    remaining = string
-    while True:
-        sub, remaining = parse_one(remaining)
-        subs.append(sub)
-        if remaining[0] == ")":
-            return subs, remaining[1:]
-        assert remaining[0] == ","  # TODO: real errors
-        remaining = remaining[1:]
+    # fragments.And then parse non-terminal ones.
+    return parse_expr_list(expr_list)
 
 
-def parse_one_num(string):
-    """Read an integer before the next comma."""
-    i = string.find(",")
-    assert i >= 0
+# The name of a fragment, or the wrappers before a ':'
+FRAGMENT_NAME = re.compile(r"[^(),:]*")
+
+WRAPPERS = {
+    "a": "WrapA",
+    "s": "WrapS",
+    "c": "WrapC",
+    "t": "WrapT",
+    "d": "WrapD",
+    "v": "WrapV",
+    "j": "WrapJ",
+    "n": "WrapN",
+    "l": "WrapL",
+    "u": "WrapU",
+}
+
+# Connectives, their parameters are fragments (except the first one of thresh)
+CONNECTIVES = {
+    "and_v": "AndV",
+    "and_b": "AndB",
+    "and_n": "AndN",
+    "or_b": "OrB",
+    "or_c": "OrC",
+    "or_d": "OrD",
+    "or_i": "OrI",
+    "andor": "AndOr",
+    "thresh": "Thresh",
+}
+
+
+def matching_parentheses(string):
+    """Map the index of each '(' in {string} to the index of the matching ')'."""
+    closing = {}
+    opened = []
+    for match in re.finditer(r"[()]", string):
+        if match.group() == "(":
+            opened.append(match.start())
+        elif opened:
+            closing[opened.pop()] = match.start()
+        else:
+            raise MiniscriptMalformed(f"Unbalanced parentheses in '{string}'")
+    if opened:
+        raise MiniscriptMalformed(f"Unbalanced parentheses in '{string}'")
+    return closing
 
-    return int(string[:i]), string[i + 1:]
 
+def parse_terminal(tag, params, get_key):
+    """Create the terminal fragment {tag} with the list of {params} strings.
 
-def parse_one(string):
-    """Read a node and its subs recursively from a string.
-    Returns the node and the part of the string not consumed.
+    :param get_key: A function returning the DescriptorKey for a key expression.
     """
+    if tag == "pk":
+        return fragments.WrapC(fragments.Pk(get_key(params[0])))
 
-    # We special case fragments.Just1 and fragments.Just0 since they are the only one which don't
-    # have a function syntax.
-    if string[0] == "0":
-        return fragments.Just0(), string[1:]
-    if string[0] == "1":
-        return fragments.Just1(), string[1:]
-
-    # Now, find the separator for all functions.
-    for i, char in enumerate(string):
-        if char in ["(", ":"]:
-            break
-    # For wrappers, we may have many of them.
-    if char == ":" and i > 1:
-        tag, remaining = string[0], string[1:]
-    else:
-        tag, remaining = string[:i], string[i + 1:]
-
-    # fragments.Wrappers
-    if char == ":":
-        sub, remaining = parse_one(remaining)
-        if tag == "a":
-            return fragments.WrapA(sub), remaining
-
-        if tag == "s":
-            return fragments.WrapS(sub), remaining
-
-        if tag == "c":
-            return fragments.WrapC(sub), remaining
-
-        if tag == "t":
-            return fragments.WrapT(sub), remaining
-
-        if tag == "d":
-            return fragments.WrapD(sub), remaining
-
-        if tag == "v":
-            return fragments.WrapV(sub), remaining
-
-        if tag == "j":
-            return fragments.WrapJ(sub), remaining
-
-        if tag == "n":
-            return fragments.WrapN(sub), remaining
-
-        if tag == "l":
-            return fragments.WrapL(sub), remaining
-
-        if tag == "u":
-            return fragments.WrapU(sub), remaining
-
-        assert False, (tag, sub, remaining)  # TODO: real errors
-
-    # Terminal elements other than 0 and 1
-    if tag in [
-        "pk",
-        "pkh",
-        "pk_k",
-        "pk_h",
-        "sha256",
-        "hash256",
-        "ripemd160",
-        "hash160",
-        "older",
-        "after",
-        "multi",
-    ]:
-        params, remaining = split_params(remaining)
-
-        if tag == "0":
-            return fragments.Just0(), remaining
+    if tag == "pk_k":
+        return fragments.Pk(get_key(params[0]))
 
-        if tag == "1":
-            return fragments.Just1(), remaining
+    if tag == "pkh":
+        return fragments.WrapC(fragments.Pkh(get_key(params[0])))
 
-        if tag == "pk":
-            return fragments.WrapC(fragments.Pk(params[0])), remaining
+    if tag == "pk_h":
+        return fragments.Pkh(get_key(params[0]))
 
-        if tag == "pk_k":
-            return fragments.Pk(params[0]), remaining
+    if tag == "older":
+        return fragments.Older(int(params[0]))
 
-        if tag == "pkh":
-            return fragments.WrapC(fragments.Pkh(params[0])), remaining
+    if tag == "after":
+        return fragments.After(int(params[0]))
 
-        if tag == "pk_h":
-            return fragments.Pkh(params[0]), remaining
+    if tag == "sha256":
+        return fragments.Sha256(bytes.fromhex(params[0]))
 
-        if tag == "older":
-            value = int(params[0])
-            return fragments.Older(value), remaining
+    if tag == "hash256":
+        return fragments.Hash256(bytes.fromhex(params[0]))
 
-        if tag == "after":
-            value = int(params[0])
-            return fragments.After(value), remaining
+    if tag == "ripemd160":
+        return fragments.Ripemd160(bytes.fromhex(params[0]))
 
-        if tag in ["sha256", "hash256", "ripemd160", "hash160"]:
-            digest = bytes.fromhex(params[0])
-            if tag == "sha256":
-                return fragments.Sha256(digest), remaining
-            if tag == "hash256":
-                return fragments.Hash256(digest), remaining
-            if tag == "ripemd160":
-                return fragments.Ripemd160(digest), remaining
-            return fragments.Hash160(digest), remaining
+    if tag == "hash160":
+        return fragments.Hash160(bytes.fromhex(params[0]))
 
-        if tag == "multi":
-            k = int(params.pop(0))
-            key_n = []
-            for param in params:
-                key_obj = DescriptorKey(param)
-                key_n.append(key_obj)
-            return fragments.Multi(k, key_n), remaining
+    if tag == "multi":
+        return fragments.Multi(int(params[0]), [get_key(param) for param in params[1:]])
 
-        assert False, (tag, params, remaining)
-
-    # Non-terminal elements (connectives)
-    # We special case fragments.Thresh, as its first sub is an integer.
-    if tag == "thresh":
-        k, remaining = parse_one_num(remaining)
-    # TODO: real errors in place of unpacking
-    subs, remaining = parse_many(remaining)
-
-    if tag == "and_v":
-        return fragments.AndV(*subs), remaining
-
-    if tag == "and_b":
-        return fragments.AndB(*subs), remaining
-
-    if tag == "and_n":
-        return fragments.AndN(*subs), remaining
-
-    if tag == "or_b":
-        return fragments.OrB(*subs), remaining
-
-    if tag == "or_c":
-        return fragments.OrC(*subs), remaining
-
-    if tag == "or_d":
-        return fragments.OrD(*subs), remaining
-
-    if tag == "or_i":
-        return fragments.OrI(*subs), remaining
-
-    if tag == "andor":
-        return fragments.AndOr(*subs), remaining
-
-    if tag == "thresh":
-        return fragments.Thresh(k, subs), remaining
-
-    assert False, (tag, subs, remaining)  # TODO
+    # Not a terminal
+    return None
 
 
 def miniscript_from_str(ms_str):
     """Construct miniscript node from string representation"""
-    node, remaining = parse_one(ms_str)
-    assert remaining == ""
-    return node
+    closing = matching_parentheses(ms_str)
+    end = len(ms_str)
+
+    # The nodes already parsed, by their string representation
+    nodes = {}
+    keys = {}
+
+    def get_key(key_str):
+        key = keys.get(key_str)
+        if key is None:
+            key = keys[key_str] = DescriptorKey(key_str)
+        return key
+
+    def wrap(node, wrappers):
+        for wrapper in reversed(wrappers):
+            if wrapper not in WRAPPERS:
+                raise MiniscriptMalformed(f"Unknown wrapper '{wrapper}' in '{ms_str}'")
+            node = getattr(fragments, WRAPPERS[wrapper])(node)
+        return node
+
+    # The connectives whose parameters are being parsed, as
+    # [tag, k, subs, start of their wrappers, start of their name, wrappers]
+    parents = []
+    pos = 0
+    while True:
+        # Parse the fragment starting at pos, or start parsing its parameters.
+        start = pos
+        wrappers = ""
+        while True:
+            if ms_str.startswith(("0", "1"), pos):
+                name_end = pos + 1
+                break
+            name_end = FRAGMENT_NAME.match(ms_str, pos).end()
+            if name_end == end or ms_str[name_end] != ":":
+                break
+            if name_end == pos:
+                raise MiniscriptMalformed(f"Missing wrapper at position {pos} in '{ms_str}'")
+            wrappers += ms_str[pos:name_end]
+            pos = name_end + 1
+
+        if ms_str.startswith(("0", "1"), pos):
+            frag_end = pos + 1
+        elif name_end < end and ms_str[name_end] == "(":
+            frag_end = closing[name_end] + 1
+        else:
+            raise MiniscriptMalformed(f"Invalid fragment at position {pos} in '{ms_str}'")
+
+        node = nodes.get(ms_str[start:frag_end])
+        if node is None:
+            node = nodes.get(ms_str[pos:frag_end])
+            if node is None:
+                tag = ms_str[pos:name_end]
+                if tag == "0":
+                    node = fragments.Just0()
+                elif tag == "1":
+                    node = fragments.Just1()
+                elif tag in CONNECTIVES:
+                    k, name_start = None, pos
+                    pos = name_end + 1
+                    if tag == "thresh":
+                        comma = ms_str.find(",", pos, frag_end)
+                        if comma < 0:
+                            raise MiniscriptMalformed(f"Invalid thresh at position {pos} in '{ms_str}'")
+                        k, pos = int(ms_str[pos:comma]), comma + 1
+                    parents.append([tag, k, [], start, name_start, wrappers])
+                    continue
+                else:
+                    node = parse_terminal(tag, ms_str[name_end + 1:frag_end - 1].split(","), get_key)
+                    if node is None:
+                        raise MiniscriptMalformed(f"Unknown fragment '{tag}' in '{ms_str}'")
+                nodes[ms_str[pos:frag_end]] = node
+            node = nodes[ms_str[start:frag_end]] = wrap(node, wrappers)
+        pos = frag_end
+
+        # Add it to the parameters of its parent, and create the parents whose parameters are
+        # all parsed.
+        while parents:
+            parents[-1][2].append(node)
+            if pos < end and ms_str[pos] == ",":
+                pos += 1
+                break
+            if pos == end or ms_str[pos] != ")":
+                raise MiniscriptMalformed(f"Expected ',' or ')' at position {pos} in '{ms_str}'")
+            pos += 1
+            tag, k, subs, frag_start, name_start, wrappers = parents.pop()
+            if tag == "thresh":
+                node = fragments.Thresh(k, subs)
+            else:
+                node = getattr(fragments, CONNECTIVES[tag])(*subs)
+            nodes[ms_str[name_start:pos]] = node
+            node = nodes[ms_str[frag_start:pos]] = wrap(node, wrappers)
+        else:
+            if pos != end:
+                raise MiniscriptMalformed(f"Unexpected '{ms_str[pos:]}' in '{ms_str}'")
+            return node
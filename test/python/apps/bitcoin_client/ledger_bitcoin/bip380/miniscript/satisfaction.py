@@ -74,6 +74,19 @@ class Satisfaction:
         has_sig = self.has_sig or other.has_sig
         return Satisfaction(witness, has_sig)
 
+    def __eq__(self, other):
+        return self.witness == other.witness and self.has_sig == other.has_sig
+
+    # The witness is a mutable list.
+    __hash__ = None
+
+    def concat(sats):
+        """Concatenate a list of satisfactions together, in order."""
+        if any(sat.witness is None for sat in sats):
+            return Satisfaction.unavailable()
+        witness = [elem for sat in sats for elem in sat.witness]
+        return Satisfaction(witness, has_sig=any(sat.has_sig for sat in sats))
+
     def __or__(self, other):
         """Choose between two (dis)satisfactions."""
         assert isinstance(other, Satisfaction)
@@ -117,72 +130,165 @@ class Satisfaction:
     def size(self):
         return len(self.witness) + sum(len(elem) for elem in self.witness)
 
-    def from_concat(sat_material, sub_a, sub_b, disjunction=False):
+    def from_concat(sub_a, sub_b, disjunction=False):
         """Get the satisfaction for a Miniscript whose Script corresponds to a
         concatenation of two subscripts A and B.
 
-        :param sub_a: The sub-fragment A.
-        :param sub_b: The sub-fragment B.
+        :param sub_a: The (satisfaction, dissatisfaction) of the sub-fragment A.
+        :param sub_b: The (satisfaction, dissatisfaction) of the sub-fragment B.
         :param disjunction: Whether this fragment has an 'or()' semantic.
         """
         if disjunction:
-            return (sub_b.dissatisfaction() + sub_a.satisfaction(sat_material)) | (
-                sub_b.satisfaction(sat_material) + sub_a.dissatisfaction()
-            )
-        return sub_b.satisfaction(sat_material) + sub_a.satisfaction(sat_material)
+            return (sub_b[1] + sub_a[0]) | (sub_b[0] + sub_a[1])
+        return sub_b[0] + sub_a[0]
 
-    def from_or_uneven(sat_material, sub_a, sub_b):
+    def from_or_uneven(sub_a, sub_b):
         """Get the satisfaction for a Miniscript which unconditionally executes a first
         sub A and only executes B if A was dissatisfied.
 
-        :param sub_a: The sub-fragment A.
-        :param sub_b: The sub-fragment B.
+        :param sub_a: The (satisfaction, dissatisfaction) of the sub-fragment A.
+        :param sub_b: The (satisfaction, dissatisfaction) of the sub-fragment B.
         """
-        return sub_a.satisfaction(sat_material) | (
-            sub_b.satisfaction(sat_material) + sub_a.dissatisfaction()
-        )
+        return sub_a[0] | (sub_b[0] + sub_a[1])
 
-    def from_thresh(sat_material, k, subs):
+    def from_thresh(k, subs):
         """Get the satisfaction for a Miniscript which satisfies k of the given subs,
         and dissatisfies all the others.
 
-        :param sat_material: The material to satisfy the challenges.
+        The best way to satisfy j of the first i subs is the best of satisfying j of the
+        first i - 1 subs and dissatisfying the i-th one, and of satisfying j - 1 of them and
+        the i-th one. Only the markers and sizes are combined this way, the witness is
+        assembled once at the end.
+
         :param k: The number of subs that need to be satisfied.
-        :param subs: The list of all subs of the threshold.
+        :param subs: The list of the (satisfaction, dissatisfaction) of all subs of the
+                     threshold.
         """
-        # Pick the k sub-fragments to satisfy, prefering (in order):
-        # 1. Fragments that don't require a signature to be satisfied
-        # 2. Fragments whose satisfaction's size is smaller
-        # Record the unavailable (in either way) ones as we go.
-        arbitrage, unsatisfiable, undissatisfiable = [], [], []
-        for sub in subs:
-            sat, dissat = sub.satisfaction(sat_material), sub.dissatisfaction()
-            if sat.witness is None:
-                unsatisfiable.append(sub)
-            elif dissat.witness is None:
-                undissatisfiable.append(sub)
-            else:
-                arbitrage.append(
-                    (int(sat.has_sig), len(sat.witness) - len(dissat.witness), sub)
-                )
+        n = len(subs)
+        if k > 0 and all(sat.witness is None or sat.has_sig for sat, _ in subs):
+            # All the ways to satisfy at least one sub have a signature, so the best one
+            # is the smallest: satisfy the subs whose satisfaction adds the least to the
+            # size, the first ones among those adding as much.
+            forced, arbitrage = [], []
+            for i, (sat, dissat) in enumerate(subs):
+                if sat.witness is None:
+                    if dissat.witness is None:
+                        return Satisfaction.unavailable()
+                elif dissat.witness is None:
+                    forced.append(i)
+                else:
+                    arbitrage.append((sat.size() - dissat.size(), i))
+            if len(forced) > k or len(forced) + len(arbitrage) < k:
+                return Satisfaction.unavailable()
+            arbitrage.sort()
+            to_satisfy = set(forced).union(i for _, i in arbitrage[: k - len(forced)])
+        else:
+            # best[j] is the (has_sig, size) of the best way to satisfy j of the subs seen
+            # so far and dissatisfy the others, None if there is none. Comparing these
+            # tuples is choosing between the (dis)satisfactions with '|'.
+            best = [(False, 0)] + [None] * k
+            # For each sub, whether it is satisfied in each of the best ways
+            sat_choices = []
+            for i, (sat, dissat) in enumerate(subs):
+                s = None if sat.witness is None else (sat.has_sig, sat.size())
+                d = None if dissat.witness is None else (dissat.has_sig, dissat.size())
+                prev, best = best, [None] * (k + 1)
+                choices = bytearray(k + 1)
+                # Counts from which k can't be reached with the remaining subs are pruned.
+                for j in range(max(0, k - n + i + 1), min(i + 1, k) + 1):
+                    a = prev[j]
+                    if a is not None and d is not None:
+                        a = (a[0] or d[0], a[1] + d[1])
+                    else:
+                        a = None
+                    b = prev[j - 1] if j > 0 else None
+                    if b is not None and s is not None:
+                        b = (b[0] or s[0], b[1] + s[1])
+                        if a is None or b < a:
+                            best[j] = b
+                            choices[j] = 1
+                            continue
+                    best[j] = a
+                sat_choices.append(choices)
+            if best[k] is None:
+                return Satisfaction.unavailable()
+            to_satisfy = set()
+            j = k
+            for i in range(n - 1, -1, -1):
+                if sat_choices[i][j]:
+                    to_satisfy.add(i)
+                    j -= 1
+
+        # The witness of the last sub comes first.
+        return Satisfaction.concat(
+            [subs[i][0 if i in to_satisfy else 1] for i in range(n - 1, -1, -1)]
+        )
 
-        # If not enough (dis)satisfactions are available, fail.
-        if len(unsatisfiable) > len(subs) - k or len(undissatisfiable) > k:
-            return Satisfaction.unavailable()
 
-        # Otherwise, satisfy the k most optimal ones.
-        arbitrage = sorted(arbitrage, key=lambda x: x[:2])
-        optimal_sat = undissatisfiable + [a[2] for a in arbitrage] + unsatisfiable
-        to_satisfy = set(optimal_sat[:k])
-        return sum(
-            [
-                sub.satisfaction(sat_material)
-                if sub in to_satisfy
-                else sub.dissatisfaction()
-                for sub in subs[::-1]
-            ],
-            start=Satisfaction(witness=[]),
-        )
+class SatisfactionCache:
+    """The satisfaction and dissatisfaction of all the fragments of a Miniscript.
+
+    They are computed bottom-up, each fragment from those of its subs, so a fragment
+    shared by several parents is only computed once. They are kept between updates: the
+    leaves are computed again each time, as they depend on the satisfaction material and
+    on the keys which may both be modified in place, but the other fragments only if they
+    are an ancestor of a leaf whose (dis)satisfaction changed.
+    """
+
+    def __init__(self, root):
+        """
+        :param root: The Miniscript fragment to satisfy.
+        """
+        # All the fragments, each one after its subs, and the indexes of their subs.
+        self.nodes = []
+        self.subs = []
+        indexes, expanded = {}, set()
+        stack = [root]
+        while stack:
+            node = stack[-1]
+            if id(node) in indexes:
+                stack.pop()
+            elif id(node) in expanded:
+                stack.pop()
+                indexes[id(node)] = len(self.nodes)
+                self.nodes.append(node)
+                self.subs.append([indexes[id(sub)] for sub in node.subs])
+            else:
+                expanded.add(id(node))
+                stack.extend(node.subs[::-1])
+        self.leaves = [i for i, subs in enumerate(self.subs) if not subs]
+        self.parents = [[] for _ in self.nodes]
+        for i, subs in enumerate(self.subs):
+            for j in subs:
+                self.parents[j].append(i)
+        self.results = [None] * len(self.nodes)
+        # The material of the last update, the dissatisfactions don't depend on it.
+        self.sat_material = None
+
+    def update(self, sat_material):
+        """Get the (satisfaction, dissatisfaction) of the root fragment.
+
+        :param sat_material: a SatisfactionMaterial containing available data to satisfy
+                             challenges.
+        """
+        nodes, results, parents = self.nodes, self.results, self.parents
+        stack = []
+        for i in self.leaves:
+            result = (nodes[i].satisfaction(sat_material), nodes[i].dissatisfaction())
+            if result != results[i]:
+                results[i] = result
+                stack.extend(parents[i])
+        ancestors = set()
+        while stack:
+            i = stack.pop()
+            if i not in ancestors:
+                ancestors.add(i)
+                stack.extend(parents[i])
+        # Subs come before their parents.
+        for i in sorted(ancestors):
+            results[i] = nodes[i].combine_satisfactions([results[j] for j in self.subs[i]])
+        self.sat_material = sat_material
+        return results[-1]
 
 
 class ExecutionInfo:
@@ -3,7 +3,7 @@ Common Bitcoin hashes.
 """
 
 import hashlib
-from .ripemd_fallback import ripemd160_fallback
+from ...ripemd import hash160 as _hash160
 
 
 def sha256(data):
@@ -15,6 +15,4 @@ def sha256(data):
 def hash160(data):
     """{data} must be bytes, returns ripemd160(sha256(data))"""
     assert isinstance(data, bytes)
-    if 'ripemd160' in hashlib.algorithms_available:
-        return hashlib.new("ripemd160", sha256(data)).digest()
-    return ripemd160_fallback(sha256(data))
+    return _hash160(data)
@@ -23,6 +23,15 @@ from .bitcoinVarint import *
 from .btchipException import *
 from .btchipHelpers import *
 from binascii import hexlify, unhexlify
+import itertools
+import struct
+import time
+
+# The APDU length bytes, by length
+LENGTH_BYTES = [ bytes([length]) for length in range(256) ]
+
+def blockCount(length, blockLength):
+	return (length + blockLength - 1) // blockLength
 
 class btchip:
 	BTCHIP_CLA = 0xe0
@@ -79,6 +88,10 @@ class btchip:
 	def __init__(self, dongle):
 		self.dongle = dongle
 		self.needKeyCache = False
+		# called with (phase, exchanged APDUs, total APDUs) as the streamed commands progress
+		self.progressCallback = None
+		# by phase, the number of APDUs streamed and the seconds spent serializing and exchanging them
+		self.phaseTimings = {}
 		try:
 			firmware = self.getFirmwareVersion()['version']
 			self.multiOutputSupported = tuple(map(int, (firmware.split(".")))) >= (1, 1, 4)
@@ -105,71 +118,94 @@ class btchip:
 		result['chainCode'] = response[offset : offset + 32]
 		return result
 
-	def getTrustedInput(self, transaction, index):
-		result = {}
-		# Header
-		apdu = [ self.BTCHIP_CLA, self.BTCHIP_INS_GET_TRUSTED_INPUT, 0x00, 0x00 ]
-		params = bytearray.fromhex("%.8x" % (index))
+	def streamAPDUs(self, phase, apdus, total):
+		"""
+		Exchange the APDUs yielded by `apdus`, none of which depends on the response to the previous ones, and
+		return the response to the last one. The APDUs are serialized as they are sent: with dongles pipelining
+		exchangeMany, while the previous ones are processed by the device.
+		"""
+		timing = self.phaseTimings.setdefault(phase, {'apdus': 0, 'serialize': 0.0, 'exchange': 0.0})
+		exchanged = 0
+
+		def timedAPDUs():
+			# serialized a few APDUs at a time, not to time each one
+			while True:
+				start = time.perf_counter()
+				chunk = list(itertools.islice(apdus, 16))
+				timing['serialize'] += time.perf_counter() - start
+				if not chunk:
+					return
+				yield from chunk
+
+		def received(response):
+			nonlocal exchanged
+			exchanged += 1
+			if self.progressCallback is not None:
+				self.progressCallback(phase, exchanged, total)
+
+		start = time.perf_counter()
+		serialized = timing['serialize']
+		exchangeMany = getattr(self.dongle, 'exchangeMany', None)
+		if exchangeMany is not None:
+			responses = exchangeMany(timedAPDUs(), callback=received)
+		else:
+			responses = []
+			for apdu in timedAPDUs():
+				responses.append(self.dongle.exchange(apdu))
+				received(responses[-1])
+		timing['exchange'] += time.perf_counter() - start - (timing['serialize'] - serialized)
+		timing['apdus'] += exchanged
+		return responses[-1] if responses else None
+
+	def trustedInputAPDUs(self, transaction, index):
+		header = bytes([ self.BTCHIP_CLA, self.BTCHIP_INS_GET_TRUSTED_INPUT, 0x80, 0x00 ])
+		params = bytearray(struct.pack(">I", index))
 		params.extend(transaction.version)
 		writeVarint(len(transaction.inputs), params)
-		apdu.append(len(params))
-		apdu.extend(params)
-		self.dongle.exchange(bytearray(apdu))
+		yield bytes([ self.BTCHIP_CLA, self.BTCHIP_INS_GET_TRUSTED_INPUT, 0x00, 0x00, len(params) ]) + params
 		# Each input
 		for trinput in transaction.inputs:
-			apdu = [ self.BTCHIP_CLA, self.BTCHIP_INS_GET_TRUSTED_INPUT, 0x80, 0x00 ]
 			params = bytearray(trinput.prevOut)
 			writeVarint(len(trinput.script), params)
-			apdu.append(len(params))
-			apdu.extend(params)
-			self.dongle.exchange(bytearray(apdu))
+			yield header + LENGTH_BYTES[len(params)] + params
+			script = trinput.script
 			offset = 0
 			while True:
-				blockLength = 251
-				if ((offset + blockLength) < len(trinput.script)):
-					dataLength = blockLength
-				else:
-					dataLength = len(trinput.script) - offset
-				params = bytearray(trinput.script[offset : offset + dataLength])
-				if ((offset + dataLength) == len(trinput.script)):
-					params.extend(trinput.sequence)
-				apdu = [ self.BTCHIP_CLA, self.BTCHIP_INS_GET_TRUSTED_INPUT, 0x80, 0x00, len(params) ]
-				apdu.extend(params)
-				self.dongle.exchange(bytearray(apdu))
+				dataLength = min(251, len(script) - offset)
+				params = script[offset : offset + dataLength]
+				if ((offset + dataLength) == len(script)):
+					params = params + trinput.sequence
+				yield header + LENGTH_BYTES[len(params)] + params
 				offset += dataLength
-				if (offset >= len(trinput.script)):
+				if (offset >= len(script)):
 					break
 		# Number of outputs
-		apdu = [ self.BTCHIP_CLA, self.BTCHIP_INS_GET_TRUSTED_INPUT, 0x80, 0x00 ]
-		params = []
-		writeVarint(len(transaction.outputs), params)
-		apdu.append(len(params))
-		apdu.extend(params)
-		self.dongle.exchange(bytearray(apdu))
+		params = writeVarint(len(transaction.outputs), bytearray())
+		yield header + LENGTH_BYTES[len(params)] + params
 		# Each output
-		indexOutput = 0
 		for troutput in transaction.outputs:
-			apdu = [ self.BTCHIP_CLA, self.BTCHIP_INS_GET_TRUSTED_INPUT, 0x80, 0x00 ]
-			params = bytearray(troutput.amount)
-			writeVarint(len(troutput.script), params)
-			apdu.append(len(params))
-			apdu.extend(params)
-			self.dongle.exchange(bytearray(apdu))
-			offset = 0
-			while (offset < len(troutput.script)):
-				blockLength = 255
-				if ((offset + blockLength) < len(troutput.script)):
-					dataLength = blockLength
-				else:
-					dataLength = len(troutput.script) - offset
-				apdu = [ self.BTCHIP_CLA, self.BTCHIP_INS_GET_TRUSTED_INPUT, 0x80, 0x00, dataLength ]
-				apdu.extend(troutput.script[offset : offset + dataLength])
-				self.dongle.exchange(bytearray(apdu))
-				offset += dataLength
+			script = troutput.script
+			scriptLength = len(script)
+			if scriptLength < 0xfd:
+				yield header + LENGTH_BYTES[len(troutput.amount) + 1] + troutput.amount + LENGTH_BYTES[scriptLength]
+			else:
+				params = writeVarint(scriptLength, bytearray(troutput.amount))
+				yield header + LENGTH_BYTES[len(params)] + params
+			if scriptLength <= 255:
+				if scriptLength:
+					yield header + LENGTH_BYTES[scriptLength] + script
+				continue
+			for offset in range(0, scriptLength, 255):
+				block = script[offset : offset + 255]
+				yield header + LENGTH_BYTES[len(block)] + block
 		# Locktime
-		apdu = [ self.BTCHIP_CLA, self.BTCHIP_INS_GET_TRUSTED_INPUT, 0x80, 0x00, len(transaction.lockTime) ]
-		apdu.extend(transaction.lockTime)
-		response = self.dongle.exchange(bytearray(apdu))
+		yield header + LENGTH_BYTES[len(transaction.lockTime)] + transaction.lockTime
+
+	def getTrustedInput(self, transaction, index):
+		result = {}
+		total = 3 + sum(1 + max(1, blockCount(len(trinput.script), 251)) for trinput in transaction.inputs) \
+			+ sum(1 + blockCount(len(troutput.script), 255) for troutput in transaction.outputs)
+		response = self.streamAPDUs('getTrustedInput', self.trustedInputAPDUs(transaction, index), total)
 		result['trustedInput'] = True
 		result['value'] = response
 		return result
@@ -189,12 +225,16 @@ class btchip:
 				p2 = 0x00
 		else:
 				p2 = 0x10 if continueSegwit else 0x80
-		apdu = [ self.BTCHIP_CLA, self.BTCHIP_INS_HASH_INPUT_START, 0x00, p2 ]
+		apdus = self.untrustedTransactionAPDUs(p2, inputIndex, outputList, redeemScript, version)
+		total = 1 + sum(1 + (blockCount(len(redeemScript), 255) if currentIndex == inputIndex and len(redeemScript) else 1)
+			for currentIndex in range(len(outputList)))
+		self.streamAPDUs('startUntrustedTransaction', apdus, total)
+
+	def untrustedTransactionAPDUs(self, p2, inputIndex, outputList, redeemScript, version):
+		header = bytes([ self.BTCHIP_CLA, self.BTCHIP_INS_HASH_INPUT_START, 0x80, 0x00 ])
 		params = bytearray([version, 0x00, 0x00, 0x00])
 		writeVarint(len(outputList), params)
-		apdu.append(len(params))
-		apdu.extend(params)
-		self.dongle.exchange(bytearray(apdu))
+		yield bytes([ self.BTCHIP_CLA, self.BTCHIP_INS_HASH_INPUT_START, 0x00, p2, len(params) ]) + params
 		# Loop for each input
 		currentIndex = 0
 		for passedOutput in outputList:
@@ -202,8 +242,7 @@ class btchip:
 				sequence = bytearray(unhexlify(passedOutput['sequence']))
 			else:
 				sequence = bytearray([0xFF, 0xFF, 0xFF, 0xFF]) # default sequence
-			apdu = [ self.BTCHIP_CLA, self.BTCHIP_INS_HASH_INPUT_START, 0x80, 0x00 ]
-			params = []
+			params = bytearray()
 			script = bytearray(redeemScript)
 			if ('trustedInput' in passedOutput) and passedOutput['trustedInput']:
 				params.append(0x01)
@@ -217,29 +256,26 @@ class btchip:
 			if currentIndex != inputIndex:
 				script = bytearray()
 			writeVarint(len(script), params)
-			apdu.append(len(params))
-			apdu.extend(params)
-			self.dongle.exchange(bytearray(apdu))
-			offset = 0
-			while(offset < len(script)):
-				blockLength = 255
-				if ((offset + blockLength) < len(script)):
-					dataLength = blockLength
-				else:
-					dataLength = len(script) - offset
-				params = script[offset : offset + dataLength]
-				if ((offset + dataLength) == len(script)):
+			yield header + LENGTH_BYTES[len(params)] + params
+			for offset in range(0, len(script), 255):
+				params = script[offset : offset + 255]
+				if ((offset + 255) >= len(script)):
 					params.extend(sequence)
-				apdu = [ self.BTCHIP_CLA, self.BTCHIP_INS_HASH_INPUT_START, 0x80, 0x00, len(params) ]
-				apdu.extend(params)
-				self.dongle.exchange(bytearray(apdu))
-				offset += blockLength
+				yield header + LENGTH_BYTES[len(params)] + params
 			if len(script) == 0:
-				apdu = [ self.BTCHIP_CLA, self.BTCHIP_INS_HASH_INPUT_START, 0x80, 0x00, len(sequence) ]
-				apdu.extend(sequence)
-				self.dongle.exchange(bytearray(apdu))				
+				yield header + LENGTH_BYTES[len(sequence)] + sequence
 			currentIndex += 1
 
+	def finalizeInputFullAPDUs(self, donglePath, outputs):
+		if len(donglePath) != 0:
+			yield bytes([ self.BTCHIP_CLA, self.BTCHIP_INS_HASH_INPUT_FINALIZE_FULL, 0xFF, 0x00, len(donglePath) ]) + bytes(donglePath)
+		blockLength = self.scriptBlockLength
+		outputs = bytes(outputs)
+		for offset in range(0, len(outputs), blockLength):
+			block = outputs[offset : offset + blockLength]
+			p1 = 0x00 if ((offset + blockLength) < len(outputs)) else 0x80
+			yield bytes([ self.BTCHIP_CLA, self.BTCHIP_INS_HASH_INPUT_FINALIZE_FULL, p1, 0x00, len(block) ]) + block
+
 	def finalizeInput(self, outputAddress, amount, fees, changePath, rawTx=None):
 		alternateEncoding = False
 		donglePath = parse_bip32_path(changePath)
@@ -251,27 +287,8 @@ class btchip:
 			try:
 				fullTx = bitcoinTransaction(bytearray(rawTx))
 				outputs = fullTx.serializeOutputs()
-				if len(donglePath) != 0:
-					apdu = [ self.BTCHIP_CLA, self.BTCHIP_INS_HASH_INPUT_FINALIZE_FULL, 0xFF, 0x00 ]
-					params = []
-					params.extend(donglePath)
-					apdu.append(len(params))
-					apdu.extend(params)
-					response = self.dongle.exchange(bytearray(apdu))
-				offset = 0
-				while (offset < len(outputs)):
-					blockLength = self.scriptBlockLength
-					if ((offset + blockLength) < len(outputs)):
-						dataLength = blockLength
-						p1 = 0x00
-					else:
-						dataLength = len(outputs) - offset
-						p1 = 0x80
-					apdu = [ self.BTCHIP_CLA, self.BTCHIP_INS_HASH_INPUT_FINALIZE_FULL, \
-						p1, 0x00, dataLength ]
-					apdu.extend(outputs[offset : offset + dataLength])
-					response = self.dongle.exchange(bytearray(apdu))
-					offset += dataLength
+				total = (1 if len(donglePath) != 0 else 0) + blockCount(len(outputs), self.scriptBlockLength)
+				response = self.streamAPDUs('finalizeInput', self.finalizeInputFullAPDUs(donglePath, outputs), total)
 				alternateEncoding = True
 			except Exception:
 				pass
@@ -19,10 +19,12 @@
 
 from abc import ABCMeta, abstractmethod
 from .btchipException import *
-from .ledgerWrapper import wrapCommandAPDU, unwrapResponseAPDU
+from .ledgerWrapper import unwrapResponseAPDU
 from binascii import hexlify
+import itertools
 import time
 import os
+import selectors
 import struct
 import socket
 
@@ -54,6 +56,20 @@ class Dongle(object):
 	def exchange(self, apdu, timeout=20000):
 		pass
 
+	def exchangeMany(self, apdus, timeout=20000, callback=None):
+		"""
+		Exchange APDUs whose contents do not depend on the previous responses, and return the responses in order.
+		`apdus` can be any iterable, consumed as the APDUs are sent, and `callback` is called with each response as
+		it is received. Transports that can pipeline requests send the next APDUs before the previous responses are
+		received.
+		"""
+		responses = []
+		for apdu in apdus:
+			responses.append(self.exchange(apdu, timeout))
+			if callback is not None:
+				callback(responses[-1])
+		return responses
+
 	@abstractmethod
 	def close(self):
 		pass
@@ -61,6 +77,21 @@ class Dongle(object):
 	def setWaitImpl(self, waitImpl):
 		self.waitImpl = waitImpl
 
+# Size of the HID reports of the device, each one written after its report ID
+HID_REPORT_SIZE = 64
+HID_FRAME_SIZE = HID_REPORT_SIZE + 1
+# Channel and tag of the Ledger framing of APDUs in HID reports
+LEDGER_CHANNEL = 0x0101
+LEDGER_TAG = 0x05
+
+def ledgerFrameCount(length):
+	"""Number of HID reports of a message of `length` bytes with the Ledger framing"""
+	# the first report has a 7 bytes header (channel, tag, sequence, length), the next ones a 5 bytes header
+	first = HID_REPORT_SIZE - 7
+	if length <= first:
+		return 1
+	return 1 + (length - first + HID_REPORT_SIZE - 6) // (HID_REPORT_SIZE - 5)
+
 class HIDDongleHIDAPI(Dongle, DongleWait):
 
 	def __init__(self, device, ledger=False, debug=False):
@@ -69,28 +100,64 @@ class HIDDongleHIDAPI(Dongle, DongleWait):
 		self.debug = debug
 		self.waitImpl = self
 		self.opened = True
+		# the reports of a request are framed in this buffer, grown on demand and reused by the next requests
+		self.frames = bytearray(HID_FRAME_SIZE)
+
+	def frameAPDU(self, apdu):
+		"""
+		Frame `apdu` in HID reports, each one preceded by its report ID (0). Returns the number of reports, framed
+		at the start of self.frames.
+		"""
+		length = len(apdu)
+		if self.ledger:
+			count = ledgerFrameCount(length)
+		else:
+			# an empty APDU is still sent, as one padded report
+			count = max(1, (length + HID_REPORT_SIZE - 1) // HID_REPORT_SIZE)
+		size = count * HID_FRAME_SIZE
+		if len(self.frames) < size:
+			self.frames = bytearray(size)
+		frames = self.frames
+		# all the reports but the last one are full, only the last one is padded
+		frames[size - HID_FRAME_SIZE:size] = bytes(HID_FRAME_SIZE)
+		offset = 0
+		for sequenceIdx in range(count):
+			position = sequenceIdx * HID_FRAME_SIZE + 1
+			if self.ledger:
+				if sequenceIdx == 0:
+					struct.pack_into(">HBHH", frames, position, LEDGER_CHANNEL, LEDGER_TAG, 0, length)
+					position += 7
+				else:
+					struct.pack_into(">HBH", frames, position, LEDGER_CHANNEL, LEDGER_TAG, sequenceIdx)
+					position += 5
+			blockSize = min(length - offset, (sequenceIdx + 1) * HID_FRAME_SIZE - position)
+			frames[position:position + blockSize] = apdu[offset:offset + blockSize]
+			offset += blockSize
+		return count
+
+	def readReport(self, deadline):
+		# blocking read of the next report, up to the deadline
+		remaining = int((deadline - time.monotonic()) * 1000)
+		if remaining > 0:
+			data = self.device.read(HID_FRAME_SIZE, remaining)
+			if len(data):
+				return data
+		raise BTChipException("Timeout")
 
 	def exchange(self, apdu, timeout=20000):
+		"""Exchange an APDU with the device, waiting up to `timeout` milliseconds for each report of its response"""
 		if self.debug:
 			print("=> %s" % hexlify(apdu))
-		if self.ledger:
-			apdu = wrapCommandAPDU(0x0101, apdu, 64)		
-		padSize = len(apdu) % 64
-		tmp = apdu
-		if padSize != 0:
-			tmp.extend([0] * (64 - padSize))
-		offset = 0
-		while(offset != len(tmp)):
-			data = tmp[offset:offset + 64]
-			data = bytearray([0]) + data
-			self.device.write(data)
-			offset += 64
+		count = self.frameAPDU(apdu)
+		frames = self.frames
+		for i in range(count):
+			self.device.write(frames[i * HID_FRAME_SIZE:(i + 1) * HID_FRAME_SIZE])
 		dataLength = 0
 		dataStart = 2		
 		result = self.waitImpl.waitFirstResponse(timeout)
+		deadline = time.monotonic() + timeout / 1000.0
 		if not self.ledger:
 			if result[0] == 0x61: # 61xx : data available
-				self.device.set_nonblocking(False)
 				dataLength = result[1]
 				dataLength += 2
 				if dataLength > 62:
@@ -100,25 +167,24 @@ class HIDDongleHIDAPI(Dongle, DongleWait):
 							blockLength = 64
 						else:
 							blockLength = remaining
-						result.extend(bytearray(self.device.read(65))[0:blockLength])
+						result.extend(bytearray(self.readReport(deadline))[0:blockLength])
 						remaining -= blockLength
 				swOffset = dataLength
 				dataLength -= 2
-				self.device.set_nonblocking(True)
 			else:
 				swOffset = 0
 		else:
-			self.device.set_nonblocking(False)
-			while True:
-				response = unwrapResponseAPDU(0x0101, result, 64)
-				if response is not None:
-					result = response
-					dataStart = 0
-					swOffset = len(response) - 2
-					dataLength = len(response) - 2
-					self.device.set_nonblocking(True)
-					break
-				result.extend(bytearray(self.device.read(65)))
+			# the length of the response, in the header of its first report, gives the number of reports to read
+			if len(result) >= 7:
+				for _ in range(ledgerFrameCount(struct.unpack_from(">H", result, 5)[0]) - 1):
+					result.extend(self.readReport(deadline))
+			response = unwrapResponseAPDU(LEDGER_CHANNEL, result, HID_REPORT_SIZE)
+			if response is None:
+				raise BTChipException("Invalid response framing")
+			result = response
+			dataStart = 0
+			swOffset = len(response) - 2
+			dataLength = len(response) - 2
 		sw = (result[swOffset] << 8) + result[swOffset + 1]
 		response = result[dataStart : dataLength + dataStart]
 		if self.debug:
@@ -128,15 +194,8 @@ class HIDDongleHIDAPI(Dongle, DongleWait):
 		return response
 
 	def waitFirstResponse(self, timeout):
-		start = time.time()
-		data = ""
-		while len(data) == 0:
-			data = self.device.read(65)
-			if not len(data):
-				if time.time() - start > timeout:
-					raise BTChipException("Timeout")
-				time.sleep(0.02)
-		return bytearray(data)
+		# a blocking read with a timeout returns as soon as the device answers, instead of polling it
+		return bytearray(self.readReport(time.monotonic() + timeout / 1000.0))
 
 	def close(self):
 		if self.opened:
@@ -147,6 +206,15 @@ class HIDDongleHIDAPI(Dongle, DongleWait):
 		self.opened = False
 
 class DongleServer(Dongle):
+	"""
+	Exchanges APDUs with a proxy of the device over TCP. Each request is sent as its length (4 bytes, big endian)
+	followed by the APDU; each response is received as the length of its data (4 bytes, big endian), the data and
+	the status word (2 bytes).
+	"""
+
+	RECEIVE_SIZE = 65536
+	# Number of APDUs sent by exchangeMany before their responses are received
+	PIPELINE_DEPTH = 64
 
 	def __init__(self, server, port, debug=False):
 		self.server = server
@@ -157,23 +225,94 @@ class DongleServer(Dongle):
 			self.socket.connect((self.server, self.port))
 		except Exception:
 			raise BTChipException("Proxy connection failed")
+		self.socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+		self.socket.setblocking(False)
+		self.selector = selectors.DefaultSelector()
+		self.selector.register(self.socket, selectors.EVENT_READ)
+		self.receiveBuffer = bytearray(self.RECEIVE_SIZE)
 
 	def exchange(self, apdu, timeout=20000):
-		if self.debug:
-			print("=> %s" % hexlify(apdu))		
-		self.socket.send(struct.pack(">I", len(apdu)))
-		self.socket.send(apdu)
-		size = struct.unpack(">I", self.socket.recv(4))[0]
-		response = self.socket.recv(size)
-		sw = struct.unpack(">H", self.socket.recv(2))[0]
-		if self.debug:
-			print("<= %s%.2x" % (hexlify(response), sw))
-		if sw != 0x9000:
-			raise BTChipException("Invalid status %04x" % sw, sw)
-		return bytearray(response)
+		return self.exchangeMany([apdu], timeout)[0]
+
+	def exchangeMany(self, apdus, timeout=20000, callback=None):
+		"""
+		Pipeline the APDUs: up to PIPELINE_DEPTH of them are sent before their responses are received, and the next
+		ones are taken from `apdus` while the previous ones are processed. Each response is waited for up to
+		`timeout` milliseconds. After a failed status, no more APDUs are sent, and the status is raised once the
+		responses to the APDUs already sent are received.
+		"""
+		apdus = iter(apdus)
+		exhausted = False
+		inFlight = 0
+		pending = memoryview(b"")
+		received = bytearray()
+		receiveView = memoryview(self.receiveBuffer)
+		responses = []
+		failure = None
+		events = selectors.EVENT_READ
+		deadline = time.monotonic() + timeout / 1000.0
+		try:
+			while True:
+				if not len(pending) and not exhausted and inFlight < self.PIPELINE_DEPTH:
+					request = bytearray()
+					for apdu in itertools.islice(apdus, self.PIPELINE_DEPTH - inFlight):
+						if self.debug:
+							print("=> %s" % hexlify(apdu))
+						request += struct.pack(">I", len(apdu))
+						request += apdu
+						inFlight += 1
+					exhausted = not len(request)
+					pending = memoryview(request)
+				if exhausted and inFlight == 0:
+					break
+				wanted = selectors.EVENT_READ | selectors.EVENT_WRITE if len(pending) else selectors.EVENT_READ
+				if wanted != events:
+					self.selector.modify(self.socket, wanted)
+					events = wanted
+				remaining = deadline - time.monotonic()
+				if remaining <= 0:
+					raise BTChipException("Timeout")
+				for _, ready in self.selector.select(remaining):
+					if ready & selectors.EVENT_WRITE and len(pending):
+						pending = pending[self.socket.send(pending):]
+					if ready & selectors.EVENT_READ:
+						size = self.socket.recv_into(receiveView)
+						if size == 0:
+							raise BTChipException("Proxy connection closed")
+						received += receiveView[:size]
+						offset = 0
+						# responses may be split or grouped arbitrarily by TCP
+						while len(received) - offset >= 4:
+							end = offset + 4 + struct.unpack_from(">I", received, offset)[0]
+							if len(received) < end + 2:
+								break
+							response = bytearray(received[offset + 4:end])
+							sw = struct.unpack_from(">H", received, end)[0]
+							offset = end + 2
+							inFlight -= 1
+							deadline = time.monotonic() + timeout / 1000.0
+							if self.debug:
+								print("<= %s%.2x" % (hexlify(response), sw))
+							if sw != 0x9000:
+								if failure is None:
+									failure = BTChipException("Invalid status %04x" % sw, sw)
+								# the APDUs already framed are still sent, to keep the stream in sync
+								exhausted = True
+							elif failure is None:
+								responses.append(response)
+								if callback is not None:
+									callback(response)
+						del received[:offset]
+		finally:
+			if events != selectors.EVENT_READ:
+				self.selector.modify(self.socket, selectors.EVENT_READ)
+		if failure is not None:
+			raise failure
+		return responses
 
 	def close(self):
 		try:
+			self.selector.close()
 			self.socket.close()
 		except Exception:
 			pass
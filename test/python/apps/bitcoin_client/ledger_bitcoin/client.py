@@ -1,19 +1,21 @@
 from packaging.version import parse as parse_version
 from typing import Tuple, List, Mapping, Optional, Union
 import base64
-from io import BytesIO, BufferedReader
+from io import BufferedReader
 
 from .bip380.descriptors import Descriptor
 
 from .command_builder import BitcoinCommandBuilder, BitcoinInsType
-from .common import Chain, read_uint, read_varint
+from .common import ByteStreamParser, Chain
 from .client_command import ClientCommandInterpreter
 from .client_base import Client, PartialSignature
 from .client_legacy import LegacyClient
 from .errors import UnknownDeviceError
-from .merkle import get_merkleized_map_commitment
 from .wallet import WalletPolicy, WalletType
+from .wallet_cache import WalletCache
 from .psbt import PSBT, normalize_psbt
+from .psbt_commitment import PsbtCommitment
+from .psbt_parser import PSBTMapParser
 from . import segwit_addr
 from ._serialize import deser_string
 from ragger.backend import BackendInterface
@@ -59,9 +61,23 @@ class NewClient(Client):
     # internal use for testing: if set to True, sign_psbt will not clone the psbt before converting to psbt version 2
     _no_clone_psbt: bool = False
 
+    # if set to True, sign_psbt computes all the Merkle proofs of the PSBT upfront instead of on each request of the
+    # device; faster for large PSBTs, at the cost of O(n log n) memory
+    precompute_merkle_proofs: bool = False
+
+    # maximum number of worker processes hashing the maps of very large PSBTs in sign_psbt; None for the number of CPUs,
+    # 1 to always hash in this process
+    commitment_processes: Optional[int] = None
+
+    # if set, the wallet policies registered with register_wallet and the addresses derived on the host to check
+    # get_wallet_address are cached, so that later flows with the same policies skip both; set on the class to share
+    # the cache between clients
+    wallet_cache: Optional[WalletCache] = None
+
     def __init__(self, comm_client: BackendInterface, chain: Chain = Chain.MAIN, debug: bool = False) -> None:
         super().__init__(comm_client, chain, debug)
         self.builder = BitcoinCommandBuilder()
+        self._master_fingerprint: Optional[bytes] = None
 
     # Modifies the behavior of the base method by taking care of SW_INTERRUPTED_EXECUTION responses
     def _make_request(
@@ -92,6 +108,11 @@ class NewClient(Client):
         if wallet.version not in [WalletType.WALLET_POLICY_V1, WalletType.WALLET_POLICY_V2]:
             raise ValueError("invalid wallet policy version")
 
+        if self.wallet_cache is not None:
+            wallet_hmac = self.wallet_cache.get_hmac(self._get_cached_master_fingerprint(), wallet)
+            if wallet_hmac is not None:
+                return wallet.id, wallet_hmac
+
         client_intepreter = ClientCommandInterpreter()
         client_intepreter.add_known_preimage(wallet.serialize())
         client_intepreter.add_known_list([k.encode() for k in wallet.keys_info])
@@ -116,9 +137,12 @@ class NewClient(Client):
             # sanity check: for miniscripts, derive the first address independently with python-bip380
             first_addr_device = self.get_wallet_address(wallet, wallet_hmac, 0, 0, False)
 
-            if first_addr_device != self._derive_segwit_address_for_policy(wallet, False, 0):
+            if first_addr_device != self._get_expected_address(wallet, 0, 0):
                 raise RuntimeError("Invalid address. Please update your Bitcoin app. If the problem persists, report a bug at https://github.com/LedgerHQ/app-bitcoin-new")
 
+        if self.wallet_cache is not None:
+            self.wallet_cache.set_hmac(self._get_cached_master_fingerprint(), wallet, wallet_hmac)
+
         return wallet_id, wallet_hmac
 
     def get_wallet_address(
@@ -136,7 +160,7 @@ class NewClient(Client):
         if change != 0 and change != 1:
             raise ValueError("Invalid change")
 
-        client_intepreter = ClientCommandInterpreter()
+        client_intepreter = ClientCommandInterpreter(precompute_proofs=self.precompute_merkle_proofs)
         client_intepreter.add_known_list([k.encode() for k in wallet.keys_info])
         client_intepreter.add_known_preimage(wallet.serialize())
 
@@ -158,7 +182,7 @@ class NewClient(Client):
         if self._should_validate_address(wallet):
             # sanity check: for miniscripts, derive the address independently with python-bip380
 
-            if result != self._derive_segwit_address_for_policy(wallet, change, address_index):
+            if result != self._get_expected_address(wallet, change, address_index):
                 raise RuntimeError("Invalid address. Please update your Bitcoin app. If the problem persists, report a bug at https://github.com/LedgerHQ/app-bitcoin-new")
 
         return result
@@ -173,53 +197,42 @@ class NewClient(Client):
                 psbt_v2 = psbt
             else:
                 psbt_v2 = PSBT()
-                psbt_v2.deserialize(psbt.serialize())  # clone psbt
+                psbt_v2.deserialize_bytes(psbt.serialize_bytes())  # clone psbt
                 psbt_v2.convert_to_v2()
         else:
             psbt_v2 = psbt
 
-        psbt_bytes = base64.b64decode(psbt_v2.serialize())
-        f = BytesIO(psbt_bytes)
+        psbt_bytes = psbt_v2.serialize_bytes()
+        parser = PSBTMapParser(psbt_bytes)
 
         # We parse the individual maps (global map, each input map, and each output map) from the psbt serialized as a
         # sequence of bytes, in order to produce the serialized Merkleized map commitments. Moreover, we prepare the
         # client interpreter to respond on queries on all the relevant Merkle trees and pre-images in the psbt.
 
-        assert f.read(5) == b"psbt\xff"
-
-        client_intepreter = ClientCommandInterpreter()
+        client_intepreter = ClientCommandInterpreter(precompute_proofs=self.precompute_merkle_proofs)
         client_intepreter.add_known_list([k.encode() for k in wallet.keys_info])
         client_intepreter.add_known_preimage(wallet.serialize())
 
         # necessary for version 1 of the protocol (introduced in version 2.1.0)
         client_intepreter.add_known_preimage(wallet.descriptor_template.encode())
 
-        global_map: Mapping[bytes, bytes] = parse_stream_to_map(f)
-        client_intepreter.add_known_mapping(global_map)
+        global_map: Mapping[bytes, bytes] = parser.read_map()
+        input_maps: List[Mapping[bytes, bytes]] = [parser.read_map() for _ in range(len(psbt_v2.inputs))]
+        output_maps: List[Mapping[bytes, bytes]] = [parser.read_map() for _ in range(len(psbt_v2.outputs))]
 
-        input_maps: List[Mapping[bytes, bytes]] = []
-        for _ in range(len(psbt_v2.inputs)):
-            input_maps.append(parse_stream_to_map(f))
-        for m in input_maps:
-            client_intepreter.add_known_mapping(m)
+        # Each key and value is hashed once: the Merkle trees of the maps give both the commitments sent to the device,
+        # and the trees the client interpreter answers on
+        psbt_commitment = PsbtCommitment(global_map, input_maps, output_maps, self.commitment_processes)
 
-        output_maps: List[Mapping[bytes, bytes]] = []
-        for _ in range(len(psbt_v2.outputs)):
-            output_maps.append(parse_stream_to_map(f))
-        for m in output_maps:
-            client_intepreter.add_known_mapping(m)
+        for m in [psbt_commitment.global_map, *psbt_commitment.input_maps, *psbt_commitment.output_maps]:
+            client_intepreter.add_known_merkleized_map(m)
 
         # We also add the Merkle tree of the input (resp. output) map commitments as a known tree
-        input_commitments = [get_merkleized_map_commitment(m_in) for m_in in input_maps]
-        output_commitments = [get_merkleized_map_commitment(m_out) for m_out in output_maps]
-
-        client_intepreter.add_known_list(input_commitments)
-        client_intepreter.add_known_list(output_commitments)
+        client_intepreter.add_known_tree(psbt_commitment.inputs_tree, psbt_commitment.input_commitments)
+        client_intepreter.add_known_tree(psbt_commitment.outputs_tree, psbt_commitment.output_commitments)
 
         sw, _ = self._make_request(
-            self.builder.sign_psbt(
-                global_map, input_maps, output_maps, wallet, wallet_hmac
-            ),
+            self.builder.sign_psbt_commitment(psbt_commitment, wallet, wallet_hmac),
             client_intepreter,
         )
 
@@ -234,13 +247,13 @@ class NewClient(Client):
 
         results_list: List[Tuple[int, PartialSignature]] = []
         for res in results:
-            res_buffer = BytesIO(res)
-            input_index = read_varint(res_buffer)
+            res_buffer = ByteStreamParser(res)
+            input_index = res_buffer.read_varint()
 
-            pubkey_augm_len = read_uint(res_buffer, 8)
-            pubkey_augm = res_buffer.read(pubkey_augm_len)
+            pubkey_augm_len = res_buffer.read_uint(1)
+            pubkey_augm = res_buffer.read_bytes(pubkey_augm_len)
 
-            signature = res_buffer.read()
+            signature = res_buffer.read_remaining()
 
             results_list.append((input_index, _make_partial_signature(pubkey_augm, signature)))
 
@@ -272,6 +285,27 @@ class NewClient(Client):
 
         return base64.b64encode(response).decode('utf-8')
 
+    def _get_cached_master_fingerprint(self) -> bytes:
+        # the fingerprint keys the entries of the wallet cache; it is only asked to the device once per client
+        if self._master_fingerprint is None:
+            self._master_fingerprint = self.get_master_fingerprint()
+        return self._master_fingerprint
+
+    def _get_expected_address(self, wallet: WalletPolicy, change: int, address_index: int) -> str:
+        if self.wallet_cache is None:
+            return self._derive_segwit_address_for_policy(wallet, change, address_index)
+
+        fingerprint = self._get_cached_master_fingerprint()
+        hrp = self._segwit_hrp()
+        address = self.wallet_cache.get_address(fingerprint, wallet, hrp, change, address_index)
+        if address is None:
+            address = self._derive_segwit_address_for_policy(wallet, change, address_index)
+            self.wallet_cache.set_address(fingerprint, wallet, hrp, change, address_index, address)
+        return address
+
+    def _segwit_hrp(self) -> str:
+        return "bc" if self.chain == Chain.MAIN else "tb"
+
     def _should_validate_address(self, wallet: WalletPolicy) -> bool:
         # TODO: extend to taproot miniscripts once supported
         return wallet.descriptor_template.startswith("wsh(") and not wallet.descriptor_template.startswith("wsh(sortedmulti(")
@@ -282,8 +316,7 @@ class NewClient(Client):
         spk = desc.script_pubkey
         if spk[0:2] != b'\x00\x20' or len(spk) != 34:
             raise RuntimeError("Invalid scriptPubKey")
-        hrp = "bc" if self.chain == Chain.MAIN else "tb"
-        return segwit_addr.encode(hrp, 0, spk[2:])
+        return segwit_addr.encode(self._segwit_hrp(), 0, spk[2:])
 
 
 def createClient(comm_client: BackendInterface, chain: Chain = Chain.MAIN, debug: bool = False) -> Union[LegacyClient, NewClient]:
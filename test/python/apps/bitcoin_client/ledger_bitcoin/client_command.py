@@ -1,11 +1,12 @@
 from enum import IntEnum
-from typing import List, Mapping
-from collections import deque
+from typing import List, Mapping, Union
 from hashlib import sha256
 
 from .common import ByteStreamParser, sha256, write_varint
-from .merkle import MerkleTree, element_hash
+from .merkle import MerkleizedMap, MerkleProofs, MerkleTree, element_hash
 
+# Smaller trees, like the ones of the keys and values of each PSBT map, are cheaper to prove on demand
+PRECOMPUTE_PROOFS_MIN_LEAVES = 64
 
 class ClientCommandCode(IntEnum):
     YIELD = 0x10
@@ -15,6 +16,59 @@ class ClientCommandCode(IntEnum):
     GET_MORE_ELEMENTS = 0xA0
 
 
+class ElementQueue:
+    """Elements of the same byte length waiting to be sent with GET_MORE_ELEMENTS.
+
+    The elements are stored contiguously: a single buffer, the length of each element (stride) and the offset of the
+    next element to send. Queuing the remainder of a preimage does not copy it, and the elements are served by slices
+    of the buffer.
+    """
+
+    def __init__(self):
+        self._buffer = memoryview(b"")
+        self._offset = 0
+        self.element_len = 0
+
+    def __len__(self) -> int:
+        """Return the number of elements in the queue."""
+        if self.element_len == 0:
+            return 0
+        return (len(self._buffer) - self._offset) // self.element_len
+
+    def extend(self, data: Union[bytes, memoryview], element_len: int) -> None:
+        """Add the elements of length `element_len` concatenated in `data` at the end of the queue."""
+
+        if element_len <= 0 or len(data) % element_len != 0:
+            raise ValueError("The data must be a concatenation of elements of the given length.")
+        if len(data) == 0:
+            return
+
+        if len(self) == 0:
+            self._buffer = memoryview(data)
+            self._offset = 0
+            self.element_len = element_len
+        elif element_len != self.element_len:
+            raise ValueError(
+                "The queue contains elements of different byte length, which is not expected."
+            )
+        else:
+            self._buffer = memoryview(bytes(self._buffer[self._offset:]) + bytes(data))
+            self._offset = 0
+
+    def pop(self, max_bytes: int) -> bytes:
+        """Remove as many elements as fit in `max_bytes` from the front of the queue, and return them concatenated."""
+
+        n_elements = min(len(self), max_bytes // self.element_len)
+        end = self._offset + n_elements * self.element_len
+        result = self._buffer[self._offset:end].tobytes()
+        self._offset = end
+        if self._offset == len(self._buffer):
+            # release the reference to the queued data
+            self._buffer = memoryview(b"")
+            self._offset = 0
+        return result
+
+
 class ClientCommand:
     def execute(self, request: bytes) -> bytes:
         raise NotImplementedError("Subclasses should implement this method.")
@@ -38,7 +92,7 @@ class YieldCommand(ClientCommand):
 
 
 class GetPreimageCommand(ClientCommand):
-    def __init__(self, known_preimages: Mapping[bytes, bytes], queue: "deque[bytes]"):
+    def __init__(self, known_preimages: Mapping[bytes, bytes], queue: ElementQueue):
         self.queue = queue
         self.known_preimages = known_preimages
 
@@ -47,7 +101,7 @@ class GetPreimageCommand(ClientCommand):
         return ClientCommandCode.GET_PREIMAGE
 
     def execute(self, request: bytes) -> bytes:
-        req = ByteStreamParser(request[1:])
+        req = ByteStreamParser(request, 1)
 
         if req.read_bytes(1) != b'\0':
             raise RuntimeError(f"Unsupported request: the first byte should be 0")
@@ -68,13 +122,8 @@ class GetPreimageCommand(ClientCommand):
             payload_size = min(max_payload_size, len(known_preimage))
 
             if payload_size < len(known_preimage):
-                # split into list of length-1 bytes elements
-                extra_elements = [
-                    known_preimage[i: i + 1]
-                    for i in range(payload_size, len(known_preimage))
-                ]
-                # add to the queue any remaining extra bytes
-                self.queue.extend(extra_elements)
+                # add to the queue any remaining extra bytes, as length-1 elements
+                self.queue.extend(memoryview(known_preimage)[payload_size:], 1)
 
             return (
                 preimage_len_out
@@ -87,16 +136,17 @@ class GetPreimageCommand(ClientCommand):
 
 
 class GetMerkleLeafProofCommand(ClientCommand):
-    def __init__(self, known_trees: Mapping[bytes, MerkleTree], queue: "deque[bytes]"):
+    def __init__(self, known_trees: Mapping[bytes, MerkleTree], known_proofs: Mapping[bytes, MerkleProofs], queue: ElementQueue):
         self.queue = queue
         self.known_trees = known_trees
+        self.known_proofs = known_proofs
 
     @property
     def code(self) -> int:
         return ClientCommandCode.GET_MERKLE_LEAF_PROOF
 
     def execute(self, request: bytes) -> bytes:
-        req = ByteStreamParser(request[1:])
+        req = ByteStreamParser(request, 1)
 
         root = req.read_bytes(32)
         tree_size = req.read_varint()
@@ -116,22 +166,26 @@ class GetMerkleLeafProofCommand(ClientCommand):
                 "This command should not execute when the queue is not empty."
             )
 
-        proof = mt.prove_leaf(leaf_index)
+        if root in self.known_proofs:
+            proof = self.known_proofs[root].proof(leaf_index)
+        else:
+            proof = memoryview(b"".join(mt.prove_leaf(leaf_index)))
+        proof_len = len(proof) // 32
 
         # Compute how many elements we can fit in 255 - 32 - 1 - 1 = 221 bytes
-        n_response_elements = min((255 - 32 - 1 - 1) // 32, len(proof))
-        n_leftover_elements = len(proof) - n_response_elements
+        n_response_elements = min((255 - 32 - 1 - 1) // 32, proof_len)
+        n_leftover_elements = proof_len - n_response_elements
 
         # Add to the queue any proof elements that do not fit the response
         if (n_leftover_elements > 0):
-            self.queue.extend(proof[-n_leftover_elements:])
+            self.queue.extend(proof[32 * n_response_elements:], 32)
 
         return b"".join(
             [
                 mt.get(leaf_index),
-                len(proof).to_bytes(1, byteorder="big"),
+                proof_len.to_bytes(1, byteorder="big"),
                 n_response_elements.to_bytes(1, byteorder="big"),
-                *proof[:n_response_elements],
+                proof[:32 * n_response_elements],
             ]
         )
 
@@ -145,7 +199,7 @@ class GetMerkleLeafIndexCommand(ClientCommand):
         return ClientCommandCode.GET_MERKLE_LEAF_INDEX
 
     def execute(self, request: bytes) -> bytes:
-        req = ByteStreamParser(request[1:])
+        req = ByteStreamParser(request, 1)
 
         root = req.read_bytes(32)
         leaf_hash = req.read_bytes(32)
@@ -165,7 +219,7 @@ class GetMerkleLeafIndexCommand(ClientCommand):
 
 
 class GetMoreElementsCommand(ClientCommand):
-    def __init__(self, queue: "deque[bytes]"):
+    def __init__(self, queue: ElementQueue):
         self.queue = queue
 
     @property
@@ -179,26 +233,17 @@ class GetMoreElementsCommand(ClientCommand):
         if len(self.queue) == 0:
             raise ValueError("No elements to get.")
 
-        element_len = len(self.queue[0])
-        if any(len(el) != element_len for el in self.queue):
-            raise ValueError(
-                "The queue contains elements of different byte length, which is not expected."
-            )
+        element_len = self.queue.element_len
 
         # pop from the queue, keeping the total response length at most 255
-
-        response_elements = bytearray()
-
-        n_added_elements = 0
-        while len(self.queue) > 0 and len(response_elements) + element_len <= 253:
-            response_elements.extend(self.queue.popleft())
-            n_added_elements += 1
+        response_elements = self.queue.pop(253)
+        n_added_elements = len(response_elements) // element_len
 
         return b"".join(
             [
                 n_added_elements.to_bytes(1, byteorder="big"),
                 element_len.to_bytes(1, byteorder="big"),
-                bytes(response_elements),
+                response_elements,
             ]
         )
 
@@ -220,6 +265,11 @@ class ClientCommandInterpreter:
     Finally, it keeps track of the yielded values (that is, the values sent from the hardware
     wallet with a YIELD client command).
 
+    If `precompute_proofs` is set, the Merkle proofs of all the leaves of each known Merkle tree of at least
+    PRECOMPUTE_PROOFS_MIN_LEAVES leaves are computed when the tree is added, and GET_MERKLE_LEAF_PROOF is answered
+    with slices of them. This costs O(n log n) time and memory per tree of n leaves, and pays off when the hardware
+    wallet asks for the proofs of most leaves, as in `sign_psbt`.
+
     Attributes
     ----------
     yielded: list[bytes]
@@ -227,19 +277,21 @@ class ClientCommandInterpreter:
         processing of an APDU.
     """
 
-    def __init__(self):
+    def __init__(self, precompute_proofs: bool = False):
         self.known_preimages: Mapping[bytes, bytes] = {}
         self.known_trees: Mapping[bytes, MerkleTree] = {}
+        self.known_proofs: Mapping[bytes, MerkleProofs] = {}
+        self.precompute_proofs = precompute_proofs
 
         self.yielded: List[bytes] = []
 
-        queue = deque()
+        queue = ElementQueue()
 
         commands = [
             YieldCommand(self.yielded),
             GetPreimageCommand(self.known_preimages, queue),
             GetMerkleLeafIndexCommand(self.known_trees),
-            GetMerkleLeafProofCommand(self.known_trees, queue),
+            GetMerkleLeafProofCommand(self.known_trees, self.known_proofs, queue),
             GetMoreElementsCommand(queue),
         ]
 
@@ -306,12 +358,27 @@ class ClientCommandInterpreter:
             A list of `bytes` corresponding to the leafs of the Merkle tree.
         """
 
-        for el in elements:
-            self.add_known_preimage(b"\x00" + el)
+        self.add_known_tree(MerkleTree(element_hash(el) for el in elements), elements)
 
-        mt = MerkleTree(element_hash(el) for el in elements)
+    def add_known_tree(self, mt: MerkleTree, elements: List[bytes]) -> None:
+        """Adds a known Merkleized list, whose Merkle tree was already computed.
+
+        Same as `add_known_list`, without hashing the elements again: the leaves of `mt` must be
+        `element_hash(el)` for each `el` in `elements`, in the same order.
+
+        Parameters
+        ----------
+        mt : MerkleTree
+            The Merkle tree of `elements`.
+        elements : List[bytes]
+            A list of `bytes` corresponding to the leafs of the Merkle tree.
+        """
+
+        self.known_preimages.update(zip(map(mt.get, range(len(mt))), (b"\x00" + el for el in elements)))
 
         self.known_trees[mt.root] = mt
+        if self.precompute_proofs and len(mt) >= PRECOMPUTE_PROOFS_MIN_LEAVES and mt.root not in self.known_proofs:
+            self.known_proofs[mt.root] = MerkleProofs(mt)
 
     def add_known_mapping(self, mapping: Mapping[bytes, bytes]) -> None:
         """Adds the Merkle trees of keys, and the Merkle tree of values (ordered by key)
@@ -326,9 +393,17 @@ class ClientCommandInterpreter:
             A mapping whose keys and values are `bytes`.
         """
 
-        items_sorted = list(sorted(mapping.items()))
+        self.add_known_merkleized_map(MerkleizedMap.from_mapping(mapping))
+
+    def add_known_merkleized_map(self, merkleized_map: MerkleizedMap) -> None:
+        """Adds the Merkle trees of keys and of values of a Merkleized map, as `add_known_mapping`
+        does, reusing the trees already computed for its commitment.
+
+        Parameters
+        ----------
+        merkleized_map : MerkleizedMap
+            A mapping of bytes to bytes, with the Merkle trees of its keys and values.
+        """
 
-        keys = [i[0] for i in items_sorted]
-        values = [i[1] for i in items_sorted]
-        self.add_known_list(keys)
-        self.add_known_list(values)
+        self.add_known_tree(merkleized_map.keys_tree, merkleized_map.keys)
+        self.add_known_tree(merkleized_map.values_tree, merkleized_map.values)
@@ -2,7 +2,8 @@ import enum
 from typing import List, Tuple, Mapping, Union, Iterator, Optional
 
 from .common import bip32_path_from_string, write_varint
-from .merkle import get_merkleized_map_commitment, MerkleTree, element_hash
+from .merkle import MerkleTree, element_hash
+from .psbt_commitment import PsbtCommitment
 from .wallet import WalletPolicy
 
 # p2 encodes the protocol version implemented
@@ -137,25 +138,20 @@ class BitcoinCommandBuilder:
         wallet: WalletPolicy,
         wallet_hmac: Optional[bytes],
     ):
+        return self.sign_psbt_commitment(
+            PsbtCommitment(global_mapping, input_mappings, output_mappings), wallet, wallet_hmac
+        )
 
-        cdata = bytearray()
-        cdata += get_merkleized_map_commitment(global_mapping)
-
-        cdata += write_varint(len(input_mappings))
-        cdata += MerkleTree(
-            [
-                element_hash(get_merkleized_map_commitment(m_in))
-                for m_in in input_mappings
-            ]
-        ).root
+    def sign_psbt_commitment(
+        self,
+        psbt_commitment: PsbtCommitment,
+        wallet: WalletPolicy,
+        wallet_hmac: Optional[bytes],
+    ):
+        """Same as sign_psbt, with the maps of the PSBT already Merkleized."""
 
-        cdata += write_varint(len(output_mappings))
-        cdata += MerkleTree(
-            [
-                element_hash(get_merkleized_map_commitment(m_out))
-                for m_out in output_mappings
-            ]
-        ).root
+        cdata = bytearray()
+        cdata += psbt_commitment.serialize()
 
         cdata += wallet.id
         cdata += wallet_hmac if wallet_hmac is not None else b'\0' * 32
@@ -1,9 +1,12 @@
-from io import BytesIO
-from typing import List, Optional, Literal
+from typing import List, Literal, Tuple
 from enum import Enum
 from typing import Union
 
 import hashlib
+import struct
+
+# Re-exported, they used to be defined here
+from .ripemd import hash160, ripemd160  # noqa: F401
 
 UINT64_MAX: int = 18446744073709551615
 UINT32_MAX: int = 4294967295
@@ -86,78 +89,103 @@ def write_varint(n: int) -> bytes:
     raise ValueError(f"Can't write to varint: '{n}'!")
 
 
-def read_varint(buf: BytesIO,
-                prefix: Optional[bytes] = None) -> int:
-    b: bytes = prefix if prefix else buf.read(1)
+def serialize_str(value: str) -> bytes:
+    return len(value.encode()).to_bytes(1, byteorder="big") + value.encode()
 
-    if not b:
-        raise ValueError(f"Can't read prefix: '{b}'!")
 
-    n: int = {b"\xfd": 2, b"\xfe": 4, b"\xff": 8}.get(b, 1)  # default to 1
+def sha256(s: bytes) -> bytes:
+    return hashlib.new('sha256', s).digest()
 
-    b = buf.read(n) if n > 1 else b
 
-    if len(b) != n:
-        raise ValueError("Can't read varint!")
+def hash256(s: bytes) -> bytes:
+    return sha256(sha256(s))
 
-    return int.from_bytes(b, byteorder="little")
 
+# Unpackers of the unsigned integers of 1, 2, 4 and 8 bytes, by size and byte order
+_UINT_UNPACKERS = {
+    (size, byteorder): struct.Struct(("<" if byteorder == "little" else ">") + fmt).unpack_from
+    for size, fmt in ((1, "B"), (2, "H"), (4, "I"), (8, "Q"))
+    for byteorder in ("big", "little")
+}
 
-def read_uint(buf: BytesIO,
-              bit_len: int,
-              byteorder: Literal['big', 'little'] = 'little') -> int:
-    size: int = bit_len // 8
-    b: bytes = buf.read(size)
 
-    if len(b) < size:
-        raise ValueError(f"Can't read u{bit_len} in buffer!")
+class ByteStreamParser:
+    """
+    A cursor parsing a request or a response in order, without copying it.
 
-    return int.from_bytes(b, byteorder)
+    All the reads are bounds-checked, and raise ValueError past the end of the bytes. Integers are unpacked in place,
+    and bytes are only copied by the reads returning `bytes`: :meth:`read_view` returns a view instead.
 
+    :param input: The bytes to parse. They are not copied, and must not be modified while the parser or the views it
+        returned are in use.
+    :param offset: The offset of the first byte to parse.
+    """
 
-def serialize_str(value: str) -> bytes:
-    return len(value.encode()).to_bytes(1, byteorder="big") + value.encode()
+    def __init__(self, input: Union[bytes, bytearray, memoryview], offset: int = 0):
+        # bytes are sliced and unpacked directly, which is faster than going through a view for short reads
+        self._data: Union[bytes, memoryview] = input if isinstance(input, bytes) else memoryview(input).cast("B")
+        self._offset = offset
+        self._end = len(self._data)
 
+    @property
+    def offset(self) -> int:
+        """The offset of the next byte to parse."""
+        return self._offset
 
-def ripemd160(x: bytes) -> bytes:
-    try:
-        h = hashlib.new("ripemd160")
-        h.update(x)
-        return h.digest()
-    except BaseException:
-        # ripemd160 is not always present in hashlib.
-        # Fallback to custom implementation if missing.
-        from . import ripemd
-        return ripemd.ripemd160(x)
-
-def sha256(s: bytes) -> bytes:
-    return hashlib.new('sha256', s).digest()
+    def remaining(self) -> int:
+        """Return the number of bytes left to parse."""
+        return self._end - self._offset
 
+    def assert_empty(self) -> None:
+        if self._offset < self._end:
+            raise ValueError("Byte stream was expected to be empty")
 
-def hash160(s: bytes) -> bytes:
-    return ripemd160(sha256(s))
+    def _advance(self, n: int) -> int:
+        # moves past the next n bytes, and returns their offset
+        start = self._offset
+        if n < 0 or start + n > self._end:
+            raise ValueError("Byte stream exhausted")
+        self._offset = start + n
+        return start
 
+    def read_view(self, n: int) -> memoryview:
+        """Read the next n bytes, as a view of the parsed bytes."""
+        start = self._advance(n)
+        return memoryview(self._data)[start:start + n]
 
-def hash256(s: bytes) -> bytes:
-    return sha256(sha256(s))
-
+    def read_bytes(self, n: int) -> bytes:
+        start = self._offset
+        end = start + n
+        if n < 0 or end > self._end:
+            raise ValueError("Byte stream exhausted")
+        self._offset = end
+        data = self._data[start:end]
+        return data if isinstance(data, bytes) else data.tobytes()
 
-class ByteStreamParser:
-    def __init__(self, input: bytes):
-        self.stream = BytesIO(input)
+    def read_remaining(self) -> bytes:
+        """Read all the bytes left to parse."""
+        return self.read_bytes(self._end - self._offset)
 
-    def assert_empty(self) -> bytes:
-        if self.stream.read(1) != b'':
-            raise ValueError("Byte stream was expected to be empty")
+    def read_prefixed_bytes(self) -> bytes:
+        """Read bytes prefixed by their length, on one byte."""
+        return self.read_bytes(self.read_uint(1))
 
-    def read_bytes(self, n: int) -> bytes:
-        result = self.stream.read(n)
-        if len(result) < n:
-            raise ValueError("Byte stream exhausted")
-        return result
+    def read_struct(self, unpacker: struct.Struct) -> Tuple:
+        """Read the values packed with a precompiled struct."""
+        return unpacker.unpack_from(self._data, self._advance(unpacker.size))
 
     def read_uint(self, n: int, byteorder: Literal['big', 'little'] = "big") -> int:
-        return int.from_bytes(self.read_bytes(n), byteorder)
+        start = self._offset
+        end = start + n
+        if n < 0 or end > self._end:
+            raise ValueError("Byte stream exhausted")
+        self._offset = end
+        if n == 1:
+            return self._data[start]
+        unpack = _UINT_UNPACKERS.get((n, byteorder))
+        if unpack is None:
+            return int.from_bytes(self._data[start:end], byteorder)
+        return unpack(self._data, start)[0]
 
     def read_varint(self) -> int:
         prefix = self.read_uint(1)
@@ -16,7 +16,6 @@ from . import _base58 as base58
 from .common import (
     AddressType,
     Chain,
-    hash256,
     hash160,
 )
 from .errors import BadArgumentError
@@ -25,6 +24,14 @@ import binascii
 import hmac
 import hashlib
 import struct
+
+from functools import lru_cache
+
+try:
+    import coincurve as _coincurve
+except ImportError:
+    # pure Python elliptic curve arithmetic
+    _coincurve = None
 from typing import (
     Dict,
     List,
@@ -55,6 +62,68 @@ def is_hardened(i: int) -> bool:
     return i & HARDENED_FLAG != 0
 
 
+# Jacobian coordinates (X, Y, Z) represent the affine point (X / Z^2, Y / Z^3); None is the point at infinity.
+# They avoid the modular inverse of each affine addition, only one inverse is needed to convert the result back.
+JacobianPoint = Optional[Tuple[int, int, int]]
+
+
+def _jacobian_double(P: JacobianPoint) -> JacobianPoint:
+    if P is None or P[1] == 0:
+        return None
+    X, Y, Z = P
+    YY = Y * Y % p
+    S = 4 * X * YY % p
+    M = 3 * X * X % p
+    X3 = (M * M - 2 * S) % p
+    return (X3, (M * (S - X3) - 8 * YY * YY) % p, 2 * Y * Z % p)
+
+
+def _jacobian_add_affine(P: JacobianPoint, q: Point) -> JacobianPoint:
+    # Mixed addition of a point in Jacobian coordinates and an affine point
+    if q is None:
+        return P
+    if P is None:
+        return (q[0], q[1], 1)
+    X1, Y1, Z1 = P
+    Z1Z1 = Z1 * Z1 % p
+    H = (q[0] * Z1Z1 - X1) % p
+    r = (q[1] * Z1 * Z1Z1 - Y1) % p
+    if H == 0:
+        return _jacobian_double(P) if r == 0 else None
+    HH = H * H % p
+    HHH = H * HH % p
+    V = X1 * HH % p
+    X3 = (r * r - HHH - 2 * V) % p
+    return (X3, (r * (V - X3) - Y1 * HHH) % p, Z1 * H % p)
+
+
+def _batch_to_affine(points: Sequence[JacobianPoint]) -> List[Point]:
+    # Montgomery's trick: a single modular inverse for all the points
+    finite = [P for P in points if P is not None]
+    prefix = [1]
+    for P in finite:
+        prefix.append(prefix[-1] * P[2] % p)
+    inv = pow(prefix[-1], p - 2, p)
+    inverses = [0] * len(finite)
+    for i in range(len(finite) - 1, -1, -1):
+        inverses[i] = inv * prefix[i] % p
+        inv = inv * finite[i][2] % p
+    result: List[Point] = []
+    it = iter(zip(finite, inverses))
+    for P in points:
+        if P is None:
+            result.append(None)
+        else:
+            (X, Y, _), z_inv = next(it)
+            zz_inv = z_inv * z_inv % p
+            result.append((X * zz_inv % p, Y * zz_inv * z_inv % p))
+    return result
+
+
+def _to_affine(P: JacobianPoint) -> Point:
+    return _batch_to_affine([P])[0]
+
+
 def point_add(p1: Point, p2: Point) -> Point:
     if (p1 is None):
         return p2
@@ -70,13 +139,104 @@ def point_add(p1: Point, p2: Point) -> Point:
     return (x3, (lam * (p1[0] - x3) - p1[1]) % p)
 
 
-def point_mul(p: Point, n: int) -> Point:
-    r = None
-    for i in range(256):
-        if ((n >> i) & 1):
-            r = point_add(r, p)
-        p = point_add(p, p)
-    return r
+# Width of the windowed NAF of the scalars multiplying arbitrary points
+WNAF_WIDTH = 5
+
+
+def _wnaf(k: int) -> List[int]:
+    """Return the width-WNAF_WIDTH non-adjacent form of k, least significant digit first."""
+    digits = []
+    window = 1 << WNAF_WIDTH
+    while k > 0:
+        if k & 1:
+            d = k & (window - 1)
+            if d >= window // 2:
+                d -= window
+            k -= d
+        else:
+            d = 0
+        digits.append(d)
+        k >>= 1
+    return digits
+
+
+def _point_mul_wnaf(point: Point, k: int) -> Point:
+    # the odd multiples point, 3 * point, ..., (2^(w-1) - 1) * point, in affine coordinates for mixed additions
+    double = _to_affine(_jacobian_double((point[0], point[1], 1)))
+    odd_multiples: List[JacobianPoint] = [(point[0], point[1], 1)]
+    for _ in range((1 << (WNAF_WIDTH - 2)) - 1):
+        odd_multiples.append(_jacobian_add_affine(odd_multiples[-1], double))
+    table = _batch_to_affine(odd_multiples)
+
+    R: JacobianPoint = None
+    for d in reversed(_wnaf(k)):
+        R = _jacobian_double(R)
+        if d > 0:
+            R = _jacobian_add_affine(R, table[d >> 1])
+        elif d < 0:
+            q = table[(-d) >> 1]
+            R = _jacobian_add_affine(R, (q[0], p - q[1]))
+    return _to_affine(R)
+
+
+# Fixed-base comb: _G_TABLE[i][j - 1] is j * 16^i * G, so that k * G is the sum of one table entry per nibble of k,
+# without any doubling. Computed on first use.
+_G_TABLE: List[List[Point]] = []
+
+
+def _g_table() -> List[List[Point]]:
+    if not _G_TABLE:
+        rows: List[JacobianPoint] = []
+        base = (G[0], G[1], 1)
+        for _ in range(64):
+            row = [base]
+            base_affine = _to_affine(base)
+            for _ in range(14):
+                row.append(_jacobian_add_affine(row[-1], base_affine))
+            rows.extend(row)
+            # 16 * base
+            base = _jacobian_add_affine(row[-1], base_affine)
+        affine = _batch_to_affine(rows)
+        _G_TABLE.extend(affine[i:i + 15] for i in range(0, len(affine), 15))
+    return _G_TABLE
+
+
+def _point_mul_g(k: int) -> JacobianPoint:
+    table = _g_table()
+    R: JacobianPoint = None
+    i = 0
+    while k:
+        nibble = k & 0xF
+        if nibble:
+            R = _jacobian_add_affine(R, table[i][nibble - 1])
+        k >>= 4
+        i += 1
+    return R
+
+
+def point_mul(point: Point, k: int) -> Point:
+    """Return k * point. Uses coincurve when installed."""
+    k %= n
+    if point is None or k == 0:
+        return None
+    if _coincurve is not None:
+        if point == G:
+            return _coincurve.PublicKey.from_secret(k.to_bytes(32, byteorder="big")).point()
+        return _coincurve.PublicKey(point_to_bytes(point)).multiply(k.to_bytes(32, byteorder="big")).point()
+    if point == G:
+        return _to_affine(_point_mul_g(k))
+    return _point_mul_wnaf(point, k)
+
+
+def point_add_mul_g(point: Point, k: int) -> Point:
+    """Return point + k * G, as in BIP32 public derivation and taproot tweaks. Uses coincurve when installed."""
+    k %= n
+    if k == 0:
+        return point
+    if _coincurve is not None and point is not None:
+        return _coincurve.PublicKey(point_to_bytes(point)).add(k.to_bytes(32, byteorder="big")).point()
+    # a single conversion to affine coordinates
+    return _to_affine(_jacobian_add_affine(_point_mul_g(k), point))
 
 
 def deserialize_point(b: bytes) -> Point:
@@ -120,7 +280,11 @@ def taproot_tweak_pubkey(pubkey: bytes, h: bytes) -> Tuple[int, bytes]:
     t = int_from_bytes(tagged_hash("TapTweak", pubkey + h))
     if t >= p:
         raise ValueError
-    Q = point_add(lift_x(int_from_bytes(pubkey)), point_mul(G, t))
+    if _coincurve is not None:
+        # the 0x02 prefix selects the even y coordinate, as lift_x does
+        Q = _coincurve.PublicKey(b'\x02' + pubkey).add(t.to_bytes(32, byteorder="big")).point()
+    else:
+        Q = point_add_mul_g(lift_x(int_from_bytes(pubkey)), t)
     return 0 if Q[1] & 1 == 0 else 1, Q[0].to_bytes(32, byteorder="big")
 
 
@@ -131,6 +295,71 @@ def get_taproot_output_key(derived_key: bytes) -> bytes:
     return key
 
 
+# Number of derived child keys kept in memory, shared by all the ExtendedKey instances, so that the common prefix of
+# the derivation paths of a batch of keys is only derived once. The private children are cached too: up to this many
+# private keys derived from an xprv stay in memory until they are evicted or clear_derivation_cache is called
+DERIVATION_CACHE_SIZE = 4096
+
+
+@lru_cache(maxsize=DERIVATION_CACHE_SIZE)
+def _derive_pub_child(pubkey: bytes, chaincode: bytes, i: int) -> Tuple[bytes, bytes]:
+    """Return the public key and the chaincode of the non-hardened child i of the given public key (BIP 32 CKDpub)."""
+
+    # Data to HMAC.  Same as CKDpriv() for public child key.
+    data = pubkey + struct.pack(">L", i)
+
+    # Get HMAC of data
+    Ihmac = hmac.new(chaincode, data, hashlib.sha512).digest()
+    Il = Ihmac[:32]
+    Ir = Ihmac[32:]
+
+    # Construct curve point Il*G+K
+    if _coincurve is not None:
+        child_pubkey = _coincurve.PublicKey(pubkey).add(Il).format()
+    else:
+        Il_int = int(binascii.hexlify(Il), 16)
+        child_pubkey = point_to_bytes(point_add_mul_g(bytes_to_point(pubkey), Il_int))
+
+    return child_pubkey, Ir
+
+
+@lru_cache(maxsize=DERIVATION_CACHE_SIZE)
+def _derive_priv_child(privkey: bytes, pubkey: bytes, chaincode: bytes, i: int) -> Optional[Tuple[bytes, bytes, bytes]]:
+    """
+    Return the private key, public key and chaincode of the child i of the given private key (BIP 32 CKDpriv), or None
+    if the child index is invalid for this key.
+    """
+
+    # Data to HMAC
+    if is_hardened(i):
+        data = b'\0' + privkey + struct.pack(">L", i)
+    else:
+        data = pubkey + struct.pack(">L", i)
+
+    # Get HMAC of data
+    Ihmac = hmac.new(chaincode, data, hashlib.sha512).digest()
+    Il = Ihmac[:32]
+    Ir = Ihmac[32:]
+
+    # Construct new key material from Il and current private key
+    Il_int = int.from_bytes(Il, byteorder="big")
+    if Il_int > n:
+        return None
+
+    privkey_int = int.from_bytes(privkey, byteorder="big")
+    k_int = (Il_int + privkey_int) % n
+    if (k_int == 0):
+        return None
+
+    return k_int.to_bytes(32, byteorder="big"), point_to_bytes(point_mul(G, k_int)), Ir
+
+
+def clear_derivation_cache() -> None:
+    """Forget the child keys derived so far by all the ExtendedKey instances, private keys included."""
+    _derive_pub_child.cache_clear()
+    _derive_priv_child.cache_clear()
+
+
 # An extended public key (xpub) or private key (xprv). Just a data container for now.
 # Only handles deserialization of extended keys into component data to be handled by something else
 class ExtendedKey(object):
@@ -220,9 +449,7 @@ class ExtendedKey(object):
 
         :return: Base58 check encoded xpub
         """
-        data = self.serialize()
-        checksum = hash256(data)[0:4]
-        return base58.encode(data + checksum)
+        return base58.encode_check(self.serialize())
 
     def get_printable_dict(self) -> Dict[str, object]:
         """
@@ -251,33 +478,7 @@ class ExtendedKey(object):
         if not self.privkey:
             raise ValueError("Can only derive a private key from an extended private key")
 
-        # Data to HMAC
-        if is_hardened(i):
-            data = b'\0' + self.privkey + struct.pack(">L", i)
-        else:
-            data = self.pubkey + struct.pack(">L", i)
-
-        # Get HMAC of data
-        Ihmac = hmac.new(self.chaincode, data, hashlib.sha512).digest()
-        Il = Ihmac[:32]
-        Ir = Ihmac[32:]
-
-        # Construct new key material from Il and current private key
-        Il_int = int.from_bytes(Il, byteorder="big")
-        if Il_int > n:
-            return None
-
-        privkey_int = int.from_bytes(self.privkey, byteorder="big")
-        k_int = (Il_int + privkey_int) % n
-        if (k_int == 0):
-            return None
-
-        privkey = k_int.to_bytes(32, byteorder="big")
-        pubkey = point_to_bytes(point_mul(G, k_int))
-
-        chaincode = Ir
-        fingerprint = hash160(self.pubkey)[0:4]
-        return ExtendedKey(ExtendedKey.TESTNET_PRIVATE if self.is_testnet else ExtendedKey.MAINNET_PRIVATE, self.depth + 1, fingerprint, i, chaincode, privkey, pubkey)
+        return self._derive_child(i, hash160(self.pubkey)[0:4], private=True)
 
     def derive_pub(self, i: int) -> 'ExtendedKey':
         """
@@ -288,23 +489,20 @@ class ExtendedKey(object):
         if is_hardened(i):
             raise ValueError("Index cannot be larger than 2^31")
 
-        # Data to HMAC.  Same as CKDpriv() for public child key.
-        data = self.pubkey + struct.pack(">L", i)
-
-        # Get HMAC of data
-        Ihmac = hmac.new(self.chaincode, data, hashlib.sha512).digest()
-        Il = Ihmac[:32]
-        Ir = Ihmac[32:]
-
-        # Construct curve point Il*G+K
-        Il_int = int(binascii.hexlify(Il), 16)
-        child_pubkey = point_add(point_mul(G, Il_int), bytes_to_point(self.pubkey))
+        return self._derive_child(i, hash160(self.pubkey)[0:4], private=False)
 
-        # Construct and return a new BIP32Key
-        pubkey = point_to_bytes(child_pubkey)
-        chaincode = Ir
-        fingerprint = hash160(self.pubkey)[0:4]
-        return ExtendedKey(ExtendedKey.TESTNET_PUBLIC if self.is_testnet else ExtendedKey.MAINNET_PUBLIC, self.depth + 1, fingerprint, i, chaincode, None, pubkey)
+    def _derive_child(self, i: int, fingerprint: bytes, private: bool) -> 'ExtendedKey':
+        if private:
+            child = _derive_priv_child(self.privkey, self.pubkey, self.chaincode, i)
+            if child is None:
+                return None
+            privkey, pubkey, chaincode = child
+            version = ExtendedKey.TESTNET_PRIVATE if self.is_testnet else ExtendedKey.MAINNET_PRIVATE
+        else:
+            privkey = None
+            pubkey, chaincode = _derive_pub_child(self.pubkey, self.chaincode, i)
+            version = ExtendedKey.TESTNET_PUBLIC if self.is_testnet else ExtendedKey.MAINNET_PUBLIC
+        return ExtendedKey(version, self.depth + 1, fingerprint, i, chaincode, privkey, pubkey)
 
     def derive_priv_path(self, path: Sequence[int]) -> 'ExtendedKey':
         """
@@ -328,6 +526,28 @@ class ExtendedKey(object):
             key = key.derive_pub(i)
         return key
 
+    def derive_range(self, path_prefix: Sequence[int], start: int, count: int) -> List['ExtendedKey']:
+        """
+        Derive the keys at path_prefix/start, ..., path_prefix/(start + count - 1), deriving the prefix only once.
+        The keys are private if this key is private.
+
+        :param path_prefix: Sequence of integers for the path of the parent of the keys to derive
+        :param start: The child index of the first key to derive
+        :param count: The number of keys to derive
+        """
+        if count < 0 or start < 0 or start + count > 1 << 32:
+            raise ValueError("Child indexes must be between 0 and 2^32 - 1")
+        if count == 0:
+            return []
+        if self.is_private:
+            parent = self.derive_priv_path(path_prefix)
+        else:
+            parent = self.derive_pub_path(path_prefix)
+            if is_hardened(start + count - 1):
+                raise ValueError("Index cannot be larger than 2^31")
+        fingerprint = hash160(parent.pubkey)[0:4]
+        return [parent._derive_child(i, fingerprint, self.is_private) for i in range(start, start + count)]
+
     def neutered(self) -> 'ExtendedKey':
         """
         Returns the public key corresponding to this private key.
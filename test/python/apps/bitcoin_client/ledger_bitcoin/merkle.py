@@ -1,4 +1,6 @@
-from typing import List, Iterable, Mapping
+from hashlib import sha256 as _sha256
+from itertools import accumulate, chain, islice, repeat
+from typing import Dict, List, Iterable, Mapping, Optional
 
 from .common import write_varint, sha256
 
@@ -63,51 +65,18 @@ def combine_hashes(left: bytes, right: bytes) -> bytes:
     return sha256(b'\x01' + left + right)
 
 
-# root is the only node with parent == None
-# leaves have left == right == None
-class Node:
-    def __init__(self, left, right, parent, value: bytes):
-        self.left = left
-        self.right = right
-        self.parent = parent
-        self.value = value
-
-    def recompute_value(self):
-        assert self.left is not None
-        assert self.right is not None
-        self.value = combine_hashes(self.left.value, self.right.value)
-
-    def sibling(self):
-        if self.parent is None:
-            raise IndexError("The root does not have a sibling.")
-
-        if self.parent.left == self:
-            return self.parent.right
-        elif self.parent.right == self:
-            return self.parent.left
-        else:
-            raise IndexError("Invalid state: not a child of his parent.")
-
-
-def make_tree(leaves: List[Node], begin: int, size: int) -> Node:
-    """Given a list of nodes, builds the left-complete Merkle tree on top of it.
-    The nodes in `leaves` are modified by setting their `parent` field appropriately.
-    It returns the root of the newly built tree.
-    """
+HASH_LEN = 32
 
-    if size == 0:
-        return []
-    if size == 1:
-        return leaves[begin]
 
-    lchild_size = largest_power_of_2_less_than(size)
+def _parent_value(level: bytearray, index: int) -> bytes:
+    """Value of the parent of the node at position `index` of `level`: the hash of the node with its sibling, or the
+    node itself if it is the last node of a level with an odd number of nodes."""
 
-    lchild = make_tree(leaves, begin, lchild_size)
-    rchild = make_tree(leaves, begin + lchild_size, size - lchild_size)
-    root = Node(lchild, rchild, None, None)
-    root.recompute_value()
-    lchild.parent = rchild.parent = root
-    return root
+    offset = (index & ~1) * HASH_LEN
+    if offset + 2 * HASH_LEN <= len(level):
+        # left and right children are contiguous
+        return _sha256(b'\x01' + level[offset:offset + 2 * HASH_LEN]).digest()
+    return bytes(level[offset:offset + HASH_LEN])
 
 
 class MerkleTree:
@@ -125,72 +94,82 @@ class MerkleTree:
     - There are always n - 1 internal nodes; all the internal nodes have exactly two children.
     - If a subtree has n > 1 leaves, then the left subchild is a complete subtree with p leaves, where p is the largest
       power of 2 smaller than n.
+
+    The tree is stored level by level, each level being the concatenation of its 32-byte hashes in a `bytearray`,
+    from the leaves (level 0) to the root. The same tree is obtained bottom-up by hashing the nodes of each level by
+    pairs, the last node of a level with an odd number of nodes being carried to the next level unchanged.
     """
 
     def __init__(self, elements: Iterable[bytes] = []):
-        self.leaves = [Node(None, None, None, el) for el in elements]
-        n_elements = len(self.leaves)
-        if n_elements > 0:
-            self.root_node = make_tree(self.leaves, 0, n_elements)
-            self.depth = ceil_lg(n_elements)
-        else:
-            self.root_node = None
-            self.depth = None
+        elements = list(elements)
+        for el in elements:
+            if len(el) != HASH_LEN:
+                raise ValueError("Inserted elements must be exactly 32 bytes long")
+
+        self._index: Dict[bytes, int] = {}
+        for i, el in enumerate(elements):
+            self._index.setdefault(bytes(el), i)
+
+        level = bytearray(b''.join(elements))
+        self._levels: List[bytearray] = [level]
+        while len(level) > HASH_LEN:
+            n_pairs = len(level) // (2 * HASH_LEN)
+            parent = bytearray(b''.join(
+                _sha256(b'\x01' + level[offset:offset + 2 * HASH_LEN]).digest()
+                for offset in range(0, n_pairs * 2 * HASH_LEN, 2 * HASH_LEN)
+            ))
+            if len(level) % (2 * HASH_LEN) != 0:
+                parent += level[-HASH_LEN:]
+            self._levels.append(parent)
+            level = parent
 
     def __len__(self) -> int:
         """Return the total number of leaves in the tree."""
-        return len(self.leaves)
+        return len(self._levels[0]) // HASH_LEN
+
+    @property
+    def depth(self) -> Optional[int]:
+        """Return the number of levels above the leaves, or None if the tree is empty."""
+        return None if len(self) == 0 else len(self._levels) - 1
 
     @property
     def root(self) -> bytes:
         """Return the Merkle root, or None if the tree is empty."""
-        return NIL if self.root_node is None else self.root_node.value
+        return NIL if len(self) == 0 else bytes(self._levels[-1])
 
     def copy(self):
         """Return an identical copy of this Merkle tree."""
-        return MerkleTree([leaf.value for leaf in self.leaves])
+        result = MerkleTree()
+        result._levels = [bytearray(level) for level in self._levels]
+        result._index = dict(self._index)
+        return result
+
+    def _fix_up(self, index: int) -> None:
+        """Recompute the ancestors of the leaf at position `index`, extending the upper levels if needed."""
+        k = 0
+        while len(self._levels[k]) > HASH_LEN:
+            if k + 1 == len(self._levels):
+                self._levels.append(bytearray())
+            parent_level = self._levels[k + 1]
+            value = _parent_value(self._levels[k], index)
+            index >>= 1
+            offset = index * HASH_LEN
+            if offset == len(parent_level):
+                parent_level += value
+            else:
+                parent_level[offset:offset + HASH_LEN] = value
+            k += 1
 
     def add(self, x: bytes) -> None:
         """Add an element as new leaf, and recompute the tree accordingly. Cost O(log n)."""
 
-        if len(x) != 32:
+        if len(x) != HASH_LEN:
             raise ValueError("Inserted elements must be exactly 32 bytes long")
 
-        new_leaf = Node(None, None, None, x)
-        self.leaves.append(new_leaf)
-        if len(self.leaves) == 1:
-            self.root_node = new_leaf
-            self.depth = 0
-            return
-
-        # add a new leaf
-        if self.depth == 0:
-            ltree_size = 0
-        else:
-            # number of leaves of the left subtree of cur_root
-            ltree_size = 1 << (self.depth - 1)
-
-        cur_root = self.root_node
-        cur_root_size = len(self.leaves) - 1
-
-        while not is_power_of_2(cur_root_size):
-            cur_root = cur_root.right
-            cur_root_size -= ltree_size
-            ltree_size /= 2
-
-        # node value will be computed later
-        new_node = Node(cur_root, new_leaf, cur_root.parent, None)
-        if cur_root.parent is None:
-            # replacing the root
-            self.depth += 1
-            self.root_node = new_node
-        else:
-            assert cur_root.parent.right == cur_root
-            cur_root.parent.right = new_node
-        cur_root.parent = new_node
-        new_leaf.parent = new_node
-
-        self.fix_up(new_node)
+        index = len(self)
+        self._levels[0] += x
+        self._index.setdefault(bytes(x), index)
+        self._fix_up(index)
 
     def set(self, index: int, x: bytes) -> None:
         """
@@ -199,52 +178,118 @@ class MerkleTree:
 
         Cost: Worst case O(log n).
         """
-        assert 0 <= index <= len(self.leaves)
 
-        if not (0 <= index <= len(self.leaves)):
+        if not (0 <= index <= len(self)):
             raise ValueError(
                 "The index must be at least 0, and at most the current number of leaves.")
 
-        if len(x) != 32:
+        if len(x) != HASH_LEN:
             raise ValueError("Inserted elements must be exactly 32 bytes long.")
 
-        if index == len(self.leaves):
+        if index == len(self):
             self.add(x)
-        else:
-            self.leaves[index].value = x
-            self.fix_up(self.leaves[index].parent)
+            return
 
-    def fix_up(self, node: Node):
-        while node is not None:
-            node.recompute_value()
-            node = node.parent
+        old = self.get(index)
+        leaves = self._levels[0]
+        leaves[index * HASH_LEN:(index + 1) * HASH_LEN] = x
+        if self._index.get(old) == index:
+            # the replaced leaf was the first occurrence of its value, look for the next one
+            del self._index[old]
+            offset = leaves.find(old, (index + 1) * HASH_LEN)
+            while offset != -1 and offset % HASH_LEN != 0:
+                offset = leaves.find(old, offset + 1)
+            if offset != -1:
+                self._index[old] = offset // HASH_LEN
+        x = bytes(x)
+        if self._index.get(x, index + 1) > index:
+            self._index[x] = index
+        self._fix_up(index)
 
     def get(self, i: int) -> bytes:
         """Return the value of the leaf with index `i`, where 0 <= i < len(self)."""
-        return self.leaves[i].value
+        if not (0 <= i < len(self)):
+            raise IndexError("Leaf index out of range")
+        return bytes(self._levels[0][i * HASH_LEN:(i + 1) * HASH_LEN])
 
     def leaf_index(self, x: bytes) -> int:
-        """Return the index of the leaf with hash `x`. Raises `ValueError` if not found."""
-        idx = 0
-        while idx < len(self):
-            if self.leaves[idx].value == x:
-                return idx
-            idx += 1
-        raise ValueError("Leaf not found")
+        """Return the index of the first leaf with hash `x`. Raises `ValueError` if not found. Cost O(1)."""
+        try:
+            return self._index[bytes(x)]
+        except KeyError:
+            raise ValueError("Leaf not found") from None
 
     def prove_leaf(self, index: int) -> List[bytes]:
         """Produce the Merkle proof of membership for the leaf with the given index where 0 <= index < len(self)."""
-        node = self.leaves[index]
+        if not (0 <= index < len(self)):
+            raise IndexError("Leaf index out of range")
+
         proof = []
-        while node.parent is not None:
-            sibling = node.sibling()
-            assert sibling is not None
+        for level in self._levels[:-1]:
+            offset = (index ^ 1) * HASH_LEN
+            # the last node of a level with an odd number of nodes has no sibling
+            if offset < len(level):
+                proof.append(bytes(level[offset:offset + HASH_LEN]))
+            index >>= 1
+        return proof
+
 
-            proof.append(sibling.value)
+class MerkleProofs:
+    """
+    The Merkle proofs of membership of all the leaves of a tree, computed in one pass and stored as a single
+    contiguous buffer: the proof of a leaf is the slice of the concatenation of its sibling hashes, from the leaf to
+    the root. The proofs are not updated if the tree is modified afterwards.
+    """
 
-            node = node.parent
+    def __init__(self, tree: MerkleTree):
+        n = len(tree)
+        columns = []
+        for k, level in enumerate(tree._levels[:-1]):
+            n_nodes = len(level) // HASH_LEN
+            # the sibling of each node of the level; the last node of a level with an odd number of nodes has none
+            siblings = [bytes(level[((j ^ 1) * HASH_LEN):((j ^ 1) + 1) * HASH_LEN]) for j in range(n_nodes)]
+            # the node at level k above the leaf with index i is the node i >> k
+            columns.append(islice(chain.from_iterable(map(repeat, siblings, repeat(1 << k, n_nodes))), n))
+        proofs = list(map(b''.join, zip(*columns))) if columns else [b''] * n
+        self._slab = memoryview(b''.join(proofs))
+        self._offsets = [0, *accumulate(map(len, proofs))]
 
-        return proof
+    def __len__(self) -> int:
+        """Return the number of leaves of the tree."""
+        return len(self._offsets) - 1
+
+    def proof(self, index: int) -> memoryview:
+        """Return the concatenated Merkle proof of the leaf with the given index, where 0 <= index < len(self)."""
+        if not (0 <= index < len(self)):
+            raise IndexError("Leaf index out of range")
+        return self._slab[self._offsets[index]:self._offsets[index + 1]]
+
+
+class MerkleizedMap:
+    """
+    A map of bytes to bytes with the Merkle trees of its keys and of its values, both ordered by key. Each key and
+    value is hashed once, the trees can then be shared by the map commitment and the client command interpreter.
+    """
+
+    def __init__(self, keys: List[bytes], values: List[bytes], keys_tree: MerkleTree, values_tree: MerkleTree):
+        self.keys = keys
+        self.values = values
+        self.keys_tree = keys_tree
+        self.values_tree = values_tree
+
+    @classmethod
+    def from_mapping(cls, mapping: Mapping[bytes, bytes]) -> 'MerkleizedMap':
+        keys = sorted(mapping)
+        values = [mapping[key] for key in keys]
+        return cls(keys, values, MerkleTree(map(element_hash, keys)), MerkleTree(map(element_hash, values)))
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    @property
+    def commitment(self) -> bytes:
+        """The serialized Merkleized map commitment, as returned by `get_merkleized_map_commitment`."""
+        return write_varint(len(self.keys)) + self.keys_tree.root + self.values_tree.root
 
 
 def get_merkleized_map_commitment(mapping: Mapping[bytes, bytes]) -> bytes:
@@ -254,7 +299,4 @@ def get_merkleized_map_commitment(mapping: Mapping[bytes, bytes]) -> bytes:
        - the root of the Merkle tree of the values.
     """
 
-    items_sorted = list(sorted(mapping.items()))
-    keys_hashes = [element_hash(i[0]) for i in items_sorted]
-    values_hashes = [element_hash(i[1]) for i in items_sorted]
-    return write_varint(len(mapping)) + MerkleTree(keys_hashes).root + MerkleTree(values_hashes).root
+    return MerkleizedMap.from_mapping(mapping).commitment
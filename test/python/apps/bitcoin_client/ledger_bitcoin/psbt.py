@@ -36,9 +36,9 @@ from ._serialize import (
     deser_string,
     Readable,
     ser_compact_size,
-    ser_string,
     ser_uint256,
     uint256_from_str,
+    Writer,
 )
 
 def DeserializeHDKeypath(
@@ -75,12 +75,12 @@ def SerializeHDKeypath(hd_keypaths: Mapping[bytes, KeyOriginInfo], type: bytes)
     :param type: The PSBT type bytes to use
     :returns: The serialized keypaths
     """
-    r = b""
+    w = Writer()
     for pubkey, path in sorted(hd_keypaths.items()):
-        r += ser_string(type + pubkey)
+        w.write_string(type + pubkey)
         packed = path.serialize()
-        r += ser_string(packed)
-    return r
+        w.write_string(packed)
+    return w.getvalue()
 
 class PartiallySignedInput:
     """
@@ -189,7 +189,6 @@ class PartiallySignedInput:
                 self.non_witness_utxo = CTransaction()
                 utxo_bytes = BufferedReader(BytesIO(deser_string(f))) # type: ignore
                 self.non_witness_utxo.deserialize(utxo_bytes)
-                self.non_witness_utxo.rehash()
             elif key_type == PartiallySignedInput.PSBT_IN_WITNESS_UTXO:
                 if key in key_lookup:
                     raise PSBTSerializationError("Duplicate Key, input witness utxo already provided")
@@ -376,103 +375,87 @@ class PartiallySignedInput:
 
         :returns: The serialized PSBT input
         """
-        r = b""
+        w = Writer()
+        self.serialize_into(w)
+        return w.getvalue()
 
+    def serialize_into(self, w: Writer) -> None:
+        """
+        Serialize this PSBT input at the end of a writer
+
+        :param w: The writer
+        """
         if self.non_witness_utxo:
-            r += ser_string(ser_compact_size(PartiallySignedInput.PSBT_IN_NON_WITNESS_UTXO))
             tx = self.non_witness_utxo.serialize_with_witness()
-            r += ser_string(tx)
+            w.write_map_entry(PartiallySignedInput.PSBT_IN_NON_WITNESS_UTXO, b"", tx)
 
         if self.witness_utxo:
-            r += ser_string(ser_compact_size(PartiallySignedInput.PSBT_IN_WITNESS_UTXO))
             tx = self.witness_utxo.serialize()
-            r += ser_string(tx)
+            w.write_map_entry(PartiallySignedInput.PSBT_IN_WITNESS_UTXO, b"", tx)
 
         if len(self.final_script_sig) == 0 and self.final_script_witness.is_null():
             for pubkey, sig in sorted(self.partial_sigs.items()):
-                r += ser_string(ser_compact_size(PartiallySignedInput.PSBT_IN_PARTIAL_SIG) + pubkey)
-                r += ser_string(sig)
+                w.write_map_entry(PartiallySignedInput.PSBT_IN_PARTIAL_SIG, pubkey, sig)
 
             if self.sighash is not None:
-                r += ser_string(ser_compact_size(PartiallySignedInput.PSBT_IN_SIGHASH_TYPE))
-                r += ser_string(struct.pack("<I", self.sighash))
+                w.write_map_entry(PartiallySignedInput.PSBT_IN_SIGHASH_TYPE, b"", struct.pack("<I", self.sighash))
 
             if len(self.redeem_script) != 0:
-                r += ser_string(ser_compact_size(PartiallySignedInput.PSBT_IN_REDEEM_SCRIPT))
-                r += ser_string(self.redeem_script)
+                w.write_map_entry(PartiallySignedInput.PSBT_IN_REDEEM_SCRIPT, b"", self.redeem_script)
 
             if len(self.witness_script) != 0:
-                r += ser_string(ser_compact_size(PartiallySignedInput.PSBT_IN_WITNESS_SCRIPT))
-                r += ser_string(self.witness_script)
+                w.write_map_entry(PartiallySignedInput.PSBT_IN_WITNESS_SCRIPT, b"", self.witness_script)
 
-            r += SerializeHDKeypath(self.hd_keypaths, ser_compact_size(PartiallySignedInput.PSBT_IN_BIP32_DERIVATION))
+            w.write(SerializeHDKeypath(self.hd_keypaths, ser_compact_size(PartiallySignedInput.PSBT_IN_BIP32_DERIVATION)))
 
             if len(self.tap_key_sig) != 0:
-                r += ser_string(ser_compact_size(PartiallySignedInput.PSBT_IN_TAP_KEY_SIG))
-                r += ser_string(self.tap_key_sig)
+                w.write_map_entry(PartiallySignedInput.PSBT_IN_TAP_KEY_SIG, b"", self.tap_key_sig)
 
             for (xonly, leaf_hash), sig in self.tap_script_sigs.items():
-                r += ser_string(ser_compact_size(PartiallySignedInput.PSBT_IN_TAP_SCRIPT_SIG) + xonly + leaf_hash)
-                r += ser_string(sig)
+                w.write_map_entry(PartiallySignedInput.PSBT_IN_TAP_SCRIPT_SIG, xonly + leaf_hash, sig)
 
             for (script, leaf_ver), control_blocks in self.tap_scripts.items():
                 for control_block in control_blocks:
-                    r += ser_string(ser_compact_size(PartiallySignedInput.PSBT_IN_TAP_LEAF_SCRIPT) + control_block)
-                    r += ser_string(script + struct.pack("B", leaf_ver))
+                    w.write_map_entry(PartiallySignedInput.PSBT_IN_TAP_LEAF_SCRIPT, control_block, script + struct.pack("B", leaf_ver))
 
             for xonly, (leaf_hashes, origin) in self.tap_bip32_paths.items():
-                r += ser_string(ser_compact_size(PartiallySignedInput.PSBT_IN_TAP_BIP32_DERIVATION) + xonly)
-                value = ser_compact_size(len(leaf_hashes))
-                for lh in leaf_hashes:
-                    value += lh
-                value += origin.serialize()
-                r += ser_string(value)
+                value = b"".join([ser_compact_size(len(leaf_hashes)), *leaf_hashes, origin.serialize()])
+                w.write_map_entry(PartiallySignedInput.PSBT_IN_TAP_BIP32_DERIVATION, xonly, value)
 
             if len(self.tap_internal_key) != 0:
-                r += ser_string(ser_compact_size(PartiallySignedInput.PSBT_IN_TAP_INTERNAL_KEY))
-                r += ser_string(self.tap_internal_key)
+                w.write_map_entry(PartiallySignedInput.PSBT_IN_TAP_INTERNAL_KEY, b"", self.tap_internal_key)
 
             if len(self.tap_merkle_root) != 0:
-                r += ser_string(ser_compact_size(PartiallySignedInput.PSBT_IN_TAP_MERKLE_ROOT))
-                r += ser_string(self.tap_merkle_root)
+                w.write_map_entry(PartiallySignedInput.PSBT_IN_TAP_MERKLE_ROOT, b"", self.tap_merkle_root)
 
         if len(self.final_script_sig) != 0:
-            r += ser_string(ser_compact_size(PartiallySignedInput.PSBT_IN_FINAL_SCRIPTSIG))
-            r += ser_string(self.final_script_sig)
+            w.write_map_entry(PartiallySignedInput.PSBT_IN_FINAL_SCRIPTSIG, b"", self.final_script_sig)
 
         if not self.final_script_witness.is_null():
-            r += ser_string(ser_compact_size(PartiallySignedInput.PSBT_IN_FINAL_SCRIPTWITNESS))
             witstack = self.final_script_witness.serialize()
-            r += ser_string(witstack)
+            w.write_map_entry(PartiallySignedInput.PSBT_IN_FINAL_SCRIPTWITNESS, b"", witstack)
 
         if self.version >= 2:
             if len(self.prev_txid) != 0:
-                r += ser_string(ser_compact_size(PartiallySignedInput.PSBT_IN_PREVIOUS_TXID))
-                r += ser_string(self.prev_txid)
+                w.write_map_entry(PartiallySignedInput.PSBT_IN_PREVIOUS_TXID, b"", self.prev_txid)
 
             if self.prev_out is not None:
-                r += ser_string(ser_compact_size(PartiallySignedInput.PSBT_IN_OUTPUT_INDEX))
-                r += ser_string(struct.pack("<I", self.prev_out))
+                w.write_map_entry(PartiallySignedInput.PSBT_IN_OUTPUT_INDEX, b"", struct.pack("<I", self.prev_out))
 
             if self.sequence is not None:
-                r += ser_string(ser_compact_size(PartiallySignedInput.PSBT_IN_SEQUENCE))
-                r += ser_string(struct.pack("<I", self.sequence))
+                w.write_map_entry(PartiallySignedInput.PSBT_IN_SEQUENCE, b"", struct.pack("<I", self.sequence))
 
             if self.time_locktime is not None:
-                r += ser_string(ser_compact_size(PartiallySignedInput.PSBT_IN_REQUIRED_TIME_LOCKTIME))
-                r += ser_string(struct.pack("<I", self.time_locktime))
+                w.write_map_entry(PartiallySignedInput.PSBT_IN_REQUIRED_TIME_LOCKTIME, b"", struct.pack("<I", self.time_locktime))
 
             if self.height_locktime is not None:
-                r += ser_string(ser_compact_size(PartiallySignedInput.PSBT_IN_REQUIRED_HEIGHT_LOCKTIME))
-                r += ser_string(struct.pack("<I", self.height_locktime))
+                w.write_map_entry(PartiallySignedInput.PSBT_IN_REQUIRED_HEIGHT_LOCKTIME, b"", struct.pack("<I", self.height_locktime))
 
         for key, value in sorted(self.unknown.items()):
-            r += ser_string(key)
-            r += ser_string(value)
+            w.write_string(key)
+            w.write_string(value)
 
-        r += b"\x00"
-
-        return r
+        w.write(b"\x00")
 
 class PartiallySignedOutput:
     """
@@ -614,49 +597,46 @@ class PartiallySignedOutput:
 
         :returns: The serialized PSBT output
         """
-        r = b""
+        w = Writer()
+        self.serialize_into(w)
+        return w.getvalue()
+
+    def serialize_into(self, w: Writer) -> None:
+        """
+        Serialize this PSBT output at the end of a writer
+
+        :param w: The writer
+        """
         if len(self.redeem_script) != 0:
-            r += ser_string(ser_compact_size(PartiallySignedOutput.PSBT_OUT_REDEEM_SCRIPT))
-            r += ser_string(self.redeem_script)
+            w.write_map_entry(PartiallySignedOutput.PSBT_OUT_REDEEM_SCRIPT, b"", self.redeem_script)
 
         if len(self.witness_script) != 0:
-            r += ser_string(ser_compact_size(PartiallySignedOutput.PSBT_OUT_WITNESS_SCRIPT))
-            r += ser_string(self.witness_script)
+            w.write_map_entry(PartiallySignedOutput.PSBT_OUT_WITNESS_SCRIPT, b"", self.witness_script)
 
-        r += SerializeHDKeypath(self.hd_keypaths, ser_compact_size(PartiallySignedOutput.PSBT_OUT_BIP32_DERIVATION))
+        w.write(SerializeHDKeypath(self.hd_keypaths, ser_compact_size(PartiallySignedOutput.PSBT_OUT_BIP32_DERIVATION)))
 
         if self.version >= 2:
             if self.amount is not None:
-                r += ser_string(ser_compact_size(PartiallySignedOutput.PSBT_OUT_AMOUNT))
-                r += ser_string(struct.pack("<q", self.amount))
+                w.write_map_entry(PartiallySignedOutput.PSBT_OUT_AMOUNT, b"", struct.pack("<q", self.amount))
 
             if len(self.script) != 0:
-                r += ser_string(ser_compact_size(PartiallySignedOutput.PSBT_OUT_SCRIPT))
-                r += ser_string(self.script)
+                w.write_map_entry(PartiallySignedOutput.PSBT_OUT_SCRIPT, b"", self.script)
 
         if len(self.tap_internal_key) != 0:
-            r += ser_string(ser_compact_size(PartiallySignedOutput.PSBT_OUT_TAP_INTERNAL_KEY))
-            r += ser_string(self.tap_internal_key)
+            w.write_map_entry(PartiallySignedOutput.PSBT_OUT_TAP_INTERNAL_KEY, b"", self.tap_internal_key)
 
         if len(self.tap_tree) != 0:
-            r += ser_string(ser_compact_size(PartiallySignedOutput.PSBT_OUT_TAP_TREE))
-            r += ser_string(self.tap_tree)
+            w.write_map_entry(PartiallySignedOutput.PSBT_OUT_TAP_TREE, b"", self.tap_tree)
 
         for xonly, (leaf_hashes, origin) in self.tap_bip32_paths.items():
-            r += ser_string(ser_compact_size(PartiallySignedOutput.PSBT_OUT_TAP_BIP32_DERIVATION) + xonly)
-            value = ser_compact_size(len(leaf_hashes))
-            for lh in leaf_hashes:
-                value += lh
-            value += origin.serialize()
-            r += ser_string(value)
+            value = b"".join([ser_compact_size(len(leaf_hashes)), *leaf_hashes, origin.serialize()])
+            w.write_map_entry(PartiallySignedOutput.PSBT_OUT_TAP_BIP32_DERIVATION, xonly, value)
 
         for key, value in sorted(self.unknown.items()):
-            r += ser_string(key)
-            r += ser_string(value)
-
-        r += b"\x00"
+            w.write_string(key)
+            w.write_string(value)
 
-        return r
+        w.write(b"\x00")
 
     def get_txout(self) -> CTxOut:
         """
@@ -708,7 +688,14 @@ class PSBT(object):
 
         :param psbt: A base 64 PSBT.
         """
-        psbt_bytes = base64.b64decode(psbt.strip())
+        self.deserialize_bytes(base64.b64decode(psbt.strip()))
+
+    def deserialize_bytes(self, psbt_bytes: bytes) -> None:
+        """
+        Deserialize a PSBT that is not encoded.
+
+        :param psbt_bytes: The serialized PSBT.
+        """
         f = BufferedReader(BytesIO(psbt_bytes)) # type: ignore
         end = len(psbt_bytes)
 
@@ -861,8 +848,8 @@ class PSBT(object):
             else:
                 prev_txid = ser_uint256(self.tx.vin[i].prevout.hash)
 
+            # reading the hash computes the txid of the non witness utxo, once
             if psbt_in.non_witness_utxo:
-                psbt_in.non_witness_utxo.rehash()
                 if psbt_in.non_witness_utxo.hash != prev_txid:
                     raise PSBTSerializationError("Non-witness UTXO does not match outpoint hash")
 
@@ -890,64 +877,61 @@ class PSBT(object):
 
         :returns: The base 64 encoded string.
         """
-        r = b""
+        return base64.b64encode(self.serialize_bytes()).decode()
+
+    def serialize_bytes(self) -> bytes:
+        """
+        Serialize the PSBT, without encoding it.
+
+        :returns: The serialized PSBT.
+        """
+        w = Writer()
 
         # magic bytes
-        r += b"psbt\xff"
+        w.write(b"psbt\xff")
 
         if self.version == 0:
-            # unsigned tx flag
-            r += ser_string(ser_compact_size(PSBT.PSBT_GLOBAL_UNSIGNED_TX))
-
             # write serialized tx
             tx = self.tx.serialize_with_witness()
-            r += ser_compact_size(len(tx))
-            r += tx
+            w.write_map_entry(PSBT.PSBT_GLOBAL_UNSIGNED_TX, b"", tx)
 
         # write xpubs
-        r += SerializeHDKeypath(self.xpub, ser_compact_size(PSBT.PSBT_GLOBAL_XPUB))
+        w.write(SerializeHDKeypath(self.xpub, ser_compact_size(PSBT.PSBT_GLOBAL_XPUB)))
 
         if self.version >= 2:
             assert self.tx_version is not None
-            r += ser_string(ser_compact_size(PSBT.PSBT_GLOBAL_TX_VERSION))
-            r += ser_string(struct.pack("<I", self.tx_version))
+            w.write_map_entry(PSBT.PSBT_GLOBAL_TX_VERSION, b"", struct.pack("<I", self.tx_version))
 
             if self.fallback_locktime is not None:
-                r += ser_string(ser_compact_size(PSBT.PSBT_GLOBAL_FALLBACK_LOCKTIME))
-                r += ser_string(struct.pack("<I", self.fallback_locktime))
+                w.write_map_entry(PSBT.PSBT_GLOBAL_FALLBACK_LOCKTIME, b"", struct.pack("<I", self.fallback_locktime))
 
-            r += ser_string(ser_compact_size(PSBT.PSBT_GLOBAL_INPUT_COUNT))
-            r += ser_string(ser_compact_size(len(self.inputs)))
+            w.write_map_entry(PSBT.PSBT_GLOBAL_INPUT_COUNT, b"", ser_compact_size(len(self.inputs)))
 
-            r += ser_string(ser_compact_size(PSBT.PSBT_GLOBAL_OUTPUT_COUNT))
-            r += ser_string(ser_compact_size(len(self.outputs)))
+            w.write_map_entry(PSBT.PSBT_GLOBAL_OUTPUT_COUNT, b"", ser_compact_size(len(self.outputs)))
 
             if self.tx_modifiable is not None:
-                r += ser_string(ser_compact_size(PSBT.PSBT_GLOBAL_TX_MODIFIABLE))
-                r += ser_string(struct.pack("<B", self.tx_modifiable))
+                w.write_map_entry(PSBT.PSBT_GLOBAL_TX_MODIFIABLE, b"", struct.pack("<B", self.tx_modifiable))
 
         if self.version > 0 or self.explicit_version:
-            r += ser_string(ser_compact_size(PSBT.PSBT_GLOBAL_VERSION))
-            r += ser_string(struct.pack("<I", self.version))
+            w.write_map_entry(PSBT.PSBT_GLOBAL_VERSION, b"", struct.pack("<I", self.version))
 
         # unknowns
         for key, value in sorted(self.unknown.items()):
-            r += ser_string(key)
-            r += ser_string(value)
+            w.write_string(key)
+            w.write_string(value)
 
         # separator
-        r += b"\x00"
+        w.write(b"\x00")
 
         # inputs
         for input in self.inputs:
-            r += input.serialize()
+            input.serialize_into(w)
 
         # outputs
         for output in self.outputs:
-            r += output.serialize()
+            output.serialize_into(w)
 
-        # return hex string
-        return base64.b64encode(r).decode()
+        return w.getvalue()
 
     def cache_unsigned_tx_pieces(self) -> None:
         """
@@ -1090,9 +1074,10 @@ def normalize_psbt(psbt: Union[PSBT, bytes, str]) -> PSBT:
     :returns: the deserialized PSBT object. If `psbt` was already a `PSBT`, it is returned directly (without cloning).
     """
     if isinstance(psbt, bytes):
-        psbt = base64.b64encode(psbt).decode()
-
-    if isinstance(psbt, str):
+        psbt_obj = PSBT()
+        psbt_obj.deserialize_bytes(psbt)
+        psbt = psbt_obj
+    elif isinstance(psbt, str):
         psbt_obj = PSBT()
         psbt_obj.deserialize(psbt)
         psbt = psbt_obj
@@ -0,0 +1,102 @@
+"""
+Merkleized commitments of the maps of a PSBTv2, as sent to the device with SIGN_PSBT.
+
+Each key and value of the PSBT is hashed once: the same Merkle trees produce the commitments of the SIGN_PSBT request
+and answer the client commands of the device. For large PSBTs, the maps are hashed by several worker processes.
+"""
+
+import os
+
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Mapping, Optional, Tuple
+
+from .common import write_varint
+from .merkle import MerkleizedMap, MerkleTree, element_hash
+
+# Total size in bytes of the keys and values of a PSBT from which its maps are hashed in worker processes; below it,
+# starting the workers and sending them the maps costs more than the hashing itself
+PARALLEL_HASHING_MIN_SIZE = 16 * 1024 * 1024
+
+# Maps sent to a worker process at once
+PARALLEL_HASHING_CHUNK_LEN = 256
+
+
+def _merkleize_maps(maps: List[Tuple[List[bytes], List[bytes]]]) -> List[Tuple[MerkleTree, MerkleTree]]:
+    # Runs in the worker processes: the Merkle trees of the sorted keys and values of each map
+    return [(MerkleTree(map(element_hash, keys)), MerkleTree(map(element_hash, values))) for keys, values in maps]
+
+
+def merkleize_maps(mappings: List[Mapping[bytes, bytes]], processes: Optional[int] = None) -> List[MerkleizedMap]:
+    """
+    Returns the MerkleizedMap of each of `mappings`.
+
+    The maps are hashed by up to `processes` worker processes (by default, the number of CPUs) when their total size
+    is at least PARALLEL_HASHING_MIN_SIZE; with `processes` set to 1, they are always hashed in this process.
+    """
+
+    sorted_items = []
+    size = 0
+    for mapping in mappings:
+        keys = sorted(mapping)
+        values = [mapping[key] for key in keys]
+        sorted_items.append((keys, values))
+        size += sum(map(len, keys)) + sum(map(len, values))
+
+    if processes is None:
+        processes = os.cpu_count() or 1
+    chunks = [sorted_items[i:i + PARALLEL_HASHING_CHUNK_LEN]
+              for i in range(0, len(sorted_items), PARALLEL_HASHING_CHUNK_LEN)]
+
+    if processes <= 1 or len(chunks) <= 1 or size < PARALLEL_HASHING_MIN_SIZE:
+        trees = _merkleize_maps(sorted_items)
+    else:
+        with ProcessPoolExecutor(max_workers=min(processes, len(chunks))) as executor:
+            trees = [t for chunk_trees in executor.map(_merkleize_maps, chunks) for t in chunk_trees]
+
+    return [MerkleizedMap(keys, values, keys_tree, values_tree)
+            for (keys, values), (keys_tree, values_tree) in zip(sorted_items, trees)]
+
+
+class PsbtCommitment:
+    """
+    The Merkleized maps of a PSBTv2, with the Merkle trees of the commitments of its input maps and output maps.
+
+    Parameters
+    ----------
+    global_map : Mapping[bytes, bytes]
+        The global map of the PSBT.
+    input_maps : List[Mapping[bytes, bytes]]
+        The input maps of the PSBT.
+    output_maps : List[Mapping[bytes, bytes]]
+        The output maps of the PSBT.
+    processes : Optional[int]
+        The maximum number of worker processes hashing the maps, see `merkleize_maps`.
+    """
+
+    def __init__(self,
+                 global_map: Mapping[bytes, bytes],
+                 input_maps: List[Mapping[bytes, bytes]],
+                 output_maps: List[Mapping[bytes, bytes]],
+                 processes: Optional[int] = None):
+        merkleized_maps = merkleize_maps([global_map, *input_maps, *output_maps], processes)
+        self.global_map: MerkleizedMap = merkleized_maps[0]
+        self.input_maps: List[MerkleizedMap] = merkleized_maps[1:1 + len(input_maps)]
+        self.output_maps: List[MerkleizedMap] = merkleized_maps[1 + len(input_maps):]
+
+        self.input_commitments = [m.commitment for m in self.input_maps]
+        self.output_commitments = [m.commitment for m in self.output_maps]
+        self.inputs_tree = MerkleTree(map(element_hash, self.input_commitments))
+        self.outputs_tree = MerkleTree(map(element_hash, self.output_commitments))
+
+    def serialize(self) -> bytes:
+        """
+        Returns the commitment to the PSBT sent in the SIGN_PSBT request: the commitment of the global map, then the
+        number of inputs and the root of the Merkle tree of the input map commitments, and the same for the outputs.
+        """
+        return b"".join([
+            self.global_map.commitment,
+            write_varint(len(self.input_maps)),
+            self.inputs_tree.root,
+            write_varint(len(self.output_maps)),
+            self.outputs_tree.root,
+        ])
@@ -0,0 +1,119 @@
+"""
+Streaming parser of serialized PSBTs
+************************************
+
+Walks the maps of a serialized PSBT in a single ``memoryview``, without copying it: keys and values are yielded as
+views of the serialized PSBT, and only converted to ``bytes`` when the caller asks for them. Maps that are not
+needed can be skipped by reading their lengths only.
+"""
+
+from typing import Dict, Iterator, Tuple, Union
+
+from .errors import PSBTSerializationError
+
+PSBT_MAGIC = b"psbt\xff"
+
+
+def read_compact_size(data: memoryview, offset: int) -> Tuple[int, int]:
+    """
+    Read a compact size unsigned integer from `data` at `offset`.
+
+    :returns: The integer and the offset following it
+    """
+    try:
+        n = data[offset]
+        if n < 253:
+            return n, offset + 1
+        size = 2 if n == 253 else 4 if n == 254 else 8
+        if offset + 1 + size > len(data):
+            raise IndexError
+        return int.from_bytes(data[offset + 1:offset + 1 + size], "little"), offset + 1 + size
+    except IndexError:
+        raise PSBTSerializationError("Unexpected end of PSBT while reading a compact size") from None
+
+
+def key_type(key: memoryview) -> int:
+    """Return the type of a PSBT key, which is the compact size it starts with."""
+    return read_compact_size(key, 0)[0]
+
+
+class PSBTMapParser:
+    """
+    Parse the maps of a serialized PSBT, in order: the global map, then the input maps, then the output maps.
+
+    Each map is consumed by exactly one call to :meth:`entries`, :meth:`read_map` or :meth:`skip_map`. If the
+    iteration of :meth:`entries` is stopped before the end of the map, :meth:`skip_map` moves to the next map.
+
+    :param psbt: The serialized PSBT, starting with the magic bytes. It is not copied, and must not be modified while
+        the parser or the views it returned are in use.
+    """
+
+    def __init__(self, psbt: Union[bytes, bytearray, memoryview]) -> None:
+        self._data = memoryview(psbt).cast("B")
+        if self._data[:len(PSBT_MAGIC)] != PSBT_MAGIC:
+            raise PSBTSerializationError("invalid magic")
+        self._offset = len(PSBT_MAGIC)
+        # slicing bytes directly is about twice as fast as materializing a view
+        self._bytes = psbt if isinstance(psbt, bytes) else None
+
+    @property
+    def offset(self) -> int:
+        """The offset in the serialized PSBT of the next entry to parse."""
+        return self._offset
+
+    def at_end(self) -> bool:
+        """Return True if all the serialized PSBT was parsed."""
+        return self._offset >= len(self._data)
+
+    def _spans(self) -> Iterator[Tuple[int, int, int, int]]:
+        # Yields the offsets of the start and end of the key and of the value of each entry of the current map, and
+        # moves to the next map. As in the other parsers of this package, the end of the data also ends a map.
+        data = self._data
+        end = len(data)
+        offset = self._offset
+        while offset < end:
+            # single byte compact sizes are by far the most common, they are read inline
+            key_len = data[offset]
+            key_start = offset + 1
+            if key_len >= 253:
+                key_len, key_start = read_compact_size(data, offset)
+            if key_len == 0:
+                # separator
+                self._offset = key_start
+                return
+            key_end = key_start + key_len
+            if key_end >= end:
+                raise PSBTSerializationError("Unexpected end of PSBT while reading a key")
+            value_len = data[key_end]
+            value_start = key_end + 1
+            if value_len >= 253:
+                value_len, value_start = read_compact_size(data, key_end)
+            value_end = value_start + value_len
+            if value_end > end:
+                raise PSBTSerializationError("Unexpected end of PSBT while reading a value")
+            offset = self._offset = value_end
+            yield key_start, key_end, value_start, value_end
+        self._offset = offset
+
+    def entries(self) -> Iterator[Tuple[memoryview, memoryview]]:
+        """Yield the (key, value) pairs of the next map, as views of the serialized PSBT."""
+        data = self._data
+        for key_start, key_end, value_start, value_end in self._spans():
+            yield data[key_start:key_end], data[value_start:value_end]
+
+    def read_map(self) -> Dict[bytes, bytes]:
+        """Return the next map, with its keys and values as `bytes`."""
+        if self._bytes is not None:
+            data = self._bytes
+            return {data[key_start:key_end]: data[value_start:value_end]
+                    for key_start, key_end, value_start, value_end in self._spans()}
+        view = self._data
+        return {view[key_start:key_end].tobytes(): view[value_start:value_end].tobytes()
+                for key_start, key_end, value_start, value_end in self._spans()}
+
+    def skip_map(self) -> int:
+        """Move past the rest of the current map without creating views of it. Returns the number of skipped entries."""
+        n_entries = 0
+        for _ in self._spans():
+            n_entries += 1
+        return n_entries
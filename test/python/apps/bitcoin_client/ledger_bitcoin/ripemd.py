@@ -5,12 +5,21 @@
 # Taken from https://github.com/bitcoin/bitcoin/blob/124e75a41ea0f3f0e90b63b0c41813184ddce2ab/test/functional/test_framework/ripemd160.py
 
 """
-Pure Python RIPEMD160 implementation.
+RIPEMD160 and HASH160.
 
-WARNING: This implementation is NOT constant-time.
+The hashlib implementation is used when it is available, which is detected once at import: hashlib builds with
+OpenSSL 3 may list ripemd160 in `hashlib.algorithms_available` without being able to compute it. Otherwise, a pure
+Python implementation is used.
+
+WARNING: The pure Python implementation is NOT constant-time.
 Do not use without understanding the implications.
 """
 
+import hashlib
+import struct
+
+from typing import Callable, Iterable, List, Optional
+
 # Message schedule indexes for the left path.
 ML = [
     0, 1, 2, 3, 4, 5, 6, 7, 8, 9, 10, 11, 12, 13, 14, 15,
@@ -53,63 +62,135 @@ KL = [0, 0x5a827999, 0x6ed9eba1, 0x8f1bbcdc, 0xa953fd4e]
 # K constants for the right path.
 KR = [0x50a28be6, 0x5c4dd124, 0x6d703ef3, 0x7a6d76e9, 0]
 
-
-def fi(x, y, z, i):
-    """The f1, f2, f3, f4, and f5 functions from the specification."""
-    if i == 0:
-        return x ^ y ^ z
-    elif i == 1:
-        return (x & y) | (~x & z)
-    elif i == 2:
-        return (x | ~y) ^ z
-    elif i == 3:
-        return (x & z) | (y & ~z)
-    elif i == 4:
-        return x ^ (y | ~z)
-    else:
-        assert False
-
-
-def rol(x, i):
-    """Rotate the bottom 32 bits of x left by i bits."""
-    return ((x << i) | ((x & 0xffffffff) >> (32 - i))) & 0xffffffff
+M32 = 0xffffffff
+
+# Message schedule indexes and rotation counts of each group of 16 rounds, for the left and right paths.
+ROUNDS_L = [tuple(zip(ML[16 * i:16 * (i + 1)], RL[16 * i:16 * (i + 1)])) for i in range(5)]
+ROUNDS_R = [tuple(zip(MR[16 * i:16 * (i + 1)], RR[16 * i:16 * (i + 1)])) for i in range(5)]
+
+_unpack_block = struct.Struct("<16L").unpack
+
+
+def _left(a, b, c, d, e, x):
+    """The 80 rounds of the left path, with the f1, f2, f3, f4 and f5 functions inlined."""
+    (r0, r1, r2, r3, r4), (k0, k1, k2, k3, k4) = ROUNDS_L, KL
+    for i, s in r0:
+        t = (a + (b ^ c ^ d) + x[i] + k0) & M32
+        a, b, c, d, e = e, (((t << s) | (t >> (32 - s))) + e) & M32, b, ((c << 10) | (c >> 22)) & M32, d
+    for i, s in r1:
+        t = (a + (d ^ (b & (c ^ d))) + x[i] + k1) & M32
+        a, b, c, d, e = e, (((t << s) | (t >> (32 - s))) + e) & M32, b, ((c << 10) | (c >> 22)) & M32, d
+    for i, s in r2:
+        t = (a + ((b | (c ^ M32)) ^ d) + x[i] + k2) & M32
+        a, b, c, d, e = e, (((t << s) | (t >> (32 - s))) + e) & M32, b, ((c << 10) | (c >> 22)) & M32, d
+    for i, s in r3:
+        t = (a + (c ^ (d & (b ^ c))) + x[i] + k3) & M32
+        a, b, c, d, e = e, (((t << s) | (t >> (32 - s))) + e) & M32, b, ((c << 10) | (c >> 22)) & M32, d
+    for i, s in r4:
+        t = (a + (b ^ (c | (d ^ M32))) + x[i] + k4) & M32
+        a, b, c, d, e = e, (((t << s) | (t >> (32 - s))) + e) & M32, b, ((c << 10) | (c >> 22)) & M32, d
+    return a, b, c, d, e
+
+
+def _right(a, b, c, d, e, x):
+    """The 80 rounds of the right path, which uses the functions in the reverse order."""
+    (r0, r1, r2, r3, r4), (k0, k1, k2, k3, k4) = ROUNDS_R, KR
+    for i, s in r0:
+        t = (a + (b ^ (c | (d ^ M32))) + x[i] + k0) & M32
+        a, b, c, d, e = e, (((t << s) | (t >> (32 - s))) + e) & M32, b, ((c << 10) | (c >> 22)) & M32, d
+    for i, s in r1:
+        t = (a + (c ^ (d & (b ^ c))) + x[i] + k1) & M32
+        a, b, c, d, e = e, (((t << s) | (t >> (32 - s))) + e) & M32, b, ((c << 10) | (c >> 22)) & M32, d
+    for i, s in r2:
+        t = (a + ((b | (c ^ M32)) ^ d) + x[i] + k2) & M32
+        a, b, c, d, e = e, (((t << s) | (t >> (32 - s))) + e) & M32, b, ((c << 10) | (c >> 22)) & M32, d
+    for i, s in r3:
+        t = (a + (d ^ (b & (c ^ d))) + x[i] + k3) & M32
+        a, b, c, d, e = e, (((t << s) | (t >> (32 - s))) + e) & M32, b, ((c << 10) | (c >> 22)) & M32, d
+    for i, s in r4:
+        t = (a + (b ^ c ^ d) + x[i] + k4) & M32
+        a, b, c, d, e = e, (((t << s) | (t >> (32 - s))) + e) & M32, b, ((c << 10) | (c >> 22)) & M32, d
+    return a, b, c, d, e
 
 
 def compress(h0, h1, h2, h3, h4, block):
     """Compress state (h0, h1, h2, h3, h4) with block."""
-    # Left path variables.
-    al, bl, cl, dl, el = h0, h1, h2, h3, h4
-    # Right path variables.
-    ar, br, cr, dr, er = h0, h1, h2, h3, h4
-    # Message variables.
-    x = [int.from_bytes(block[4*i:4*(i+1)], 'little') for i in range(16)]
-
-    # Iterate over the 80 rounds of the compression.
-    for j in range(80):
-        rnd = j >> 4
-        # Perform left side of the transformation.
-        al = rol(al + fi(bl, cl, dl, rnd) + x[ML[j]] + KL[rnd], RL[j]) + el
-        al, bl, cl, dl, el = el, al, bl, rol(cl, 10), dl
-        # Perform right side of the transformation.
-        ar = rol(ar + fi(br, cr, dr, 4 - rnd) + x[MR[j]] + KR[rnd], RR[j]) + er
-        ar, br, cr, dr, er = er, ar, br, rol(cr, 10), dr
-
-    # Compose old state, left transform, and right transform into new state.
-    return h1 + cl + dr, h2 + dl + er, h3 + el + ar, h4 + al + br, h0 + bl + cr
-
-
-def ripemd160(data):
-    """Compute the RIPEMD-160 hash of data."""
+    x = _unpack_block(block)
+    # The left and right paths are independent until they are composed with the old state.
+    al, bl, cl, dl, el = _left(h0, h1, h2, h3, h4, x)
+    ar, br, cr, dr, er = _right(h0, h1, h2, h3, h4, x)
+    return ((h1 + cl + dr) & M32, (h2 + dl + er) & M32, (h3 + el + ar) & M32, (h4 + al + br) & M32,
+            (h0 + bl + cr) & M32)
+
+
+def ripemd160_fallback(data):
+    """Compute the RIPEMD-160 hash of data in pure Python."""
     # Initialize state.
     state = (0x67452301, 0xefcdab89, 0x98badcfe, 0x10325476, 0xc3d2e1f0)
     # Process full 64-byte blocks in the input.
     for b in range(len(data) >> 6):
-        state = compress(*state, data[64*b:64*(b+1)])
+        state = compress(*state, data[64 * b:64 * (b + 1)])
     # Construct final blocks (with padding and size).
     pad = b"\x80" + b"\x00" * ((119 - len(data)) & 63)
-    fin = data[len(data) & ~63:] + pad + (8 * len(data)).to_bytes(8, 'little')
+    fin = bytes(data[len(data) & ~63:]) + pad + (8 * len(data)).to_bytes(8, 'little')
     # Process final blocks.
     for b in range(len(fin) >> 6):
-        state = compress(*state, fin[64*b:64*(b+1)])
+        state = compress(*state, fin[64 * b:64 * (b + 1)])
     # Produce output.
-    return b"".join((h & 0xffffffff).to_bytes(4, 'little') for h in state)
+    return struct.pack("<5L", *state)
+
+
+def _hashlib_ripemd160() -> Optional[Callable[[], "hashlib._Hash"]]:
+    # Returns the constructor of hashlib's RIPEMD160 objects, or None if hashlib cannot compute it. Copying an empty
+    # object is much faster than looking up the algorithm by name for each hash.
+    try:
+        return hashlib.new("ripemd160").copy
+    except ValueError:
+        return None
+
+
+_new_ripemd160 = _hashlib_ripemd160()
+
+# Whether hashlib provides RIPEMD160
+HASHLIB_RIPEMD160 = _new_ripemd160 is not None
+
+
+def _ripemd160_hashlib(data):
+    """Compute the RIPEMD-160 hash of data."""
+    h = _new_ripemd160()
+    h.update(data)
+    return h.digest()
+
+
+def _hash160_hashlib(data):
+    """Compute the HASH160 of data, the RIPEMD-160 hash of its SHA256 hash."""
+    h = _new_ripemd160()
+    h.update(hashlib.sha256(data).digest())
+    return h.digest()
+
+
+def _hash160_fallback(data):
+    """Compute the HASH160 of data, the RIPEMD-160 hash of its SHA256 hash."""
+    return ripemd160_fallback(hashlib.sha256(data).digest())
+
+
+if HASHLIB_RIPEMD160:
+    ripemd160 = _ripemd160_hashlib
+    hash160 = _hash160_hashlib
+else:
+    ripemd160 = ripemd160_fallback
+    hash160 = _hash160_fallback
+
+
+def hash160_many(items: Iterable[bytes]) -> List[bytes]:
+    """Compute the HASH160 of each of items, in order."""
+    sha256 = hashlib.sha256
+    if not HASHLIB_RIPEMD160:
+        return [ripemd160_fallback(sha256(data).digest()) for data in items]
+    new_ripemd160 = _new_ripemd160
+    result = []
+    for data in items:
+        h = new_ripemd160()
+        h.update(sha256(data).digest())
+        result.append(h.digest())
+    return result
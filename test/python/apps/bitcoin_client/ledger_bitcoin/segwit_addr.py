@@ -22,6 +22,7 @@
 
 
 from enum import Enum
+from functools import lru_cache
 
 class Encoding(Enum):
     """Enumeration type to list the various supported encodings."""
@@ -29,17 +30,28 @@ class Encoding(Enum):
     BECH32M = 2
 
 CHARSET = "qpzry9x8gf2tvdw0s3jn54khce6mua7l"
+CHARSET_VALUES = {c: i for i, c in enumerate(CHARSET)}
 BECH32M_CONST = 0x2bc830a3
 
-def bech32_polymod(values):
-    """Internal function that computes the Bech32 checksum."""
+def bech32_polymod_step(chk, value):
+    """Internal function that feeds a single value to the Bech32 checksum."""
     generator = [0x3b6a57b2, 0x26508e6d, 0x1ea119fa, 0x3d4233dd, 0x2a1462b3]
-    chk = 1
-    for value in values:
-        top = chk >> 25
-        chk = (chk & 0x1ffffff) << 5 ^ value
-        for i in range(5):
-            chk ^= generator[i] if ((top >> i) & 1) else 0
+    top = chk >> 25
+    chk = (chk & 0x1ffffff) << 5 ^ value
+    for i in range(5):
+        chk ^= generator[i] if ((top >> i) & 1) else 0
+    return chk
+
+# What the top 10 bits of the checksum XOR into it while two values are fed to it
+POLYMOD_TABLE = [bech32_polymod_step(bech32_polymod_step(top << 20, 0), 0) for top in range(1024)]
+
+def bech32_polymod(values, chk=1):
+    """Internal function that computes the Bech32 checksum, from the state chk."""
+    pairs = iter(values)
+    for first, second in zip(pairs, pairs):
+        chk = (chk & 0xfffff) << 10 ^ (first << 5 | second) ^ POLYMOD_TABLE[chk >> 20]
+    if len(values) % 2:
+        chk = bech32_polymod_step(chk, values[-1])
     return chk
 
 
@@ -48,9 +60,15 @@ def bech32_hrp_expand(hrp):
     return [ord(x) >> 5 for x in hrp] + [0] + [ord(x) & 31 for x in hrp]
 
 
+@lru_cache(maxsize=16)
+def bech32_hrp_polymod(hrp):
+    """The state of the checksum after the expanded HRP, which is shared by all the strings of an HRP."""
+    return bech32_polymod(bech32_hrp_expand(hrp))
+
+
 def bech32_verify_checksum(hrp, data):
     """Verify a checksum given HRP and converted data characters."""
-    const = bech32_polymod(bech32_hrp_expand(hrp) + data)
+    const = bech32_polymod(data, bech32_hrp_polymod(hrp))
     if const == 1:
         return Encoding.BECH32
     if const == BECH32M_CONST:
@@ -59,9 +77,8 @@ def bech32_verify_checksum(hrp, data):
 
 def bech32_create_checksum(hrp, data, spec):
     """Compute the checksum values given HRP and data."""
-    values = bech32_hrp_expand(hrp) + data
     const = BECH32M_CONST if spec == Encoding.BECH32M else 1
-    polymod = bech32_polymod(values + [0, 0, 0, 0, 0, 0]) ^ const
+    polymod = bech32_polymod(data + [0, 0, 0, 0, 0, 0], bech32_hrp_polymod(hrp)) ^ const
     return [(polymod >> 5 * (5 - i)) & 31 for i in range(6)]
 
 
@@ -79,10 +96,11 @@ def bech32_decode(bech):
     pos = bech.rfind('1')
     if pos < 1 or pos + 7 > len(bech) or len(bech) > 90:
         return (None, None, None)
-    if not all(x in CHARSET for x in bech[pos+1:]):
+    try:
+        data = [CHARSET_VALUES[x] for x in bech[pos+1:]]
+    except KeyError:
         return (None, None, None)
     hrp = bech[:pos]
-    data = [CHARSET.find(x) for x in bech[pos+1:]]
     spec = bech32_verify_checksum(hrp, data)
     if spec is None:
         return (None, None, None)
@@ -134,4 +152,14 @@ def encode(hrp, witver, witprog):
     ret = bech32_encode(hrp, [witver] + convertbits(witprog, 8, 5), spec)
     if decode(hrp, ret) == (None, None):
         return None
-    return ret
\ No newline at end of file
+    return ret
+
+
+def encode_many(hrp, witver, witprogs):
+    """Encode segwit addresses of the same HRP and version for each of the witness programs."""
+    return [encode(hrp, witver, witprog) for witprog in witprogs]
+
+
+def verify_many(hrp, addrs):
+    """Return whether each of the addresses is a valid segwit address of the HRP."""
+    return [decode(hrp, addr) != (None, None) for addr in addrs]
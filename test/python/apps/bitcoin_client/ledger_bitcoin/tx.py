@@ -15,6 +15,7 @@ CTransaction,CTxIn, CTxOut, etc....:
 """
 
 import copy
+import itertools
 import struct
 
 from .common import (
@@ -35,13 +36,13 @@ from ._serialize import (
     deser_vector,
     Readable,
     ser_uint256,
-    ser_string,
     ser_string_vector,
-    ser_vector,
     uint256_from_str,
+    Writer,
 )
 
 from typing import (
+    Iterable,
     List,
     Optional,
     Tuple,
@@ -51,6 +52,45 @@ from typing import (
 
 MSG_WITNESS_FLAG = 1 << 30
 
+_UINT32 = struct.Struct("<I")
+_INT32 = struct.Struct("<i")
+_INT64 = struct.Struct("<q")
+
+# Stamps of the contents of the tracked lists; a list gets a new one each time it is modified
+_stamps = itertools.count()
+
+
+class TrackedList(list):
+    """
+    A list whose stamp changes each time it is modified, so that the hashes computed from its contents
+    can be cached until then. Changes to the objects in the list are not tracked.
+    """
+
+    __slots__ = ("stamp",)
+
+    def __init__(self, iterable: Iterable = ()) -> None:
+        super().__init__(iterable)
+        self.stamp = next(_stamps)
+
+    def __reduce__(self):
+        # copies are new lists, with their own stamps
+        return (self.__class__, (list(self),))
+
+
+def _tracked_mutation(name: str):
+    mutate = getattr(list, name)
+
+    def tracked(self, *args, **kwargs):
+        self.stamp = next(_stamps)
+        return mutate(self, *args, **kwargs)
+    tracked.__name__ = name
+    return tracked
+
+
+for _name in ("__setitem__", "__delitem__", "__iadd__", "__imul__",
+              "append", "extend", "insert", "pop", "remove", "clear", "sort", "reverse"):
+    setattr(TrackedList, _name, _tracked_mutation(_name))
+
 class COutPoint(object):
     def __init__(self, hash: int = 0, n: int = 0xffffffff):
         self.hash = hash
@@ -60,11 +100,14 @@ class COutPoint(object):
         self.hash = deser_uint256(f)
         self.n = struct.unpack("<I", f.read(4))[0]
 
+    def serialize_into(self, w: Writer) -> None:
+        w.write_uint256(self.hash)
+        w.write(_UINT32.pack(self.n))
+
     def serialize(self) -> bytes:
-        r = b""
-        r += ser_uint256(self.hash)
-        r += struct.pack("<I", self.n)
-        return r
+        w = Writer()
+        self.serialize_into(w)
+        return w.getvalue()
 
     def __repr__(self) -> str:
         return "COutPoint(hash=%064x n=%i)" % (self.hash, self.n)
@@ -90,12 +133,15 @@ class CTxIn(object):
         self.scriptSig = deser_string(f)
         self.nSequence = struct.unpack("<I", f.read(4))[0]
 
+    def serialize_into(self, w: Writer) -> None:
+        self.prevout.serialize_into(w)
+        w.write_string(self.scriptSig)
+        w.write(_UINT32.pack(self.nSequence))
+
     def serialize(self) -> bytes:
-        r = b""
-        r += self.prevout.serialize()
-        r += ser_string(self.scriptSig)
-        r += struct.pack("<I", self.nSequence)
-        return r
+        w = Writer()
+        self.serialize_into(w)
+        return w.getvalue()
 
     def __repr__(self) -> str:
         return "CTxIn(prevout=%s scriptSig=%s nSequence=%i)" \
@@ -112,11 +158,14 @@ class CTxOut(object):
         self.nValue = struct.unpack("<q", f.read(8))[0]
         self.scriptPubKey = deser_string(f)
 
+    def serialize_into(self, w: Writer) -> None:
+        w.write(_INT64.pack(self.nValue))
+        w.write_string(self.scriptPubKey)
+
     def serialize(self) -> bytes:
-        r = b""
-        r += struct.pack("<q", self.nValue)
-        r += ser_string(self.scriptPubKey)
-        return r
+        w = Writer()
+        self.serialize_into(w)
+        return w.getvalue()
 
     def is_opreturn(self) -> bool:
         return is_opreturn(self.scriptPubKey)
@@ -163,6 +212,9 @@ class CTxInWitness(object):
     def deserialize(self, f: Readable) -> None:
         self.scriptWitness.stack = deser_string_vector(f)
 
+    def serialize_into(self, w: Writer) -> None:
+        w.write_string_vector(self.scriptWitness.stack)
+
     def serialize(self) -> bytes:
         return ser_string_vector(self.scriptWitness.stack)
 
@@ -181,14 +233,17 @@ class CTxWitness(object):
         for i in range(len(self.vtxinwit)):
             self.vtxinwit[i].deserialize(f)
 
-    def serialize(self) -> bytes:
-        r = b""
+    def serialize_into(self, w: Writer) -> None:
         # This is different than the usual vector serialization --
         # we omit the length of the vector, which is required to be
         # the same length as the transaction's vin vector.
         for x in self.vtxinwit:
-            r += x.serialize()
-        return r
+            x.serialize_into(w)
+
+    def serialize(self) -> bytes:
+        w = Writer()
+        self.serialize_into(w)
+        return w.getvalue()
 
     def __repr__(self) -> str:
         return "CTxWitness(%s)" % \
@@ -202,24 +257,71 @@ class CTxWitness(object):
 
 
 class CTransaction(object):
+    """
+    A transaction. Reading its txid through hash or sha256 computes it once, and reuses it until the version, the
+    lock time or the lists of inputs and outputs are modified; after modifying the inputs or outputs themselves, call
+    rehash (or calc_sha256), which always recomputes it.
+    """
+
     def __init__(self, tx: Optional['CTransaction'] = None) -> None:
+        self._txid: Optional[Tuple[tuple, bytes]] = None
         if tx is None:
             self.nVersion = 1
             self.vin: List[CTxIn] = []
             self.vout: List[CTxOut] = []
             self.wit = CTxWitness()
             self.nLockTime = 0
-            self.sha256: Optional[int] = None
-            self.hash: Optional[bytes] = None
         else:
             self.nVersion = tx.nVersion
             self.vin = copy.deepcopy(tx.vin)
             self.vout = copy.deepcopy(tx.vout)
             self.nLockTime = tx.nLockTime
-            self.sha256 = tx.sha256
-            self.hash = tx.hash
             self.wit = copy.deepcopy(tx.wit)
 
+    @property
+    def vin(self) -> List[CTxIn]:
+        return self._vin
+
+    @vin.setter
+    def vin(self, vin: List[CTxIn]) -> None:
+        self._vin = vin if isinstance(vin, TrackedList) else TrackedList(vin)
+
+    @property
+    def vout(self) -> List[CTxOut]:
+        return self._vout
+
+    @vout.setter
+    def vout(self, vout: List[CTxOut]) -> None:
+        self._vout = vout if isinstance(vout, TrackedList) else TrackedList(vout)
+
+    def _txid_state(self) -> tuple:
+        # what the cached txid was computed from
+        return (self.nVersion, self.nLockTime, self._vin.stamp, self._vout.stamp)
+
+    def _txid_hash(self) -> bytes:
+        state = self._txid_state()
+        if self._txid is None or self._txid[0] != state:
+            self._txid = (state, hash256(self.serialize_without_witness()))
+        return self._txid[1]
+
+    @property
+    def hash(self) -> bytes:
+        """The txid, as serialized."""
+        return self._txid_hash()
+
+    @hash.setter
+    def hash(self, hash: Optional[bytes]) -> None:
+        self._txid = None if hash is None else (self._txid_state(), hash)
+
+    @property
+    def sha256(self) -> int:
+        """The txid, as an integer."""
+        return uint256_from_str(self._txid_hash())
+
+    @sha256.setter
+    def sha256(self, sha256: Optional[int]) -> None:
+        self._txid = None if sha256 is None else (self._txid_state(), ser_uint256(sha256))
+
     def deserialize(self, f: Readable) -> None:
         self.nVersion = struct.unpack("<i", f.read(4))[0]
         self.vin = deser_vector(f, CTxIn)
@@ -237,38 +339,37 @@ class CTransaction(object):
             self.wit.vtxinwit = [CTxInWitness() for i in range(len(self.vin))]
             self.wit.deserialize(f)
         self.nLockTime = struct.unpack("<I", f.read(4))[0]
-        self.sha256 = None
-        self.hash = None
+        self._txid = None
 
     def serialize_without_witness(self) -> bytes:
-        r = b""
-        r += struct.pack("<i", self.nVersion)
-        r += ser_vector(self.vin)
-        r += ser_vector(self.vout)
-        r += struct.pack("<I", self.nLockTime)
-        return r
+        w = Writer()
+        w.write(_INT32.pack(self.nVersion))
+        w.write_vector(self.vin)
+        w.write_vector(self.vout)
+        w.write(_UINT32.pack(self.nLockTime))
+        return w.getvalue()
 
     # Only serialize with witness when explicitly called for
     def serialize_with_witness(self) -> bytes:
         flags = 0
         if not self.wit.is_null():
             flags |= 1
-        r = b""
-        r += struct.pack("<i", self.nVersion)
+        w = Writer()
+        w.write(_INT32.pack(self.nVersion))
         if flags:
-            r += ser_vector([])
-            r += struct.pack("<B", flags)
-        r += ser_vector(self.vin)
-        r += ser_vector(self.vout)
+            w.write_varint(0)
+            w.write(struct.pack("<B", flags))
+        w.write_vector(self.vin)
+        w.write_vector(self.vout)
         if flags & 1:
             if (len(self.wit.vtxinwit) != len(self.vin)):
                 # vtxinwit must have the same length as vin
                 self.wit.vtxinwit = self.wit.vtxinwit[:len(self.vin)]
                 for _ in range(len(self.wit.vtxinwit), len(self.vin)):
                     self.wit.vtxinwit.append(CTxInWitness())
-            r += self.wit.serialize()
-        r += struct.pack("<I", self.nLockTime)
-        return r
+            self.wit.serialize_into(w)
+        w.write(_UINT32.pack(self.nLockTime))
+        return w.getvalue()
 
     # Regular serialization is without witness -- must explicitly
     # call serialize_with_witness to include witness data.
@@ -277,19 +378,15 @@ class CTransaction(object):
 
     # Recalculate the txid (transaction hash without witness)
     def rehash(self) -> None:
-        self.sha256 = None
         self.calc_sha256()
 
-    # We will only cache the serialization without witness in
-    # self.sha256 and self.hash -- those are expected to be the txid.
+    # The txid is recomputed and cached in self.sha256 and self.hash;
+    # the wtxid (transaction hash with witness) is returned, not cached.
     def calc_sha256(self, with_witness: bool = False) -> Optional[int]:
         if with_witness:
-            # Don't cache the result, just return it
             return uint256_from_str(hash256(self.serialize_with_witness()))
 
-        if self.sha256 is None:
-            self.sha256 = uint256_from_str(hash256(self.serialize_without_witness()))
-        self.hash = hash256(self.serialize())
+        self._txid = (self._txid_state(), hash256(self.serialize_without_witness()))
         return None
 
     def is_null(self) -> bool:
@@ -0,0 +1,129 @@
+"""
+Cache of the registrations and the addresses of wallet policies
+***************************************************************
+
+Registering a wallet policy needs a confirmation of the user on the device, and the addresses of miniscript policies
+are derived again on the host to check the ones returned by the device. When the same policies are used in many flows,
+a :class:`WalletCache` shared by the clients keeps the registration HMACs and the addresses derived on the host, and
+optionally persists them to a JSON file between runs.
+
+Entries are keyed by the master key fingerprint of the device and the id of the policy. The HMAC of a registration
+only depends on the seed of the device, and the id commits to the name, the descriptor template and the keys of the
+policy (including their network), so an entry never applies to another device or to another policy. The addresses are
+also keyed by the human-readable part of the network they are encoded for, as clients of different chains may share
+a cache.
+"""
+
+import json
+import os
+
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Dict, Optional, Tuple, Union
+
+from .wallet import WalletPolicy
+
+
+# Version of the persisted file; files of another version are not loaded, and are replaced on the next write
+_FORMAT_VERSION = 2
+
+
+@dataclass
+class _WalletCacheEntry:
+    hmac: Optional[bytes] = None
+    # addresses derived on the host, by (hrp, change, address_index)
+    addresses: Dict[Tuple[str, int, int], str] = field(default_factory=dict)
+
+
+class WalletCache:
+    """
+    Registration HMACs and host-derived addresses of wallet policies, by device fingerprint and policy id.
+
+    :param path: The JSON file persisting the cache, if any. It is loaded if it exists, and rewritten after each new
+        entry.
+    """
+
+    def __init__(self, path: Optional[Union[str, Path]] = None) -> None:
+        self.path = Path(path) if path is not None else None
+        self._entries: Dict[Tuple[bytes, bytes], _WalletCacheEntry] = {}
+        if self.path is not None and self.path.exists():
+            self._load()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _entry(self, fingerprint: bytes, wallet: WalletPolicy) -> Optional[_WalletCacheEntry]:
+        return self._entries.get((fingerprint, wallet.id))
+
+    def get_hmac(self, fingerprint: bytes, wallet: WalletPolicy) -> Optional[bytes]:
+        """Return the HMAC of the registration of `wallet` on the device with `fingerprint`, if it is cached."""
+        entry = self._entry(fingerprint, wallet)
+        return entry.hmac if entry is not None else None
+
+    def set_hmac(self, fingerprint: bytes, wallet: WalletPolicy, wallet_hmac: bytes) -> None:
+        entry = self._entries.setdefault((fingerprint, wallet.id), _WalletCacheEntry())
+        if entry.hmac != wallet_hmac:
+            entry.hmac = wallet_hmac
+            self._save()
+
+    def get_address(self, fingerprint: bytes, wallet: WalletPolicy, hrp: str, change: int,
+                    address_index: int) -> Optional[str]:
+        """
+        Return the address of `wallet` derived on the host at (`change`, `address_index`) and encoded with the
+        human-readable part `hrp`, if it is cached.
+        """
+        entry = self._entry(fingerprint, wallet)
+        return entry.addresses.get((hrp, change, address_index)) if entry is not None else None
+
+    def set_address(self, fingerprint: bytes, wallet: WalletPolicy, hrp: str, change: int, address_index: int,
+                    address: str) -> None:
+        entry = self._entries.setdefault((fingerprint, wallet.id), _WalletCacheEntry())
+        key = (hrp, int(change), address_index)
+        if entry.addresses.get(key) != address:
+            entry.addresses[key] = address
+            self._save()
+
+    def clear(self) -> None:
+        """Drop all the entries, and the persisted ones."""
+        self._entries.clear()
+        self._save()
+
+    def _load(self) -> None:
+        with open(self.path, "r") as f:
+            data = json.load(f)
+        if not isinstance(data, dict) or data.get("version") != _FORMAT_VERSION:
+            return
+
+        for key, value in data["wallets"].items():
+            fingerprint, wallet_id = key.split(":")
+            hmac = value.get("hmac")
+            self._entries[(bytes.fromhex(fingerprint), bytes.fromhex(wallet_id))] = _WalletCacheEntry(
+                hmac=bytes.fromhex(hmac) if hmac is not None else None,
+                addresses={
+                    (hrp, int(change), int(address_index)): address
+                    for hrp, by_change in value.get("addresses", {}).items()
+                    for change, addresses in by_change.items()
+                    for address_index, address in addresses.items()
+                },
+            )
+
+    def _save(self) -> None:
+        if self.path is None:
+            return
+
+        wallets = {}
+        for (fingerprint, wallet_id), entry in self._entries.items():
+            addresses: Dict[str, Dict[str, Dict[str, str]]] = {}
+            for (hrp, change, address_index), address in sorted(entry.addresses.items()):
+                addresses.setdefault(hrp, {}).setdefault(str(change), {})[str(address_index)] = address
+            wallets[f"{fingerprint.hex()}:{wallet_id.hex()}"] = {
+                "hmac": entry.hmac.hex() if entry.hmac is not None else None,
+                "addresses": addresses,
+            }
+        data = {"version": _FORMAT_VERSION, "wallets": wallets}
+
+        # written to a temporary file first, so that an interrupted run never leaves a truncated cache
+        tmp_path = self.path.with_name(self.path.name + ".tmp")
+        with open(tmp_path, "w") as f:
+            json.dump(data, f, indent=2)
+        os.replace(tmp_path, self.path)
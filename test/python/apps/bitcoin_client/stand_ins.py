@@ -0,0 +1,207 @@
+"""
+Stand-ins of the devices and transports of the ledger_bitcoin client, shared by the benchmarks and the tests.
+"""
+
+import socket
+import struct
+import threading
+import time
+
+from time import perf_counter
+from typing import Callable, Iterator, List, Optional, Tuple
+
+from ledger_bitcoin.btchip.btchip import btchip
+from ledger_bitcoin.btchip.btchipComm import HID_FRAME_SIZE, HID_REPORT_SIZE, LEDGER_CHANNEL, DongleServer
+from ledger_bitcoin.btchip.ledgerWrapper import unwrapResponseAPDU, wrapCommandAPDU
+from ledger_bitcoin.client_command import ClientCommandCode
+from ledger_bitcoin.command_builder import BitcoinInsType
+from ledger_bitcoin.common import ByteStreamParser, write_varint
+from ledger_bitcoin.merkle import element_hash
+from ledger_bitcoin.psbt_commitment import PsbtCommitment
+
+from ragger.backend.interface import RAPDU
+
+
+def sign_psbt_requests(psbt_commitment: PsbtCommitment) -> Iterator[bytes]:
+    """
+    Yields the client commands of a device signing a PSBT: for each map, the proof of its commitment, then the index
+    of each key, and the proof and preimage of its value; finally, a signature for each input.
+    """
+    maps = [(None, None, psbt_commitment.global_map)]
+    maps += [(psbt_commitment.inputs_tree, i, m) for i, m in enumerate(psbt_commitment.input_maps)]
+    maps += [(psbt_commitment.outputs_tree, i, m) for i, m in enumerate(psbt_commitment.output_maps)]
+    for commitments_tree, index, m in maps:
+        if commitments_tree is not None:
+            yield (bytes([ClientCommandCode.GET_MERKLE_LEAF_PROOF]) + commitments_tree.root
+                   + write_varint(len(commitments_tree)) + write_varint(index))
+        values_root, n_values = m.values_tree.root, write_varint(len(m))
+        for map_key, value in zip(m.keys, m.values):
+            yield bytes([ClientCommandCode.GET_MERKLE_LEAF_INDEX]) + m.keys_tree.root + element_hash(map_key)
+            yield (bytes([ClientCommandCode.GET_MERKLE_LEAF_PROOF]) + values_root + n_values
+                   + write_varint(m.keys_tree.leaf_index(element_hash(map_key))))
+            yield bytes([ClientCommandCode.GET_PREIMAGE, 0]) + element_hash(value)
+    for index in range(len(psbt_commitment.input_maps)):
+        yield bytes([ClientCommandCode.YIELD]) + write_varint(index) + bytes([33]) + bytes(33) + bytes(71)
+
+
+class SignPsbtReplayBackend:
+    """
+    Stands for the device in NewClient.sign_psbt: on SIGN_PSBT, replays the client commands of `sign_psbt_requests`.
+    The responses of the client are not verified, they are only read to send the GET_MORE_ELEMENTS they call for.
+    """
+
+    def __init__(self, psbt_commitment: PsbtCommitment):
+        self._psbt_commitment = psbt_commitment
+        self._requests: Iterator[bytes] = iter(())
+        self._last_code: Optional[int] = None
+        self._remaining = 0
+
+    def exchange(self, cla: int, ins: int, p1: int = 0, p2: int = 0, data: bytes = b"", tick_timeout: int = 0) -> RAPDU:
+        if ins == BitcoinInsType.SIGN_PSBT:
+            self._requests = sign_psbt_requests(self._psbt_commitment)
+        elif self._last_code == ClientCommandCode.GET_PREIMAGE:
+            response = ByteStreamParser(data)
+            self._remaining = response.read_varint() - response.read_uint(1)
+        elif self._last_code == ClientCommandCode.GET_MERKLE_LEAF_PROOF:
+            self._remaining = data[32] - data[33]
+        elif self._last_code == ClientCommandCode.GET_MORE_ELEMENTS:
+            self._remaining -= data[0]
+
+        if self._remaining > 0:
+            request = bytes([ClientCommandCode.GET_MORE_ELEMENTS])
+        else:
+            request = next(self._requests, None)
+            if request is None:
+                self._last_code = None
+                return RAPDU(0x9000, b"")
+        self._last_code = request[0]
+        return RAPDU(0xE000, request)
+
+class FakeHIDDevice:
+    """
+    Stands for a hidapi device: answers each APDU written in HID reports with `respond(apdu)`, as (data, sw), framed
+    as btchip's HIDDongleHIDAPI expects. The response is available `latency` seconds after the request is written.
+    """
+
+    def __init__(self, respond: Callable[[bytes], Tuple[bytes, int]], ledger: bool = True, latency: float = 0.0):
+        self._respond = respond
+        self._ledger = ledger
+        self._latency = latency
+        self._nonblocking = False
+        self._request = bytearray()
+        self._reports: List[bytes] = []
+        self._ready_at = 0.0
+
+    def set_nonblocking(self, nonblocking: bool) -> None:
+        self._nonblocking = nonblocking
+
+    def write(self, data: bytes) -> int:
+        assert len(data) == HID_FRAME_SIZE and data[0] == 0
+        self._request += data[1:]
+        if self._ledger:
+            apdu = unwrapResponseAPDU(LEDGER_CHANNEL, self._request, HID_REPORT_SIZE)
+        else:
+            apdu = self._request[:5 + self._request[4]] if len(self._request) >= 5 + self._request[4] else None
+        if apdu is not None:
+            self._request = bytearray()
+            data, sw = self._respond(bytes(apdu))
+            if self._ledger:
+                frames = wrapCommandAPDU(LEDGER_CHANNEL, data + sw.to_bytes(2, "big"), HID_REPORT_SIZE)
+            elif data:
+                frames = bytes([0x61, len(data)]) + data + sw.to_bytes(2, "big")
+                frames += bytes(-len(frames) % HID_REPORT_SIZE)
+            else:
+                frames = sw.to_bytes(2, "big") + bytes(HID_REPORT_SIZE - 2)
+            self._reports = [frames[i:i + HID_REPORT_SIZE] for i in range(0, len(frames), HID_REPORT_SIZE)]
+            self._ready_at = perf_counter() + self._latency
+        return len(data)
+
+    def read(self, max_length: int, timeout_ms: int = 0) -> List[int]:
+        if not self._reports:
+            return []
+        wait = self._ready_at - perf_counter()
+        if wait > 0:
+            if timeout_ms > 0:
+                wait = min(wait, timeout_ms / 1000)
+            elif self._nonblocking:
+                return []
+            time.sleep(wait)
+            if perf_counter() < self._ready_at:
+                return []
+        return list(self._reports.pop(0))
+
+    def close(self) -> None:
+        pass
+
+
+class DongleStandIn:
+    """
+    Stands for a device proxy on a local TCP port, with the framing of btchip's DongleServer: answers each APDU with
+    `respond(apdu)`, as (data, sw). Requests are parsed from the stream as they arrive, so they can be pipelined; the
+    responses are sent in segments of at most `segment_size` bytes, to exercise the partial reads of the client.
+    """
+
+    def __init__(self, respond: Callable[[bytes], Tuple[bytes, int]], segment_size: Optional[int] = None):
+        self._respond = respond
+        self._segment_size = segment_size
+        self._server = socket.create_server(("127.0.0.1", 0))
+        self.port = self._server.getsockname()[1]
+        threading.Thread(target=self._serve, daemon=True).start()
+
+    def _serve(self) -> None:
+        while True:
+            try:
+                conn, _ = self._server.accept()
+            except OSError:
+                return
+            threading.Thread(target=self._serve_connection, args=(conn,), daemon=True).start()
+
+    def _serve_connection(self, conn: socket.socket) -> None:
+        with conn:
+            conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            buffer = bytearray()
+            while True:
+                chunk = conn.recv(65536)
+                if not chunk:
+                    return
+                buffer += chunk
+                offset = 0
+                out = bytearray()
+                while len(buffer) - offset >= 4:
+                    end = offset + 4 + struct.unpack_from(">I", buffer, offset)[0]
+                    if len(buffer) < end:
+                        break
+                    data, sw = self._respond(bytes(buffer[offset + 4:end]))
+                    out += struct.pack(">I", len(data)) + data + struct.pack(">H", sw)
+                    offset = end
+                del buffer[:offset]
+                segment_size = self._segment_size or max(len(out), 1)
+                for i in range(0, len(out), segment_size):
+                    conn.sendall(out[i:i + segment_size])
+
+    def connect(self) -> DongleServer:
+        return DongleServer("127.0.0.1", self.port)
+
+    def close(self) -> None:
+        self._server.close()
+
+def legacy_app_response(apdu: bytes) -> Tuple[bytes, int]:
+    """
+    Stands for the legacy Bitcoin app in the btchip commands streaming transactions: GET_TRUSTED_INPUT returns a
+    trusted input, HASH_INPUT_FINALIZE_FULL needs no confirmation, every other block is accepted.
+    """
+    ins = apdu[1]
+    if ins == btchip.BTCHIP_INS_GET_FIRMWARE_VERSION:
+        return bytes([0x01, 0x00, 1, 4, 3]), 0x9000
+    if ins == btchip.BTCHIP_INS_GET_TRUSTED_INPUT:
+        return bytes(56), 0x9000
+    if ins == btchip.BTCHIP_INS_HASH_INPUT_FINALIZE_FULL:
+        return bytes(2), 0x9000
+    return b"", 0x9000
+
+
+class SequentialDongle:
+    """A dongle without exchangeMany, as the DongleAdaptor of the legacy client."""
+
+    def __init__(self, dongle: DongleServer):
+        self.exchange = dongle.exchange
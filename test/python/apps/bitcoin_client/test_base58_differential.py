@@ -0,0 +1,134 @@
+import random
+
+from binascii import hexlify, unhexlify
+from typing import List
+
+import pytest
+
+from ledger_bitcoin import _base58 as base58
+from ledger_bitcoin.common import hash256
+from ledger_bitcoin.errors import BadArgumentError
+
+
+# Frozen copy of the digit by digit implementation that the table-driven codec replaced
+
+def _reference_encode(b: bytes) -> str:
+    n: int = int('0x0' + hexlify(b).decode('utf8'), 16)
+    temp: List[str] = []
+    while n > 0:
+        n, r = divmod(n, 58)
+        temp.append(base58.b58_digits[r])
+    res: str = ''.join(temp[::-1])
+    pad: int = 0
+    for c in b:
+        if c == 0:
+            pad += 1
+        else:
+            break
+    return base58.b58_digits[0] * pad + res
+
+
+def _reference_decode(s: str) -> bytes:
+    if not s:
+        return b''
+    n: int = 0
+    for c in s:
+        n *= 58
+        if c not in base58.b58_digits:
+            raise BadArgumentError('Character %r is not a valid base58 character' % c)
+        n += base58.b58_digits.index(c)
+    h: str = '%x' % n
+    if len(h) % 2:
+        h = '0' + h
+    res = unhexlify(h.encode('utf8'))
+    pad = 0
+    for c in s[:-1]:
+        if c == base58.b58_digits[0]:
+            pad += 1
+        else:
+            break
+    return b'\x00' * pad + res
+
+
+def _reference_encode_check(b: bytes) -> str:
+    return _reference_encode(b + hash256(b)[0:4])
+
+
+def _reference_decode_check(s: str) -> bytes:
+    data = _reference_decode(s)
+    if len(data) < 4 or hash256(data[:-4])[0:4] != data[-4:]:
+        raise BadArgumentError('Invalid base58 checksum')
+    return data[:-4]
+
+
+def _outcome(f, arg):
+    # The result, or the type and message of the exception raised
+    try:
+        return f(arg)
+    except Exception as e:  # pylint: disable=broad-except
+        return (type(e), str(e))
+
+
+def _random_bytes(rng: random.Random) -> List[bytes]:
+    items = [b"", b"\x00", b"\x00" * 5, b"\x00\x01", b"\xff" * 40, bytes(82)]
+    for _ in range(1000):
+        length = rng.choice([rng.randrange(8), rng.randrange(100), 78, 82, rng.randrange(2000)])
+        data = bytes(rng.getrandbits(8) for _ in range(length))
+        items.append(bytes(rng.randrange(4)) + data)
+    return items
+
+
+def _random_strings(rng: random.Random) -> List[str]:
+    items = ["", "1", "11", "1" * 30, "z", "21", "1112", "0", "O", "I", "l", " ", "1 1", "é", "1₿", "abc\x00"]
+    for _ in range(1000):
+        s = "".join(rng.choice(base58.b58_digits) for _ in range(rng.randrange(120)))
+        if rng.randrange(4) == 0:
+            s = "1" * rng.randrange(5) + s
+        if rng.randrange(4) == 0:
+            # an invalid character: outside of the alphabet, or not even ASCII
+            position = rng.randrange(len(s) + 1)
+            s = s[:position] + rng.choice("0OIl+/=-_ \n\xffé₿") + s[position:]
+        items.append(s)
+    return items
+
+
+@pytest.fixture
+def rng():
+    return random.Random(0)
+
+
+def test_encode(rng):
+    items = _random_bytes(rng)
+    expected = [_reference_encode(b) for b in items]
+    assert [base58.encode(b) for b in items] == expected
+    assert base58.encode_many(items) == expected
+
+
+def test_decode(rng):
+    items = _random_strings(rng) + [_reference_encode(b) for b in _random_bytes(rng)]
+    for s in items:
+        assert _outcome(base58.decode, s) == _outcome(_reference_decode, s), s
+
+    valid = [s for s in items if all(c in base58.b58_digits for c in s)]
+    assert base58.decode_many(valid) == [_reference_decode(s) for s in valid]
+
+
+def test_check(rng):
+    items = _random_bytes(rng)
+    encoded = [_reference_encode_check(b) for b in items]
+    assert [base58.encode_check(b) for b in items] == encoded
+    assert base58.encode_many(items, check=True) == encoded
+    assert base58.decode_many(encoded, check=True) == items
+
+    # altered encodings: wrong checksums, too short data and invalid characters
+    altered = [s[:-1] + base58.b58_digits[(base58.b58_digits.index(s[-1]) + 1) % 58] for s in encoded[:200]]
+    altered += ["", "1", "1111", "2NEpo7TZRRrLZSi2U", "11111111111111111111O"] + _random_strings(rng)[:200]
+    for s in encoded + altered:
+        assert _outcome(base58.decode_check, s) == _outcome(_reference_decode_check, s), s
+
+
+def test_decode_many_errors():
+    with pytest.raises(BadArgumentError, match="'0' is not a valid base58 character"):
+        base58.decode_many(["2NEpo7TZRRrLZSi2U", "10"])
+    with pytest.raises(BadArgumentError, match="Invalid base58 checksum"):
+        base58.decode_many([base58.encode_check(b"\x00data"), base58.encode(b"\x00data")], check=True)
@@ -0,0 +1,93 @@
+import random
+
+from typing import List, Tuple
+
+import pytest
+
+from ledger_bitcoin.btchip.btchipComm import HID_FRAME_SIZE, LEDGER_CHANNEL, HIDDongleHIDAPI
+from ledger_bitcoin.btchip.btchipException import BTChipException
+from ledger_bitcoin.btchip.ledgerWrapper import wrapCommandAPDU
+
+from stand_ins import DongleStandIn, FakeHIDDevice
+
+rng = random.Random(0)
+# around the report boundaries of both framings, up to the largest extended APDUs
+LENGTHS = list(range(0, 200)) + [250, 255, 256, 260, 1000, 4096, 65535]
+
+
+def _reference_reports(apdu: bytes, ledger: bool) -> List[bytes]:
+    # the reports written by HIDDongleHIDAPI.exchange before the APDUs were framed in place
+    if ledger:
+        apdu = wrapCommandAPDU(LEDGER_CHANNEL, apdu, 64)
+    tmp = bytearray(apdu)
+    padSize = len(tmp) % 64
+    if padSize != 0:
+        tmp.extend([0] * (64 - padSize))
+    return [bytes([0]) + tmp[offset:offset + 64] for offset in range(0, len(tmp), 64)]
+
+
+def _echo(apdu: bytes) -> Tuple[bytes, int]:
+    # the data of the APDU, and its P1 P2 as the status word
+    return apdu[5:], int.from_bytes(apdu[2:4], "big")
+
+
+def _framed_reports(dongle: HIDDongleHIDAPI, apdu: bytes) -> List[bytes]:
+    count = dongle.frameAPDU(apdu)
+    return [bytes(dongle.frames[i * HID_FRAME_SIZE:(i + 1) * HID_FRAME_SIZE]) for i in range(count)]
+
+
+@pytest.mark.parametrize("ledger", [True, False])
+def test_frames(ledger):
+    dongle = HIDDongleHIDAPI(FakeHIDDevice(_echo, ledger=ledger), ledger=ledger)
+    # the frames buffer is reused: longer APDUs first, so that shorter ones are framed over their reports
+    for length in sorted(LENGTHS, reverse=True) + LENGTHS:
+        apdu = rng.randbytes(length)
+        reports = _framed_reports(dongle, apdu)
+        if length == 0 and not ledger:
+            # nothing was written before, the empty APDU is now sent as a padded report
+            assert reports == [bytes(HID_FRAME_SIZE)]
+        else:
+            assert reports == _reference_reports(apdu, ledger)
+
+
+def _apdu(data: bytes, sw: int = 0x9000) -> bytes:
+    return bytes([0xE0, 0x00]) + sw.to_bytes(2, "big") + bytes([len(data) & 0xFF]) + data
+
+
+@pytest.mark.parametrize("ledger", [True, False])
+def test_hid_exchange(ledger):
+    device = FakeHIDDevice(_echo, ledger=ledger)
+    dongle = HIDDongleHIDAPI(device, ledger=ledger)
+    # the short responses of the APDUs of the legacy app, whose data length is in their header
+    for length in range(0, 256 if ledger else 64):
+        data = rng.randbytes(length)
+        assert dongle.exchange(_apdu(data)) == data
+    # the status words are checked once the whole response is read
+    with pytest.raises(BTChipException) as e:
+        dongle.exchange(_apdu(b"\x01\x02", 0x6A80))
+    assert e.value.sw == 0x6A80
+    assert dongle.exchange(_apdu(b"after")) == b"after"
+
+
+def _responses(apdu: bytes) -> Tuple[bytes, int]:
+    # responses of any length, given by the APDU
+    length = int.from_bytes(apdu[5:8], "big")
+    return bytes((length + i) % 256 for i in range(length)), 0x9000
+
+
+@pytest.mark.parametrize("segment_size", [None, 1, 3, 7, 65536])
+def test_dongle_server_partial_reads(segment_size):
+    stand_in = DongleStandIn(_responses, segment_size=segment_size)
+    try:
+        dongle = stand_in.connect()
+        lengths = [0, 1, 2, 3, 4, 5, 6, 255, 256, 1000, 70000] + [rng.randrange(300) for _ in range(200)]
+        apdus = [bytes([0xE0, 0x00, 0x00, 0x00, 0x03]) + length.to_bytes(3, "big") for length in lengths]
+        expected = [_responses(apdu)[0] for apdu in apdus]
+
+        # whatever the segments of the responses, they are the ones of the sequential exchanges
+        assert [dongle.exchange(apdu) for apdu in apdus[:20]] == expected[:20]
+        received = []
+        assert dongle.exchangeMany(iter(apdus), callback=received.append) == expected
+        assert received == expected
+    finally:
+        stand_in.close()
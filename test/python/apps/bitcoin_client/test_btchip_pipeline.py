@@ -0,0 +1,149 @@
+import hashlib
+
+from typing import List, Tuple
+
+import pytest
+
+from ledger_bitcoin.btchip.bitcoinTransaction import bitcoinTransaction
+from ledger_bitcoin.btchip.btchip import btchip
+from ledger_bitcoin.btchip.btchipComm import DongleServer
+from ledger_bitcoin.btchip.btchipException import BTChipException
+from ledger_bitcoin.tx import COutPoint, CTransaction, CTxIn, CTxOut
+
+from stand_ins import DongleStandIn, SequentialDongle, legacy_app_response
+
+
+# Digests of the APDUs sent and of the responses returned by the flow below, recorded with the btchip module from
+# before the APDUs were streamed
+EXPECTED_STREAM_DIGEST = "d5b8727c5cbd24e51021635805c730b7ef2bf5615e67b7a7f6d93ed45b09d9ba"
+EXPECTED_RESPONSES_DIGEST = "6108b742483e51fb749bee2bef365adc46ad7a1a96b4fee7c44106cf405cdd5a"
+EXPECTED_APDUS = 511
+
+GET_FIRMWARE_VERSION = bytes([0xE0, 0xC4, 0x00, 0x00, 0x00])
+
+
+class _Device:
+    """
+    The legacy app of stand_ins.legacy_app_response, whose trusted inputs and confirmations are the digest of all the
+    APDUs received so far: any difference in the content or the order of the APDUs changes the responses. The APDU
+    number `fail_at` (from 1) is answered with 0x6A80.
+    """
+
+    def __init__(self, fail_at: int = 0):
+        self.apdus: List[bytes] = []
+        self.digest = hashlib.sha256()
+        self.fail_at = fail_at
+
+    def respond(self, apdu: bytes) -> Tuple[bytes, int]:
+        self.apdus.append(apdu)
+        self.digest.update(apdu)
+        if len(self.apdus) == self.fail_at:
+            return b"", 0x6A80
+        if apdu[1] == btchip.BTCHIP_INS_GET_TRUSTED_INPUT:
+            return self.digest.digest() + bytes(24), 0x9000
+        if apdu[1] == btchip.BTCHIP_INS_HASH_INPUT_FINALIZE_FULL:
+            return bytes(2) + self.digest.digest(), 0x9000
+        return legacy_app_response(apdu)
+
+
+def _previous_tx() -> bytearray:
+    # scripts around the lengths where they are split in several APDUs, or need a longer varint
+    lengths = [0, 1, 22, 250, 251, 252, 254, 255, 256, 510, 511, 700]
+    tx = CTransaction()
+    tx.nVersion = 2
+    tx.vin = [CTxIn(COutPoint(0x1234 * (i + 1) << 200, i), bytes((i + j) % 256 for j in range(length)), 0xfffffffe - i)
+              for i, length in enumerate(lengths)]
+    tx.vout = [CTxOut(1000 * i + 1, bytes((3 * i + j) % 256 for j in range(length)))
+               for i, length in enumerate(lengths * 3)]
+    tx.nLockTime = 1234
+    return bytearray(tx.serialize_without_witness())
+
+
+def _flow(app: btchip) -> List:
+    raw_tx = _previous_tx()
+    responses = []
+    for index in (0, 5):
+        responses.append(bytes(app.getTrustedInput(bitcoinTransaction(bytearray(raw_tx)), index)["value"]))
+    inputs = [{"trustedInput": True, "value": bytearray(responses[0]), "sequence": "fdffffff"},
+              {"trustedInput": False, "witness": True, "value": bytearray(40)}]
+    for redeem_script in (bytearray(), bytearray(range(256)) * 2, bytearray(251), bytearray(600), bytearray(25)):
+        app.startUntrustedTransaction(True, 1, inputs, redeem_script)
+        app.startUntrustedTransaction(False, 0, inputs, redeem_script, continueSegwit=True)
+    result = app.finalizeInput(b"", 0, 0, "44'/0'/0'/1/0", raw_tx)
+    responses.append((bytes(result["outputData"]), result["confirmationType"]))
+    return responses
+
+
+def _responses_digest(responses: List) -> str:
+    trusted_inputs, (output_data, confirmation_type) = responses[:-1], responses[-1]
+    return hashlib.sha256(b"".join(trusted_inputs) + output_data + bytes([confirmation_type])).hexdigest()
+
+
+@pytest.fixture(params=["pipelined", "pipelined_small_window", "sequential"])
+def transport(request, monkeypatch):
+    if request.param == "pipelined_small_window":
+        # a few APDUs in flight, and responses split in small segments
+        monkeypatch.setattr(DongleServer, "PIPELINE_DEPTH", 7)
+        segment_size = 13
+    else:
+        segment_size = None
+
+    servers = []
+
+    def connect(device: _Device):
+        stand_in = DongleStandIn(device.respond, segment_size=segment_size)
+        servers.append(stand_in)
+        dongle = stand_in.connect()
+        return SequentialDongle(dongle) if request.param == "sequential" else dongle
+
+    yield connect
+    for stand_in in servers:
+        stand_in.close()
+
+
+def test_apdu_stream(transport):
+    device = _Device()
+    app = btchip(transport(device))
+    responses = _flow(app)
+
+    assert len(device.apdus) == EXPECTED_APDUS
+    assert hashlib.sha256(b"".join(device.apdus)).hexdigest() == EXPECTED_STREAM_DIGEST
+    # the responses are the ones of the device, in order, whatever the transport
+    assert _responses_digest(responses) == EXPECTED_RESPONSES_DIGEST
+    # all of them but the firmware version are streamed
+    assert sum(timing["apdus"] for timing in app.phaseTimings.values()) == EXPECTED_APDUS - 1
+
+
+def test_progress(transport):
+    calls = []
+    app = btchip(transport(_Device()))
+    app.progressCallback = lambda *args: calls.append(args)
+    _flow(app)
+
+    last = {}
+    for phase, exchanged, total in calls:
+        assert 0 < exchanged <= total
+        if exchanged == 1:
+            # a new command of the phase: the previous one ended with all its APDUs exchanged
+            assert phase not in last or last[phase][0] == last[phase][1]
+        else:
+            assert last[phase] == (exchanged - 1, total)
+        last[phase] = (exchanged, total)
+    assert all(exchanged == total for exchanged, total in last.values())
+    assert len(calls) == EXPECTED_APDUS - 1
+
+
+def test_failure_mid_stream(transport):
+    device = _Device(fail_at=20)
+    app = btchip(transport(device))
+    with pytest.raises(BTChipException) as e:
+        app.getTrustedInput(bitcoinTransaction(_previous_tx()), 0)
+    assert e.value.sw == 0x6A80
+
+    # no APDU is sent after the failure is seen, beyond the ones already in flight
+    assert 20 <= len(device.apdus) < 20 + DongleServer.PIPELINE_DEPTH + 1
+    if isinstance(app.dongle, SequentialDongle):
+        assert len(device.apdus) == 20
+
+    # the responses of the APDUs in flight were consumed: the next exchange gets its own response
+    assert app.dongle.exchange(GET_FIRMWARE_VERSION) == bytes([0x01, 0x00, 1, 4, 3])
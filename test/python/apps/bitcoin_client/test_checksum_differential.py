@@ -0,0 +1,210 @@
+import random
+
+from typing import List
+
+from ledger_bitcoin import segwit_addr
+from ledger_bitcoin.bip380.descriptors import checksum
+from ledger_bitcoin.segwit_addr import BECH32M_CONST, CHARSET, Encoding, bech32_hrp_expand, convertbits
+
+
+# Frozen copies of the symbol by symbol checksums that the table-driven ones replaced
+
+def _reference_descsum_polymod(symbols):
+    chk = 1
+    for value in symbols:
+        top = chk >> 35
+        chk = (chk & 0x7FFFFFFFF) << 5 ^ value
+        for i in range(5):
+            chk ^= checksum.GENERATOR[i] if ((top >> i) & 1) else 0
+    return chk
+
+
+def _reference_descsum_expand(s):
+    groups = []
+    symbols = []
+    for c in s:
+        if c not in checksum.INPUT_CHARSET:
+            return None
+        v = checksum.INPUT_CHARSET.find(c)
+        symbols.append(v & 31)
+        groups.append(v >> 5)
+        if len(groups) == 3:
+            symbols.append(groups[0] * 9 + groups[1] * 3 + groups[2])
+            groups = []
+    if len(groups) == 1:
+        symbols.append(groups[0])
+    elif len(groups) == 2:
+        symbols.append(groups[0] * 3 + groups[1])
+    return symbols
+
+
+def _reference_descsum_create(s):
+    symbols = _reference_descsum_expand(s) + [0, 0, 0, 0, 0, 0, 0, 0]
+    chk = _reference_descsum_polymod(symbols) ^ 1
+    return s + "#" + "".join(checksum.CHECKSUM_CHARSET[(chk >> (5 * (7 - i))) & 31] for i in range(8))
+
+
+def _reference_descsum_check(s):
+    if s[-9] != "#":
+        return False
+    if not all(x in checksum.CHECKSUM_CHARSET for x in s[-8:]):
+        return False
+    symbols = _reference_descsum_expand(s[:-9]) + [checksum.CHECKSUM_CHARSET.find(x) for x in s[-8:]]
+    return _reference_descsum_polymod(symbols) == 1
+
+
+def _reference_bech32_polymod(values):
+    generator = [0x3b6a57b2, 0x26508e6d, 0x1ea119fa, 0x3d4233dd, 0x2a1462b3]
+    chk = 1
+    for value in values:
+        top = chk >> 25
+        chk = (chk & 0x1ffffff) << 5 ^ value
+        for i in range(5):
+            chk ^= generator[i] if ((top >> i) & 1) else 0
+    return chk
+
+
+def _reference_bech32_verify_checksum(hrp, data):
+    const = _reference_bech32_polymod(bech32_hrp_expand(hrp) + data)
+    if const == 1:
+        return Encoding.BECH32
+    if const == BECH32M_CONST:
+        return Encoding.BECH32M
+    return None
+
+
+def _reference_bech32_create_checksum(hrp, data, spec):
+    values = bech32_hrp_expand(hrp) + data
+    const = BECH32M_CONST if spec == Encoding.BECH32M else 1
+    polymod = _reference_bech32_polymod(values + [0, 0, 0, 0, 0, 0]) ^ const
+    return [(polymod >> 5 * (5 - i)) & 31 for i in range(6)]
+
+
+def _reference_bech32_decode(bech):
+    if ((any(ord(x) < 33 or ord(x) > 126 for x in bech)) or
+            (bech.lower() != bech and bech.upper() != bech)):
+        return (None, None, None)
+    bech = bech.lower()
+    pos = bech.rfind('1')
+    if pos < 1 or pos + 7 > len(bech) or len(bech) > 90:
+        return (None, None, None)
+    if not all(x in CHARSET for x in bech[pos + 1:]):
+        return (None, None, None)
+    hrp = bech[:pos]
+    data = [CHARSET.find(x) for x in bech[pos + 1:]]
+    spec = _reference_bech32_verify_checksum(hrp, data)
+    if spec is None:
+        return (None, None, None)
+    return (hrp, data[:-6], spec)
+
+
+def _reference_segwit_decode(hrp, addr):
+    hrpgot, data, spec = _reference_bech32_decode(addr)
+    if hrpgot != hrp:
+        return (None, None)
+    decoded = convertbits(data[1:], 5, 8, False)
+    if decoded is None or len(decoded) < 2 or len(decoded) > 40:
+        return (None, None)
+    if data[0] > 16:
+        return (None, None)
+    if data[0] == 0 and len(decoded) != 20 and len(decoded) != 32:
+        return (None, None)
+    if data[0] == 0 and spec != Encoding.BECH32 or data[0] != 0 and spec != Encoding.BECH32M:
+        return (None, None)
+    return (data[0], decoded)
+
+
+def _reference_segwit_encode(hrp, witver, witprog):
+    spec = Encoding.BECH32 if witver == 0 else Encoding.BECH32M
+    data = [witver] + convertbits(witprog, 8, 5)
+    combined = data + _reference_bech32_create_checksum(hrp, data, spec)
+    ret = hrp + '1' + ''.join([CHARSET[d] for d in combined])
+    if _reference_segwit_decode(hrp, ret) == (None, None):
+        return None
+    return ret
+
+
+def _outcome(f, *args):
+    # The result, or the type of the exception raised
+    try:
+        return f(*args)
+    except Exception as e:  # pylint: disable=broad-except
+        return type(e)
+
+
+def _corrupt(rng: random.Random, s: str, alphabet: str) -> str:
+    position = rng.randrange(len(s))
+    change = rng.randrange(4)
+    if change == 0:
+        return s[:position] + rng.choice(alphabet) + s[position + 1:]
+    if change == 1:
+        return s[:position] + s[position + 1:]
+    if change == 2:
+        return s[:position] + rng.choice(alphabet) + s[position:]
+    return s.upper() if rng.randrange(2) else s[:position] + s[position:].upper()
+
+
+def test_polymod():
+    rng = random.Random(0)
+    for length in list(range(20)) + [rng.randrange(1000) for _ in range(200)]:
+        symbols = [rng.randrange(32) for _ in range(length)]
+        assert checksum.descsum_polymod(symbols) == _reference_descsum_polymod(symbols)
+        assert segwit_addr.bech32_polymod(symbols) == _reference_bech32_polymod(symbols)
+
+        # starting from the state after an HRP is the same as feeding the HRP first
+        hrp = "".join(rng.choice("abctnrl") for _ in range(rng.randrange(1, 6)))
+        assert segwit_addr.bech32_polymod(symbols, segwit_addr.bech32_hrp_polymod(hrp)) == \
+            _reference_bech32_polymod(bech32_hrp_expand(hrp) + symbols)
+
+
+def test_descriptor_checksum():
+    rng = random.Random(1)
+    descriptors = ["", "a", "ab", "abc", "pkh(xpub/0/*)", "wpkh([d34db33f/84'/0'/0']xpub/<0;1>/*)"]
+    for _ in range(1000):
+        s = "".join(rng.choice(checksum.INPUT_CHARSET) for _ in range(rng.randrange(300)))
+        descriptors.append(s)
+    invalid = [d + "é" for d in descriptors[:50]] + ["\n", "wpkh(\t)"]
+
+    for s in descriptors + invalid:
+        assert checksum.descsum_expand(s) == _reference_descsum_expand(s), s
+        assert _outcome(checksum.descsum_create, s) == _outcome(_reference_descsum_create, s), s
+
+    created = [_reference_descsum_create(s) for s in descriptors]
+    assert checksum.descsum_create_many(descriptors) == created
+
+    altered = [_corrupt(rng, s, checksum.INPUT_CHARSET + "é") for s in created for _ in range(3)]
+    altered += [s[:-1] for s in created[:50]] + [s[:-9] + "$" + s[-8:] for s in created[:50]]
+    altered = [s for s in altered if len(s) >= 9]
+    for s in altered:
+        assert _outcome(checksum.descsum_check, s) == _outcome(_reference_descsum_check, s), s
+
+    # the strings with characters outside of INPUT_CHARSET raise a TypeError in both
+    checked = created + [s for s in altered if _reference_descsum_expand(s[:-9]) is not None]
+    expected = [_reference_descsum_check(s) for s in checked]
+    assert checksum.descsum_check_many(checked) == expected
+    assert all(expected[:len(created)]) and not all(expected)
+
+
+def _witprogs(rng: random.Random) -> List[bytes]:
+    # valid and invalid lengths of witness programs
+    lengths = [20, 32, 20, 32, 2, 40, 1, 41, 0]
+    return [bytes(rng.getrandbits(8) for _ in range(rng.choice(lengths))) for _ in range(300)]
+
+
+def test_segwit_addresses():
+    rng = random.Random(2)
+    for hrp in ["bc", "tb", "bcrt", "ltc", "x"]:
+        for witver in [0, 1, 2, 16, 17]:
+            witprogs = _witprogs(rng)
+            expected = [_outcome(_reference_segwit_encode, hrp, witver, witprog) for witprog in witprogs]
+            assert [_outcome(segwit_addr.encode, hrp, witver, witprog) for witprog in witprogs] == expected
+            if witver <= 16:
+                assert segwit_addr.encode_many(hrp, witver, witprogs) == expected
+
+            addrs = [addr for addr in expected if isinstance(addr, str)]
+            addrs += [_corrupt(rng, addr, CHARSET + "bio1 ") for addr in addrs for _ in range(3)]
+            addrs += ["", "1", hrp + "1", "A" * 91]
+            decoded = [_reference_segwit_decode(hrp, addr) for addr in addrs]
+            assert [segwit_addr.decode(hrp, addr) for addr in addrs] == decoded
+            assert segwit_addr.verify_many(hrp, addrs) == [result != (None, None) for result in decoded]
+            assert [segwit_addr.bech32_decode(addr) for addr in addrs] == [_reference_bech32_decode(addr) for addr in addrs]
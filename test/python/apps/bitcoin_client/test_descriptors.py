@@ -0,0 +1,76 @@
+import pytest
+
+from bip32 import BIP32
+
+from ledger_bitcoin.bip380.descriptors import Descriptor
+from ledger_bitcoin.bip380.key import DescriptorKey, derive_public_child
+
+XPUB_A = BIP32.from_seed(bytes(32)).get_xpub()
+XPUB_B = BIP32.from_seed(bytes([1]) * 32).get_xpub()
+PUBKEY = "02cc8a4bc64d897bddc5fbc2f670f7a8ba0b386779106cf1223c6fc5d7cd6fc115"
+# Extended keys are not supported as Taproot internal keys, only raw x-only keys
+XONLY_PUBKEY = PUBKEY[2:]
+
+DESCRIPTORS = [
+    f"wpkh({PUBKEY})",
+    f"wpkh({XPUB_A})",
+    f"wpkh({XPUB_A}/*)",
+    f"wpkh([00000000/84h/0h/0h]{XPUB_A}/0/*)",
+    f"tr({XONLY_PUBKEY})",
+    f"wsh(pk({PUBKEY}))",
+    f"wsh(pkh({XPUB_A}/1/*))",
+    f"wsh(multi(1,{XPUB_A}/0/*,{XPUB_B}/*))",
+    f"wsh(multi(2,{PUBKEY},{XPUB_A}/0/*,{XPUB_B}/7/3/*))",
+    f"wsh(or_d(pk({XPUB_A}/0/*),pkh({XPUB_B}/2/*)))",
+    # the same key twice, once hashed
+    f"wsh(and_v(v:pk({XPUB_A}/0/*),pkh({XPUB_A}/0/*)))",
+    f"wsh(andor(pk({XPUB_A}/0/*),older(144),pk({XPUB_B})))",
+]
+
+
+def _derived(desc: Descriptor, index: int) -> bytes:
+    copy = desc.copy()
+    copy.derive(index)
+    return copy.script_pubkey
+
+
+@pytest.mark.parametrize("desc_str", DESCRIPTORS)
+@pytest.mark.parametrize("start,count", [(0, 1), (0, 5), (17, 3), (2**31 - 2, 2)])
+def test_derive_range(desc_str, start, count):
+    desc = Descriptor.from_str(desc_str)
+    expected = [_derived(desc, index) for index in range(start, start + count)]
+    assert desc.derive_range(start, count) == expected
+    assert desc.derive_range(start, count, packed=True) == b"".join(expected)
+    # the descriptor itself is not derived
+    assert str(desc) == str(Descriptor.from_str(desc_str))
+
+
+def test_derive_range_empty():
+    desc = Descriptor.from_str(DESCRIPTORS[2])
+    assert desc.derive_range(0, 0) == []
+    assert desc.derive_range(5, 0, packed=True) == b""
+
+
+def test_derive_range_multipath():
+    desc = Descriptor.from_str(f"wsh(multi(1,{XPUB_A}/<0;1>/*,{XPUB_B}/<2;3>/*))")
+    for single in desc.singlepath_descriptors():
+        assert single.derive_range(3, 4) == [_derived(single, index) for index in range(3, 7)]
+
+
+@pytest.mark.parametrize("path", [[0], [5, 0], [2**31 - 1]])
+def test_derive_public_child(path):
+    key = BIP32.from_xpub(XPUB_A)
+    pubkey, chaincode = key.pubkey, key.chaincode
+    for index in path:
+        pubkey, chaincode = derive_public_child(pubkey, chaincode, index)
+    assert (chaincode, pubkey) == key.get_extended_pubkey_from_path(path)
+
+
+def test_key_derive_range():
+    key = DescriptorKey(f"{XPUB_B}/4/*")
+    expected = []
+    for index in range(10):
+        copy = DescriptorKey(f"{XPUB_B}/4/*")
+        copy.derive(index)
+        expected.append(copy.bytes())
+    assert key.derive_range(0, 10) == expected
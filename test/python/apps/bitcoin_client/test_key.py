@@ -0,0 +1,171 @@
+import hashlib
+import hmac
+import random
+
+import coincurve
+import pytest
+
+from ledger_bitcoin import key
+from ledger_bitcoin.key import G, H_, n, p
+
+# Scalars at the edges of the group order, and a few of each width of the wNAF and comb digits
+EDGE_SCALARS = [0, 1, 2, 3, 15, 16, 17, 31, 32, 33, 2**128, 2**255, n // 2, n - 2, n - 1, n, n + 1, 2 * n - 1]
+
+rng = random.Random(0)
+RANDOM_SCALARS = [rng.randrange(1, n) for _ in range(20)]
+
+
+@pytest.fixture
+def pure_python(monkeypatch):
+    # the derivation cache may hold children computed with coincurve
+    key.clear_derivation_cache()
+    monkeypatch.setattr(key, "_coincurve", None)
+    yield
+    key.clear_derivation_cache()
+
+
+def _coincurve_mul_g(k: int) -> key.Point:
+    k %= n
+    if k == 0:
+        return None
+    return coincurve.PublicKey.from_secret(k.to_bytes(32, byteorder="big")).point()
+
+
+def _negate(point: key.Point) -> key.Point:
+    return None if point is None else (point[0], p - point[1])
+
+
+POINTS = [G, _negate(G), _coincurve_mul_g(7), _coincurve_mul_g(n - 7)] + [_coincurve_mul_g(k) for k in RANDOM_SCALARS[:4]]
+
+
+@pytest.mark.parametrize("k", EDGE_SCALARS + RANDOM_SCALARS)
+def test_point_mul_g(pure_python, k):
+    assert key.point_mul(G, k) == _coincurve_mul_g(k)
+
+
+@pytest.mark.parametrize("point", POINTS)
+@pytest.mark.parametrize("k", EDGE_SCALARS + RANDOM_SCALARS[:5])
+def test_point_mul(pure_python, point, k):
+    if k % n == 0:
+        expected = None
+    else:
+        expected = coincurve.PublicKey(key.point_to_bytes(point)).multiply((k % n).to_bytes(32, byteorder="big")).point()
+    assert key.point_mul(point, k) == expected
+
+
+def test_point_mul_infinity(pure_python):
+    assert key.point_mul(None, 5) is None
+
+
+@pytest.mark.parametrize("point", POINTS + [None])
+@pytest.mark.parametrize("k", EDGE_SCALARS + RANDOM_SCALARS[:5])
+def test_point_add_mul_g(pure_python, point, k):
+    # the affine addition of the textbook formulas, which handles the point at infinity
+    assert key.point_add_mul_g(point, k) == key.point_add(point, _coincurve_mul_g(k))
+
+
+@pytest.mark.parametrize("k", [1, 7, n - 1] + RANDOM_SCALARS[:5])
+def test_point_add_mul_g_opposite(pure_python, k):
+    # P + k * G is the point at infinity when P is -k * G
+    assert key.point_add_mul_g(_negate(_coincurve_mul_g(k)), k) is None
+
+
+@pytest.mark.parametrize("point", POINTS)
+@pytest.mark.parametrize("k", RANDOM_SCALARS[:5])
+def test_point_add_mul_g_coincurve(pure_python, point, k):
+    expected = coincurve.PublicKey(key.point_to_bytes(point)).add(k.to_bytes(32, byteorder="big")).point()
+    assert key.point_add_mul_g(point, k) == expected
+
+
+@pytest.mark.parametrize("h", [b"", bytes(32), bytes(range(32))])
+@pytest.mark.parametrize("k", [1, 2, n - 1] + RANDOM_SCALARS[:5])
+def test_taproot_tweak_pubkey(monkeypatch, h, k):
+    pubkey = _coincurve_mul_g(k)[0].to_bytes(32, byteorder="big")
+    expected = key.taproot_tweak_pubkey(pubkey, h)
+    monkeypatch.setattr(key, "_coincurve", None)
+    assert key.taproot_tweak_pubkey(pubkey, h) == expected
+
+
+def _master_key() -> key.ExtendedKey:
+    # the master key of the seed 000102...0f, as in the first test vector of BIP 32
+    digest = hmac.new(b"Bitcoin seed", bytes(range(16)), hashlib.sha512).digest()
+    privkey = digest[:32]
+    pubkey = key.point_to_bytes(key.point_mul(G, int.from_bytes(privkey, byteorder="big")))
+    return key.ExtendedKey(key.ExtendedKey.MAINNET_PRIVATE, 0, bytes(4), 0, digest[32:], privkey, pubkey)
+
+
+MASTER = _master_key()
+XPUB = MASTER.derive_priv_path([H_(84), H_(0), H_(0)]).neutered()
+
+
+def test_bip32_test_vector():
+    assert MASTER.to_string() == "xprv9s21ZrQH143K3QTDL4LXw2F7HEK3wJUD2nW2nRk4stbPy6cq3jPPqjiChkVvvNKmPGJxWUtg6LnF5kejMRNNU3TGtRBeJgk33yuGBxrMPHi"
+    [child] = MASTER.derive_range([], H_(0), 1)
+    assert child.to_string() == "xprv9uHRZZhk6KAJC1avXpDAp4MDc3sQKNxDiPvvkX8Br5ngLNv1TxvUxt4cV1rGL5hj6KCesnDYUhd7oWgT11eZG7XnxHrnYeSvkzY7d2bhkJ7"
+
+
+@pytest.mark.parametrize("path_prefix,start,count", [
+    ([H_(84), H_(0), H_(0), 0], 0, 5),
+    ([H_(84), H_(0), H_(0)], 0, 3),
+    ([], 0, 3),
+    ([0], H_(0) - 2, 4),
+    ([0], H_(0), 3),
+    ([0], 2**32 - 3, 3),
+])
+def test_derive_range_private(path_prefix, start, count):
+    key.clear_derivation_cache()
+    keys = MASTER.derive_range(path_prefix, start, count)
+    # the second time from the cache
+    assert [k.to_string() for k in MASTER.derive_range(path_prefix, start, count)] == [k.to_string() for k in keys]
+    key.clear_derivation_cache()
+    assert [k.to_string() for k in keys] == \
+        [MASTER.derive_priv_path(list(path_prefix) + [i]).to_string() for i in range(start, start + count)]
+
+
+@pytest.mark.parametrize("path_prefix,start,count", [
+    ([0], 0, 5),
+    ([], 10, 3),
+    ([1, 7], H_(0) - 3, 3),
+])
+def test_derive_range_public(path_prefix, start, count):
+    key.clear_derivation_cache()
+    keys = XPUB.derive_range(path_prefix, start, count)
+    assert [k.to_string() for k in XPUB.derive_range(path_prefix, start, count)] == [k.to_string() for k in keys]
+    key.clear_derivation_cache()
+    assert [k.to_string() for k in keys] == \
+        [XPUB.derive_pub_path(list(path_prefix) + [i]).to_string() for i in range(start, start + count)]
+    # and the public keys of the private derivation
+    private_keys = MASTER.derive_range([H_(84), H_(0), H_(0)] + path_prefix, start, count)
+    assert [k.to_string() for k in keys] == [k.neutered().to_string() for k in private_keys]
+
+
+def test_derive_range_pure_python(pure_python):
+    assert [k.to_string() for k in XPUB.derive_range([0], 0, 3)] == \
+        [XPUB.derive_pub_path([0, i]).to_string() for i in range(3)]
+
+
+def test_derive_range_cache():
+    key.clear_derivation_cache()
+    XPUB.derive_range([0], 0, 10)
+    misses = key._derive_pub_child.cache_info().misses
+    # the prefix and the children are not derived again
+    XPUB.derive_range([0], 5, 10)
+    assert key._derive_pub_child.cache_info().misses == misses + 5
+
+
+def test_derive_range_empty():
+    assert XPUB.derive_range([], 0, 0) == []
+    assert MASTER.derive_range([], 0, 0) == []
+    assert XPUB.derive_range([0], H_(0), 0) == []
+
+
+@pytest.mark.parametrize("start,count", [(H_(0) - 1, 2), (H_(0), 1), (2**32 - 1, 1)])
+def test_derive_range_public_hardened(start, count):
+    with pytest.raises(ValueError):
+        XPUB.derive_range([0], start, count)
+
+
+@pytest.mark.parametrize("start,count", [(-1, 2), (0, -1), (2**32 - 1, 2)])
+def test_derive_range_invalid(start, count):
+    with pytest.raises(ValueError):
+        MASTER.derive_range([0], start, count)
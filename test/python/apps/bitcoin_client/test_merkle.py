@@ -0,0 +1,99 @@
+import random
+
+from typing import List
+
+import pytest
+
+from ledger_bitcoin.merkle import (
+    NIL, MerkleProofs, MerkleTree, ceil_lg, combine_hashes, element_hash, largest_power_of_2_less_than
+)
+
+MAX_LEAVES = 70
+
+
+def _reference_root(leaves: List[bytes]) -> bytes:
+    # the left-complete tree of the definition: the left subtree has the largest power of 2 leaves less than the total
+    if len(leaves) == 0:
+        return NIL
+    if len(leaves) == 1:
+        return leaves[0]
+    split = largest_power_of_2_less_than(len(leaves))
+    return combine_hashes(_reference_root(leaves[:split]), _reference_root(leaves[split:]))
+
+
+def _reference_proof(leaves: List[bytes], index: int) -> List[bytes]:
+    if len(leaves) == 1:
+        return []
+    split = largest_power_of_2_less_than(len(leaves))
+    if index < split:
+        return _reference_proof(leaves[:split], index) + [_reference_root(leaves[split:])]
+    return _reference_proof(leaves[split:], index - split) + [_reference_root(leaves[:split])]
+
+
+def _leaves(count: int, start: int = 0) -> List[bytes]:
+    return [element_hash(i.to_bytes(4, "big")) for i in range(start, start + count)]
+
+
+def _check(tree: MerkleTree, leaves: List[bytes]):
+    assert len(tree) == len(leaves)
+    assert tree.root == _reference_root(leaves)
+    assert tree.depth == (ceil_lg(len(leaves)) if leaves else None)
+    proofs = MerkleProofs(tree)
+    for i, leaf in enumerate(leaves):
+        assert tree.get(i) == leaf
+        assert tree.prove_leaf(i) == _reference_proof(leaves, i)
+        assert bytes(proofs.proof(i)) == b"".join(_reference_proof(leaves, i))
+        assert tree.leaf_index(leaf) == leaves.index(leaf)
+
+
+@pytest.mark.parametrize("count", range(MAX_LEAVES))
+def test_tree(count):
+    _check(MerkleTree(_leaves(count)), _leaves(count))
+
+
+def test_add():
+    tree = MerkleTree()
+    leaves: List[bytes] = []
+    for leaf in _leaves(MAX_LEAVES):
+        tree.add(leaf)
+        leaves.append(leaf)
+        _check(tree, leaves)
+
+
+@pytest.mark.parametrize("count", [1, 2, 3, 5, 8, 13, 33])
+def test_set(count):
+    rng = random.Random(count)
+    tree = MerkleTree(_leaves(count))
+    leaves = _leaves(count)
+    # new values, values already in the tree (duplicates), and additions through set
+    candidates = _leaves(5, start=1000) + leaves[:3]
+    for _ in range(4 * count):
+        index = rng.randrange(len(leaves) + 1)
+        value = rng.choice(candidates)
+        tree.set(index, value)
+        if index == len(leaves):
+            leaves.append(value)
+        else:
+            leaves[index] = value
+        _check(tree, leaves)
+
+    copy = tree.copy()
+    copy.set(0, _leaves(1, start=2000)[0])
+    _check(tree, leaves)
+
+
+def test_leaf_index_not_found():
+    tree = MerkleTree(_leaves(3))
+    tree.set(1, _leaves(1, start=1000)[0])
+    with pytest.raises(ValueError):
+        tree.leaf_index(_leaves(3)[1])
+
+
+def test_invalid():
+    tree = MerkleTree(_leaves(3))
+    with pytest.raises(ValueError):
+        tree.add(bytes(31))
+    with pytest.raises(ValueError):
+        tree.set(4, _leaves(1)[0])
+    with pytest.raises(IndexError):
+        tree.prove_leaf(3)
@@ -0,0 +1,58 @@
+import pytest
+
+from ledger_bitcoin import key
+from ledger_bitcoin.bip380.miniscript import Node
+from ledger_bitcoin.bip380.utils.hashes import hash160
+
+PUBKEYS = [key.point_to_bytes(key.point_mul(key.G, i + 1)).hex() for i in range(4)]
+A, B, C, D = PUBKEYS
+H32 = "ab" * 32
+H20 = "cd" * 20
+
+# One miniscript per fragment and wrapper at least, with single-sub thresholds
+MINISCRIPTS = [
+    f"pk({A})",
+    f"pkh({A})",
+    f"c:pk_k({A})",
+    f"c:pk_h({A})",
+    "older(144)",
+    "after(500000)",
+    f"sha256({H32})",
+    f"hash256({H32})",
+    f"ripemd160({H20})",
+    f"hash160({H20})",
+    f"multi(2,{A},{B},{C})",
+    f"and_v(v:pk({A}),pk({B}))",
+    f"and_b(pk({A}),s:pk({B}))",
+    f"and_n(pk({A}),older(144))",
+    f"andor(pk({A}),pk({B}),pk({C}))",
+    f"or_b(pk({A}),s:pk({B}))",
+    f"t:or_c(pk({A}),v:pk({B}))",
+    f"or_d(pk({A}),pk({B}))",
+    f"or_i(pk({A}),pk({B}))",
+    f"l:pk({A})",
+    f"u:pk({A})",
+    f"j:pk({A})",
+    f"n:pk({A})",
+    f"a:pk({A})",
+    "d:v:older(144)",
+    f"thresh(1,pk({A}))",
+    f"thresh(1,pkh({A}))",
+    f"thresh(1,thresh(1,pk({A})))",
+    f"thresh(1,pk({A}),s:pk({B}))",
+    f"thresh(2,pk({A}),s:pk({B}),s:pk({C}))",
+    f"thresh(3,pk({A}),s:pk({B}),s:pk({C}),sln:older(144))",
+    f"or_d(thresh(1,pk({A})),and_v(v:thresh(1,pk({B})),older(144)))",
+    f"andor(thresh(1,pk({A})),thresh(1,pk({B})),thresh(2,pk({C}),a:pk({D})))",
+]
+
+PKH_PREIMAGES = {hash160(bytes.fromhex(pubkey)): bytes.fromhex(pubkey) for pubkey in PUBKEYS}
+
+
+@pytest.mark.parametrize("ms_str", MINISCRIPTS)
+def test_script_round_trip(ms_str):
+    node = Node.from_str(ms_str)
+    decoded = Node.from_script(node.script, PKH_PREIMAGES)
+    assert decoded.script == node.script
+    assert repr(decoded) == repr(node)
+    assert type(decoded) is type(node)
@@ -0,0 +1,84 @@
+import random
+
+from typing import Dict, List
+
+import pytest
+
+from ledger_bitcoin import psbt_commitment
+from ledger_bitcoin.command_builder import BitcoinCommandBuilder
+from ledger_bitcoin.common import write_varint
+from ledger_bitcoin.merkle import NIL, combine_hashes, element_hash, largest_power_of_2_less_than
+from ledger_bitcoin.psbt_commitment import PsbtCommitment
+from ledger_bitcoin.wallet import WalletPolicy
+
+WALLET = WalletPolicy(
+    "",
+    "wpkh(@0/**)",
+    ["[f5acc2fd/84'/1'/0']tpubDCtKfsNyRhULjZ9XMS4VKKtVcPdVDi8MKUbcSD9MJDyjRu1A2ND5MiipozyyspBT9bg8upEp7a8EAgFxNxXn1d7QkdbL52Ty5jiSLcxPt1P"],
+)
+
+
+def _root(leaves: List[bytes]) -> bytes:
+    if len(leaves) == 0:
+        return NIL
+    if len(leaves) == 1:
+        return leaves[0]
+    split = largest_power_of_2_less_than(len(leaves))
+    return combine_hashes(_root(leaves[:split]), _root(leaves[split:]))
+
+
+def _map_commitment(mapping: Dict[bytes, bytes]) -> bytes:
+    # the Merkleized map commitment, hashed again for each map as the client used to
+    keys = sorted(mapping)
+    return write_varint(len(keys)) + _root([element_hash(k) for k in keys]) + _root([element_hash(mapping[k]) for k in keys])
+
+
+def _reference_cdata(global_map, input_maps, output_maps) -> bytes:
+    # the commitment to the PSBT that sign_psbt sent before the maps were Merkleized once
+    return b"".join([
+        _map_commitment(global_map),
+        write_varint(len(input_maps)),
+        _root([element_hash(_map_commitment(m)) for m in input_maps]),
+        write_varint(len(output_maps)),
+        _root([element_hash(_map_commitment(m)) for m in output_maps]),
+    ])
+
+
+def _random_map(rng: random.Random, max_len: int) -> Dict[bytes, bytes]:
+    return {rng.randbytes(rng.randrange(1, 40)): rng.randbytes(rng.randrange(0, 120)) for _ in range(rng.randrange(max_len))}
+
+
+def _random_maps(seed: int, n_inputs: int, n_outputs: int):
+    rng = random.Random(seed)
+    return _random_map(rng, 8), [_random_map(rng, 12) for _ in range(n_inputs)], [_random_map(rng, 5) for _ in range(n_outputs)]
+
+
+@pytest.mark.parametrize("n_inputs,n_outputs", [(0, 0), (1, 1), (2, 3), (5, 1), (17, 9)])
+def test_commitment(n_inputs, n_outputs):
+    global_map, input_maps, output_maps = _random_maps(n_inputs * 100 + n_outputs, n_inputs, n_outputs)
+    commitment = PsbtCommitment(global_map, input_maps, output_maps, processes=1)
+    assert commitment.serialize() == _reference_cdata(global_map, input_maps, output_maps)
+    assert commitment.input_commitments == [_map_commitment(m) for m in input_maps]
+    assert commitment.output_commitments == [_map_commitment(m) for m in output_maps]
+    for merkleized, mapping in zip([commitment.global_map] + commitment.input_maps + commitment.output_maps,
+                                   [global_map] + input_maps + output_maps):
+        assert merkleized.keys == sorted(mapping)
+        assert merkleized.values == [mapping[k] for k in sorted(mapping)]
+
+
+def test_commitment_worker_processes(monkeypatch):
+    monkeypatch.setattr(psbt_commitment, "PARALLEL_HASHING_MIN_SIZE", 0)
+    monkeypatch.setattr(psbt_commitment, "PARALLEL_HASHING_CHUNK_LEN", 3)
+    global_map, input_maps, output_maps = _random_maps(0, 10, 4)
+    commitment = PsbtCommitment(global_map, input_maps, output_maps, processes=2)
+    assert commitment.serialize() == _reference_cdata(global_map, input_maps, output_maps)
+
+
+@pytest.mark.parametrize("wallet_hmac", [None, bytes(range(32))])
+def test_sign_psbt(wallet_hmac):
+    global_map, input_maps, output_maps = _random_maps(1, 3, 2)
+    builder = BitcoinCommandBuilder()
+    expected = _reference_cdata(global_map, input_maps, output_maps) + WALLET.id + (wallet_hmac or bytes(32))
+    assert builder.sign_psbt(global_map, input_maps, output_maps, WALLET, wallet_hmac)["data"] == expected
+    commitment = PsbtCommitment(global_map, input_maps, output_maps, processes=1)
+    assert builder.sign_psbt_commitment(commitment, WALLET, wallet_hmac)["data"] == expected
@@ -0,0 +1,46 @@
+import hashlib
+import random
+
+import pytest
+
+from ledger_bitcoin import ripemd
+
+# The test vectors of the RIPEMD-160 specification
+VECTORS = [
+    (b"", "9c1185a5c5e9fc54612808977ee8f548b2258d31"),
+    (b"a", "0bdc9d2d256b3ee9daae347be6f4dc835a467ffe"),
+    (b"abc", "8eb208f7e05d987a9b044a8e98c6b087f15a0bfc"),
+    (b"message digest", "5d0689ef49d2fae572b881b123a85ffa21595f36"),
+    (b"abcdefghijklmnopqrstuvwxyz", "f71c27109c692c1b56bbdceb5b9d2865b3708dbc"),
+    (b"abcdbcdecdefdefgefghfghighijhijkijkljklmklmnlmnomnopnopq", "12a053384a9c0c88e405a06c27dcf49ada62eb2b"),
+    (b"ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789", "b0e20b6e3116640286ed3a87a5713079b21f5189"),
+    (b"1234567890" * 8, "9b752e45573d4b39f4dbd3323cab82bf63326bfb"),
+    (b"a" * 1000000, "52783243c1697bdbe16d37f97f68f08325dc1528"),
+]
+
+rng = random.Random(0)
+# around the block and padding boundaries
+MESSAGES = [rng.randbytes(length) for length in list(range(0, 130)) + [191, 192, 193, 1000, 4096]]
+
+
+@pytest.mark.parametrize("data,digest", VECTORS)
+def test_vectors(data, digest):
+    assert ripemd.ripemd160_fallback(data).hex() == digest
+    assert ripemd.ripemd160(data).hex() == digest
+
+
+@pytest.mark.skipif(not ripemd.HASHLIB_RIPEMD160, reason="hashlib does not provide RIPEMD160")
+def test_hashlib():
+    for data in MESSAGES:
+        assert ripemd.ripemd160_fallback(data) == hashlib.new("ripemd160", data).digest()
+        # and from the other buffer types
+        assert ripemd.ripemd160_fallback(bytearray(data)) == ripemd.ripemd160_fallback(memoryview(data)) == \
+            hashlib.new("ripemd160", data).digest()
+
+
+def test_hash160(monkeypatch):
+    expected = [ripemd.ripemd160_fallback(hashlib.sha256(data).digest()) for data in MESSAGES]
+    assert [ripemd.hash160(data) for data in MESSAGES] == expected
+    assert ripemd.hash160_many(MESSAGES) == expected
+    monkeypatch.setattr(ripemd, "HASHLIB_RIPEMD160", False)
+    assert ripemd.hash160_many(MESSAGES) == expected
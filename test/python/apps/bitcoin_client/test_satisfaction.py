@@ -0,0 +1,122 @@
+import itertools
+import random
+
+from functools import reduce
+from operator import or_
+
+import pytest
+
+from ledger_bitcoin import key
+from ledger_bitcoin.bip380.miniscript import Node
+from ledger_bitcoin.bip380.miniscript.fragments import Thresh
+from ledger_bitcoin.bip380.miniscript.satisfaction import Satisfaction, SatisfactionMaterial
+
+PUBKEYS = [key.point_to_bytes(key.point_mul(key.G, i + 1)) for i in range(40)]
+LOCKTIMES = [10, 144, 1000]
+
+
+class _PolicyGenerator:
+    def __init__(self, rng: random.Random):
+        self.rng = rng
+        self.keys = iter(PUBKEYS)
+
+    def first_sub(self, depth: int) -> str:
+        choice = self.rng.randrange(3 if depth > 0 else 2)
+        if choice == 0:
+            return f"pk({next(self.keys).hex()})"
+        if choice == 1:
+            return f"pkh({next(self.keys).hex()})"
+        return self.thresh(depth - 1)
+
+    def other_sub(self, depth: int) -> str:
+        choice = self.rng.randrange(5 if depth > 0 else 4)
+        if choice == 0:
+            return f"s:pk({next(self.keys).hex()})"
+        if choice == 1:
+            return f"a:pk({next(self.keys).hex()})"
+        if choice == 2:
+            return f"a:pkh({next(self.keys).hex()})"
+        if choice == 3:
+            return f"sln:older({self.rng.choice(LOCKTIMES)})"
+        return "a:" + self.thresh(depth - 1)
+
+    def thresh(self, depth: int, nested: bool = True) -> str:
+        # Thresh does not support a nested thresh(1,...) under a larger threshold
+        n = self.rng.randrange(2 if nested else 1, 6)
+        k = self.rng.randrange(2 if nested else 1, n + 1)
+        subs = [self.first_sub(depth)] + [self.other_sub(depth) for _ in range(n - 1)]
+        return f"thresh({k},{','.join(subs)})"
+
+
+def _random_material(rng: random.Random, material: SatisfactionMaterial) -> None:
+    # modifies the material in place, as the signers do between the rounds
+    material.signatures.clear()
+    for pubkey in PUBKEYS:
+        if rng.random() < 0.6:
+            material.signatures[pubkey] = bytes([0x30]) * rng.randrange(70, 74)
+    material.max_sequence = rng.choice([0] + LOCKTIMES)
+
+
+def _key(sat: Satisfaction):
+    return None if sat.is_unavailable() else (sat.has_sig, sat.size())
+
+
+def _reference(node: Node, material: SatisfactionMaterial):
+    # the (satisfaction, dissatisfaction) of each fragment computed again from scratch, choosing between all the
+    # combinations of k satisfied subs of the thresholds
+    if not node.subs:
+        return node.satisfaction(material), node.dissatisfaction()
+    subs = [_reference(sub, material) for sub in node.subs]
+    if not isinstance(node, Thresh):
+        return node.combine_satisfactions(subs)
+    return reduce(or_, _combinations(node.k, subs)), Satisfaction.concat([sub[1] for sub in subs])
+
+
+def _combinations(k: int, subs):
+    # the witnesses satisfying each combination of k subs, and dissatisfying the others
+    n = len(subs)
+    return [
+        Satisfaction.concat([subs[i][0 if i in chosen else 1] for i in range(n - 1, -1, -1)])
+        for chosen in map(set, itertools.combinations(range(n), k))
+    ]
+
+
+def _thresh_candidates(node: Thresh, material: SatisfactionMaterial):
+    return _combinations(node.k, [(sub.satisfaction(material), sub.dissatisfaction()) for sub in node.subs])
+
+
+@pytest.mark.parametrize("seed", range(40))
+def test_thresh_satisfaction(seed):
+    rng = random.Random(seed)
+    node = Node.from_str(_PolicyGenerator(rng).thresh(depth=2, nested=False))
+    material = SatisfactionMaterial({}, {})
+    # the same material modified in place, so that the cache of the fragments is updated
+    for _ in range(6):
+        _random_material(rng, material)
+        sat = node.satisfaction(material)
+        expected_sat, expected_dissat = _reference(node, material)
+        assert _key(sat) == _key(expected_sat)
+        assert node.dissatisfaction() == expected_dissat
+        if not sat.is_unavailable():
+            # one of the best choices, the ties are broken either way
+            assert sat in _thresh_candidates(node, material)
+        assert node.satisfy(material) == (sat.witness if sat.has_sig else None)
+
+
+@pytest.mark.parametrize("k", [1, 2, 3, 4])
+def test_thresh_satisfaction_all_signatures(k):
+    # every sub needs a signature: the smallest satisfactions are chosen
+    subs = [f"pk({PUBKEYS[0].hex()})"] + [f"a:pkh({pubkey.hex()})" for pubkey in PUBKEYS[1:4]]
+    node = Node.from_str(f"thresh({k},{','.join(subs)})")
+    material = SatisfactionMaterial({}, {PUBKEYS[i]: bytes(72 - i) for i in range(4)})
+    assert _key(node.satisfaction(material)) == _key(reduce(or_, _thresh_candidates(node, material)))
+    del material.signatures[PUBKEYS[0]]
+    del material.signatures[PUBKEYS[1]]
+    sat = node.satisfaction(material)
+    assert _key(sat) == _key(_reference(node, material)[0])
+    assert sat.is_unavailable() == (k > 2)
+
+
+def test_satisfaction_not_hashable():
+    with pytest.raises(TypeError):
+        hash(Satisfaction([b""]))
@@ -0,0 +1,96 @@
+import pytest
+
+from ledger_bitcoin.common import hash256
+from ledger_bitcoin.psbt import PSBT, PartiallySignedInput, PartiallySignedOutput, PSBTSerializationError
+from ledger_bitcoin.tx import COutPoint, CTransaction, CTxIn, CTxInWitness, CTxOut
+from ledger_bitcoin._serialize import uint256_from_str
+
+
+def _segwit_tx() -> CTransaction:
+    tx = CTransaction()
+    tx.nVersion = 2
+    for i in range(3):
+        tx.vin.append(CTxIn(COutPoint(i + 1, i), b"", 0xfffffffd))
+        witness = CTxInWitness()
+        witness.scriptWitness.stack = [bytes([i]) * 64]
+        tx.wit.vtxinwit.append(witness)
+    tx.vout.append(CTxOut(1000, bytes.fromhex("0014") + bytes(20)))
+    return tx
+
+
+def _txid(tx: CTransaction) -> bytes:
+    return hash256(tx.serialize_without_witness())
+
+
+def _wtxid(tx: CTransaction) -> int:
+    return uint256_from_str(hash256(tx.serialize_with_witness()))
+
+
+def test_calc_sha256_after_witness_edit():
+    tx = _segwit_tx()
+    tx.rehash()
+    wtxid = tx.calc_sha256(with_witness=True)
+    assert wtxid == _wtxid(tx)
+
+    # editing a witness in place is not tracked by the transaction
+    tx.wit.vtxinwit[0].scriptWitness.stack = [b"\x01" * 72, b"\x02" * 33]
+
+    assert tx.calc_sha256(with_witness=True) == _wtxid(tx) != wtxid
+
+
+def test_calc_sha256_after_input_edit():
+    tx = _segwit_tx()
+    tx.rehash()
+    txid = tx.hash
+    assert txid == _txid(tx)
+
+    # editing an input in place is not tracked either, the txid is only refreshed explicitly
+    tx.vin[0].nSequence = 5
+    assert tx.hash == txid
+
+    tx.calc_sha256()
+    assert tx.hash == _txid(tx) != txid
+    assert tx.sha256 == uint256_from_str(tx.hash)
+
+    tx.vout[0].nValue = 2000
+    tx.rehash()
+    assert tx.hash == _txid(tx)
+
+
+def test_txid_cache_follows_the_lists():
+    tx = _segwit_tx()
+    txid = tx.hash
+
+    tx.vout.append(CTxOut(500, b"\x6a"))
+    assert tx.hash == _txid(tx) != txid
+
+    tx.nLockTime = 800000
+    assert tx.hash == _txid(tx)
+
+    # copies get their own lists, and their own cache
+    copy = CTransaction(tx)
+    copy.vin.pop()
+    assert copy.hash == _txid(copy) != tx.hash
+
+
+def _psbt_spending(prev_tx: CTransaction, prevout_hash: int) -> bytes:
+    tx = CTransaction()
+    tx.vin.append(CTxIn(COutPoint(prevout_hash, 0), b"", 0xfffffffd))
+    tx.vout.append(CTxOut(900, bytes.fromhex("0014") + bytes(20)))
+    psbt = PSBT(tx)
+    psbt.inputs.append(PartiallySignedInput(0))
+    psbt.inputs[0].non_witness_utxo = prev_tx
+    psbt.outputs.append(PartiallySignedOutput(0))
+    return psbt.serialize_bytes()
+
+
+def test_psbt_non_witness_utxo_txid():
+    prev_tx = _segwit_tx()
+    psbt = PSBT()
+    psbt.deserialize_bytes(_psbt_spending(prev_tx, uint256_from_str(_txid(prev_tx))))
+    utxo = psbt.inputs[0].non_witness_utxo
+    assert utxo.hash == _txid(prev_tx)
+    assert utxo.sha256 == psbt.tx.vin[0].prevout.hash
+
+    with pytest.raises(PSBTSerializationError):
+        PSBT().deserialize_bytes(_psbt_spending(prev_tx, 1))
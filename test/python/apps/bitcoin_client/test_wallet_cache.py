@@ -0,0 +1,87 @@
+import json
+
+from ledger_bitcoin import Chain, WalletCache, WalletPolicy
+from ledger_bitcoin.client import NewClient
+from ledger_bitcoin.command_builder import BitcoinInsType
+
+FINGERPRINT = bytes.fromhex("f5acc2fd")
+
+# A timelocked 2-of-2 multisig, whose addresses get_wallet_address derives again on the host
+WALLET = WalletPolicy(
+    "Timelocked 2-of-2",
+    "wsh(or_d(multi(2,@0/**,@1/**),and_v(v:pkh(@2/**),older(144))))",
+    [
+        "[f5acc2fd/48'/1'/0'/2']tpubDCtKfsNyRhULjZ9XMS4VKKtVcPdVDi8MKUbcSD9MJDyjRu1A2ND5MiipozyyspBT9bg8upEp7a8EAgFxNxXn1d7QkdbL52Ty5jiSLcxPt1P",
+        "[f5acc2fd/48'/1'/1'/2']tpubDCtKfsNyRhULjZ9XMS4VKKtVcPdVDi8MKUbcSD9MJDyjRu1A2ND5MiipozyyspBT9bg8upEp7a8EAgFxNxXn1d7QkdbL52Ty5jiSLcxPt1P",
+        "[f5acc2fd/48'/1'/2'/2']tpubDCtKfsNyRhULjZ9XMS4VKKtVcPdVDi8MKUbcSD9MJDyjRu1A2ND5MiipozyyspBT9bg8upEp7a8EAgFxNxXn1d7QkdbL52Ty5jiSLcxPt1P",
+    ],
+)
+
+
+class _HostClient(NewClient):
+    """A NewClient whose device returns the addresses of WALLET for its chain, as derived on the host."""
+
+    def __init__(self, chain: Chain, wallet_cache: WalletCache):
+        super().__init__(None, chain)
+        self.wallet_cache = wallet_cache
+        self.derived = 0
+
+    def _derive_segwit_address_for_policy(self, wallet, change, address_index):
+        self.derived += 1
+        return super()._derive_segwit_address_for_policy(wallet, change, address_index)
+
+    def _make_request(self, apdu, client_intepreter=None):
+        if apdu["ins"] == BitcoinInsType.GET_MASTER_FINGERPRINT:
+            return 0x9000, FINGERPRINT
+        address_index = int.from_bytes(apdu["data"][-4:], "big")
+        return 0x9000, NewClient._derive_segwit_address_for_policy(self, WALLET, 0, address_index).encode()
+
+
+def test_addresses_of_each_chain(tmp_path):
+    cache = WalletCache(tmp_path / "wallets.json")
+    main = _HostClient(Chain.MAIN, cache)
+    test = _HostClient(Chain.TEST, cache)
+
+    # the clients share the cache, each one gets and caches the addresses of its chain
+    main_addresses = [main.get_wallet_address(WALLET, None, 0, i, False) for i in range(3)]
+    test_addresses = [test.get_wallet_address(WALLET, None, 0, i, False) for i in range(3)]
+    assert all(address.startswith("bc1") for address in main_addresses)
+    assert all(address.startswith("tb1") for address in test_addresses)
+    assert main.derived == test.derived == 3
+
+    assert [main.get_wallet_address(WALLET, None, 0, i, False) for i in range(3)] == main_addresses
+    assert [test.get_wallet_address(WALLET, None, 0, i, False) for i in range(3)] == test_addresses
+    assert main.derived == test.derived == 3
+
+    # and so does a cache loaded from the file
+    reloaded = WalletCache(tmp_path / "wallets.json")
+    assert [reloaded.get_address(FINGERPRINT, WALLET, "bc", 0, i) for i in range(3)] == main_addresses
+    assert [reloaded.get_address(FINGERPRINT, WALLET, "tb", 0, i) for i in range(3)] == test_addresses
+    assert reloaded.get_address(FINGERPRINT, WALLET, "bcrt", 0, 0) is None
+
+
+def test_persisted_hmac(tmp_path):
+    cache = WalletCache(tmp_path / "wallets.json")
+    cache.set_hmac(FINGERPRINT, WALLET, bytes(range(32)))
+
+    reloaded = WalletCache(tmp_path / "wallets.json")
+    assert reloaded.get_hmac(FINGERPRINT, WALLET) == bytes(range(32))
+    assert reloaded.get_hmac(bytes(4), WALLET) is None
+
+    reloaded.clear()
+    assert len(WalletCache(tmp_path / "wallets.json")) == 0
+
+
+def test_unversioned_file_is_not_loaded(tmp_path):
+    # addresses persisted without their network must not be trusted
+    path = tmp_path / "wallets.json"
+    path.write_text(json.dumps({
+        f"{FINGERPRINT.hex()}:{WALLET.id.hex()}": {"hmac": None, "addresses": {"0": {"0": "tb1qwrong"}}},
+    }))
+
+    cache = WalletCache(path)
+    assert len(cache) == 0
+
+    client = _HostClient(Chain.MAIN, cache)
+    assert client.get_wallet_address(WALLET, None, 0, 0, False).startswith("bc1")
+    assert json.loads(path.read_text())["version"] == 2
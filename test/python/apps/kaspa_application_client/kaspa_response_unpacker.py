@@ -1,14 +1,9 @@
 from typing import Tuple
 from struct import unpack
 
-# remainder, data_len, data
-def pop_sized_buf_from_buffer(buffer:bytes, size:int) -> Tuple[bytes, bytes]:
-    return buffer[size:], buffer[0:size]
-
-# remainder, data_len, data
-def pop_size_prefixed_buf_from_buf(buffer:bytes) -> Tuple[bytes, int, bytes]:
-    data_len = buffer[0]
-    return buffer[1+data_len:], data_len, buffer[1:data_len+1]
+# the Bitcoin app puts the ledger_bitcoin package on the path
+from .. import bitcoin  # noqa: F401
+from ledger_bitcoin.common import ByteStreamParser
 
 # Unpack from response:
 # response = app_name (var)
@@ -33,12 +28,13 @@ def unpack_get_version_response(response: bytes) -> Tuple[int, int, int]:
 #            unused_len (1)
 #            unused (var)
 def unpack_get_app_and_version_response(response: bytes) -> Tuple[str, str]:
-    response, _ = pop_sized_buf_from_buffer(response, 1)
-    response, _, app_name_raw = pop_size_prefixed_buf_from_buf(response)
-    response, _, version_raw = pop_size_prefixed_buf_from_buf(response)
-    response, _, _ = pop_size_prefixed_buf_from_buf(response)
+    buf = ByteStreamParser(response)
+    buf.read_bytes(1)  # format_id
+    app_name_raw = buf.read_prefixed_bytes()
+    version_raw = buf.read_prefixed_bytes()
+    buf.read_prefixed_bytes()
 
-    assert len(response) == 0
+    assert buf.remaining() == 0
 
     return app_name_raw.decode("ascii"), version_raw.decode("ascii")
 
@@ -48,12 +44,14 @@ def unpack_get_app_and_version_response(response: bytes) -> Tuple[str, str]:
 #            chain_code_len (1)
 #            chain_code (var)
 def unpack_get_public_key_response(response: bytes) -> Tuple[int, bytes, int, bytes]:
-    response, pub_key_len, pub_key = pop_size_prefixed_buf_from_buf(response)
-    response, chain_code_len, chain_code = pop_size_prefixed_buf_from_buf(response)
+    buf = ByteStreamParser(response)
+    pub_key = buf.read_prefixed_bytes()
+    chain_code = buf.read_prefixed_bytes()
+    pub_key_len, chain_code_len = len(pub_key), len(chain_code)
 
     assert pub_key_len == 65
     assert chain_code_len == 32
-    assert len(response) == 0
+    assert buf.remaining() == 0
 
     return pub_key_len, pub_key, chain_code_len, chain_code
 
@@ -65,16 +63,17 @@ def unpack_get_public_key_response(response: bytes) -> Tuple[int, bytes, int, by
 #            sighash_len (1)
 #            sighash (32)
 def unpack_sign_tx_response(response: bytes) -> Tuple[int, int, int, bytes, int, bytes]:
-    response, has_more = pop_sized_buf_from_buffer(response, 1)
-    response, input_index = pop_sized_buf_from_buffer(response, 1)
-    response, der_sig_len, der_sig = pop_size_prefixed_buf_from_buf(response)
-    response, sighash_len, sighash = pop_size_prefixed_buf_from_buf(response)
+    buf = ByteStreamParser(response)
+    has_more = buf.read_uint(1)
+    input_index = buf.read_uint(1)
+    der_sig = buf.read_prefixed_bytes()
+    sighash = buf.read_prefixed_bytes()
 
-    assert len(response) == 0
+    assert buf.remaining() == 0
 
-    return int.from_bytes(has_more, byteorder='big'), \
-           int.from_bytes(input_index, byteorder='big'), \
-           der_sig_len, \
+    return has_more, \
+           input_index, \
+           len(der_sig), \
            der_sig, \
-           sighash_len, \
+           len(sighash), \
            sighash
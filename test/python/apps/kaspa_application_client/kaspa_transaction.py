@@ -1,7 +1,10 @@
-from io import BytesIO
 from typing import Union
 from hashlib import blake2b
 
+# the Bitcoin app puts the ledger_bitcoin package on the path
+from .. import bitcoin  # noqa: F401
+from ledger_bitcoin.common import ByteStreamParser
+
 from .kaspa_utils import read, read_uint
 
 def hash_init() -> blake2b:
@@ -36,8 +39,8 @@ class TransactionInput:
         ])
 
     @classmethod
-    def from_bytes(cls, hexa: Union[bytes, BytesIO]):
-        buf: BytesIO = BytesIO(hexa) if isinstance(hexa, bytes) else hexa
+    def from_bytes(cls, hexa: Union[bytes, ByteStreamParser]):
+        buf: ByteStreamParser = ByteStreamParser(hexa) if isinstance(hexa, bytes) else hexa
 
         value: int = read_uint(buf, 8, 'big')
         tx_id: str = read(buf, 32).decode("hex")
@@ -69,8 +72,8 @@ class TransactionOutput:
         ])
 
     @classmethod
-    def from_bytes(cls, hexa: Union[bytes, BytesIO]):
-        buf: BytesIO = BytesIO(hexa) if isinstance(hexa, bytes) else hexa
+    def from_bytes(cls, hexa: Union[bytes, ByteStreamParser]):
+        buf: ByteStreamParser = ByteStreamParser(hexa) if isinstance(hexa, bytes) else hexa
 
         value: int = read_uint(buf, 8, 'big')
         script_public_key: str = read(buf, 34).decode("hex")
@@ -123,8 +126,8 @@ class Transaction:
         return Sighash(self, input_index).to_hash()
 
     @classmethod
-    def from_bytes(cls, hexa: Union[bytes, BytesIO]):
-        buf: BytesIO = BytesIO(hexa) if isinstance(hexa, bytes) else hexa
+    def from_bytes(cls, hexa: Union[bytes, ByteStreamParser]):
+        buf: ByteStreamParser = ByteStreamParser(hexa) if isinstance(hexa, bytes) else hexa
 
         version: int = read_uint(buf, 16, byteorder="big")
         tx_output_len: int = read_uint(buf, 8, byteorder="big")
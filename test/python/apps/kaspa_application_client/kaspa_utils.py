@@ -1,28 +1,28 @@
-from io import BytesIO
 from typing import Literal
 
+# the Bitcoin app puts the ledger_bitcoin package on the path
+from .. import bitcoin  # noqa: F401
+from ledger_bitcoin.common import ByteStreamParser
+
 
 UINT64_MAX: int = 2**64-1
 UINT32_MAX: int = 2**32-1
 UINT16_MAX: int = 2**16-1
 
 
-def read(buf: BytesIO, size: int) -> bytes:
-    b: bytes = buf.read(size)
-
-    if len(b) < size:
+def read(buf: ByteStreamParser, size: int) -> bytes:
+    if buf.remaining() < size:
         raise ValueError(f"Can't read {size} bytes in buffer!")
 
-    return b
+    return buf.read_bytes(size)
 
 
-def read_uint(buf: BytesIO,
+def read_uint(buf: ByteStreamParser,
               bit_len: int,
               byteorder: Literal['big', 'little'] = 'little') -> int:
     size: int = bit_len // 8
-    b: bytes = buf.read(size)
 
-    if len(b) < size:
+    if buf.remaining() < size:
         raise ValueError(f"Can't read u{bit_len} in buffer!")
 
-    return int.from_bytes(b, byteorder)
+    return buf.read_uint(size, byteorder)
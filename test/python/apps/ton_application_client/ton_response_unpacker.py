@@ -1,14 +1,9 @@
 from typing import Tuple
 from struct import unpack
 
-# remainder, data_len, data
-def pop_sized_buf_from_buffer(buffer:bytes, size:int) -> Tuple[bytes, bytes]:
-    return buffer[size:], buffer[0:size]
-
-# remainder, data_len, data
-def pop_size_prefixed_buf_from_buf(buffer:bytes) -> Tuple[bytes, int, bytes]:
-    data_len = buffer[0]
-    return buffer[1+data_len:], data_len, buffer[1:data_len+1]
+# the Bitcoin app puts the ledger_bitcoin package on the path
+from .. import bitcoin  # noqa: F401
+from ledger_bitcoin.common import ByteStreamParser
 
 # Unpack from response:
 # response = app_name (var)
@@ -33,44 +28,39 @@ def unpack_get_version_response(response: bytes) -> Tuple[int, int, int]:
 #            unused_len (1)
 #            unused (var)
 def unpack_get_app_and_version_response(response: bytes) -> Tuple[str, str]:
-    response, _ = pop_sized_buf_from_buffer(response, 1)
-    response, _, app_name_raw = pop_size_prefixed_buf_from_buf(response)
-    response, _, version_raw = pop_size_prefixed_buf_from_buf(response)
-    response, _, _ = pop_size_prefixed_buf_from_buf(response)
+    buf = ByteStreamParser(response)
+    buf.read_bytes(1)  # format_id
+    app_name_raw = buf.read_prefixed_bytes()
+    version_raw = buf.read_prefixed_bytes()
+    buf.read_prefixed_bytes()
 
-    assert len(response) == 0
+    assert buf.remaining() == 0
 
     return app_name_raw.decode("ascii"), version_raw.decode("ascii")
 
 def unpack_sign_tx_response(response: bytes) -> Tuple[bytes, bytes]:
-    response, sig_len, sig = pop_size_prefixed_buf_from_buf(response)
-    response, hash_len, hash_b = pop_size_prefixed_buf_from_buf(response)
-
-    assert sig_len == len(sig)
-    assert hash_len == len(hash_b)
+    buf = ByteStreamParser(response)
+    sig = buf.read_prefixed_bytes()
+    hash_b = buf.read_prefixed_bytes()
 
-    assert len(response) == 0
+    assert buf.remaining() == 0
 
     return sig, hash_b
 
 def unpack_sign_data_response(response: bytes) -> Tuple[bytes, bytes]:
-    response, sig_len, sig = pop_size_prefixed_buf_from_buf(response)
-    response, hash_len, hash_b = pop_size_prefixed_buf_from_buf(response)
+    buf = ByteStreamParser(response)
+    sig = buf.read_prefixed_bytes()
+    hash_b = buf.read_prefixed_bytes()
 
-    assert sig_len == len(sig)
-    assert hash_len == len(hash_b)
-
-    assert len(response) == 0
+    assert buf.remaining() == 0
 
     return sig, hash_b
 
 def unpack_proof_response(response: bytes) -> Tuple[bytes, bytes]:
-    response, sig_len, sig = pop_size_prefixed_buf_from_buf(response)
-    response, hash_len, hash_b = pop_size_prefixed_buf_from_buf(response)
-
-    assert sig_len == len(sig)
-    assert hash_len == len(hash_b)
+    buf = ByteStreamParser(response)
+    sig = buf.read_prefixed_bytes()
+    hash_b = buf.read_prefixed_bytes()
 
-    assert len(response) == 0
+    assert buf.remaining() == 0
 
     return sig, hash_b
@@ -1,10 +1,19 @@
 import pytest
 
 from pathlib import Path
+from unittest.mock import MagicMock
 
 from ragger.conftest import configuration
+from ragger.backend import SpeculosBackend
+from ragger.conftest.base_conftest import prepare_speculos_args
+from ragger.navigator import NanoNavigator, TouchNavigator
+from ledgered.devices import Devices
 
 from ledger_app_clients.exchange.navigation_helper import ExchangeNavigationHelper
+from ledger_app_clients.exchange.benchmark import BenchmarkRecorder
+from ledger_app_clients.exchange.model_backend import ExchangeModelBackend, ExchangeModelNavigationHelper
+from ledger_app_clients.exchange.emulator_pool import EmulatorSpec, get_unused_ports, parse_pool_address, pooled_backend
+from ledger_app_clients.exchange.fan_out import dump_reports, open_backends
 
 ###########################
 ### CONFIGURATION START ###
@@ -18,6 +27,7 @@ configuration.OPTIONAL.BACKEND_SCOPE = "class"
 
 # --8<-- [start:sideloaded_applications]
 def pytest_configure(config):
+    config.addinivalue_line("markers", "exchange_model: the test only talks to Exchange and can run against the model backend")
     current_setup = config.getoption("--setup")
     # We don't need any lib dependency for the prod_build test
     if current_setup == "default":
@@ -53,6 +63,44 @@ def pytest_configure(config):
 # Pull all features from the base ragger conftest using the overridden configuration
 pytest_plugins = ("ragger.conftest.base_conftest", )
 
+def pytest_addoption(parser):
+    parser.addoption("--benchmark_runs", action="store", type=int, default=0,
+                     help="Number of runs of each benchmarked flow, benchmarks are skipped if 0")
+    parser.addoption("--benchmark_output", action="store", default="benchmark.json",
+                     help="Path of the JSON percentile report written at the end of the benchmark session")
+    parser.addoption("--fuzz_iterations", action="store", type=int, default=0,
+                     help="Number of fuzzing executions per target, fuzzing is skipped if 0")
+    parser.addoption("--exchange_model", action="store_true", default=False,
+                     help="Run the tests marked exchange_model against the Python model of the Exchange application instead of a device")
+    parser.addoption("--emulator_pool", action="store", default=None,
+                     help="<host>:<port> of an emulator pool daemon to lease the Speculos instances from instead of booting them")
+    parser.addoption("--fan_out", action="store_true", default=False,
+                     help="Run the fan-out tests, driving each flow on all the requested devices at once")
+    parser.addoption("--fan_out_output", action="store", default="fan_out.json",
+                     help="Path of the JSON per-device report written at the end of the fan-out session")
+
+@pytest.fixture(scope="session")
+def benchmark_runs(pytestconfig):
+    return pytestconfig.getoption("benchmark_runs")
+
+@pytest.fixture(scope="session")
+def fuzz_iterations(pytestconfig):
+    return pytestconfig.getoption("fuzz_iterations")
+
+@pytest.fixture(scope="session")
+def fan_out_reports(pytestconfig):
+    reports = []
+    yield reports
+    if pytestconfig.getoption("fan_out"):
+        dump_reports(reports, Path(pytestconfig.getoption("fan_out_output")))
+
+@pytest.fixture(scope="session")
+def benchmark_recorder(pytestconfig):
+    recorder = BenchmarkRecorder()
+    yield recorder
+    if pytestconfig.getoption("benchmark_runs") > 0:
+        recorder.dump(Path(pytestconfig.getoption("benchmark_output")))
+
 @pytest.fixture(scope="session")
 def snapshots_path():
     """
@@ -62,9 +110,83 @@ def snapshots_path():
     # Use the current file's directory as the base path
     return Path(__file__).parent.resolve()
 
+def _speculos_args(request, device):
+    return prepare_speculos_args(request.getfixturevalue("root_pytest_dir"),
+                                 device,
+                                 request.getfixturevalue("display"),
+                                 request.getfixturevalue("pki_prod"),
+                                 request.getfixturevalue("cli_user_seed"),
+                                 request.getfixturevalue("additional_speculos_arguments"),
+                                 request.getfixturevalue("verbose_speculos"),
+                                 request.getfixturevalue("ignore_missing_binaries"))
+
+# Replaces the ragger backend by the Exchange model if requested, no device nor emulator is started
+# or by an instance leased from the emulator pool daemon, already booted with the sideloaded applications
+@pytest.fixture(scope=configuration.OPTIONAL.BACKEND_SCOPE)
+def backend(request, pytestconfig, skip_tests_for_unsupported_devices, device, backend_name):
+    if pytestconfig.getoption("exchange_model"):
+        with ExchangeModelBackend(device) as b:
+            yield b
+    elif pytestconfig.getoption("emulator_pool") is not None and backend_name.lower() == "speculos":
+        application, speculos_args = _speculos_args(request, device)
+        spec = EmulatorSpec.from_speculos_args(device, application, speculos_args)
+        with pooled_backend(spec,
+                            parse_pool_address(pytestconfig.getoption("emulator_pool")),
+                            log_apdu_file=request.getfixturevalue("log_apdu_file")) as b:
+            yield b
+    else:
+        yield request.getfixturevalue("backend")
+
+# One started backend per requested device, for the fan-out tests. The tests using it must not use
+# the device parametrized fixtures
+@pytest.fixture(scope="class")
+def fan_out_backends(request, pytestconfig, supported_devices, backend_name):
+    if not pytestconfig.getoption("fan_out"):
+        pytest.skip("Fan-out tests are only run with --fan_out")
+    if backend_name.lower() != "speculos":
+        pytest.skip("Fan-out tests need one emulator per device")
+
+    requested = pytestconfig.getoption("device")
+    devices = [d for d in Devices()
+               if d.name in supported_devices
+               and (requested in (d.name, "all") or (requested == "all_nano" and d.is_nano) or (requested == "all_eink" and not d.is_nano))]
+
+    def factory(device):
+        application, speculos_args = _speculos_args(request, device)
+        if pytestconfig.getoption("emulator_pool") is not None:
+            spec = EmulatorSpec.from_speculos_args(device, application, speculos_args)
+            return lambda: pooled_backend(spec, parse_pool_address(pytestconfig.getoption("emulator_pool")))
+        # Explicit ports, the emulators are booted concurrently
+        api_port, apdu_port = get_unused_ports(2)
+        speculos_args["args"] += ["--api-port", str(api_port), "--apdu-port", str(apdu_port)]
+        return lambda: SpeculosBackend(application, device=device, **speculos_args)
+
+    with open_backends({device.name: factory(device) for device in devices}) as backends:
+        yield backends
+
+@pytest.fixture(scope="function")
+def fan_out_sessions(fan_out_backends, snapshots_path, golden_run, navigation):
+    # Same navigator selection as the ragger navigator fixture, the helper is given its test name by the test
+    def sessions(test_name):
+        result = []
+        for backend in fan_out_backends.values():
+            if not navigation:
+                navigator = MagicMock()
+            elif backend.device.is_nano:
+                navigator = NanoNavigator(backend, backend.device, golden_run)
+            else:
+                navigator = TouchNavigator(backend, backend.device, golden_run)
+            result.append((backend, ExchangeNavigationHelper(backend=backend, navigator=navigator, snapshots_path=snapshots_path, test_name=test_name)))
+        return result
+    return sessions
+
 @pytest.fixture(scope="function")
 def exchange_navigation_helper(backend, navigator, snapshots_path, test_name):
-    return ExchangeNavigationHelper(backend=backend, navigator=navigator, snapshots_path=snapshots_path, test_name=test_name)
+    if isinstance(backend, ExchangeModelBackend):
+        helper_class = ExchangeModelNavigationHelper
+    else:
+        helper_class = ExchangeNavigationHelper
+    return helper_class(backend=backend, navigator=navigator, snapshots_path=snapshots_path, test_name=test_name)
 
 # Pytest is trying to do "smart" stuff and reorders tests using parametrize by alphabetical order of parameter
 # This breaks the backend scope optim. We disable this
@@ -75,3 +197,10 @@ def pytest_collection_modifyitems(config, items):
 
     # re-order the items using the param_part function as key
     items[:] = sorted(items, key=param_part)
+
+    # The model only knows about Exchange, tests needing a coin application can not run on it
+    if config.getoption("exchange_model"):
+        skip_model = pytest.mark.skip(reason="Test not supported by the Exchange model backend")
+        for item in items:
+            if item.get_closest_marker("exchange_model") is None:
+                item.add_marker(skip_model)
@@ -0,0 +1,71 @@
+import pytest
+
+from ledger_app_clients.exchange.navigation_helper import ExchangeNavigationHelper
+from ledger_app_clients.exchange.test_runner import ALL_TESTS_EXCEPT_MEMO, ALL_TESTS_EXCEPT_THORSWAP, \
+    ALL_TESTS_EXCEPT_MEMO_AND_THORSWAP, ALL_TESTS_EXCEPT_MEMO_THORSWAP_AND_FEES, ALL_TESTS_EXCEPT_THORSWAP_AND_FEES, \
+    SWAP_TESTS_EXCEPT_THORSWAP
+
+# The valid flows of ExchangeTestRunner, one per perform_valid_*_from_custom entry point
+BENCHMARK_FLOWS = ["swap_valid_1", "thorswap_valid_1", "fund_valid_1", "sell_valid_1"]
+
+# Benchmarked coins, indexed by the name of their regular test function so that the
+# navigation reuses the golden snapshots of that test: the test module and the class of
+# their runner, and the flows they support
+BENCHMARKED_COINS = {
+    "test_aptos": ("test_aptos", "AptosTests", ALL_TESTS_EXCEPT_MEMO_AND_THORSWAP),
+    "test_bitcoin": ("test_bitcoin", "BitcoinTests", ALL_TESTS_EXCEPT_MEMO),
+    "test_cardano_shelley": ("test_cardano", "CardanoShelleyClientTests", ALL_TESTS_EXCEPT_MEMO_AND_THORSWAP),
+    "test_celo": ("test_celo", "CeloTests", ALL_TESTS_EXCEPT_THORSWAP),
+    "test_cosmos": ("test_cosmos", "CosmosTests", ALL_TESTS_EXCEPT_THORSWAP),
+    "test_ethereum": ("test_ethereum", "EthereumTests", ALL_TESTS_EXCEPT_MEMO),
+    "test_bsc": ("test_ethereum", "BSCTests", ALL_TESTS_EXCEPT_MEMO),
+    "test_dai": ("test_ethereum", "DAITests", ALL_TESTS_EXCEPT_MEMO),
+    "test_mon": ("test_ethereum", "MONTests", ALL_TESTS_EXCEPT_MEMO),
+    "test_kaspa": ("test_kaspa", "KaspaTests", ALL_TESTS_EXCEPT_MEMO_AND_THORSWAP),
+    "test_near": ("test_near", "NearTests", ALL_TESTS_EXCEPT_MEMO_THORSWAP_AND_FEES),
+    "test_polkadot": ("test_polkadot", "PolkadotTests", ALL_TESTS_EXCEPT_MEMO_THORSWAP_AND_FEES),
+    "test_ripple": ("test_ripple", "RippleTests", SWAP_TESTS_EXCEPT_THORSWAP),
+    "test_stellar": ("test_stellar", "StellarTests", ALL_TESTS_EXCEPT_THORSWAP),
+    "test_sui": ("test_sui", "GenericSuiTests", ALL_TESTS_EXCEPT_MEMO_AND_THORSWAP),
+    "test_sui_tokens": ("test_sui", "SuiSwaptTokenTests", ALL_TESTS_EXCEPT_MEMO_AND_THORSWAP),
+    "test_tezos": ("test_tezos", "TezosTests", ALL_TESTS_EXCEPT_MEMO_AND_THORSWAP),
+    "test_ton": ("test_ton", "TonTests", ALL_TESTS_EXCEPT_MEMO_THORSWAP_AND_FEES),
+    "test_ton_usdt": ("test_ton", "TonUSDTTests", ALL_TESTS_EXCEPT_MEMO_THORSWAP_AND_FEES),
+    "test_tron_trx": ("test_tron", "TronTrxTests", ALL_TESTS_EXCEPT_THORSWAP_AND_FEES),
+    "test_tron_usdt": ("test_tron", "TronUsdtTests", ALL_TESTS_EXCEPT_THORSWAP_AND_FEES),
+    "test_tron_usdc": ("test_tron", "TronUsdcTests", ALL_TESTS_EXCEPT_THORSWAP_AND_FEES),
+}
+
+BENCHMARK_CASES = [(coin, flow)
+                   for coin, (_, _, supported_tests) in BENCHMARKED_COINS.items()
+                   for flow in BENCHMARK_FLOWS if flow in supported_tests]
+
+
+def import_runner_class(coin: str) -> type:
+    """
+    Import the runner class of a benchmarked coin. The test modules are only imported by the cases of their coin,
+    so that a coin whose module can't be imported (a missing dependency) only skips its own cases.
+    """
+    module_name, class_name, _ = BENCHMARKED_COINS[coin]
+    module = pytest.importorskip(f"{__package__}.{module_name}")
+    return getattr(module, class_name)
+
+
+# Use a class to reuse the same Speculos instance
+class TestsBenchmark:
+
+    @pytest.mark.parametrize('coin,flow', BENCHMARK_CASES)
+    def test_benchmark(self, backend, navigator, snapshots_path, benchmark_runs, benchmark_recorder, coin, flow):
+        if benchmark_runs <= 0:
+            pytest.skip("Benchmarks are only run with --benchmark_runs N")
+        if backend.firmware.device == "nanos":
+            pytest.skip("Benchmarks are not supported on NanoS device")
+
+        runner_class = import_runner_class(coin)
+        key = benchmark_recorder.key(coin, backend.firmware.device, flow)
+        for _ in range(benchmark_runs):
+            helper = ExchangeNavigationHelper(backend=backend, navigator=navigator, snapshots_path=snapshots_path, test_name=coin)
+            runner = runner_class(backend, helper)
+            with benchmark_recorder.run(key) as timer:
+                runner.phase_timer = timer
+                runner.run_test(flow)
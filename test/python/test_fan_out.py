@@ -0,0 +1,22 @@
+import pytest
+
+from ledger_app_clients.exchange.fan_out import run_fan_out
+
+from .test_benchmark import BENCHMARKED_COINS, import_runner_class
+
+FAN_OUT_CASES = [(coin, flow)
+                 for coin, (_, _, supported_tests) in BENCHMARKED_COINS.items()
+                 for flow in sorted(supported_tests)]
+
+
+# Use a class to reuse the same emulators for all the cases
+class TestsFanOut:
+
+    @pytest.mark.parametrize('coin,flow', FAN_OUT_CASES)
+    def test_fan_out(self, fan_out_sessions, fan_out_reports, coin, flow):
+        runner_class = import_runner_class(coin)
+        # The helpers are named after the regular test function of the coin to reuse its golden snapshots
+        report = run_fan_out(runner_class, flow, fan_out_sessions(coin))
+        fan_out_reports.append(report)
+        print(report.summary())
+        assert report.passed, report.summary()
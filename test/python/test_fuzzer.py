@@ -0,0 +1,29 @@
+import pytest
+
+from ledger_app_clients.exchange.fuzzer import ExchangeFuzzer, TARGETS
+from ledger_app_clients.exchange.client import Errors
+
+pytestmark = pytest.mark.exchange_model
+
+
+# Use a class to reuse the same Speculos instance
+class TestsFuzzer:
+
+    # The prelude of each target and its unmutated seed must be accepted, or the fuzzed APDUs are never reached
+    @pytest.mark.parametrize('target', list(TARGETS))
+    def test_seed(self, backend, target):
+        fuzzer = ExchangeFuzzer(backend, targets=[target])
+        status, error, sent = fuzzer.execute(fuzzer.targets[0], fuzzer.state.corpus[target][0])
+        assert error is None
+        assert status == Errors.SUCCESS
+        assert sent
+
+    @pytest.mark.parametrize('target', list(TARGETS))
+    def test_fuzz(self, backend, fuzz_iterations, target):
+        if fuzz_iterations <= 0:
+            pytest.skip("Fuzzing is only run with --fuzz_iterations N")
+
+        fuzzer = ExchangeFuzzer(backend, targets=[target])
+        stats = fuzzer.run(iterations=fuzz_iterations)
+        print(stats.summary())
+        assert not stats.findings, "\n".join(f"{finding}" for finding in stats.findings)
@@ -1,3 +1,4 @@
+import pytest
 from ragger.utils import RAPDU, prefix_with_len, create_currency_config
 from ragger.backend import RaisePolicy
 
@@ -10,6 +11,9 @@ from ledger_app_clients.exchange.ethereum import create_currency_config as creat
 from .apps.tezos import encode_address
 from .apps import cal as cal
 
+# Only talks to Exchange, can run against the model backend
+pytestmark = pytest.mark.exchange_model
+
 CURRENCY_FROM = cal.XLM_CURRENCY_CONFIGURATION
 CURRENCY_TO = cal.ETH_CURRENCY_CONFIGURATION
 
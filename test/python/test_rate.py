@@ -8,6 +8,9 @@ from ledger_app_clients.exchange.transaction_builder import get_partner_curve, L
 from ledger_app_clients.exchange.signing_authority import SigningAuthority, LEDGER_SIGNER
 from .apps import cal as cal
 
+# Only talks to Exchange, can run against the model backend
+pytestmark = pytest.mark.exchange_model
+
 CURRENCY_FROM = cal.ETH_CURRENCY_CONFIGURATION
 CURRENCY_TO = cal.BTC_CURRENCY_CONFIGURATION
 
@@ -12,6 +12,9 @@ from ledger_app_clients.exchange.transaction_builder import get_partner_curve, c
 from .apps import cal as cal
 from ledger_app_clients.exchange.utils import handle_lib_call_start_or_stop
 
+# Only talks to Exchange, can run against the model backend
+pytestmark = pytest.mark.exchange_model
+
 CURRENCY_FROM = cal.ETH_CURRENCY_CONFIGURATION
 CURRENCY_TO = cal.BTC_CURRENCY_CONFIGURATION
 